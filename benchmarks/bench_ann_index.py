@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Measure recall and latency of the IVF vector index against exact search.
+
+Generates a synthetic clustered corpus of unit vectors (messages about a
+number of topics, with noise), builds an exact VectorIndex and an
+IVFSegment over it, and runs the same queries through both. For each
+n_probe it reports recall@k (fraction of the exact top k found) and search
+latency; it also reports build, save and memory-mapped load times. Results
+are printed as JSON. No database is needed.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Add parent directory to path to import our modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.rag.vector_index import VectorIndex
+from src.rag.ann_index import IVFSegment
+
+def make_corpus(rows: int, dimension: int, topics: int, noise: float, seed: int):
+    """Generate unit vectors scattered around random topic directions."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((topics, dimension)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+
+    # Zipf-like topic popularity, as in real chat history
+    weights = 1.0 / np.arange(1, topics + 1)
+    labels = rng.choice(topics, size=rows, p=weights / weights.sum())
+
+    vectors = np.empty((rows, dimension), dtype=np.float32)
+    for start in range(0, rows, 100000):
+        stop = min(start + 100000, rows)
+        chunk = centers[labels[start:stop]] + noise * rng.standard_normal((stop - start, dimension)).astype(np.float32)
+        vectors[start:stop] = chunk / np.linalg.norm(chunk, axis=1, keepdims=True)
+    return vectors
+
+def percentile(values, fraction):
+    """Return the value below which the given fraction of values fall."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the IVF vector index against exact search')
+    parser.add_argument('--rows', type=int, default=1000000, help='Vectors in the corpus')
+    parser.add_argument('--dimension', type=int, default=256, help='Vector size')
+    parser.add_argument('--topics', type=int, default=5000, help='Topic clusters in the corpus')
+    parser.add_argument('--noise', type=float, default=0.04, help='Per-component noise around a topic')
+    parser.add_argument('--queries', type=int, default=200, help='Queries to run')
+    parser.add_argument('--k', type=int, default=20, help='Results per query')
+    parser.add_argument('--n-lists', type=int, default=None, help='IVF clusters, defaults to sqrt(rows)')
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 4, 8, 16, 32, 64],
+                        help='Clusters scanned per search')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    vectors = make_corpus(args.rows, args.dimension, args.topics, args.noise, args.seed)
+    ids = np.arange(args.rows, dtype=np.int64)
+    timestamps = np.zeros(args.rows, dtype=np.float64)
+    corpus_seconds = time.perf_counter() - started
+
+    # Queries are paraphrases: noisy copies of random corpus messages
+    rng = np.random.default_rng(args.seed + 1)
+    queries = vectors[rng.choice(args.rows, args.queries, replace=False)]
+    queries = queries + args.noise * rng.standard_normal(queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    exact_index = VectorIndex(args.dimension, initial_capacity=args.rows)
+    exact_index.add(ids, vectors, np.zeros(args.rows, dtype=np.int64), timestamps)
+
+    exact_results = []
+    exact_timings = []
+    for query in queries:
+        started = time.perf_counter()
+        exact_results.append({message_id for message_id, _ in exact_index.search(0, query, args.k)})
+        exact_timings.append((time.perf_counter() - started) * 1000)
+    del exact_index
+
+    started = time.perf_counter()
+    segment = IVFSegment.build(ids, vectors, timestamps, n_lists=args.n_lists)
+    build_seconds = time.perf_counter() - started
+    del vectors
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'guild_0'
+        started = time.perf_counter()
+        segment.save(path)
+        save_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        loaded = IVFSegment.load(path)
+        load_seconds = time.perf_counter() - started
+
+        results = {
+            'rows': args.rows,
+            'dimension': args.dimension,
+            'k': args.k,
+            'n_lists': segment.n_lists,
+            'corpus_seconds': round(corpus_seconds, 2),
+            'build_seconds': round(build_seconds, 2),
+            'save_seconds': round(save_seconds, 2),
+            'mmap_load_seconds': round(load_seconds, 4),
+            'exact': {
+                'p50_ms': round(statistics.median(exact_timings), 3),
+                'p95_ms': round(percentile(exact_timings, 0.95), 3)
+            },
+            'ivf': []
+        }
+
+        # Searching the memory-mapped copy measures what the bot sees after a restart
+        for n_probe in args.n_probe:
+            for query in queries[:10]:
+                loaded.search(query, args.k, n_probe)  # warm the page cache
+
+            timings = []
+            recalls = []
+            for query, expected in zip(queries, exact_results):
+                started = time.perf_counter()
+                found = loaded.search(query, args.k, n_probe)
+                timings.append((time.perf_counter() - started) * 1000)
+                recalls.append(len(expected & {message_id for message_id, _ in found}) / max(1, len(expected)))
+
+            results['ivf'].append({
+                'n_probe': n_probe,
+                'recall_at_k': round(statistics.fmean(recalls), 4),
+                'p50_ms': round(statistics.median(timings), 3),
+                'p95_ms': round(percentile(timings, 0.95), 3)
+            })
+
+        del loaded
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
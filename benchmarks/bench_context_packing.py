@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Measure the cost of packing retrieved messages into the prompt.
+
+Builds synthetic candidate lists shaped like retrieval results (chat
+messages of varied length, ranked, with random timestamps) and times
+ContextProcessor.pack_messages and process_messages on each. Results are
+printed as JSON. No database is needed.
+"""
+
+import argparse
+import datetime
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path to import our modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.rag.processor import ContextProcessor
+from src.rag.tokens import create_tokenizer
+
+WORDS = ("the release deploy bot server channel role admin error crash fix update "
+         "friday monday meeting docs link config database token api please thanks").split()
+
+def make_candidates(count: int, rng: random.Random):
+    """Generate ranked message records with a long-tailed length distribution."""
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    candidates = []
+    for i in range(count):
+        length = min(400, int(rng.paretovariate(1.2) * 6))
+        candidates.append({
+            'message_id': i,
+            'channel_id': rng.randrange(10),
+            'channel_name': f'channel-{rng.randrange(10)}',
+            'author_name': f'user{rng.randrange(200)}',
+            'content': ' '.join(rng.choice(WORDS) for _ in range(length)),
+            'timestamp': start + datetime.timedelta(minutes=rng.randrange(60 * 24 * 30))
+        })
+    return candidates
+
+def summarize(timings):
+    """Summarize timings in milliseconds."""
+    ordered = sorted(timings)
+    return {
+        'p50_ms': round(statistics.median(ordered), 4),
+        'p95_ms': round(ordered[int(len(ordered) * 0.95)], 4),
+        'max_ms': round(ordered[-1], 4)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark token-aware context packing')
+    parser.add_argument('--candidates', type=int, default=500, help='Retrieved messages per request')
+    parser.add_argument('--requests', type=int, default=200, help='Requests to simulate')
+    parser.add_argument('--budget', type=int, default=3000, help='Context token budget')
+    parser.add_argument('--tokenizer', default='approximate', help="'approximate' or 'tiktoken'")
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    requests = [make_candidates(args.candidates, rng) for _ in range(args.requests)]
+    processor = ContextProcessor(max_context_tokens=args.budget, tokenizer=create_tokenizer(args.tokenizer))
+
+    pack_timings = []
+    process_timings = []
+    packed = []
+    for candidates in requests:
+        started = time.perf_counter()
+        selection = processor.pack_messages(candidates)
+        pack_timings.append((time.perf_counter() - started) * 1000)
+        packed.append(len(selection))
+
+        started = time.perf_counter()
+        context = processor.process_messages(candidates)
+        process_timings.append((time.perf_counter() - started) * 1000)
+
+    results = {
+        'candidates': args.candidates,
+        'budget_tokens': args.budget,
+        'tokenizer': processor.tokenizer.name,
+        'messages_packed_mean': round(statistics.fmean(packed), 1),
+        'context_tokens_last': processor.tokenizer.count(context),
+        'pack': summarize(pack_timings),
+        'process_messages': summarize(process_timings)
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Compare recent-window RAG retrieval on a flat and a month-partitioned messages table.
+
+Builds both tables with the same synthetic rows in a scratch schema of the
+database configured through the usual DB_* environment variables, then
+runs the query shape of ``get_messages_for_rag`` against each. For every
+window it reports the number of partitions the plan touches and the
+latency, as JSON on stdout. The scratch schema is dropped afterwards
+unless ``--keep`` is given.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import asyncpg
+
+# Add parent directory to path to import our modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.database.connection import DEFAULT_DB_CONFIG
+from src.database.models import messages_table_sql, MESSAGE_COLUMNS
+from src.database.partitions import create_month_partition, month_start, add_months
+
+SCHEMA = 'bench_partitions'
+
+WORDS = ['deploy', 'release', 'bug', 'crash', 'login', 'database', 'latency', 'cache',
+         'docker', 'discord', 'token', 'question', 'roadmap', 'meeting', 'review', 'test']
+
+# Same shape as get_messages_for_rag
+RAG_QUERY = """
+SELECT message_id, channel_id, author_name, content, timestamp,
+       ts_rank_cd(content_tsv, tsq) AS rank
+FROM {table}, to_tsquery('english', $3) AS tsq
+WHERE guild_id = $1
+AND timestamp > $2
+AND content_tsv @@ tsq
+ORDER BY rank DESC
+LIMIT 20
+"""
+
+async def build_tables(conn: asyncpg.Connection, rows: int, months: int, now: datetime.datetime) -> None:
+    """Create and fill messages_flat and the partitioned messages table."""
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    await conn.execute(f"SET search_path TO {SCHEMA}")
+
+    await conn.execute(messages_table_sql('messages_flat').replace(' PARTITION BY RANGE (timestamp)', ''))
+    await conn.execute(messages_table_sql('messages'))
+
+    first = add_months(month_start(now), -(months - 1))
+    for offset in range(months + 1):
+        await create_month_partition(conn, add_months(first, offset))
+
+    start = datetime.datetime(first.year, first.month, 1, tzinfo=datetime.timezone.utc)
+    word_array = "ARRAY[" + ", ".join(f"'{word}'" for word in WORDS) + "]"
+    await conn.execute(f"""
+        INSERT INTO messages_flat ({', '.join(MESSAGE_COLUMNS)}, content_tsv)
+        SELECT i, i % 50, 'channel', 1 + i % 4, i % 1000, 'author',
+               content, ts, FALSE, FALSE, NULL, to_tsvector('english', content)
+        FROM (
+            SELECT i,
+                   $1::timestamptz + (($2::timestamptz - $1::timestamptz) * i / $3) AS ts,
+                   ({word_array})[1 + i % {len(WORDS)}] || ' ' ||
+                   ({word_array})[1 + (i * 7) % {len(WORDS)}] || ' message ' || i AS content
+            FROM generate_series(1, $3) AS i
+        ) AS generated
+    """, start, now, rows)
+    await conn.execute("INSERT INTO messages SELECT * FROM messages_flat")
+
+    for table in ('messages_flat', 'messages'):
+        await conn.execute(f"CREATE INDEX ON {table} (guild_id)")
+        await conn.execute(f"CREATE INDEX ON {table} (timestamp)")
+        await conn.execute(f"CREATE INDEX ON {table} USING GIN (content_tsv)")
+        await conn.execute(f"ANALYZE {table}")
+
+def scanned_relations(plan: dict) -> set:
+    """Collect the names of all relations scanned by a plan tree."""
+    names = set()
+    if 'Relation Name' in plan:
+        names.add(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        names |= scanned_relations(child)
+    return names
+
+async def measure(conn: asyncpg.Connection, table: str, args: tuple, iterations: int) -> dict:
+    """Explain and time the RAG query against one table."""
+    sql = RAG_QUERY.format(table=table)
+    explained = await conn.fetchval(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", *args)
+    plan = json.loads(explained)[0]['Plan']
+
+    statement = await conn.prepare(sql)
+    await statement.fetch(*args)  # warm up
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await statement.fetch(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return {
+        'relations_scanned': len(scanned_relations(plan)),
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(sorted(timings)[int(len(timings) * 0.95) - 1], 3),
+        'mean_ms': round(statistics.fmean(timings), 3)
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description='Benchmark partition pruning for recent-window retrieval')
+    parser.add_argument('--rows', type=int, default=500000, help='Synthetic messages to generate')
+    parser.add_argument('--months', type=int, default=24, help='Months of history the rows span')
+    parser.add_argument('--windows', type=int, nargs='+', default=[7, 30, 90],
+                        help='max_days windows to query')
+    parser.add_argument('--iterations', type=int, default=50, help='Timed runs per query')
+    parser.add_argument('--query', type=str, default='deploy | crash', help='tsquery to search for')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch schema')
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(
+        host=os.getenv('DB_HOST', DEFAULT_DB_CONFIG['host']),
+        port=int(os.getenv('DB_PORT', DEFAULT_DB_CONFIG['port'])),
+        user=os.getenv('DB_USER', DEFAULT_DB_CONFIG['user']),
+        password=os.getenv('DB_PASSWORD', DEFAULT_DB_CONFIG['password']),
+        database=os.getenv('DB_NAME', DEFAULT_DB_CONFIG['database'])
+    )
+
+    try:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        started = time.perf_counter()
+        await build_tables(conn, args.rows, args.months, now)
+        results = {
+            'rows': args.rows,
+            'months': args.months,
+            'partitions': args.months + 1,
+            'build_seconds': round(time.perf_counter() - started, 2),
+            'windows': []
+        }
+
+        for days in args.windows:
+            query_args = (1, now - datetime.timedelta(days=days), args.query)
+            results['windows'].append({
+                'max_days': days,
+                'flat': await measure(conn, 'messages_flat', query_args, args.iterations),
+                'partitioned': await measure(conn, 'messages', query_args, args.iterations)
+            })
+
+        print(json.dumps(results, indent=2))
+    finally:
+        if not args.keep:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Compare per-call latency of the hot queries sent as text and as prepared statements.
+
+Fills a month-partitioned messages table with synthetic rows in a scratch
+schema of the database configured through the usual DB_* environment
+variables, then runs the registered statements of
+``src/database/statements.py`` on two connections: one with the statement
+cache disabled, so every call is parsed and planned again, and one with
+asyncpg's statement cache, as the pool uses it, where the first call
+prepares the statement and later calls reuse it. Reports per-call latency
+and the first call after connecting as JSON on stdout. The scratch schema is dropped afterwards
+unless ``--keep`` is given.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import asyncpg
+
+# Add parent directory to path to import our modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.database.connection import DEFAULT_DB_CONFIG
+from src.database.models import messages_table_sql, MESSAGE_COLUMNS
+from src.database.partitions import create_month_partition, month_start, add_months
+from src.database.statements import STATEMENTS
+
+SCHEMA = 'bench_statements'
+
+WORDS = ['deploy', 'release', 'bug', 'crash', 'login', 'database', 'latency', 'cache',
+         'docker', 'discord', 'token', 'question', 'roadmap', 'meeting', 'review', 'test']
+
+async def connect(**kwargs) -> asyncpg.Connection:
+    """Connect to the benchmark database with the scratch schema on the search path."""
+    return await asyncpg.connect(
+        host=os.getenv('DB_HOST', DEFAULT_DB_CONFIG['host']),
+        port=int(os.getenv('DB_PORT', DEFAULT_DB_CONFIG['port'])),
+        user=os.getenv('DB_USER', DEFAULT_DB_CONFIG['user']),
+        password=os.getenv('DB_PASSWORD', DEFAULT_DB_CONFIG['password']),
+        database=os.getenv('DB_NAME', DEFAULT_DB_CONFIG['database']),
+        server_settings={'search_path': SCHEMA},
+        **kwargs
+    )
+
+async def build_table(conn: asyncpg.Connection, rows: int, months: int, now: datetime.datetime) -> None:
+    """Create and fill the partitioned messages table."""
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    await conn.execute(messages_table_sql('messages'))
+
+    first = add_months(month_start(now), -(months - 1))
+    for offset in range(months + 1):
+        await create_month_partition(conn, add_months(first, offset))
+
+    start = datetime.datetime(first.year, first.month, 1, tzinfo=datetime.timezone.utc)
+    word_array = "ARRAY[" + ", ".join(f"'{word}'" for word in WORDS) + "]"
+    # Every tenth message replies to the one five messages before it
+    await conn.execute(f"""
+        INSERT INTO messages ({', '.join(MESSAGE_COLUMNS)}, content_tsv)
+        SELECT i, i % 50, 'channel', 1, i % 1000, 'author',
+               content, ts, FALSE, FALSE,
+               CASE WHEN i % 10 = 0 AND i > 5 THEN i - 5 END,
+               to_tsvector('english', content)
+        FROM (
+            SELECT i,
+                   $1::timestamptz + (($2::timestamptz - $1::timestamptz) * i / $3) AS ts,
+                   ({word_array})[1 + i % {len(WORDS)}] || ' ' ||
+                   ({word_array})[1 + (i * 7) % {len(WORDS)}] || ' message ' || i AS content
+            FROM generate_series(1, $3) AS i
+        ) AS generated
+    """, start, now, rows)
+
+    await conn.execute("CREATE INDEX ON messages (guild_id, timestamp)")
+    await conn.execute("CREATE INDEX ON messages (channel_id, timestamp)")
+    await conn.execute("CREATE INDEX ON messages (reference_message_id) WHERE reference_message_id IS NOT NULL")
+    await conn.execute("CREATE INDEX ON messages USING GIN (content_tsv)")
+    await conn.execute("ANALYZE messages")
+
+async def workload(conn: asyncpg.Connection, now: datetime.datetime) -> dict:
+    """Arguments for each benchmarked statement, taken from the generated rows."""
+    hits = await conn.fetch("""
+        SELECT message_id, channel_id, timestamp FROM messages
+        WHERE content_tsv @@ to_tsquery('english', 'deploy')
+        ORDER BY timestamp DESC LIMIT 5
+    """)
+    return {
+        'messages_for_rag': (1, now - datetime.timedelta(days=30), 'deploy | crash', 20),
+        'messages_by_ids': ([hit['message_id'] for hit in hits],),
+        'messages_by_date': (1, now - datetime.timedelta(days=7), now, 50),
+        'channel_messages_by_date': (1, 3, now - datetime.timedelta(days=7), now, 50),
+        'messages_by_content': (1, 3, 'release', 50),
+        'message_context': (
+            [hit['message_id'] for hit in hits],
+            [hit['channel_id'] for hit in hits],
+            [hit['timestamp'] for hit in hits],
+            5, 2, datetime.timedelta(hours=1)
+        )
+    }
+
+def summarize(timings: list) -> dict:
+    """Latency percentiles of a list of timings in milliseconds."""
+    ordered = sorted(timings)
+    return {
+        'p50_ms': round(statistics.median(ordered), 3),
+        'p95_ms': round(ordered[max(0, int(len(ordered) * 0.95) - 1)], 3),
+        'max_ms': round(ordered[-1], 3)
+    }
+
+async def time_calls(conn: asyncpg.Connection, sql: str, args: tuple, iterations: int) -> list:
+    """Time repeated fetches of one statement, in milliseconds."""
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await conn.fetch(sql, *args)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+async def first_call_ms(name: str, args: tuple) -> float:
+    """Time the first call of a statement on a fresh connection, which prepares it."""
+    conn = await connect()
+    try:
+        started = time.perf_counter()
+        await conn.fetch(STATEMENTS[name], *args)
+        return round((time.perf_counter() - started) * 1000, 3)
+    finally:
+        await conn.close()
+
+async def main():
+    parser = argparse.ArgumentParser(description='Benchmark prepared statements for the hot queries')
+    parser.add_argument('--rows', type=int, default=200000, help='Synthetic messages to generate')
+    parser.add_argument('--months', type=int, default=12, help='Months of history the rows span')
+    parser.add_argument('--iterations', type=int, default=200, help='Timed runs per statement')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch schema')
+    args = parser.parse_args()
+
+    setup = await connect()
+    try:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        started = time.perf_counter()
+        await build_table(setup, args.rows, args.months, now)
+        calls = await workload(setup, now)
+        results = {
+            'rows': args.rows,
+            'iterations': args.iterations,
+            'build_seconds': round(time.perf_counter() - started, 2),
+            'statements': {}
+        }
+
+        unprepared = await connect(statement_cache_size=0)
+        prepared = await connect()
+        try:
+            for name, call_args in calls.items():
+                sql = STATEMENTS[name]
+                # Warm up the buffer cache so both runs read the same pages
+                await unprepared.fetch(sql, *call_args)
+                results['statements'][name] = {
+                    'unprepared': summarize(await time_calls(unprepared, sql, call_args, args.iterations)),
+                    'prepared': summarize(await time_calls(prepared, sql, call_args, args.iterations)),
+                    'first_call_ms': await first_call_ms(name, call_args)
+                }
+        finally:
+            await unprepared.close()
+            await prepared.close()
+
+        print(json.dumps(results, indent=2))
+    finally:
+        if not args.keep:
+            await setup.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await setup.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
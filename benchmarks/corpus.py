@@ -0,0 +1,280 @@
+"""
+Deterministic synthetic Discord guild corpus for benchmarks.
+
+The same seed and settings always produce the same messages, so results
+of runs on different commits can be compared. The corpus is shaped like
+real server history:
+
+- guilds, the channels of a guild and its authors are ranked by activity
+  and chosen with Zipfian weights, so a few of each do most of the talking;
+- message text is drawn from a vocabulary of made-up words whose use
+  follows Zipf's law, with a long-tailed message length, so searches can
+  target common, mid-frequency and rare words;
+- some messages reply to a recent message of their channel, forming
+  reply chains, and some carry attachments;
+- message IDs are snowflakes of their timestamps, which increase evenly
+  over the covered months.
+"""
+
+import bisect
+import collections
+import datetime
+import hashlib
+import itertools
+import json
+import random
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+# Milliseconds of the Discord epoch, the start of snowflake timestamps
+DISCORD_EPOCH_MS = 1420070400000
+
+# Syllables of the made-up vocabulary; consonant-vowel-consonant keeps
+# words clear of English stop words, which full-text search would drop
+_ONSETS = 'bdfgklmnprstvz'
+_VOWELS = 'aeiou'
+_CODAS = 'klmnprtx'
+
+_ATTACHMENT_TYPES = (
+    ('png', 'image/png', True),
+    ('jpg', 'image/jpeg', True),
+    ('txt', 'text/plain', False),
+    ('pdf', 'application/pdf', False),
+    ('log', 'text/plain', False)
+)
+
+def snowflake(timestamp: datetime.datetime, sequence: int = 0) -> int:
+    """
+    Make a Discord snowflake ID for a time.
+
+    Args:
+        timestamp (datetime.datetime): Creation time
+        sequence (int): Distinguishes IDs made in the same millisecond
+
+    Returns:
+        int: The ID
+    """
+    milliseconds = int(timestamp.timestamp() * 1000) - DISCORD_EPOCH_MS
+    return (milliseconds << 22) | (sequence & 0x3FFFFF)
+
+def zipf_cumulative_weights(count: int, exponent: float) -> List[float]:
+    """
+    Cumulative Zipfian weights of ranks 1 to count, for ``random.choices``.
+
+    Args:
+        count (int): Number of ranks
+        exponent (float): Skew; 1.0 is classic Zipf, 0 is uniform
+
+    Returns:
+        List[float]: Running totals of 1 / rank ** exponent
+    """
+    return list(itertools.accumulate(1.0 / rank ** exponent for rank in range(1, count + 1)))
+
+class CorpusConfig:
+    """Settings of a synthetic corpus; equal settings generate equal corpora."""
+
+    def __init__(self, messages: int = 1000000, guilds: int = 3, channels: int = 20,
+                 authors: int = 500, months: int = 12, end: Optional[datetime.date] = None,
+                 vocabulary: int = 20000, zipf_exponent: float = 1.07, mean_words: float = 12.0,
+                 reply_rate: float = 0.15, attachment_rate: float = 0.03, seed: int = 0):
+        """
+        Initialize the settings.
+
+        Args:
+            messages (int): Messages across all guilds
+            guilds (int): Number of guilds
+            channels (int): Channels per guild
+            authors (int): Authors per guild
+            months (int): Months of history, ending at ``end``
+            end (datetime.date, optional): Day the history ends, today (UTC) by default
+            vocabulary (int): Distinct words
+            zipf_exponent (float): Skew of word use
+            mean_words (float): Average words per message
+            reply_rate (float): Share of messages replying to an earlier one
+            attachment_rate (float): Share of messages with attachments
+            seed (int): Random seed
+        """
+        self.messages = messages
+        self.guilds = guilds
+        self.channels = channels
+        self.authors = authors
+        self.months = months
+        self.end = end or datetime.datetime.now(datetime.timezone.utc).date()
+        self.vocabulary = vocabulary
+        self.zipf_exponent = zipf_exponent
+        self.mean_words = mean_words
+        self.reply_rate = reply_rate
+        self.attachment_rate = attachment_rate
+        self.seed = seed
+
+    @property
+    def end_time(self) -> datetime.datetime:
+        """Time of the last message: midnight UTC at the end of ``end``."""
+        return datetime.datetime.combine(self.end + datetime.timedelta(days=1), datetime.time(),
+                                         tzinfo=datetime.timezone.utc)
+
+    @property
+    def start_time(self) -> datetime.datetime:
+        """Time of the first message, ``months`` of 30 days before the end."""
+        return self.end_time - datetime.timedelta(days=30 * self.months)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Get the settings as plain values.
+
+        Returns:
+            Dict[str, Any]: Settings by name, the end day as an ISO date
+        """
+        settings = dict(vars(self))
+        settings['end'] = self.end.isoformat()
+        return settings
+
+    def fingerprint(self) -> str:
+        """
+        Identify the corpus the settings generate.
+
+        Returns:
+            str: Short hash of the settings
+        """
+        encoded = json.dumps(self.to_dict(), sort_keys=True).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()[:16]
+
+class CorpusGenerator:
+    """Generates the messages and attachments of a corpus in timestamp order."""
+
+    def __init__(self, config: CorpusConfig):
+        """
+        Initialize the generator.
+
+        Args:
+            config (CorpusConfig): Settings of the corpus
+        """
+        self.config = config
+        self.words = self._make_vocabulary(random.Random(f"{config.seed}:vocabulary"), config.vocabulary)
+        self._word_weights = zipf_cumulative_weights(config.vocabulary, config.zipf_exponent)
+        self._guild_weights = zipf_cumulative_weights(config.guilds, 1.0)
+        self._channel_weights = zipf_cumulative_weights(config.channels, 1.0)
+        self._author_weights = zipf_cumulative_weights(config.authors, 1.0)
+
+    @staticmethod
+    def _make_vocabulary(rng: random.Random, size: int) -> List[str]:
+        """Make distinct pronounceable words, most used first."""
+        words: List[str] = []
+        seen = set()
+        while len(words) < size:
+            syllables = rng.choice((2, 2, 3))
+            word = ''.join(rng.choice(_ONSETS) + rng.choice(_VOWELS) + rng.choice(_CODAS)
+                           for _ in range(syllables))
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+        return words
+
+    def guild_id(self, guild: int) -> int:
+        """ID of the guild of a rank, 0 being the most active."""
+        return 100000 + guild
+
+    def channel_id(self, guild: int, channel: int) -> int:
+        """ID of a channel of a guild."""
+        return 200000 + guild * 10000 + channel
+
+    def author_id(self, guild: int, author: int) -> int:
+        """ID of an author of a guild."""
+        return 300000 + guild * 100000 + author
+
+    def words_of_rank(self, first: int, last: int) -> List[str]:
+        """
+        Get the words ranked between two positions by frequency.
+
+        Args:
+            first (int): Rank of the first word, 0 being the most used
+            last (int): Rank after the last word
+
+        Returns:
+            List[str]: The words, most used first
+        """
+        return self.words[first:last]
+
+    def batches(self, batch_size: int = 10000, count: Optional[int] = None,
+                start: Optional[datetime.datetime] = None,
+                end: Optional[datetime.datetime] = None,
+                seed: Optional[str] = None) -> Iterator[Tuple[List[Tuple], List[Tuple]]]:
+        """
+        Generate messages in batches.
+
+        Args:
+            batch_size (int): Messages per batch
+            count (int, optional): Messages to generate, the corpus size by default
+            start (datetime.datetime, optional): Time of the first message, the corpus start by default
+            end (datetime.datetime, optional): Time after the last message, the corpus end by default
+            seed (str, optional): Random seed, the corpus seed by default; pass another
+                one to generate messages that are not part of the corpus
+
+        Yields:
+            Tuple[List[Tuple], List[Tuple]]: Message rows in the order of
+                ``MESSAGE_COLUMNS`` and attachment rows in the order of ``ATTACHMENT_COLUMNS``
+        """
+        config = self.config
+        count = config.messages if count is None else count
+        start = start or config.start_time
+        end = end or config.end_time
+        rng = random.Random(seed if seed is not None else f"{config.seed}:messages")
+        step = (end - start) / max(count, 1)
+
+        # Recent messages per channel, candidates for replies
+        recent: Dict[int, Deque[int]] = collections.defaultdict(lambda: collections.deque(maxlen=20))
+        words = self.words
+        word_weights = self._word_weights
+        total_words = word_weights[-1]
+        attachment_sequence = 0
+
+        for batch_start in range(0, count, batch_size):
+            size = min(batch_size, count - batch_start)
+            guilds = rng.choices(range(config.guilds), cum_weights=self._guild_weights, k=size)
+            channels = rng.choices(range(config.channels), cum_weights=self._channel_weights, k=size)
+            authors = rng.choices(range(config.authors), cum_weights=self._author_weights, k=size)
+
+            messages = []
+            attachments = []
+            for offset in range(size):
+                i = batch_start + offset
+                guild, channel, author = guilds[offset], channels[offset], authors[offset]
+                timestamp = start + step * i
+                message_id = snowflake(timestamp, i)
+                channel_id = self.channel_id(guild, channel)
+
+                # Log-normal lengths: mostly short chat lines, some long posts
+                length = max(1, min(300, int(rng.lognormvariate(0, 0.9) * config.mean_words / 1.5)))
+                content = ' '.join(words[bisect.bisect_left(word_weights, rng.random() * total_words)]
+                                   for _ in range(length))
+
+                reference = None
+                channel_recent = recent[channel_id]
+                if channel_recent and rng.random() < config.reply_rate:
+                    # Mostly the latest messages, so replies chain
+                    reference = channel_recent[-1 - min(int(rng.expovariate(0.5)), len(channel_recent) - 1)]
+                channel_recent.append(message_id)
+
+                has_attachments = rng.random() < config.attachment_rate
+                if has_attachments:
+                    for _ in range(rng.choice((1, 1, 1, 2, 3))):
+                        attachment_sequence += 1
+                        extension, content_type, image = rng.choice(_ATTACHMENT_TYPES)
+                        attachment_id = snowflake(timestamp, attachment_sequence)
+                        filename = f"{rng.choice(words[:1000])}_{attachment_sequence}.{extension}"
+                        url = f"https://cdn.discordapp.com/attachments/{channel_id}/{attachment_id}/{filename}"
+                        attachments.append((
+                            attachment_id, message_id, filename, url, content_type,
+                            rng.randrange(200, 2000) if image else None,
+                            rng.randrange(200, 2000) if image else None,
+                            rng.randrange(1000, 8000000),
+                            url.replace('cdn.discordapp.com', 'media.discordapp.net'),
+                            None
+                        ))
+
+                messages.append((
+                    message_id, channel_id, f"channel-{channel}", self.guild_id(guild),
+                    self.author_id(guild, author), f"user{author}", content, timestamp,
+                    rng.random() < 0.001, has_attachments, reference
+                ))
+
+            yield messages, attachments
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+"""
+Benchmark ingestion and retrieval against a synthetic guild corpus.
+
+Loads a deterministic corpus (see ``corpus.py``) into a benchmark database
+on the server configured through the usual DB_* environment variables,
+created with the bot's own schema by ``setup_database``, and times the
+bot's code paths on it:
+
+- ``store_message``: one call at a time, and many at once over the pool
+- ``get_messages_by_content``: searches for common, mid-frequency and rare words
+- ``get_messages_for_rag``: multi-word questions over the last 30 days and all history
+- ``ContextProcessor.process_messages``: packing the retrieved candidates
+
+Results are written as JSON: per scenario the latency percentiles, mean
+and throughput, along with the corpus settings, git commit and server
+version. Given ``--baseline`` with the results of an earlier run, the
+change of each scenario is reported too. The loaded corpus is kept and
+reused by later runs with the same settings unless ``--drop`` is given.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import types
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import asyncpg
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+# Add parent directory to path to import our modules
+sys.path.insert(0, str(BENCHMARKS_DIR.parent))
+sys.path.insert(0, str(BENCHMARKS_DIR))
+
+from corpus import CorpusConfig, CorpusGenerator
+from src.database.connection import DEFAULT_DB_CONFIG, get_db_pool, setup_database
+from src.database.models import MESSAGE_COLUMNS, ATTACHMENT_COLUMNS
+from src.database.partitions import create_month_partition, month_start, add_months
+from src.database import operations
+from src.rag.processor import ContextProcessor
+
+RESULTS_VERSION = 1
+
+SCENARIOS = ('store_message', 'get_messages_by_content', 'get_messages_for_rag', 'process_messages')
+
+# Frequency ranks of the words searched for in each class
+WORD_CLASSES = {'common': (0, 20), 'mid': (200, 400), 'rare': (5000, 6000)}
+
+CORPUS_TABLE = """
+CREATE TABLE IF NOT EXISTS bench_corpus (
+    fingerprint TEXT PRIMARY KEY,
+    config JSONB NOT NULL,
+    messages BIGINT NOT NULL,
+    attachments BIGINT NOT NULL,
+    load_seconds DOUBLE PRECISION NOT NULL,
+    loaded_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+def server_settings() -> Dict[str, Any]:
+    """Connection settings of the configured server, without the database."""
+    return {
+        'host': os.getenv('DB_HOST', DEFAULT_DB_CONFIG['host']),
+        'port': int(os.getenv('DB_PORT', DEFAULT_DB_CONFIG['port'])),
+        'user': os.getenv('DB_USER', DEFAULT_DB_CONFIG['user']),
+        'password': os.getenv('DB_PASSWORD', DEFAULT_DB_CONFIG['password'])
+    }
+
+async def create_database(database: str, recreate: bool, maintenance_database: str) -> None:
+    """Create the benchmark database, connected to another one, if it does not exist."""
+    conn = await asyncpg.connect(database=maintenance_database, **server_settings())
+    try:
+        if recreate:
+            await conn.execute(f'DROP DATABASE IF EXISTS "{database}"')
+        exists = await conn.fetchval("SELECT 1 FROM pg_database WHERE datname = $1", database)
+        if not exists:
+            await conn.execute(f'CREATE DATABASE "{database}"')
+    finally:
+        await conn.close()
+
+async def drop_database(database: str, maintenance_database: str) -> None:
+    """Drop the benchmark database, connected to another one."""
+    conn = await asyncpg.connect(database=maintenance_database, **server_settings())
+    try:
+        await conn.execute(f'DROP DATABASE IF EXISTS "{database}"')
+    finally:
+        await conn.close()
+
+async def load_corpus(generator: CorpusGenerator, batch_size: int) -> Dict[str, Any]:
+    """
+    Load the corpus into the benchmark database, unless it is loaded already.
+
+    Returns:
+        Dict[str, Any]: Settings and size of the corpus and how long loading took
+    """
+    config = generator.config
+    fingerprint = config.fingerprint()
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(CORPUS_TABLE)
+        loaded = await conn.fetchrow("SELECT * FROM bench_corpus WHERE fingerprint = $1", fingerprint)
+        if loaded is not None:
+            print(f"Reusing corpus {fingerprint} loaded at {loaded['loaded_at']}", file=sys.stderr)
+            return {
+                'fingerprint': fingerprint,
+                'config': config.to_dict(),
+                'messages': loaded['messages'],
+                'attachments': loaded['attachments'],
+                'load_seconds': loaded['load_seconds'],
+                'reused': True
+            }
+
+        # Another corpus may be loaded; start from empty tables
+        await conn.execute("TRUNCATE messages, attachments, bench_corpus")
+
+        first = month_start(config.start_time)
+        last = month_start(config.end_time)
+        month = first
+        while month <= last:
+            await create_month_partition(conn, month)
+            month = add_months(month, 1)
+
+        started = time.perf_counter()
+        messages = attachments = 0
+        for message_rows, attachment_rows in generator.batches(batch_size):
+            async with conn.transaction():
+                await conn.copy_records_to_table('messages', records=message_rows, columns=MESSAGE_COLUMNS)
+                if attachment_rows:
+                    await conn.copy_records_to_table('attachments', records=attachment_rows,
+                                                     columns=ATTACHMENT_COLUMNS)
+            messages += len(message_rows)
+            attachments += len(attachment_rows)
+            elapsed = time.perf_counter() - started
+            print(f"Loaded {messages}/{config.messages} messages ({messages / elapsed:.0f}/s)",
+                  file=sys.stderr, end='\r')
+        print(file=sys.stderr)
+        await conn.execute("ANALYZE messages")
+        await conn.execute("ANALYZE attachments")
+        load_seconds = round(time.perf_counter() - started, 2)
+
+        await conn.execute(
+            "INSERT INTO bench_corpus (fingerprint, config, messages, attachments, load_seconds) "
+            "VALUES ($1, $2, $3, $4, $5)",
+            fingerprint, json.dumps(config.to_dict()), messages, attachments, load_seconds
+        )
+
+    return {
+        'fingerprint': fingerprint,
+        'config': config.to_dict(),
+        'messages': messages,
+        'attachments': attachments,
+        'load_seconds': load_seconds,
+        'reused': False
+    }
+
+def summarize(timings: List[float], wall_seconds: Optional[float] = None, **extra: Any) -> Dict[str, Any]:
+    """
+    Summarize call timings.
+
+    Args:
+        timings (List[float]): Seconds per call
+        wall_seconds (float, optional): Elapsed time of the whole run, when calls overlapped
+        **extra: Further values to report
+
+    Returns:
+        Dict[str, Any]: Calls, latency percentiles and mean in milliseconds, and calls per second
+    """
+    ordered = sorted(timings)
+
+    def percentile(fraction: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000, 4)
+
+    total = wall_seconds if wall_seconds is not None else sum(ordered)
+    return {
+        'calls': len(ordered),
+        'p50_ms': round(statistics.median(ordered) * 1000, 4),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': round(ordered[-1] * 1000, 4),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 4),
+        'ops_per_sec': round(len(ordered) / total, 1) if total > 0 else None,
+        **extra
+    }
+
+async def time_calls(call: Callable[[int], Awaitable[Any]], iterations: int) -> List[float]:
+    """Time consecutive calls, passing each its iteration number."""
+    timings = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        await call(i)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+def as_discord_message(row: tuple, attachment_rows: List[tuple]) -> types.SimpleNamespace:
+    """Wrap a generated message row in the attributes ``store_message`` reads."""
+    values = dict(zip(MESSAGE_COLUMNS, row))
+    return types.SimpleNamespace(
+        id=values['message_id'],
+        channel=types.SimpleNamespace(id=values['channel_id'], name=values['channel_name']),
+        guild=types.SimpleNamespace(id=values['guild_id']),
+        author=types.SimpleNamespace(id=values['author_id'], name=values['author_name']),
+        content=values['content'],
+        created_at=values['timestamp'],
+        pinned=values['is_pinned'],
+        attachments=[
+            types.SimpleNamespace(id=attachment[0], **dict(zip(ATTACHMENT_COLUMNS[1:], attachment[1:])))
+            for attachment in attachment_rows
+        ],
+        reference=types.SimpleNamespace(message_id=values['reference_message_id'])
+        if values['reference_message_id'] else None
+    )
+
+async def bench_store_message(generator: CorpusGenerator, iterations: int, concurrency: int) -> Dict[str, Any]:
+    """Time storing new messages one at a time and concurrently, then remove them again."""
+    config = generator.config
+    # Messages newer than the corpus, from a seed of their own so the corpus is unaffected
+    start = config.end_time
+    new_messages = []
+    for message_rows, attachment_rows in generator.batches(
+            count=iterations * 2, start=start, end=start + datetime.timedelta(hours=1),
+            seed=f"{config.seed}:store_message"):
+        by_message: Dict[int, List[tuple]] = {}
+        for attachment in attachment_rows:
+            by_message.setdefault(attachment[1], []).append(attachment)
+        new_messages.extend(as_discord_message(row, by_message.get(row[0], [])) for row in message_rows)
+
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await create_month_partition(conn, month_start(start))
+
+    try:
+        sequential = new_messages[:iterations]
+        failures = 0
+
+        async def store_next(i):
+            nonlocal failures
+            if not await operations.store_message(sequential[i]):
+                failures += 1
+
+        timings = await time_calls(store_next, iterations)
+        results = {'sequential': summarize(timings, errors=failures)}
+
+        # Open the pool's connections first, so connecting is not timed
+        held = [await pool.acquire() for _ in range(min(concurrency, pool.get_max_size()))]
+        for conn in held:
+            await pool.release(conn)
+
+        concurrent = new_messages[iterations:]
+        semaphore = asyncio.Semaphore(concurrency)
+        concurrent_timings: List[float] = []
+        failures = 0
+
+        async def store(message):
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                if not await operations.store_message(message):
+                    failures += 1
+                concurrent_timings.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(store(message) for message in concurrent))
+        results['concurrent'] = summarize(concurrent_timings, time.perf_counter() - started,
+                                          concurrency=concurrency, errors=failures)
+        return results
+    finally:
+        ids = [message.id for message in new_messages]
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM attachments WHERE message_id = ANY($1::bigint[])", ids)
+            await conn.execute("DELETE FROM messages WHERE message_id = ANY($1::bigint[]) AND timestamp >= $2",
+                               ids, start)
+
+async def bench_messages_by_content(generator: CorpusGenerator, iterations: int) -> Dict[str, Any]:
+    """Time full-text searches for words of each frequency class in the busiest guild."""
+    rng = random.Random(f"{generator.config.seed}:by_content")
+    guild_id = generator.guild_id(0)
+    results = {}
+    for name, (first, last) in WORD_CLASSES.items():
+        candidates = generator.words_of_rank(first, last)
+        if not candidates:
+            continue
+        words = [rng.choice(candidates) for _ in range(iterations)]
+        rows: List[int] = []
+
+        async def search(i):
+            rows.append(len(await operations.get_messages_by_content(guild_id, words[i], limit=100)))
+
+        timings = await time_calls(search, iterations)
+        results[name] = summarize(timings, mean_rows=round(statistics.fmean(rows), 1))
+    return results
+
+def rag_questions(generator: CorpusGenerator, count: int) -> List[str]:
+    """Three-word questions mixing a common, a mid-frequency and a rare word."""
+    rng = random.Random(f"{generator.config.seed}:questions")
+    return [
+        ' '.join(rng.choice(generator.words_of_rank(first, last)) for first, last in WORD_CLASSES.values())
+        for _ in range(count)
+    ]
+
+async def bench_messages_for_rag(generator: CorpusGenerator, iterations: int) -> Dict[str, Any]:
+    """Time RAG retrieval over the last 30 days and over all history."""
+    guild_id = generator.guild_id(0)
+    questions = rag_questions(generator, iterations)
+    results = {}
+    for name, max_days in (('last_30_days', 30), ('all_history', None)):
+        rows: List[int] = []
+
+        async def retrieve(i):
+            rows.append(len(await operations.get_messages_for_rag(guild_id, questions[i], 20, max_days)))
+
+        timings = await time_calls(retrieve, iterations)
+        results[name] = summarize(timings, mean_rows=round(statistics.fmean(rows), 1))
+    return results
+
+async def bench_process_messages(generator: CorpusGenerator, iterations: int,
+                                 candidates: int, budget: int) -> Dict[str, Any]:
+    """Time packing retrieved candidates into the prompt context."""
+    guild_id = generator.guild_id(0)
+    candidate_lists = []
+    for question in rag_questions(generator, 20):
+        messages = await operations.get_messages_for_rag(guild_id, question, candidates, None)
+        if messages:
+            candidate_lists.append(messages)
+    if not candidate_lists:
+        return {}
+
+    processor = ContextProcessor(max_context_tokens=budget)
+    timings = []
+    for i in range(iterations):
+        messages = candidate_lists[i % len(candidate_lists)]
+        started = time.perf_counter()
+        processor.process_messages(messages)
+        timings.append(time.perf_counter() - started)
+    return {
+        f"{candidates}_candidates": summarize(
+            timings,
+            mean_candidates=round(statistics.fmean(len(messages) for messages in candidate_lists), 1),
+            budget_tokens=budget
+        )
+    }
+
+def flatten(scenarios: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Key results by ``scenario.case``."""
+    return {f"{scenario}.{case}": result
+            for scenario, cases in scenarios.items() for case, result in cases.items()}
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> Dict[str, Any]:
+    """
+    Compare the results of this run with those of an earlier one.
+
+    Args:
+        results (Dict[str, Any]): Results of this run
+        baseline (Dict[str, Any]): Results of the earlier run
+        threshold (float): Relative change of the median latency reported as a regression or improvement
+
+    Returns:
+        Dict[str, Any]: Per case the baseline and current p50 and p95 and their ratios
+    """
+    comparison: Dict[str, Any] = {
+        'baseline_commit': baseline.get('git_commit'),
+        'same_corpus': baseline.get('corpus', {}).get('fingerprint') == results['corpus']['fingerprint'],
+        'cases': {}
+    }
+    before_cases = flatten(baseline.get('scenarios', {}))
+    for case, after in flatten(results['scenarios']).items():
+        before = before_cases.get(case)
+        if not before or not before.get('p50_ms') or not before.get('p95_ms'):
+            continue
+        p50_ratio = round(after['p50_ms'] / before['p50_ms'], 3)
+        verdict = 'unchanged'
+        if p50_ratio > 1 + threshold:
+            verdict = 'slower'
+        elif p50_ratio < 1 - threshold:
+            verdict = 'faster'
+        comparison['cases'][case] = {
+            'p50_ms': [before['p50_ms'], after['p50_ms']],
+            'p95_ms': [before['p95_ms'], after['p95_ms']],
+            'p50_ratio': p50_ratio,
+            'p95_ratio': round(after['p95_ms'] / before['p95_ms'], 3),
+            'verdict': verdict
+        }
+    return comparison
+
+def git_commit() -> Optional[str]:
+    """Commit of the working tree, marked when it has uncommitted changes."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BENCHMARKS_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_day(value: str) -> datetime.date:
+    """Parse an ISO date given on the command line."""
+    return datetime.date.fromisoformat(value)
+
+async def main():
+    parser = argparse.ArgumentParser(description='Benchmark ingestion and retrieval on a synthetic corpus')
+    parser.add_argument('--database', default='discord_rag_bench', help='Benchmark database, created if missing')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS),
+                        help='Scenarios to run')
+    parser.add_argument('--messages', type=int, default=1000000, help='Messages in the corpus')
+    parser.add_argument('--guilds', type=int, default=3, help='Guilds in the corpus')
+    parser.add_argument('--channels', type=int, default=20, help='Channels per guild')
+    parser.add_argument('--authors', type=int, default=500, help='Authors per guild')
+    parser.add_argument('--months', type=int, default=12, help='Months of history')
+    parser.add_argument('--end', type=parse_day, help='Last day of the history (default: today, UTC); '
+                                                      'pin it to reuse a corpus on later days')
+    parser.add_argument('--vocabulary', type=int, default=20000, help='Distinct words')
+    parser.add_argument('--zipf', type=float, default=1.07, help='Zipf exponent of word use')
+    parser.add_argument('--reply-rate', type=float, default=0.15, help='Share of messages that are replies')
+    parser.add_argument('--attachment-rate', type=float, default=0.03, help='Share of messages with attachments')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--iterations', type=int, default=200, help='Timed calls per case')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent calls in store_message.concurrent')
+    parser.add_argument('--candidates', type=int, default=200, help='Retrieved messages packed by process_messages')
+    parser.add_argument('--budget', type=int, default=3000, help='Context token budget of process_messages')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Messages per COPY batch when loading')
+    parser.add_argument('--output', type=Path, help='Write the results to this file as well as stdout')
+    parser.add_argument('--baseline', type=Path, help='Results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative change of the median reported as slower or faster')
+    parser.add_argument('--load-only', action='store_true', help='Load the corpus and stop')
+    parser.add_argument('--rebuild', action='store_true', help='Recreate the database and reload the corpus')
+    parser.add_argument('--drop', action='store_true', help='Drop the benchmark database afterwards')
+    args = parser.parse_args()
+
+    config = CorpusConfig(
+        messages=args.messages, guilds=args.guilds, channels=args.channels, authors=args.authors,
+        months=args.months, end=args.end, vocabulary=args.vocabulary, zipf_exponent=args.zipf,
+        reply_rate=args.reply_rate, attachment_rate=args.attachment_rate, seed=args.seed
+    )
+    generator = CorpusGenerator(config)
+
+    maintenance_database = os.getenv('DB_NAME', DEFAULT_DB_CONFIG['database'])
+    await create_database(args.database, args.rebuild, maintenance_database)
+    # The bot's database code connects to DB_NAME
+    os.environ['DB_NAME'] = args.database
+    os.environ.setdefault('DB_MAX_POOL_SIZE', str(max(args.concurrency, 4)))
+
+    pool = None
+    try:
+        pool = await get_db_pool()
+        await setup_database()
+        results: Dict[str, Any] = {
+            'version': RESULTS_VERSION,
+            'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'corpus': await load_corpus(generator, args.batch_size),
+            'scenarios': {}
+        }
+        results['postgres'] = await pool.fetchval("SHOW server_version")
+        if args.load_only:
+            print(json.dumps(results, indent=2))
+            return
+
+        for scenario in args.scenarios:
+            print(f"Running {scenario}", file=sys.stderr)
+            if scenario == 'store_message':
+                outcome = await bench_store_message(generator, args.iterations, args.concurrency)
+            elif scenario == 'get_messages_by_content':
+                outcome = await bench_messages_by_content(generator, args.iterations)
+            elif scenario == 'get_messages_for_rag':
+                outcome = await bench_messages_for_rag(generator, args.iterations)
+            else:
+                outcome = await bench_process_messages(generator, args.iterations, args.candidates, args.budget)
+            results['scenarios'][scenario] = outcome
+
+        if args.baseline:
+            results['comparison'] = compare(results, json.loads(args.baseline.read_text()), args.threshold)
+
+        output = json.dumps(results, indent=2)
+        print(output)
+        if args.output:
+            args.output.write_text(output + '\n')
+    finally:
+        if pool is not None:
+            await pool.close()
+        if args.drop:
+            await drop_database(args.database, maintenance_database)
+
+if __name__ == "__main__":
+    asyncio.run(main())
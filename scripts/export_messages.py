@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import asyncio
+import argparse
+import datetime
+import json
+import sys
+from pathlib import Path
+
+# Add parent directory to path to import our modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.utils.logging import setup_logging
+from src.utils.config import load_config
+from src.database.export import EXPORT_FORMATS, export_archive
+
+def parse_date(value: str) -> datetime.datetime:
+    """Parse an ISO date or time given on the command line, as UTC unless it has an offset."""
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+async def main():
+    """Main function to export the message archive."""
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description='Export stored Discord messages to JSONL or Parquet files')
+    parser.add_argument('output', type=Path, help='Directory to write the files to')
+    parser.add_argument('--config', type=str, help='Path to config file')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl', help='Output format')
+    parser.add_argument('--guild', type=int, help='Only export this server')
+    parser.add_argument('--channel', type=int, help='Only export this channel')
+    parser.add_argument('--since', type=parse_date, help='Oldest date or time to export (UTC)')
+    parser.add_argument('--until', type=parse_date, help='Date or time to stop before (UTC)')
+    parser.add_argument('--workers', type=int, default=4, help='Partitions exported in parallel')
+    parser.add_argument('--row-group-size', type=int, default=100000, help='Rows per Parquet row group')
+    parser.add_argument('--compression', type=str,
+                        help="'gzip' (default) or 'none' for JSONL; a Parquet codec (default zstd)")
+    parser.add_argument('--no-attachments', action='store_true', help='Do not export attachments')
+    parser.add_argument('--summary', action='store_true', help='Print the export summary as JSON')
+    args = parser.parse_args()
+
+    # Load configuration
+    load_config(args.config)
+
+    # Set up logging
+    logger = setup_logging()
+    logger.info(f"Exporting messages to {args.output} as {args.format}")
+
+    try:
+        summary = await export_archive(
+            args.output,
+            fmt=args.format,
+            guild_id=args.guild,
+            channel_id=args.channel,
+            since=args.since,
+            until=args.until,
+            workers=args.workers,
+            row_group_size=args.row_group_size,
+            compression=args.compression,
+            attachments=not args.no_attachments
+        )
+    except ImportError:
+        logger.error("Parquet export requires pyarrow: pip install pyarrow")
+        sys.exit(1)
+    except Exception as e:
+        logger.error(f"Error exporting messages: {str(e)}")
+        sys.exit(1)
+
+    if args.summary:
+        print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    # Run the main function
+    asyncio.run(main())
@@ -13,6 +13,8 @@ sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 from src.utils.logging import setup_logging
 from src.utils.config import load_config
 from src.database.connection import setup_database, get_db_pool
+from src.database.migrations import backfill_content_tsv, partition_messages_table
+from src.rag.semantic import get_semantic_index
 import asyncpg
 
 async def create_database_if_not_exists(host, port, user, password, database):
@@ -56,6 +58,15 @@ async def main():
     parser = argparse.ArgumentParser(description='Set up the Discord RAG Bot database')
     parser.add_argument('--config', type=str, help='Path to config file')
     parser.add_argument('--recreate', action='store_true', help='Recreate database if it exists')
+    parser.add_argument('--backfill-tsv', action='store_true',
+                        help='Fill in the stored search vector for existing messages')
+    parser.add_argument('--batch-size', type=int, default=5000, help='Rows per migration batch')
+    parser.add_argument('--embed', action='store_true',
+                        help='Embed stored messages for semantic search')
+    parser.add_argument('--partition', action='store_true',
+                        help='Convert an existing messages table to monthly partitions')
+    parser.add_argument('--drop-legacy', action='store_true',
+                        help='Drop the old messages table after --partition')
     args = parser.parse_args()
     
     # Load configuration
@@ -113,6 +124,39 @@ async def main():
         logger.info("Database setup completed successfully")
     except Exception as e:
         logger.error(f"Error setting up database schema: {str(e)}")
+        return
+    
+    # Populate search vectors of messages stored before content_tsv existed
+    if args.backfill_tsv:
+        try:
+            logger.info("Backfilling content_tsv...")
+            updated = await backfill_content_tsv(batch_size=args.batch_size)
+            logger.info(f"Backfilled content_tsv for {updated} messages")
+        except Exception as e:
+            logger.error(f"Error backfilling content_tsv: {str(e)}")
+
+    # Move messages stored before partitioning into a partitioned table
+    if args.partition:
+        try:
+            logger.info("Partitioning messages table...")
+            copied = await partition_messages_table(drop_legacy=args.drop_legacy)
+            logger.info(f"Partitioned messages table, {copied} messages copied")
+            await setup_database()
+        except Exception as e:
+            logger.error(f"Error partitioning messages table: {str(e)}")
+
+    # Embed messages stored before semantic search was enabled
+    if args.embed:
+        semantic_index = get_semantic_index()
+        if semantic_index is None:
+            logger.warning("Embeddings are disabled in the configuration, skipping --embed")
+            return
+        try:
+            logger.info(f"Embedding messages with {semantic_index.embedder.name}...")
+            embedded = await semantic_index.backfill(batch_size=args.batch_size)
+            logger.info(f"Embedded {embedded} messages")
+        except Exception as e:
+            logger.error(f"Error embedding messages: {str(e)}")
 
 if __name__ == "__main__":
     # Run the main function
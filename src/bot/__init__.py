@@ -2,5 +2,7 @@ from .client import create_bot, run_bot
 from .commands import register_commands
 from .events import register_events
 from .slash_commands import register_slash_commands, setup_slash_commands
+from .user_commands import register_user_commands
+from .monitoring import register_monitoring, register_error_reporting
 
-__all__ = ['create_bot', 'run_bot', 'register_commands', 'register_events', 'register_slash_commands' 'setup_slash_commands']
+__all__ = ['create_bot', 'run_bot', 'register_commands', 'register_events', 'register_slash_commands', 'setup_slash_commands', 'register_user_commands', 'register_monitoring', 'register_error_reporting']
@@ -0,0 +1,467 @@
+"""Concurrent backfill engine for fetching historical channel messages."""
+
+import asyncio
+import discord
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+# Configure logging
+logger = logging.getLogger('discord_bot.backfill')
+
+# Discord returns at most 100 messages per history request
+MAX_PAGE_SIZE = 100
+
+class RateLimiter:
+    """Token bucket that paces how often an operation may run."""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        """
+        Initialize the rate limiter.
+
+        Args:
+            rate (float): Tokens added per second
+            burst (int, optional): Maximum number of tokens that can accumulate,
+                defaults to one second worth of tokens
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = float(burst if burst is not None else max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """
+        Wait until the requested number of tokens is available and consume them.
+
+        Args:
+            tokens (float): Number of tokens to consume
+        """
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
+
+class ChannelProgress:
+    """Progress of a single channel within a backfill run."""
+
+    def __init__(self, channel_id: int, channel_name: str):
+        """
+        Initialize channel progress.
+
+        Args:
+            channel_id (int): Discord channel ID
+            channel_name (str): Channel name, used for reporting
+        """
+        self.channel_id = channel_id
+        self.channel_name = channel_name
+        self.status = 'pending'
+        self.fetched = 0
+        self.pages = 0
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds spent fetching this channel so far."""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the progress as a plain dictionary."""
+        return {
+            'channel_id': self.channel_id,
+            'channel_name': self.channel_name,
+            'status': self.status,
+            'fetched': self.fetched,
+            'pages': self.pages,
+            'error': self.error,
+            'elapsed': round(self.elapsed, 3)
+        }
+
+class BackfillReport:
+    """Aggregate progress and throughput of a backfill run."""
+
+    def __init__(self):
+        """Initialize an empty report."""
+        self.channels: Dict[int, ChannelProgress] = {}
+        self.stored = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def fetched(self) -> int:
+        """Total number of messages fetched across all channels."""
+        return sum(progress.fetched for progress in self.channels.values())
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the run started."""
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def messages_per_second(self) -> float:
+        """Overall fetch throughput of the run."""
+        elapsed = self.elapsed
+        return self.fetched / elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        """Return a one-line human readable summary."""
+        done = sum(1 for p in self.channels.values() if p.status in ('complete', 'forbidden', 'error'))
+        return (f"{done}/{len(self.channels)} channels, {self.fetched} fetched, "
+                f"{self.stored} stored, {self.failed} failed, "
+                f"{self.messages_per_second:.1f} msg/s")
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the report as a plain dictionary."""
+        return {
+            'fetched': self.fetched,
+            'stored': self.stored,
+            'failed': self.failed,
+            'elapsed': round(self.elapsed, 3),
+            'messages_per_second': round(self.messages_per_second, 2),
+            'channels': [progress.as_dict() for progress in self.channels.values()]
+        }
+
+class PageMarker:
+    """Range of message IDs fetched in one history page, queued behind its messages."""
+
+    def __init__(self, channel_id: int, guild_id: Optional[int], oldest_id: Optional[int],
+                 newest_id: Optional[int], complete: bool = False):
+        """
+        Initialize a page marker.
+
+        Args:
+            channel_id (int): Discord channel ID
+            guild_id (int, optional): Discord server ID
+            oldest_id (int, optional): Lowest message ID on the page
+            newest_id (int, optional): Highest message ID on the page
+            complete (bool): Whether the page reached the beginning of the channel
+        """
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.oldest_id = oldest_id
+        self.newest_id = newest_id
+        self.complete = complete
+        self.replace = False
+
+    def merge(self, other: 'PageMarker') -> None:
+        """Extend this marker's range with another contiguous page of the same channel."""
+        ids = [i for i in (self.oldest_id, other.oldest_id) if i is not None]
+        self.oldest_id = min(ids) if ids else None
+        ids = [i for i in (self.newest_id, other.newest_id) if i is not None]
+        self.newest_id = max(ids) if ids else None
+        self.complete = self.complete or other.complete
+
+class BackfillEngine:
+    """
+    Fetch history from many channels concurrently and feed a single write pipeline.
+
+    Channel fetchers page through history themselves so that every request to
+    Discord passes through a global rate budget and a per-channel (per-route)
+    rate budget. Fetched messages are pushed onto a bounded queue consumed by a
+    single writer task, which applies backpressure to the fetchers when the
+    database falls behind.
+
+    Each page is followed on the queue by a PageMarker. When checkpointing is
+    enabled the writer collects these markers and, at most every
+    ``checkpoint_interval`` seconds, flushes the store and saves the covered
+    ID range per channel, so a checkpoint never gets ahead of the data
+    actually written. Each channel's fetched range stays contiguous, which is
+    what allows a later run to resume from it.
+
+    Any object exposing ``id``, ``name`` and a discord.py compatible
+    ``history(limit=, before=, after=, oldest_first=)`` async iterator can be
+    used as a channel, which keeps the engine testable without Discord.
+    """
+
+    def __init__(self,
+                 store: Callable[[Any], Awaitable[bool]],
+                 concurrency: int = 4,
+                 global_rate: float = 40.0,
+                 route_rate: float = 5.0,
+                 page_size: int = MAX_PAGE_SIZE,
+                 queue_size: int = 1000,
+                 progress_interval: float = 10.0,
+                 flush: Optional[Callable[[], Awaitable[bool]]] = None,
+                 save_checkpoint: Optional[Callable[..., Awaitable[bool]]] = None,
+                 checkpoint_interval: float = 5.0):
+        """
+        Initialize the backfill engine.
+
+        Args:
+            store (Callable): Coroutine function persisting a single message
+            concurrency (int): Maximum number of channels fetched at once
+            global_rate (float): History requests per second across all channels
+            route_rate (float): History requests per second for a single channel
+            page_size (int): Messages requested per history call (max 100)
+            queue_size (int): Maximum number of fetched messages waiting to be written
+            progress_interval (float): Seconds between progress reports
+            flush (Callable, optional): Coroutine function making stored messages
+                durable, returning True on success
+            save_checkpoint (Callable, optional): Coroutine function called as
+                ``save_checkpoint(channel_id, guild_id, oldest_id, newest_id,
+                complete, replace=...)``; enables checkpointing
+            checkpoint_interval (float): Minimum seconds between checkpoint saves
+        """
+        self.store = store
+        self.concurrency = max(1, concurrency)
+        self.global_limiter = RateLimiter(global_rate)
+        self.route_rate = route_rate
+        self.page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        self.queue_size = queue_size
+        self.progress_interval = progress_interval
+        self.flush = flush
+        self.save_checkpoint = save_checkpoint
+        self.checkpoint_interval = checkpoint_interval
+
+    async def run(self,
+                  channels: Iterable[Any],
+                  fetch_limit: Optional[int] = 10000,
+                  after_date: Optional[Any] = None,
+                  on_progress: Optional[Callable[[BackfillReport], Awaitable[None]]] = None,
+                  checkpoints: Optional[Dict[int, Dict[str, Any]]] = None) -> BackfillReport:
+        """
+        Fetch and store history for all given channels.
+
+        Args:
+            channels (Iterable): Channels to fetch messages from
+            fetch_limit (int, optional): Maximum messages per channel, None for no limit
+            after_date (datetime, optional): Only fetch messages after this date
+            on_progress (Callable, optional): Coroutine called with the report
+                every ``progress_interval`` seconds and once at the end
+            checkpoints (Dict[int, Dict], optional): Saved checkpoints keyed by
+                channel ID. When given, the run resumes: each channel first
+                fetches messages newer than its checkpoint, then continues
+                backwards from the oldest fetched message unless its history is
+                complete. Channels without a checkpoint start from the newest
+                message. When omitted, every channel starts over and its
+                checkpoint is replaced.
+
+        Returns:
+            BackfillReport: Per-channel progress and overall throughput
+        """
+        report = BackfillReport()
+        channels = list(channels)
+        for channel in channels:
+            report.channels[channel.id] = ChannelProgress(channel.id, getattr(channel, 'name', str(channel.id)))
+
+        resume = checkpoints is not None
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending: Dict[int, PageMarker] = {}
+        # Checkpoints of a fresh run replace any saved range the first time they are written
+        replace = {channel.id: not resume for channel in channels}
+
+        async def fetch(channel):
+            checkpoint = (checkpoints or {}).get(channel.id)
+            async with semaphore:
+                await self._fetch_channel(channel, report.channels[channel.id], queue,
+                                          fetch_limit, after_date, checkpoint)
+
+        writer = asyncio.create_task(self._write(queue, report, pending, replace))
+        reporter = asyncio.create_task(self._report_progress(report, on_progress))
+
+        try:
+            await asyncio.gather(*(fetch(channel) for channel in channels))
+            await queue.join()
+        finally:
+            writer.cancel()
+            reporter.cancel()
+            await asyncio.gather(writer, reporter, return_exceptions=True)
+            await self._commit_checkpoints(pending, replace)
+            report.finished_at = time.monotonic()
+
+        logger.info(f"Backfill complete: {report.summary()}")
+        if on_progress:
+            await self._notify(on_progress, report)
+        return report
+
+    async def _fetch_channel(self, channel, progress: ChannelProgress, queue: asyncio.Queue,
+                             fetch_limit: Optional[int], after_date: Optional[Any],
+                             checkpoint: Optional[Dict[str, Any]] = None) -> None:
+        """Fetch a channel's history, resuming around its checkpoint if one is given."""
+        route_limiter = RateLimiter(self.route_rate)
+        progress.status = 'running'
+        progress.started_at = time.monotonic()
+        logger.info(f"Fetching messages from #{progress.channel_name} (ID: {progress.channel_id})")
+
+        guild = getattr(channel, 'guild', None)
+        guild_id = guild.id if guild is not None else None
+        remaining = [fetch_limit]
+
+        try:
+            newest_id = checkpoint.get('newest_message_id') if checkpoint else None
+            oldest_id = checkpoint.get('oldest_message_id') if checkpoint else None
+            complete = bool(checkpoint.get('history_complete')) if checkpoint else False
+
+            # Messages sent since the last run
+            if newest_id is not None:
+                await self._page(channel, progress, queue, route_limiter, guild_id, remaining,
+                                 after=discord.Object(id=newest_id))
+
+            # Older history not fetched yet
+            if not complete:
+                before = discord.Object(id=oldest_id) if oldest_id is not None else None
+                await self._page(channel, progress, queue, route_limiter, guild_id, remaining,
+                                 before=before, after_date=after_date)
+
+            progress.status = 'complete'
+            logger.info(f"Completed fetching {progress.fetched} messages from #{progress.channel_name}")
+        except discord.errors.Forbidden:
+            progress.status = 'forbidden'
+            logger.warning(f"No permission to read history in #{progress.channel_name}")
+        except Exception as e:
+            progress.status = 'error'
+            progress.error = str(e)
+            logger.error(f"Error fetching messages from #{progress.channel_name}: {str(e)}")
+        finally:
+            progress.finished_at = time.monotonic()
+
+    async def _page(self, channel, progress: ChannelProgress, queue: asyncio.Queue,
+                    route_limiter: RateLimiter, guild_id: Optional[int], remaining: List[Optional[int]],
+                    before: Optional[Any] = None, after: Optional[Any] = None,
+                    after_date: Optional[Any] = None) -> None:
+        """
+        Page through history in one direction, enqueueing messages and page markers.
+
+        With ``after`` the channel is walked forwards (oldest first) from that
+        message to the present; otherwise it is walked backwards from
+        ``before`` (or the newest message) to ``after_date`` or the beginning
+        of the channel. ``remaining`` holds the message budget shared by both
+        directions.
+        """
+        forward = after is not None
+
+        while remaining[0] is None or remaining[0] > 0:
+            limit = self.page_size if remaining[0] is None else min(self.page_size, remaining[0])
+
+            await self.global_limiter.acquire()
+            await route_limiter.acquire()
+
+            if forward:
+                history_params = {'limit': limit, 'after': after, 'oldest_first': True}
+            else:
+                history_params = {'limit': limit, 'oldest_first': False}
+                if before is not None:
+                    history_params['before'] = before
+                if after_date is not None:
+                    history_params['after'] = after_date
+
+            page = [message async for message in channel.history(**history_params)]
+            progress.pages += 1
+
+            for message in page:
+                await queue.put(message)
+            progress.fetched += len(page)
+
+            if remaining[0] is not None:
+                remaining[0] -= len(page)
+
+            # A short page means we reached the present, the beginning of the
+            # channel, or after_date
+            exhausted = len(page) < limit
+            ids = [message.id for message in page]
+            await queue.put(PageMarker(
+                progress.channel_id, guild_id,
+                min(ids) if ids else None, max(ids) if ids else None,
+                complete=exhausted and not forward and after_date is None
+            ))
+
+            if exhausted:
+                break
+            if forward:
+                after = page[-1]
+            else:
+                before = page[-1]
+
+    async def _write(self, queue: asyncio.Queue, report: BackfillReport,
+                     pending: Dict[int, PageMarker], replace: Dict[int, bool]) -> None:
+        """Single writer draining the queue into the store and collecting page markers."""
+        last_commit = time.monotonic()
+        while True:
+            item = await queue.get()
+            try:
+                if isinstance(item, PageMarker):
+                    if item.channel_id in pending:
+                        pending[item.channel_id].merge(item)
+                    else:
+                        pending[item.channel_id] = item
+                    if time.monotonic() - last_commit >= self.checkpoint_interval:
+                        await self._commit_checkpoints(pending, replace)
+                        last_commit = time.monotonic()
+                elif await self.store(item):
+                    report.stored += 1
+                else:
+                    report.failed += 1
+            except Exception as e:
+                report.failed += 1
+                logger.error(f"Error storing message {getattr(item, 'id', '?')}: {str(e)}")
+            finally:
+                queue.task_done()
+
+    async def _commit_checkpoints(self, pending: Dict[int, PageMarker], replace: Dict[int, bool]) -> None:
+        """Flush the store and save the ranges of all pages written since the last commit."""
+        if self.save_checkpoint is None or not pending:
+            return
+
+        if self.flush is not None and not await self.flush():
+            # Keep the markers; they are retried with the next commit
+            logger.warning("Flush failed, postponing backfill checkpoints")
+            return
+
+        for channel_id, marker in list(pending.items()):
+            saved = await self.save_checkpoint(
+                channel_id, marker.guild_id, marker.oldest_id, marker.newest_id,
+                marker.complete, replace=replace.get(channel_id, False)
+            )
+            if saved:
+                replace[channel_id] = False
+                del pending[channel_id]
+
+    async def _report_progress(self, report: BackfillReport,
+                               on_progress: Optional[Callable[[BackfillReport], Awaitable[None]]]) -> None:
+        """Periodically log progress and notify the progress callback."""
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            logger.info(f"Backfill progress: {report.summary()}")
+            if on_progress:
+                await self._notify(on_progress, report)
+
+    @staticmethod
+    async def _notify(on_progress: Callable[[BackfillReport], Awaitable[None]], report: BackfillReport) -> None:
+        try:
+            await on_progress(report)
+        except Exception as e:
+            logger.warning(f"Backfill progress callback failed: {str(e)}")
+
+def format_progress(report: BackfillReport, max_channels: int = 10) -> str:
+    """
+    Format a backfill report as a Discord status message.
+
+    Args:
+        report (BackfillReport): The report to format
+        max_channels (int): Maximum number of channel lines to include
+
+    Returns:
+        str: Status message
+    """
+    lines = [f"**Backfill progress:** {report.summary()}"]
+    active: List[ChannelProgress] = [p for p in report.channels.values() if p.status == 'running']
+    for progress in active[:max_channels]:
+        lines.append(f"#{progress.channel_name}: {progress.fetched} messages ({progress.pages} pages)")
+    if len(active) > max_channels:
+        lines.append(f"...and {len(active) - max_channels} more channels in progress")
+    return "\n".join(lines)
@@ -2,11 +2,18 @@ import discord
 from discord.ext import commands
 import logging
 import os
-from typing import Optional
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from ..utils.metrics import get_metrics
 
 # Configure logging
 logger = logging.getLogger('discord_bot.client')
 
+EVENT_HANDLER_SECONDS = get_metrics().histogram(
+    'event_handler_seconds', 'Time spent in Discord event handlers', ('event',)
+)
+
 def create_bot() -> commands.Bot:
     """
     Create and configure the Discord bot with all necessary permissions.
@@ -29,8 +36,81 @@ def create_bot() -> commands.Bot:
         logger.info(f'Logged in as {bot.user.name} ({bot.user.id})')
         logger.info(f'Connected to {len(bot.guilds)} guild(s)')
     
+    _install_lifecycle_hooks(bot)
+    _install_event_timing(bot)
+    
     return bot
 
+def _install_event_timing(bot: commands.Bot) -> None:
+    """
+    Time every event handler the bot runs, including its error handling.
+    
+    Args:
+        bot (commands.Bot): The bot to time the handlers of
+    """
+    original_run_event = bot._run_event
+    
+    async def run_event(coro: Callable[..., Awaitable[Any]], event_name: str, *args: Any, **kwargs: Any) -> None:
+        started = time.perf_counter()
+        try:
+            await original_run_event(coro, event_name, *args, **kwargs)
+        finally:
+            EVENT_HANDLER_SECONDS.labels(event_name).observe(time.perf_counter() - started)
+    
+    bot._run_event = run_event
+
+def _install_lifecycle_hooks(bot: commands.Bot) -> None:
+    """
+    Make the bot run registered startup hooks on login and shutdown hooks on close.
+    
+    Args:
+        bot (commands.Bot): The bot to install the hooks on
+    """
+    bot.startup_hooks = []
+    bot.shutdown_hooks = []
+    original_close = bot.close
+    
+    async def setup_hook():
+        for hook in bot.startup_hooks:
+            await hook()
+    
+    async def close():
+        # Run shutdown hooks once, newest first, before the gateway disconnects
+        hooks, bot.shutdown_hooks = bot.shutdown_hooks, []
+        for hook in reversed(hooks):
+            try:
+                await hook()
+            except Exception as e:
+                logger.error(f"Error in shutdown hook: {str(e)}")
+        await original_close()
+    
+    bot.setup_hook = setup_hook
+    bot.close = close
+
+def add_startup_hook(bot: commands.Bot, hook: Callable[[], Awaitable[None]]) -> None:
+    """
+    Register a coroutine function to run once when the bot logs in.
+    
+    Args:
+        bot (commands.Bot): The bot to register the hook on
+        hook (Callable): Coroutine function without arguments
+    """
+    if not hasattr(bot, 'startup_hooks'):
+        _install_lifecycle_hooks(bot)
+    bot.startup_hooks.append(hook)
+
+def add_shutdown_hook(bot: commands.Bot, hook: Callable[[], Awaitable[None]]) -> None:
+    """
+    Register a coroutine function to run when the bot is closed.
+    
+    Args:
+        bot (commands.Bot): The bot to register the hook on
+        hook (Callable): Coroutine function without arguments
+    """
+    if not hasattr(bot, 'shutdown_hooks'):
+        _install_lifecycle_hooks(bot)
+    bot.shutdown_hooks.append(hook)
+
 def run_bot(bot: commands.Bot, token: Optional[str] = None) -> None:
     """
     Run the Discord bot with the provided token.
@@ -3,70 +3,136 @@
 import discord
 from discord.ext import commands
 import logging
-import asyncio
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Optional
 import datetime
 
+from .backfill import BackfillEngine, BackfillReport, format_progress
+from ..utils.config import get_config
+from ..utils.tracing import get_tracer
+from .streaming import split_message
+
 # Configure logging
 logger = logging.getLogger('discord_bot.commands')
 
 async def fetch_historical_messages(channels: List[discord.TextChannel], 
-                                   fetch_limit: int = 10000,
-                                   fetch_delay: float = 1.0,
-                                   after_date: Optional[datetime.datetime] = None) -> int:
+                                   fetch_limit: Optional[int] = 10000,
+                                   after_date: Optional[datetime.datetime] = None,
+                                   on_progress: Optional[Callable[[BackfillReport], Awaitable[None]]] = None,
+                                   resume: bool = False) -> int:
     """
     Fetch historical messages from a list of channels and store them in the database.
     
+    Channels are fetched concurrently by a BackfillEngine configured from the
+    ``backfill`` config section. Progress is checkpointed per channel; with
+    ``resume`` each channel only fetches messages newer than its checkpoint
+    and then continues backwards from where the previous run stopped.
+    
     Args:
         channels (List[discord.TextChannel]): List of channels to fetch messages from
-        fetch_limit (int, optional): Maximum number of messages to fetch per channel
-        fetch_delay (float, optional): Delay between batches to avoid rate limits
+        fetch_limit (int, optional): Maximum number of messages to fetch per channel, None for no limit
         after_date (datetime, optional): Only fetch messages after this date
+        on_progress (Callable, optional): Coroutine called periodically with a BackfillReport
+        resume (bool, optional): Continue from saved checkpoints instead of starting over
     
     Returns:
         int: Total number of messages fetched
     """
     # Import here to avoid circular imports
-    from ..database.operations import store_message
+    from ..database.bulk import get_bulk_writer
+    from ..database.operations import get_backfill_checkpoints, save_backfill_checkpoint
     
-    total_messages = 0
+    writer = await get_bulk_writer()
+    flush = _checkpoint_flush(writer)
     
-    for channel in channels:
-        if not isinstance(channel, discord.TextChannel):
-            continue  # Skip non-text channels
-            
-        logger.info(f"Fetching messages from #{channel.name} (ID: {channel.id})")
-        message_count = 0
-        
-        try:
-            # Create history parameters
-            history_params = {"limit": fetch_limit}
-            if after_date:
-                history_params["after"] = after_date
-                
-            async for message in channel.history(**history_params):
-                await store_message(message)
-                message_count += 1
-                
-                # Process images and other attachments
-                if message.attachments:
-                    logger.debug(f"Message {message.id} has {len(message.attachments)} attachment(s)")
-                
-                # Add a small delay every 100 messages to avoid rate limiting
-                if message_count % 100 == 0:
-                    logger.info(f"Fetched {message_count} messages from #{channel.name}")
-                    await asyncio.sleep(fetch_delay)
-            
-            total_messages += message_count
-            logger.info(f"Completed fetching {message_count} messages from #{channel.name}")
-            
-        except discord.errors.Forbidden:
-            logger.warning(f"No permission to read history in #{channel.name}")
-        except Exception as e:
-            logger.error(f"Error fetching messages from #{channel.name}: {str(e)}")
+    # Skip non-text channels
+    text_channels = [channel for channel in channels if isinstance(channel, discord.TextChannel)]
+    
+    checkpoints = None
+    if resume:
+        checkpoints = await get_backfill_checkpoints([channel.id for channel in text_channels])
+        logger.info(f"Resuming backfill with checkpoints for {len(checkpoints)}/{len(text_channels)} channels")
+    
+    backfill_config = get_config().get('backfill', {})
+    engine = BackfillEngine(
+        writer.add,
+        concurrency=backfill_config.get('concurrency', 4),
+        global_rate=backfill_config.get('global_rate', 40.0),
+        route_rate=backfill_config.get('route_rate', 5.0),
+        page_size=backfill_config.get('page_size', 100),
+        queue_size=backfill_config.get('queue_size', 1000),
+        progress_interval=backfill_config.get('progress_interval', 10.0),
+        flush=flush,
+        save_checkpoint=save_backfill_checkpoint,
+        checkpoint_interval=backfill_config.get('checkpoint_interval', 5.0)
+    )
+    
+    report = await engine.run(text_channels, fetch_limit=fetch_limit,
+                              after_date=after_date, on_progress=on_progress,
+                              checkpoints=checkpoints)
+    
+    # Land the final partial batch before reporting completion
+    await writer.flush()
+    
+    logger.info(f"Historical message fetch complete. Total messages: {report.fetched}")
+    return report.fetched
+
+def _checkpoint_flush(writer) -> Callable[[], Awaitable[bool]]:
+    """
+    Create the flush callback telling a BackfillEngine whether checkpoints can be saved.
+    
+    Checkpoints may only be saved if every message fetched since the last
+    save reached the database. A flush that succeeds after earlier ones
+    failed is not enough: the writer may have dropped the oldest messages of
+    its backlog in between, and those are covered by the pending checkpoints.
+    Once that happens no checkpoint is saved for the rest of the run, so a
+    resumed run fetches the dropped messages again.
+    
+    Args:
+        writer (BulkWriter): The writer storing the fetched messages
+    
+    Returns:
+        Callable: Coroutine function flushing the writer, True if checkpoints can be saved
+    """
+    # Drops counted when the pending checkpoints started accumulating
+    dropped = writer.dropped_messages
+    lost = False
+    
+    async def flush() -> bool:
+        nonlocal dropped, lost
+        failures = writer.failed_flushes
+        await writer.flush()
+        if writer.dropped_messages != dropped and not lost:
+            lost = True
+            logger.error(f"Bulk writer dropped {writer.dropped_messages - dropped} messages, "
+                         f"no more backfill checkpoints are saved in this run")
+        if lost or writer.failed_flushes != failures:
+            return False
+        dropped = writer.dropped_messages
+        return True
+    
+    return flush
+
+def _progress_reporter(ctx: commands.Context) -> Callable[[BackfillReport], Awaitable[None]]:
+    """
+    Create a progress callback that keeps a single status message up to date.
+    
+    Args:
+        ctx (commands.Context): Context of the invoking command
+    
+    Returns:
+        Callable: Coroutine function accepting a BackfillReport
+    """
+    status_message = None
+    
+    async def report_progress(report: BackfillReport) -> None:
+        nonlocal status_message
+        content = format_progress(report)
+        if status_message is None:
+            status_message = await ctx.send(content)
+        else:
+            await status_message.edit(content=content)
     
-    logger.info(f"Historical message fetch complete. Total messages: {total_messages}")
-    return total_messages
+    return report_progress
 
 def register_commands(bot: commands.Bot) -> None:
     """
@@ -112,12 +178,45 @@ def register_commands(bot: commands.Bot) -> None:
         count = await fetch_historical_messages(
             channels, 
             fetch_limit=fetch_limit,
-            after_date=after_date
+            after_date=after_date,
+            on_progress=_progress_reporter(ctx)
         )
         
         # Send completion message
         await ctx.send(f"Historical message fetch complete! Stored {count} messages in the database.")
 
+    @bot.command(name='sync_history')
+    @commands.has_permissions(administrator=True)
+    async def sync_history_command(ctx: commands.Context, limit: Optional[int] = None):
+        """
+        Resume fetching the server's message history from the saved checkpoints.
+        
+        Each channel fetches the messages sent since the last sync and then
+        continues backwards from where an interrupted fetch stopped.
+        
+        Usage:
+            !sync_history [limit]
+            
+        Args:
+            limit: Maximum messages per channel (default: no limit)
+        """
+        await ctx.send("Resuming message history sync from saved checkpoints...")
+        
+        # Get all visible text channels
+        channels = [channel for channel in ctx.guild.text_channels 
+                   if channel.permissions_for(ctx.guild.me).read_messages]
+        
+        # Fetch messages
+        count = await fetch_historical_messages(
+            channels,
+            fetch_limit=limit,
+            on_progress=_progress_reporter(ctx),
+            resume=True
+        )
+        
+        # Send completion message
+        await ctx.send(f"History sync complete! Stored {count} new messages in the database.")
+
     @bot.command(name='db_status')
     @commands.has_permissions(administrator=True)
     async def db_status_command(ctx: commands.Context):
@@ -158,6 +257,26 @@ def register_commands(bot: commands.Bot) -> None:
             logger.error(f"Error fetching database stats: {str(e)}")
             await ctx.send(f"Error fetching database statistics: {str(e)}")
 
+    @bot.command(name='traces')
+    @commands.has_permissions(administrator=True)
+    async def traces_command(ctx: commands.Context, count: int = 3):
+        """
+        Show where the time went in the slowest recent questions.
+        
+        Usage:
+            !traces [count]
+        """
+        tracer = get_tracer()
+        traces = tracer.recent_slow_traces(max(1, min(count, 10)))
+        if not traces:
+            await ctx.send(f"No questions took {tracer.slow_trace_ms:g} ms or longer recently.")
+            return
+
+        for trace in traces:
+            # Leave room for the code block around each chunk
+            for chunk in split_message(trace.format(), limit=1980):
+                await ctx.send(f"```\n{chunk}\n```")
+
     @bot.command(name='fetch_channel')
     @commands.has_permissions(administrator=True)
     async def fetch_channel_command(ctx: commands.Context, 
@@ -190,7 +309,8 @@ def register_commands(bot: commands.Bot) -> None:
         count = await fetch_historical_messages(
             [channel], 
             fetch_limit=fetch_limit,
-            after_date=after_date
+            after_date=after_date,
+            on_progress=_progress_reporter(ctx)
         )
         
         # Send completion message
@@ -3,6 +3,8 @@ from discord.ext import commands
 import logging
 from typing import Callable, Any
 
+from .client import add_startup_hook, add_shutdown_hook
+
 # Configure logging
 logger = logging.getLogger('discord_bot.events')
 
@@ -34,14 +36,15 @@ def register_events(bot: commands.Bot) -> None:
 
         try:
             # Import here to avoid circular imports
-            from ..database.operations import store_message
+            from ..database.ingest import get_ingest_queue
 
-            # Store the message in the database
-            await store_message(message)
+            # Queue the message for a batched write; this never waits on the database
+            ingest_queue = await get_ingest_queue()
+            ingest_queue.submit(message)
 
             # Log message information
             channel_name = getattr(message.channel, 'name', 'DM')
-            logger.debug(f"Stored message from {message.author.name} in #{channel_name}")
+            logger.debug(f"Queued message from {message.author.name} in #{channel_name}")
 
             # If the message has attachments (images, files, etc.)
             if message.attachments:
@@ -79,13 +82,60 @@ def register_events(bot: commands.Bot) -> None:
 
         try:
             # Import here to avoid circular imports
-            from ..database.operations import update_message
+            from ..database.ingest import get_ingest_queue
 
-            # Update the message in the database
-            await update_message(after)
+            # Queue the new version; the upsert replaces the stored content
+            ingest_queue = await get_ingest_queue()
+            ingest_queue.submit(after)
 
-            logger.debug(f"Updated edited message from {after.author.name}")
+            logger.debug(f"Queued edited message from {after.author.name}")
         except Exception as e:
             logger.error(f"Error processing edited message: {str(e)}")
 
+    async def close_semantic_index():
+        """Close the embedder's HTTP session."""
+        from ..rag.semantic import close_semantic_index
+
+        await close_semantic_index()
+
+    # Shutdown hooks run newest first: this one runs after the drain below,
+    # whose last writes are still embedded
+    add_shutdown_hook(bot, close_semantic_index)
+
+    async def drain_ingest():
+        """Write everything still queued before the bot disconnects."""
+        from ..database.ingest import close_ingest_queue
+        from ..database.bulk import close_bulk_writer
+
+        await close_ingest_queue()
+        await close_bulk_writer()
+
+    add_shutdown_hook(bot, drain_ingest)
+
+    async def start_semantic_index():
+        """Load message embeddings and start embedding new messages."""
+        from ..rag.semantic import get_semantic_index
+
+        semantic_index = get_semantic_index()
+        if semantic_index is not None:
+            await semantic_index.start()
+
+    add_startup_hook(bot, start_semantic_index)
+
+    async def start_partition_maintenance():
+        """Keep the messages partitions of the coming months created."""
+        from ..database.partitions import start_partition_maintenance
+
+        start_partition_maintenance()
+
+    add_startup_hook(bot, start_partition_maintenance)
+
+    async def stop_partition_maintenance():
+        """Stop creating partitions once the bot disconnects."""
+        from ..database.partitions import stop_partition_maintenance
+
+        await stop_partition_maintenance()
+
+    add_shutdown_hook(bot, stop_partition_maintenance)
+
     logger.info("Bot events registered")
@@ -0,0 +1,197 @@
+import logging
+import math
+from typing import Any, Dict, Optional, Tuple
+
+from aiohttp import web
+from discord.ext import commands
+
+from .client import add_startup_hook, add_shutdown_hook
+from ..database.connection import check_database
+from ..utils.config import get_config
+from ..utils.logging import DiscordHandler, add_log_handler, remove_log_handler
+from ..utils.metrics import MetricsRegistry, get_metrics
+
+# Configure logging
+logger = logging.getLogger('discord_bot.monitoring')
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class MonitoringServer:
+    """
+    HTTP server on the bot's event loop exposing health checks and metrics.
+
+    - ``/health/live``: the process is up and its event loop is responsive
+    - ``/health`` and ``/health/ready``: connected to the Discord gateway
+      and able to query the database; 503 otherwise
+    - ``/metrics``: Prometheus metrics of the process
+    """
+
+    def __init__(self, bot: commands.Bot, host: str = '0.0.0.0', port: int = 8080,
+                 db_timeout: float = 2.0, registry: Optional[MetricsRegistry] = None):
+        """
+        Initialize the monitoring server.
+
+        Args:
+            bot (commands.Bot): The bot whose gateway connection is checked
+            host (str): Address to listen on
+            port (int): Port to listen on
+            db_timeout (float): Seconds allowed for the database check
+            registry (MetricsRegistry, optional): Metrics to expose, the shared registry by default
+        """
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.db_timeout = db_timeout
+        self.registry = registry or get_metrics()
+        self._runner: Optional[web.AppRunner] = None
+
+        self.registry.add_collector('gateway', self.gateway_stats)
+
+    def create_app(self) -> web.Application:
+        """
+        Create the web application serving the endpoints.
+
+        Returns:
+            web.Application: The application
+        """
+        app = web.Application()
+        app.router.add_get('/health', self.handle_ready)
+        app.router.add_get('/health/ready', self.handle_ready)
+        app.router.add_get('/health/live', self.handle_live)
+        app.router.add_get('/metrics', self.handle_metrics)
+        return app
+
+    async def start(self) -> None:
+        """Start listening."""
+        if self._runner is not None:
+            return
+
+        runner = web.AppRunner(self.create_app(), access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+        except OSError:
+            await runner.cleanup()
+            raise
+        self._runner = runner
+        logger.info(f"Serving health checks and metrics on http://{self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        """Stop listening."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def gateway_connected(self) -> bool:
+        """Check whether the bot is logged in and its gateway heartbeat is acknowledged."""
+        return self.bot.is_ready() and not self.bot.is_closed() and math.isfinite(self.bot.latency)
+
+    def gateway_stats(self) -> Dict[str, Any]:
+        """
+        Get the state of the Discord gateway connection.
+
+        Returns:
+            Dict[str, Any]: Connection state, heartbeat latency and guild count
+        """
+        connected = self.gateway_connected()
+        stats: Dict[str, Any] = {'connected': connected, 'guilds': len(self.bot.guilds)}
+        if connected:
+            stats['latency_seconds'] = round(self.bot.latency, 3)
+        return stats
+
+    async def check_ready(self) -> Tuple[bool, Dict[str, bool]]:
+        """
+        Check whether the bot can serve requests.
+
+        Returns:
+            Tuple[bool, Dict[str, bool]]: Overall readiness and the result of each check
+        """
+        checks = {
+            'gateway': self.gateway_connected(),
+            'database': await check_database(self.db_timeout)
+        }
+        return all(checks.values()), checks
+
+    async def handle_live(self, request: web.Request) -> web.Response:
+        """Answer the liveness check."""
+        return web.json_response({'status': 'ok'})
+
+    async def handle_ready(self, request: web.Request) -> web.Response:
+        """Answer the readiness check."""
+        ready, checks = await self.check_ready()
+        return web.json_response(
+            {'status': 'ok' if ready else 'unavailable', 'checks': checks},
+            status=200 if ready else 503
+        )
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        """Render the metrics."""
+        return web.Response(body=self.registry.render().encode('utf-8'),
+                            headers={'Content-Type': METRICS_CONTENT_TYPE})
+
+def register_monitoring(bot: commands.Bot) -> Optional[MonitoringServer]:
+    """
+    Serve health checks and metrics while the bot runs, as set in the ``monitoring`` config.
+
+    Args:
+        bot (commands.Bot): The bot to monitor
+
+    Returns:
+        MonitoringServer: The server, started when the bot logs in; None if disabled
+    """
+    monitoring_config = get_config().get('monitoring', {})
+    if not monitoring_config.get('enabled', True):
+        return None
+
+    server = MonitoringServer(
+        bot,
+        host=monitoring_config.get('host', '0.0.0.0'),
+        port=monitoring_config.get('port', 8080),
+        db_timeout=monitoring_config.get('health_check_timeout', 2.0)
+    )
+
+    async def start_server():
+        try:
+            await server.start()
+        except OSError as e:
+            logger.error(f"Could not start monitoring server on port {server.port}: {str(e)}")
+
+    add_startup_hook(bot, start_server)
+    add_shutdown_hook(bot, server.stop)
+
+    logger.info("Monitoring endpoints registered")
+    return server
+
+def register_error_reporting(bot: commands.Bot) -> Optional[DiscordHandler]:
+    """
+    Post summaries of logged errors to the channel set as ``logging.discord_channel_id``.
+
+    Args:
+        bot (commands.Bot): The bot posting the summaries
+
+    Returns:
+        DiscordHandler: The handler, posting once the bot logs in; None if no channel is set
+    """
+    logging_config = get_config().get('logging', {})
+    channel_id = logging_config.get('discord_channel_id')
+    if not channel_id:
+        return None
+
+    handler = DiscordHandler(
+        bot,
+        int(channel_id),
+        level=getattr(logging, str(logging_config.get('discord_level', 'ERROR')).upper(), logging.ERROR),
+        flush_interval=logging_config.get('discord_flush_interval', 10.0)
+    )
+    add_log_handler(handler)
+    get_metrics().add_collector('error_reporting', handler.stats)
+
+    async def stop_handler():
+        await handler.stop()
+        remove_log_handler(handler)
+
+    add_startup_hook(bot, handler.start)
+    add_shutdown_hook(bot, stop_handler)
+
+    logger.info(f"Reporting errors to channel {channel_id}")
+    return handler
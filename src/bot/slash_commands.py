@@ -6,9 +6,11 @@ from typing import Optional
 import asyncio
 
 from src.utils.config import get_config
-from src.rag.retriever import MessageRetriever
-from src.rag.processor import ContextProcessor
-from src.rag.generator import ResponseGenerator
+from src.rag.pipeline import get_rag_pipeline
+from src.rag.scheduler import PRIORITY_HIGH
+from src.bot.client import add_startup_hook, add_shutdown_hook
+from src.bot.streaming import StreamingReply
+from src.utils.tracing import get_tracer
 # Import the ConversationManager from user_commands where it's actually defined
 from src.bot.user_commands import ConversationManager
 
@@ -28,66 +30,47 @@ def register_slash_commands(bot: commands.Bot) -> None:
     """Register slash commands to the bot."""
     # Load configuration
     config = get_config()
-    rag_config = config.get('rag', {})
     ai_config = config.get('ai', {})
 
-    # Initialize components
-    retriever = MessageRetriever(
-        max_results=rag_config.get('max_context_messages', 20),
-        max_days=rag_config.get('max_context_days', 30)
-    )
-    processor = ContextProcessor()
-    generator = ResponseGenerator(
-        model=ai_config.get('model', 'gpt-3.5-turbo')
-    )
+    # Initialize components, shared with the prefix commands
+    pipeline = get_rag_pipeline()
+    # Keep one pooled HTTP session to the LLM API for the bot's lifetime
+    add_startup_hook(bot, pipeline.start)
+    add_shutdown_hook(bot, pipeline.close)
     conversation_manager = ConversationManager()
 
     @bot.tree.command(name="ask", description="Ask a question and get an answer based on server message history")
     async def ask_slash_command(interaction: discord.Interaction, question: str):
         """Ask a question using server context."""
-        await interaction.response.defer(thinking=True)
-
-        try:
-            user_id = interaction.user.id
-            guild_id = interaction.guild.id if interaction.guild else None
-
-            # Get conversation history
-            conversation_manager.add_message(user_id, question)
-
-
-            # Add user message to conversation
-           # conversation.add_user_message(question)
-
-            # Get relevant messages using RAG
-            messages = await retriever.retrieve(guild_id, question)
-
-            # Process messages into a context
-            context = processor.process(messages, question)
-
-            # Create the full prompt
-            prompt = processor.create_prompt_with_context(question, context)
-
-            # Add conversation history if available
-            conv_history = conversation_manager.get_history(user_id)
-            if conv_history:
-                prompt += f"\n\nRecent conversation history:\n{conv_history}"
-
-            # Generate a response
-            response = await generator.generate(question, context, conversation)
-
-            # Add assistant response to conversation history
-            conversation_manager.add_message(user_id, response, is_bot=True)
-
-
-            # Add assistant response to conversation
-            # conversation.add_assistant_message(response)
-
-            # Send the response
-            await interaction.followup.send(response)
-
-        except Exception as e:
-            logger.error(f"Error processing ask command: {str(e)}")
-            await interaction.followup.send(f"Sorry, I encountered an error while processing your question. Please try again later.")
+        user_id = interaction.user.id
+        guild_id = interaction.guild.id if interaction.guild else None
+
+        tracer = get_tracer()
+        with tracer.trace('ask', command='slash', guild_id=guild_id, user_id=user_id) as trace:
+            with tracer.span('discord.defer'):
+                await interaction.response.defer(thinking=True)
+
+            try:
+                # Earlier questions and answers, then the question itself
+                conv_history = conversation_manager.get_history(user_id)
+                conversation_manager.add_message(user_id, question)
+
+                # The first follow-up replaces the "thinking" indicator and is
+                # edited as the answer is generated
+                reply = StreamingReply(interaction.followup.send,
+                                       edit_interval=ai_config.get('stream_edit_interval', 1.0))
+                # Slash commands are answered ahead of prefix commands and mentions
+                async for chunk in pipeline.answer_stream(guild_id, question, conv_history, PRIORITY_HIGH):
+                    await reply.append(chunk)
+                response = await reply.finish()
+
+                # Add assistant response to conversation history
+                conversation_manager.add_message(user_id, response, is_bot=True)
+
+            except Exception as e:
+                trace.record_error(e)
+                logger.error(f"Error processing ask command: {str(e)}")
+                await interaction.followup.send(f"Sorry, I encountered an error while processing your question. Please try again later.")
 
     @bot.tree.command(name="help", description="Show the bot's help information")
     async def help_slash_command(interaction: discord.Interaction):
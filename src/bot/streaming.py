@@ -0,0 +1,109 @@
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional
+
+import discord
+
+from ..utils.tracing import get_tracer
+
+logger = logging.getLogger('discord_bot.streaming')
+
+# Discord rejects messages over 2000 characters; leave room for formatting
+MESSAGE_LIMIT = 1990
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Split text into Discord-sized chunks, preferring line and word boundaries.
+
+    Every chunk but the last depends only on the text up to its end, so it
+    stays the same as more text is appended.
+
+    Args:
+        text (str): Text to split
+        limit (int): Maximum characters per chunk
+
+    Returns:
+        List[str]: Chunks, in order
+    """
+    chunks = []
+    start = 0
+    while len(text) - start > limit:
+        end = start + limit
+        boundary = max(text.rfind('\n', start, end), text.rfind(' ', start, end))
+        if boundary > start + limit // 2:
+            end = boundary + 1
+        chunks.append(text[start:end])
+        start = end
+    if start < len(text):
+        chunks.append(text[start:])
+    return chunks
+
+class StreamingReply:
+    """
+    Reply to a command with text that arrives piece by piece.
+
+    The first piece is sent immediately; afterwards the reply is edited at
+    most once every ``edit_interval`` seconds, which keeps well within
+    Discord's message edit rate limits. Text that outgrows one message
+    continues in follow-up messages.
+    """
+
+    def __init__(self, reply: Callable[[str], Awaitable[discord.Message]],
+                 send: Optional[Callable[[str], Awaitable[discord.Message]]] = None,
+                 edit_interval: float = 1.0):
+        """
+        Initialize the streaming reply.
+
+        Args:
+            reply (Callable): Coroutine function sending the first message, e.g. ``ctx.reply``
+            send (Callable, optional): Coroutine function sending follow-up messages,
+                defaults to ``reply``
+            edit_interval (float): Minimum seconds between updates of the sent messages
+        """
+        self.reply = reply
+        self.send = send or reply
+        self.edit_interval = edit_interval
+
+        self.text = ""
+        self.messages: List[discord.Message] = []
+        self._shown: List[str] = []
+        self._last_update = 0.0
+
+    async def append(self, text: str) -> None:
+        """
+        Add text to the reply, updating Discord if the last update is old enough.
+
+        Args:
+            text (str): Text to append
+        """
+        self.text += text
+        if not self.messages or time.monotonic() - self._last_update >= self.edit_interval:
+            await self._update()
+
+    async def finish(self) -> str:
+        """
+        Show the complete text.
+
+        Returns:
+            str: The complete text of the reply
+        """
+        await self._update()
+        return self.text
+
+    async def _update(self) -> None:
+        """Edit and send messages so Discord shows the current text."""
+        if not self.text.strip():
+            return
+
+        self._last_update = time.monotonic()
+        tracer = get_tracer()
+        for i, chunk in enumerate(split_message(self.text)):
+            if i < len(self.messages):
+                if self._shown[i] != chunk:
+                    with tracer.span('discord.edit', message=i):
+                        await self.messages[i].edit(content=chunk)
+                    self._shown[i] = chunk
+            else:
+                with tracer.span('discord.send', message=i):
+                    self.messages.append(await (self.reply if i == 0 else self.send)(chunk))
+                self._shown.append(chunk)
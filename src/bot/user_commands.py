@@ -5,10 +5,12 @@ import asyncio
 from typing import Optional
 import datetime
 
-from ..rag.retriever import MessageRetriever
-from ..rag.processor import ContextProcessor
-from ..rag.generator import ResponseGenerator
+from ..rag.pipeline import get_rag_pipeline
+from ..rag.scheduler import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from .client import add_startup_hook, add_shutdown_hook
+from .streaming import StreamingReply
 from ..utils.config import get_config
+from ..utils.tracing import get_tracer
 
 # Configure logging
 logger = logging.getLogger('discord_bot.user_commands')
@@ -78,6 +80,23 @@ class ConversationManager:
         if user_id in self.user_history:
             del self.user_history[user_id]
 
+def ask_priority(ctx: commands.Context) -> int:
+    """
+    Get the LLM scheduling priority of a question.
+    
+    Args:
+        ctx (commands.Context): Context the question was asked in
+        
+    Returns:
+        int: PRIORITY_HIGH for server admins, PRIORITY_LOW for questions asked by
+            mentioning the bot, PRIORITY_NORMAL otherwise
+    """
+    permissions = getattr(ctx.author, 'guild_permissions', None)
+    if permissions is not None and permissions.administrator:
+        return PRIORITY_HIGH
+    # Mentions invoke the command on a message without the command prefix
+    return PRIORITY_NORMAL if ctx.valid else PRIORITY_LOW
+
 def register_user_commands(bot: commands.Bot) -> None:
     """
     Register user-facing commands to the Discord bot.
@@ -87,18 +106,13 @@ def register_user_commands(bot: commands.Bot) -> None:
     """
     # Load configuration
     config = get_config()
-    rag_config = config.get('rag', {})
     ai_config = config.get('ai', {})
     
     # Initialize components
-    retriever = MessageRetriever(
-        max_results=rag_config.get('max_context_messages', 20),
-        max_days=rag_config.get('max_context_days', 30)
-    )
-    processor = ContextProcessor()
-    generator = ResponseGenerator(
-        model=ai_config.get('model', 'gpt-3.5-turbo')
-    )
+    pipeline = get_rag_pipeline()
+    # Keep one pooled HTTP session to the LLM API for the bot's lifetime
+    add_startup_hook(bot, pipeline.start)
+    add_shutdown_hook(bot, pipeline.close)
     conversation_manager = ConversationManager()
     
     @bot.command(name='ask')
@@ -112,49 +126,24 @@ def register_user_commands(bot: commands.Bot) -> None:
         user_id = ctx.author.id
         guild_id = ctx.guild.id
         
-        # Add typing indicator to show the bot is working
-        async with ctx.typing():
-            # Store user question in conversation history
-            conversation_manager.add_message(user_id, question)
-            
-            # Retrieve relevant messages
-            messages = await retriever.retrieve(guild_id, question)
-            
-            # If no messages found, give a simple response
-            if not messages:
-                response = "I couldn't find any relevant information in the server's message history to answer your question."
-                await ctx.reply(response)
+        with get_tracer().trace('ask', command='prefix', guild_id=guild_id, user_id=user_id):
+            # Add typing indicator to show the bot is working
+            async with ctx.typing():
+                # Earlier questions and answers, then the question itself
+                conv_history = conversation_manager.get_history(user_id)
+                conversation_manager.add_message(user_id, question)
+                
+                # Show the answer while it is generated; long answers continue in
+                # follow-up messages
+                reply = StreamingReply(ctx.reply, ctx.send,
+                                       edit_interval=ai_config.get('stream_edit_interval', 1.0))
+                async for chunk in pipeline.answer_stream(guild_id, question, conv_history,
+                                                          ask_priority(ctx)):
+                    await reply.append(chunk)
+                response = await reply.finish()
+                
+                # Store bot response in conversation history
                 conversation_manager.add_message(user_id, response, is_bot=True)
-                return
-            
-            # Process retrieved messages into context
-            context = processor.process_messages(messages)
-            
-            # Get conversation history for additional context
-            conv_history = conversation_manager.get_history(user_id)
-            
-            # Create the full prompt with both message
-            prompt = processor.create_prompt_with_context(question, context)
-            if conv_history:
-                prompt += f"\n\nRecent conversation history:\n{conv_history}"
-            
-            # Generate response
-            response = await generator.generate_response(prompt)
-            
-            # Store bot response in conversation history
-            conversation_manager.add_message(user_id, response, is_bot=True)
-        
-        # Send the response
-        # Split long responses if they exceed Discord's character limit
-        if len(response) > 2000:
-            chunks = [response[i:i+1990] for i in range(0, len(response), 1990)]
-            for i, chunk in enumerate(chunks):
-                if i == 0:
-                    await ctx.reply(chunk)
-                else:
-                    await ctx.send(chunk)
-        else:
-            await ctx.reply(response)
     
     @bot.command(name='clear')
     async def clear_history_command(ctx: commands.Context):
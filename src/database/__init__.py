@@ -6,9 +6,15 @@ from .operations import (
     update_message,
     get_messages_by_date,
     get_messages_by_content,
+    iter_messages,
+    iter_message_pages,
     get_database_stats,
-    store_attachment
+    store_attachment,
+    get_backfill_checkpoints,
+    save_backfill_checkpoint
 )
+from .bulk import BulkWriter, get_bulk_writer, close_bulk_writer
+from .ingest import IngestQueue, get_ingest_queue, close_ingest_queue
 
 __all__ = [
     'get_db_pool',
@@ -17,6 +23,16 @@ __all__ = [
     'update_message',
     'get_messages_by_date',
     'get_messages_by_content',
+    'iter_messages',
+    'iter_message_pages',
     'get_database_stats',
-    'store_attachment'
+    'store_attachment',
+    'get_backfill_checkpoints',
+    'save_backfill_checkpoint',
+    'BulkWriter',
+    'get_bulk_writer',
+    'close_bulk_writer',
+    'IngestQueue',
+    'get_ingest_queue',
+    'close_ingest_queue'
 ]
@@ -0,0 +1,278 @@
+"""Batched bulk ingest of Discord messages using COPY and set-based upserts."""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import asyncpg
+import discord
+
+from .connection import get_db_pool
+from .models import (
+    MESSAGE_COLUMNS,
+    ATTACHMENT_COLUMNS,
+    MESSAGE_UPSERT_ASSIGNMENTS,
+    MESSAGE_CONFLICT_TARGET,
+    MESSAGE_STAGING_TABLE,
+    ATTACHMENT_STAGING_TABLE
+)
+from .operations import message_to_record, attachment_to_records
+from .partitions import ensure_message_partitions
+
+# Position of the timestamp within a message record
+TIMESTAMP_INDEX = MESSAGE_COLUMNS.index('timestamp')
+
+# Configure logging
+logger = logging.getLogger('discord_bot.database.bulk')
+
+UPSERT_MESSAGES = f"""
+INSERT INTO messages ({', '.join(MESSAGE_COLUMNS)})
+SELECT {', '.join(MESSAGE_COLUMNS)} FROM message_staging
+ON CONFLICT {MESSAGE_CONFLICT_TARGET}
+DO UPDATE SET {MESSAGE_UPSERT_ASSIGNMENTS}
+"""
+
+UPSERT_ATTACHMENTS = f"""
+INSERT INTO attachments ({', '.join(ATTACHMENT_COLUMNS)})
+SELECT {', '.join(ATTACHMENT_COLUMNS)} FROM attachment_staging
+ON CONFLICT (attachment_id) DO NOTHING
+"""
+
+# Callback invoked with the message records of every successful flush
+FlushListener = Callable[[List[Tuple]], Awaitable[None]]
+
+class BulkWriter:
+    """
+    Accumulate messages and land them in batches.
+
+    Each flush copies the pending messages and attachments into per-connection
+    temporary staging tables with ``COPY`` and moves them into the real tables
+    with one ``INSERT ... SELECT ... ON CONFLICT`` per table, all inside a
+    single transaction. A batch is flushed when it reaches ``batch_size``
+    messages or, once started, every ``flush_interval`` seconds.
+    """
+
+    def __init__(self, batch_size: int = 500, flush_interval: float = 1.0,
+                 max_pending: Optional[int] = None):
+        """
+        Initialize the bulk writer.
+
+        Args:
+            batch_size (int): Number of messages that triggers a flush
+            flush_interval (float): Seconds between background flushes
+            max_pending (int, optional): Maximum messages kept for retry after
+                failed flushes, defaults to ten batches
+        """
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending or self.batch_size * 10
+
+        # Keyed by message ID so a message written twice in a batch (e.g.
+        # created then edited) is only upserted once, with its latest state
+        self._messages: Dict[int, Tuple] = {}
+        self._attachments: Dict[int, Tuple] = {}
+
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._listeners: List[FlushListener] = []
+
+        self.flushed_messages = 0
+        self.flushed_attachments = 0
+        self.flush_count = 0
+        self.failed_flushes = 0
+        self.dropped_messages = 0
+
+    @property
+    def pending(self) -> int:
+        """Number of messages waiting to be flushed."""
+        return len(self._messages)
+
+    def add_flush_listener(self, listener: FlushListener) -> None:
+        """
+        Register a coroutine called with the message records of each successful flush.
+
+        Args:
+            listener (FlushListener): Coroutine function accepting a list of records
+        """
+        self._listeners.append(listener)
+
+    def start(self) -> None:
+        """Start the background task that flushes every ``flush_interval`` seconds."""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def close(self) -> None:
+        """Stop the background flush task and flush anything still pending."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def buffer(self, message: discord.Message) -> None:
+        """
+        Buffer a message without flushing, even if the batch is full.
+
+        Args:
+            message (discord.Message): The Discord message to store
+        """
+        self._messages[message.id] = message_to_record(message)
+        for record in attachment_to_records(message):
+            self._attachments[record[0]] = record
+
+    async def add(self, message: discord.Message) -> bool:
+        """
+        Add a message to the current batch, flushing if the batch is full.
+
+        Args:
+            message (discord.Message): The Discord message to store
+
+        Returns:
+            bool: True once the message has been accepted
+        """
+        self.buffer(message)
+        if len(self._messages) >= self.batch_size:
+            await self.flush()
+        return True
+
+    async def add_many(self, messages: Iterable[discord.Message]) -> int:
+        """
+        Add several messages, flushing whenever a batch fills up.
+
+        Args:
+            messages (Iterable[discord.Message]): Messages to store
+
+        Returns:
+            int: Number of messages accepted
+        """
+        count = 0
+        for message in messages:
+            await self.add(message)
+            count += 1
+        return count
+
+    async def flush(self) -> int:
+        """
+        Write all pending messages and attachments to the database.
+
+        Returns:
+            int: Number of messages written, 0 if nothing was pending or the flush failed
+        """
+        async with self._flush_lock:
+            if not self._messages:
+                return 0
+
+            messages = list(self._messages.values())
+            attachments = list(self._attachments.values())
+            self._messages = {}
+            self._attachments = {}
+
+            try:
+                await self._copy(messages, attachments)
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"Error flushing {len(messages)} messages: {str(e)}")
+                self._requeue(messages, attachments)
+                return 0
+
+            self.flush_count += 1
+            self.flushed_messages += len(messages)
+            self.flushed_attachments += len(attachments)
+            logger.debug(f"Flushed {len(messages)} messages and {len(attachments)} attachments")
+
+        for listener in self._listeners:
+            try:
+                await listener(messages)
+            except Exception as e:
+                logger.error(f"Error in bulk writer flush listener: {str(e)}")
+
+        return len(messages)
+
+    async def _copy(self, messages: List[Tuple], attachments: List[Tuple]) -> None:
+        """COPY a batch into the staging tables and upsert it in one transaction."""
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            try:
+                await self._upsert(conn, messages, attachments)
+            except asyncpg.CheckViolationError:
+                # A month without a partition; attach it outside the write
+                # transaction and retry once
+                await ensure_message_partitions(conn, {record[TIMESTAMP_INDEX] for record in messages})
+                await self._upsert(conn, messages, attachments)
+
+    @staticmethod
+    async def _upsert(conn: asyncpg.Connection, messages: List[Tuple], attachments: List[Tuple]) -> None:
+        """Stage and upsert a batch on a connection in one transaction."""
+        async with conn.transaction():
+            await conn.execute(MESSAGE_STAGING_TABLE)
+            await conn.copy_records_to_table('message_staging', records=messages,
+                                             columns=MESSAGE_COLUMNS)
+            await conn.execute(UPSERT_MESSAGES)
+
+            if attachments:
+                await conn.execute(ATTACHMENT_STAGING_TABLE)
+                await conn.copy_records_to_table('attachment_staging', records=attachments,
+                                                 columns=ATTACHMENT_COLUMNS)
+                await conn.execute(UPSERT_ATTACHMENTS)
+
+    def _requeue(self, messages: List[Tuple], attachments: List[Tuple]) -> None:
+        """Put a failed batch back in front of newer writes, within max_pending."""
+        retained = {record[0]: record for record in messages}
+        retained.update(self._messages)
+
+        overflow = len(retained) - self.max_pending
+        if overflow > 0:
+            self.dropped_messages += overflow
+            logger.error(f"Bulk writer backlog full, dropping {overflow} messages")
+            retained = dict(list(retained.items())[overflow:])
+
+        attachment_map = {record[0]: record for record in attachments if record[1] in retained}
+        attachment_map.update(self._attachments)
+
+        self._messages = retained
+        self._attachments = attachment_map
+
+    async def _flush_periodically(self) -> None:
+        """Flush pending messages every flush_interval seconds."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error in periodic flush: {str(e)}")
+
+# Bulk writer singleton
+_writer: Optional[BulkWriter] = None
+
+async def get_bulk_writer() -> BulkWriter:
+    """
+    Get or create the shared bulk writer, started with the ``ingest`` config.
+
+    Returns:
+        BulkWriter: The shared bulk writer
+    """
+    global _writer
+
+    if _writer is None:
+        from ..utils.config import get_config
+
+        ingest_config = get_config().get('ingest', {})
+        _writer = BulkWriter(
+            batch_size=ingest_config.get('batch_size', 500),
+            flush_interval=ingest_config.get('flush_interval', 1.0),
+            max_pending=ingest_config.get('max_pending')
+        )
+        _writer.start()
+
+    return _writer
+
+async def close_bulk_writer() -> None:
+    """Flush and stop the shared bulk writer, if one was created."""
+    global _writer
+
+    if _writer is not None:
+        await _writer.close()
+        _writer = None
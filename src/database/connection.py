@@ -3,6 +3,12 @@ import os
 import logging
 from typing import Optional, Dict, Any, List
 import asyncio
+import time
+
+from .instrumentation import count_rows, get_query_monitor, normalize_statement
+from .statements import STATEMENTS
+from ..utils.metrics import get_metrics
+from ..utils.tracing import get_tracer
 
 # Configure logging
 logger = logging.getLogger('discord_bot.database')
@@ -44,6 +50,8 @@ async def get_db_pool() -> asyncpg.Pool:
         'max_size': int(os.getenv('DB_MAX_POOL_SIZE', DEFAULT_DB_CONFIG['max_size']))
     }
 
+    get_metrics().add_collector('db_pool', get_pool_stats)
+
     # Add retry logic
     max_retries = 5
     retry_delay = 3  # seconds
@@ -84,6 +92,53 @@ async def get_db_pool() -> asyncpg.Pool:
         logger.error(f"Error connecting to PostgreSQL: {str(e)}")
         raise
 
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Get the utilization of the connection pool.
+
+    Returns:
+        Dict[str, Any]: Open, idle, in-use and maximum connections; empty if no pool is open
+    """
+    if _pool is None or _pool._closed:
+        return {}
+
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    return {
+        'size': size,
+        'idle': idle,
+        'in_use': size - idle,
+        'max_size': _pool.get_max_size(),
+        'utilization': round((size - idle) / _pool.get_max_size(), 3)
+    }
+
+async def check_database(timeout: float = 2.0) -> bool:
+    """
+    Check that the open connection pool can run a query.
+
+    Does not open a pool if there is none, so a health check never waits
+    on the connection retries of get_db_pool.
+
+    Args:
+        timeout (float): Seconds allowed to acquire a connection and run the query
+
+    Returns:
+        bool: True if a pooled connection answered in time
+    """
+    if _pool is None or _pool._closed:
+        return False
+
+    try:
+        async def ping() -> None:
+            async with _pool.acquire() as conn:
+                await conn.fetchval("SELECT 1")
+
+        await asyncio.wait_for(ping(), timeout)
+        return True
+    except Exception as e:
+        logger.warning(f"Database health check failed: {str(e) or type(e).__name__}")
+        return False
+
 async def execute_query(query: str, *args, fetch: bool = False,
                         fetch_one: bool = False, fetch_val: bool = False) -> Any:
     """
@@ -98,38 +153,73 @@ async def execute_query(query: str, *args, fetch: bool = False,
 
     Returns:
         Any: Query results if fetch=True, otherwise None
+
+    Each query is timed and counted by the query monitor, which logs slow
+    queries and a sample of the others.
     """
     pool = await get_db_pool()
+    monitor = get_query_monitor()
 
-    try:
+    # The span includes waiting for a pooled connection
+    with get_tracer().span('db.query') as span:
         async with pool.acquire() as conn:
-            logger.info(f"Executing query: {query} with args: {args}")
-            if fetch:
-                result = await conn.fetch(query, *args)
-                logger.info(f"Query result: {result}")
+            started = time.perf_counter()
+            result = None
+            error = None
+            try:
+                if fetch:
+                    result = await conn.fetch(query, *args)
+                elif fetch_one:
+                    result = await conn.fetchrow(query, *args)
+                elif fetch_val:
+                    result = await conn.fetchval(query, *args)
+                else:
+                    result = await conn.execute(query, *args)
                 return result
-            elif fetch_one:
-                result = await conn.fetchrow(query, *args)
-                logger.info(f"Query result: {result}")
-                return result
-            elif fetch_val:
-                result = await conn.fetchval(query, *args)
-                logger.info(f"Query result: {result}")
-                return result
-            else:
-                result = await conn.execute(query, *args)
-                logger.info(f"Query executed successfully")
-                return result
-    except asyncpg.PostgresError as e:
-        logger.error(f"Database query error: {str(e)}")
-        logger.error(f"Query: {query}")
-        raise
+            except asyncpg.PostgresError as e:
+                error = e
+                logger.error(f"Database query error: {str(e)}")
+                logger.error(f"Query: {query}")
+                raise
+            finally:
+                rows = count_rows(result) if error is None else None
+                monitor.record(query, args, time.perf_counter() - started, rows, error)
+                if span.trace is not None:
+                    span.set_attribute('statement', normalize_statement(query)[:120])
+                    if rows is not None:
+                        span.set_attribute('rows', rows)
+
+async def execute_statement(name: str, *args, fetch: bool = False,
+                            fetch_one: bool = False, fetch_val: bool = False) -> Any:
+    """
+    Execute a registered statement.
+
+    The statement's text never changes, so each pooled connection prepares
+    it on first use and then reuses it from asyncpg's statement cache.
+
+    Args:
+        name (str): Statement name in ``statements.STATEMENTS``
+        *args: Statement parameters
+        fetch (bool): Whether to fetch all results
+        fetch_one (bool): Whether to fetch a single row
+        fetch_val (bool): Whether to fetch a single value
+
+    Returns:
+        Any: Query results if fetching, otherwise the command status
+    """
+    return await execute_query(STATEMENTS[name], *args, fetch=fetch,
+                               fetch_one=fetch_one, fetch_val=fetch_val)
 
 async def setup_database() -> None:
     """
     Set up the database schema if it doesn't exist.
     """
-    from .models import get_schema_creation_commands
+    from .models import (
+        get_schema_creation_commands,
+        get_partitioned_index_commands,
+        get_concurrent_index_commands
+    )
+    from .partitions import is_messages_partitioned, create_upcoming_partitions
 
     pool = await get_db_pool()
 
@@ -139,4 +229,18 @@ async def setup_database() -> None:
             for command in get_schema_creation_commands():
                 await conn.execute(command)
 
+        if await is_messages_partitioned(conn, refresh=True):
+            async with conn.transaction():
+                for command in get_partitioned_index_commands():
+                    await conn.execute(command)
+
+            months_ahead = int(os.getenv('DB_PARTITION_MONTHS_AHEAD', 3))
+            await create_upcoming_partitions(conn, months_ahead)
+        else:
+            logger.warning("messages table is not partitioned; run scripts/setup_db.py --partition to migrate it")
+
+            # CONCURRENTLY cannot run inside a transaction block
+            for command in get_concurrent_index_commands():
+                await conn.execute(command)
+
     logger.info("Database schema setup complete")
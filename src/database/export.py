@@ -0,0 +1,379 @@
+"""Bulk export of the message archive to compressed JSONL and Parquet files."""
+
+import asyncio
+import datetime
+import gzip
+import io
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from .connection import get_db_pool
+from .instrumentation import count_rows
+from .partitions import add_months, is_messages_partitioned, list_month_partitions, month_start
+
+# Configure logging
+logger = logging.getLogger('discord_bot.database.export')
+
+EXPORT_FORMATS = ('jsonl', 'parquet')
+
+# Exported columns and their Arrow types; the search vector and attachment
+# data are left out
+MESSAGE_EXPORT_TYPES = {
+    'message_id': 'int64',
+    'channel_id': 'int64',
+    'channel_name': 'string',
+    'guild_id': 'int64',
+    'author_id': 'int64',
+    'author_name': 'string',
+    'content': 'string',
+    'timestamp': 'timestamp',
+    'is_pinned': 'bool',
+    'has_attachments': 'bool',
+    'reference_message_id': 'int64',
+    'last_updated': 'timestamp'
+}
+
+ATTACHMENT_EXPORT_TYPES = {
+    'attachment_id': 'int64',
+    'message_id': 'int64',
+    'filename': 'string',
+    'url': 'string',
+    'content_type': 'string',
+    'width': 'int32',
+    'height': 'int32',
+    'size': 'int32',
+    'proxy_url': 'string',
+    'description': 'string'
+}
+
+# COPY options that leave each JSON document untouched: quote and delimiter
+# are control characters, which JSON always escapes
+_JSONL_COPY_OPTIONS = {'format': 'csv', 'quote': '\x01', 'delimiter': '\x02'}
+
+class ExportTask:
+    """One output file: the rows of a table or partition matching the export filter."""
+
+    def __init__(self, relation: str, key: str, types: Dict[str, str], where: str, args: List[Any]):
+        """
+        Initialize the export task.
+
+        Args:
+            relation (str): Table or partition to read
+            key (str): Unique column the rows are paged by
+            types (Dict[str, str]): Exported columns and their Arrow types
+            where (str): Filter condition, with $n placeholders for args
+            args (List[Any]): Filter parameters
+        """
+        self.relation = relation
+        self.key = key
+        self.types = types
+        self.where = where
+        self.args = args
+
+def export_filter(guild_id: Optional[int] = None, channel_id: Optional[int] = None,
+                  since: Optional[datetime.datetime] = None,
+                  until: Optional[datetime.datetime] = None) -> Tuple[str, List[Any]]:
+    """
+    Build the condition selecting the exported messages.
+
+    Args:
+        guild_id (int, optional): Only export this Discord server
+        channel_id (int, optional): Only export this channel
+        since (datetime.datetime, optional): Oldest time to include
+        until (datetime.datetime, optional): Time to stop before
+
+    Returns:
+        Tuple[str, List[Any]]: Condition on the messages columns and its parameters
+    """
+    conditions = []
+    args: List[Any] = []
+    for condition, value in (('guild_id = ${}', guild_id), ('channel_id = ${}', channel_id),
+                             ('timestamp >= ${}', since), ('timestamp < ${}', until)):
+        if value is not None:
+            args.append(value)
+            conditions.append(condition.format(len(args)))
+    return ' AND '.join(conditions) or 'TRUE', args
+
+async def plan_export(conn: asyncpg.Connection, where: str, args: List[Any],
+                      since: Optional[datetime.datetime] = None,
+                      until: Optional[datetime.datetime] = None,
+                      attachments: bool = True) -> List[ExportTask]:
+    """
+    Split an export into one task per messages partition, plus one for attachments.
+
+    Partitions whose month lies outside the exported time range are skipped.
+
+    Args:
+        conn (asyncpg.Connection): Database connection
+        where (str): Condition selecting the exported messages, from export_filter
+        args (List[Any]): Parameters of the condition
+        since (datetime.datetime, optional): Oldest exported time
+        until (datetime.datetime, optional): Time the export stops before
+        attachments (bool): Also export the attachments of the exported messages
+
+    Returns:
+        List[ExportTask]: Export tasks, messages first
+    """
+    def overlaps(month: datetime.date) -> bool:
+        """Check whether a partition's month overlaps the exported time range."""
+        if since is not None and add_months(month, 1) <= month_start(since):
+            return False
+        if until is not None:
+            start = datetime.datetime(month.year, month.month, 1, tzinfo=datetime.timezone.utc)
+            if start >= (until if until.tzinfo else until.replace(tzinfo=datetime.timezone.utc)):
+                return False
+        return True
+
+    relations = ['messages']
+    if await is_messages_partitioned(conn, refresh=True):
+        relations = [
+            name for name, month in await list_month_partitions(conn)
+            if month is None or overlaps(month)
+        ]
+
+    tasks = [ExportTask(relation, 'message_id', MESSAGE_EXPORT_TYPES, where, args) for relation in relations]
+    if attachments:
+        attachment_where = 'TRUE' if where == 'TRUE' else \
+            f"message_id IN (SELECT message_id FROM messages WHERE {where})"
+        tasks.append(ExportTask('attachments', 'attachment_id', ATTACHMENT_EXPORT_TYPES, attachment_where, args))
+    return tasks
+
+async def copy_jsonl(conn: asyncpg.Connection, task: ExportTask, path: Path, compress: bool = True) -> int:
+    """
+    Stream the rows of a task into a JSON Lines file with a single COPY.
+
+    The server renders each row as a JSON document, so the rows are never
+    decoded in Python. Compression runs in a worker thread.
+
+    Args:
+        conn (asyncpg.Connection): Database connection
+        task (ExportTask): Rows to export
+        path (Path): Output file
+        compress (bool): Write gzip-compressed output
+
+    Returns:
+        int: Number of rows written
+    """
+    query = f"""
+        SELECT row_to_json(r) FROM (
+            SELECT {', '.join(task.types)} FROM {task.relation} WHERE {task.where}
+        ) r
+    """
+    stream = gzip.open(path, 'wb', compresslevel=6) if compress else open(path, 'wb')
+    try:
+        async def write(chunk: bytes) -> None:
+            await asyncio.to_thread(stream.write, chunk)
+
+        status = await conn.copy_from_query(query, *task.args, output=write, **_JSONL_COPY_OPTIONS)
+    finally:
+        await asyncio.to_thread(stream.close)
+    return count_rows(status) or 0
+
+def _arrow_schema(types: Dict[str, str]):
+    """Build the Parquet schema of an exported table."""
+    import pyarrow as pa
+
+    arrow_types = {
+        'int64': pa.int64(),
+        'int32': pa.int32(),
+        'string': pa.string(),
+        'bool': pa.bool_(),
+        'timestamp': pa.timestamp('us', tz='UTC')
+    }
+    return pa.schema([(column, arrow_types[kind]) for column, kind in types.items()])
+
+def _csv_to_table(data: bytes, types: Dict[str, str], schema):
+    """Parse one chunk of COPY CSV output into a table with the export schema."""
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    # Timestamps arrive as microseconds since the epoch
+    column_types = {column: (pa.int64() if kind == 'timestamp' else schema.field(column).type)
+                    for column, kind in types.items()}
+    table = pa_csv.read_csv(
+        io.BytesIO(data),
+        read_options=pa_csv.ReadOptions(column_names=list(types)),
+        # Message content may contain line breaks
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=column_types,
+            # COPY writes NULL as an unquoted empty field and an empty string
+            # as "", so text such as "NA" or "null" is kept as it is
+            null_values=[''],
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False,
+            true_values=['t'],
+            false_values=['f']
+        )
+    )
+    return table.cast(schema)
+
+async def copy_parquet(conn: asyncpg.Connection, task: ExportTask, path: Path,
+                       row_group_size: int = 100000, compression: str = 'zstd') -> int:
+    """
+    Stream the rows of a task into a Parquet file, one row group per COPY.
+
+    Each row group is read with a COPY of the next ``row_group_size`` rows
+    after the last key written, so only one row group is held in memory.
+    Parsing and compression run in a worker thread. No file is written
+    when there are no rows.
+
+    Args:
+        conn (asyncpg.Connection): Database connection
+        task (ExportTask): Rows to export
+        path (Path): Output file
+        row_group_size (int): Rows per row group
+        compression (str): Parquet compression codec
+
+    Returns:
+        int: Number of rows written
+
+    Raises:
+        ImportError: If pyarrow is not installed
+    """
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(task.types)
+    columns = ', '.join(
+        f"(extract(epoch FROM {column}) * 1000000)::bigint AS {column}" if kind == 'timestamp' else column
+        for column, kind in task.types.items()
+    )
+    key_param = len(task.args) + 1
+    query = f"""
+        SELECT {columns} FROM {task.relation}
+        WHERE {task.where} AND {task.key} > ${key_param}
+        ORDER BY {task.key}
+        LIMIT ${key_param + 1}
+    """
+
+    writer = None
+    last_key = -1
+    total = 0
+    try:
+        while True:
+            chunks: List[bytes] = []
+
+            async def collect(chunk: bytes) -> None:
+                chunks.append(chunk)
+
+            await conn.copy_from_query(query, *task.args, last_key, row_group_size,
+                                       output=collect, format='csv')
+            if not chunks:
+                break
+
+            table = await asyncio.to_thread(_csv_to_table, b''.join(chunks), task.types, schema)
+            if writer is None:
+                writer = pq.ParquetWriter(path, schema, compression=compression)
+            await asyncio.to_thread(writer.write_table, table, row_group_size)
+            total += table.num_rows
+
+            if table.num_rows < row_group_size:
+                break
+            last_key = table.column(task.key)[-1].as_py()
+    finally:
+        if writer is not None:
+            await asyncio.to_thread(writer.close)
+    return total
+
+async def export_archive(
+    output_dir: Path,
+    fmt: str = 'jsonl',
+    guild_id: Optional[int] = None,
+    channel_id: Optional[int] = None,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    workers: int = 4,
+    row_group_size: int = 100000,
+    compression: Optional[str] = None,
+    attachments: bool = True
+) -> Dict[str, Any]:
+    """
+    Export messages and their attachments to one file per messages partition.
+
+    Partitions are exported in parallel, each on its own pooled connection.
+
+    Args:
+        output_dir (Path): Directory the files are written to
+        fmt (str): 'jsonl' or 'parquet'
+        guild_id (int, optional): Only export this Discord server
+        channel_id (int, optional): Only export this channel
+        since (datetime.datetime, optional): Oldest time to include
+        until (datetime.datetime, optional): Time to stop before
+        workers (int): Number of files written at the same time
+        row_group_size (int): Rows per Parquet row group
+        compression (str, optional): 'gzip' or 'none' for JSONL, a Parquet codec for
+            Parquet; defaults to gzip and zstd
+        attachments (bool): Also export the attachments of the exported messages
+
+    Returns:
+        Dict[str, Any]: Rows, bytes and throughput of every file and in total
+
+    Raises:
+        ValueError: If the format is unknown
+        ImportError: If Parquet is requested and pyarrow is not installed
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {', '.join(EXPORT_FORMATS)}")
+    if fmt == 'parquet':
+        # Fail before any file is written
+        import pyarrow.parquet  # noqa: F401
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    where, args = export_filter(guild_id, channel_id, since, until)
+
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        tasks = await plan_export(conn, where, args, since, until, attachments)
+
+    semaphore = asyncio.Semaphore(max(1, workers))
+    started = time.perf_counter()
+
+    async def run(task: ExportTask) -> Optional[Dict[str, Any]]:
+        async with semaphore:
+            task_started = time.perf_counter()
+            async with pool.acquire() as conn:
+                if fmt == 'jsonl':
+                    compress = (compression or 'gzip') != 'none'
+                    path = output_dir / f"{task.relation}.jsonl{'.gz' if compress else ''}"
+                    rows = await copy_jsonl(conn, task, path, compress)
+                    if not rows:
+                        path.unlink()
+                else:
+                    path = output_dir / f"{task.relation}.parquet"
+                    rows = await copy_parquet(conn, task, path, row_group_size, compression or 'zstd')
+
+            if not rows:
+                return None
+
+            seconds = time.perf_counter() - task_started
+            size = path.stat().st_size
+            logger.info(f"Exported {rows} rows of {task.relation} to {path} in {seconds:.1f}s "
+                        f"({rows / seconds:.0f} rows/s, {size / seconds / 1e6:.1f} MB/s)")
+            return {
+                'file': str(path),
+                'rows': rows,
+                'bytes': size,
+                'seconds': round(seconds, 3),
+                'rows_per_second': round(rows / seconds)
+            }
+
+    files = [result for result in await asyncio.gather(*(run(task) for task in tasks)) if result]
+
+    seconds = time.perf_counter() - started
+    rows = sum(result['rows'] for result in files)
+    size = sum(result['bytes'] for result in files)
+    logger.info(f"Exported {rows} rows to {len(files)} files in {seconds:.1f}s "
+                f"({rows / seconds:.0f} rows/s, {size / seconds / 1e6:.1f} MB/s)")
+
+    return {
+        'format': fmt,
+        'files': files,
+        'rows': rows,
+        'bytes': size,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows / seconds) if seconds else 0
+    }
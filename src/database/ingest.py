@@ -0,0 +1,247 @@
+"""Write-behind queue decoupling Discord event handling from database writes."""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import discord
+
+from .bulk import BulkWriter, get_bulk_writer
+
+# Configure logging
+logger = logging.getLogger('discord_bot.database.ingest')
+
+class IngestQueue:
+    """
+    Bounded in-process queue with a background task flushing it in batches.
+
+    Event handlers call :meth:`submit`, which never waits on the database:
+    the message is either queued or, if the queue is full, dropped and
+    counted. A single flusher task drains whatever has accumulated (up to
+    ``batch_size`` messages) into the BulkWriter and flushes it, so bursts
+    are coalesced into one COPY per batch. While failed flushes fill the
+    writer's backlog up to its ``max_pending``, the flusher only retries
+    the backlog and leaves new messages queued, so an outage shows up as
+    counted queue drops rather than messages the writer discards. Dropped
+    messages are picked up again by the next incremental history sync.
+    """
+
+    def __init__(self, writer: BulkWriter, maxsize: int = 10000, batch_size: int = 500,
+                 retry_interval: float = 1.0):
+        """
+        Initialize the ingest queue.
+
+        Args:
+            writer (BulkWriter): Writer the queued messages are flushed through
+            maxsize (int): Maximum number of messages waiting to be written
+            batch_size (int): Maximum number of messages per flush
+            retry_interval (float): Seconds between retries of a full writer backlog
+        """
+        self.writer = writer
+        self.maxsize = maxsize
+        self.batch_size = max(1, batch_size)
+        self.retry_interval = retry_interval
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._flusher: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # Backpressure metrics
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.high_water_mark = 0
+        self.last_batch_size = 0
+        self.last_flush_seconds = 0.0
+        self.total_queue_seconds = 0.0
+
+    @property
+    def depth(self) -> int:
+        """Number of messages currently waiting in the queue."""
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        """Start the background flusher task."""
+        if self._flusher is None or self._flusher.done():
+            self._closing = False
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    def submit(self, message: discord.Message) -> bool:
+        """
+        Queue a message for writing without waiting.
+
+        Args:
+            message (discord.Message): The Discord message to store
+
+        Returns:
+            bool: True if the message was queued, False if it was dropped
+        """
+        if self._closing:
+            self.dropped += 1
+            logger.warning(f"Ingest queue is shutting down, dropping message {message.id}")
+            return False
+
+        try:
+            self._queue.put_nowait((message, time.monotonic()))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            # Log the first drop and then every thousandth to avoid flooding the log
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"Ingest queue full ({self.maxsize}), {self.dropped} message(s) dropped so far")
+            return False
+
+        self.enqueued += 1
+        self.high_water_mark = max(self.high_water_mark, self._queue.qsize())
+        return True
+
+    async def close(self, timeout: Optional[float] = 30.0) -> None:
+        """
+        Stop accepting messages and write everything already queued.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the queue to drain
+        """
+        self._closing = True
+        try:
+            if self._flusher is not None and not self._flusher.done():
+                await asyncio.wait_for(self._queue.join(), timeout)
+            elif not self._queue.empty():
+                # No flusher running (never started or crashed), drain inline
+                await asyncio.wait_for(self._drain_inline(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out draining ingest queue, {self.depth} message(s) not written")
+        finally:
+            if self._flusher is not None:
+                self._flusher.cancel()
+                try:
+                    await self._flusher
+                except asyncio.CancelledError:
+                    pass
+                self._flusher = None
+
+        logger.info(f"Ingest queue drained: {self.written} written, {self.dropped} dropped")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get backpressure metrics for the queue.
+
+        Returns:
+            Dict[str, Any]: Queue depth, throughput and latency counters
+        """
+        return {
+            'depth': self.depth,
+            'maxsize': self.maxsize,
+            'high_water_mark': self.high_water_mark,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            # Messages discarded by the writer after repeated failed flushes
+            'writer_dropped': self.writer.dropped_messages,
+            'writer_pending': self.writer.pending,
+            'written': self.written,
+            'batches': self.batches,
+            'failed_batches': self.failed_batches,
+            'last_batch_size': self.last_batch_size,
+            'last_flush_seconds': round(self.last_flush_seconds, 6),
+            'avg_queue_seconds': round(self.total_queue_seconds / self.written, 6) if self.written else 0.0
+        }
+
+    async def _flush_loop(self) -> None:
+        """Wait for messages and flush them in batches until cancelled."""
+        while True:
+            try:
+                await self._write_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in ingest flusher: {str(e)}")
+
+    async def _drain_inline(self) -> None:
+        """Write batches until the queue is empty."""
+        while not self._queue.empty():
+            await self._write_batch()
+
+    async def _write_batch(self) -> None:
+        """Drain up to batch_size queued messages into the writer and flush them."""
+        room = self.writer.max_pending - self.writer.pending
+        if room <= 0:
+            # The writer would drop its oldest messages to take more; retry
+            # its backlog and leave new messages to the queue until it clears
+            failures = self.writer.failed_flushes
+            await self.writer.flush()
+            if self.writer.failed_flushes > failures:
+                self.failed_batches += 1
+                await asyncio.sleep(self.retry_interval)
+            return
+
+        batch = [await self._queue.get()]
+        while len(batch) < min(self.batch_size, room):
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+        try:
+            for message, _ in batch:
+                self.writer.buffer(message)
+
+            failures = self.writer.failed_flushes
+            started = time.monotonic()
+            await self.writer.flush()
+            finished = time.monotonic()
+            self.last_flush_seconds = finished - started
+
+            if self.writer.failed_flushes > failures:
+                # The writer keeps the batch and retries it on its next flush
+                self.failed_batches += 1
+                return
+
+            self.batches += 1
+            self.written += len(batch)
+            self.last_batch_size = len(batch)
+            self.total_queue_seconds += sum(finished - queued_at for _, queued_at in batch)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+# Ingest queue singleton
+_queue: Optional[IngestQueue] = None
+
+async def get_ingest_queue() -> IngestQueue:
+    """
+    Get or create the shared ingest queue, started with the ``ingest`` config.
+
+    Returns:
+        IngestQueue: The shared ingest queue
+    """
+    global _queue
+
+    if _queue is None:
+        from ..utils.config import get_config
+        from ..utils.metrics import get_metrics
+
+        ingest_config = get_config().get('ingest', {})
+        _queue = IngestQueue(
+            await get_bulk_writer(),
+            maxsize=ingest_config.get('queue_size', 10000),
+            batch_size=ingest_config.get('batch_size', 500)
+        )
+        _queue.start()
+        get_metrics().add_collector('ingest_queue', _queue.stats)
+
+    return _queue
+
+async def close_ingest_queue(timeout: Optional[float] = 30.0) -> None:
+    """
+    Drain and stop the shared ingest queue, if one was created.
+
+    Args:
+        timeout (float, optional): Seconds to wait for the queue to drain
+    """
+    global _queue
+
+    if _queue is not None:
+        await _queue.close(timeout)
+        _queue = None
@@ -0,0 +1,248 @@
+import bisect
+import functools
+import logging
+import os
+import random
+import reprlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from ..utils.metrics import get_metrics
+
+logger = logging.getLogger('discord_bot.database.queries')
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Shortens logged arguments such as message content and ID arrays
+_args_repr = reprlib.Repr()
+_args_repr.maxstring = 80
+_args_repr.maxother = 80
+_args_repr.maxlist = 10
+
+@functools.lru_cache(maxsize=1024)
+def normalize_statement(query: str) -> str:
+    """
+    Reduce a query to the statement it is counted under.
+
+    Args:
+        query (str): SQL query as executed
+
+    Returns:
+        str: The query with whitespace collapsed
+    """
+    return ' '.join(query.split())
+
+def count_rows(result: Any) -> Optional[int]:
+    """
+    Count the rows returned or affected by a query.
+
+    Args:
+        result (Any): Result of fetch, fetchrow, fetchval or execute
+
+    Returns:
+        Optional[int]: Number of rows, or None if the command status does not say
+    """
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, str):
+        # Command status such as 'INSERT 0 5' or 'UPDATE 3'
+        count = result.rpartition(' ')[2]
+        return int(count) if count.isdigit() else None
+    return 0 if result is None else 1
+
+class StatementStats:
+    """Timing histogram and counters of one SQL statement."""
+
+    __slots__ = ('calls', 'errors', 'rows', 'total_seconds', 'max_seconds', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        # One count per bucket of LATENCY_BUCKETS_MS, plus one for slower queries
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def percentile_ms(self, fraction: float) -> float:
+        """
+        Estimate a latency percentile from the histogram.
+
+        Args:
+            fraction (float): Percentile as a fraction, e.g. 0.95
+
+        Returns:
+            float: Upper bound of the bucket holding the percentile, in milliseconds
+        """
+        target = fraction * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= target:
+                return float(bound)
+        return round(self.max_seconds * 1000, 3)
+
+class QueryMonitor:
+    """
+    Collect per-statement timings and log slow and sampled queries.
+
+    Every query is counted in its statement's latency histogram, which is
+    cheap. Queries slower than the threshold are logged with their
+    arguments at WARNING; a random sample of the others is logged at
+    INFO. Arguments are shortened before logging.
+    """
+
+    def __init__(self, slow_query_ms: float = 500.0, sample_rate: float = 0.0,
+                 max_statements: int = 500):
+        """
+        Initialize the query monitor.
+
+        Args:
+            slow_query_ms (float): Queries taking at least this long are logged; 0 disables
+            sample_rate (float): Fraction of other queries that is logged
+            max_statements (int): Distinct statements tracked; later ones are counted together
+        """
+        self.slow_query_ms = slow_query_ms
+        self.sample_rate = sample_rate
+        self.max_statements = max_statements
+
+        self._statements: Dict[str, StatementStats] = {}
+
+        # Counters
+        self.queries = 0
+        self.errors = 0
+        self.slow_queries = 0
+        self.sampled = 0
+
+    def record(self, query: str, args: Sequence[Any], elapsed: float,
+               rows: Optional[int] = None, error: Optional[BaseException] = None) -> None:
+        """
+        Record one executed query.
+
+        Args:
+            query (str): SQL query
+            args (Sequence[Any]): Query parameters
+            elapsed (float): Seconds the query took
+            rows (int, optional): Rows returned or affected
+            error (BaseException, optional): Error the query failed with
+        """
+        statement = normalize_statement(query)
+        stats = self._statements.get(statement)
+        if stats is None:
+            if len(self._statements) >= self.max_statements:
+                statement = '(other statements)'
+                stats = self._statements.get(statement)
+            if stats is None:
+                stats = self._statements[statement] = StatementStats()
+
+        elapsed_ms = elapsed * 1000
+        stats.calls += 1
+        stats.total_seconds += elapsed
+        if elapsed > stats.max_seconds:
+            stats.max_seconds = elapsed
+        stats.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        if rows:
+            stats.rows += rows
+        self.queries += 1
+        if error is not None:
+            stats.errors += 1
+            self.errors += 1
+
+        if self.slow_query_ms and elapsed_ms >= self.slow_query_ms:
+            self.slow_queries += 1
+            logger.warning(f"Slow query ({elapsed_ms:.1f}ms, {rows} rows): {statement} "
+                           f"args={_args_repr.repr(tuple(args))}")
+        elif self.sample_rate and random.random() < self.sample_rate:
+            self.sampled += 1
+            logger.info(f"Query ({elapsed_ms:.1f}ms, {rows} rows): {statement} "
+                        f"args={_args_repr.repr(tuple(args))}")
+
+    def histogram(self, query: str) -> List[int]:
+        """
+        Get the latency histogram of a statement.
+
+        Args:
+            query (str): SQL query
+
+        Returns:
+            List[int]: Query counts per bucket of LATENCY_BUCKETS_MS, the last one
+                for slower queries; all zero if the statement was not executed
+        """
+        stats = self._statements.get(normalize_statement(query))
+        return list(stats.buckets) if stats is not None else [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def totals(self) -> Tuple[List[int], float]:
+        """
+        Get the latency histogram of all statements together.
+
+        Returns:
+            Tuple[List[int], float]: Query counts per bucket of LATENCY_BUCKETS_MS, the
+                last one for slower queries, and the total time in seconds
+        """
+        buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        total_seconds = 0.0
+        for stats in list(self._statements.values()):
+            for index, count in enumerate(stats.buckets):
+                buckets[index] += count
+            total_seconds += stats.total_seconds
+        return buckets, total_seconds
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        """
+        Get query counters and the statements taking the most time.
+
+        Args:
+            top (int): Number of statements to include
+
+        Returns:
+            Dict[str, Any]: Totals and per-statement counters, slowest total first
+        """
+        statements = sorted(self._statements.items(), key=lambda item: item[1].total_seconds, reverse=True)
+        return {
+            'queries': self.queries,
+            'errors': self.errors,
+            'slow_queries': self.slow_queries,
+            'sampled': self.sampled,
+            'statements': len(self._statements),
+            'by_statement': [
+                {
+                    'statement': statement[:200],
+                    'calls': stats.calls,
+                    'errors': stats.errors,
+                    'rows': stats.rows,
+                    'total_ms': round(stats.total_seconds * 1000, 3),
+                    'mean_ms': round(stats.total_seconds * 1000 / stats.calls, 3),
+                    'p50_ms': stats.percentile_ms(0.5),
+                    'p95_ms': stats.percentile_ms(0.95),
+                    'max_ms': round(stats.max_seconds * 1000, 3)
+                }
+                for statement, stats in statements[:top]
+            ]
+        }
+
+# Query monitor singleton
+_query_monitor: Optional[QueryMonitor] = None
+
+def get_query_monitor() -> QueryMonitor:
+    """
+    Get or create the query monitor.
+
+    The slow query threshold is read from DB_SLOW_QUERY_MS (default 500)
+    and the sampling rate from DB_QUERY_LOG_SAMPLE_RATE (default 0).
+
+    Returns:
+        QueryMonitor: The shared query monitor
+    """
+    global _query_monitor
+
+    if _query_monitor is None:
+        _query_monitor = QueryMonitor(
+            slow_query_ms=float(os.getenv('DB_SLOW_QUERY_MS', 500)),
+            sample_rate=float(os.getenv('DB_QUERY_LOG_SAMPLE_RATE', 0))
+        )
+        metrics = get_metrics()
+        metrics.add_histogram_source('db_query_seconds', 'Time taken by database queries',
+                                     [bound / 1000 for bound in LATENCY_BUCKETS_MS], _query_monitor.totals)
+        metrics.add_collector('db_queries', lambda: _query_monitor.stats(top=0))
+
+    return _query_monitor
@@ -0,0 +1,210 @@
+"""Online data migrations for existing message databases."""
+
+import asyncio
+import datetime
+import logging
+
+from .connection import get_db_pool
+
+# Configure logging
+logger = logging.getLogger('discord_bot.database.migrations')
+
+# Fill in one chunk of rows above a message_id cursor; each call is its own
+# short transaction so only the rows of the chunk are locked
+BACKFILL_CONTENT_TSV_CHUNK = """
+WITH chunk AS (
+    SELECT message_id FROM messages
+    WHERE message_id > $1
+    ORDER BY message_id
+    LIMIT $2
+), updated AS (
+    UPDATE messages m
+    SET content_tsv = to_tsvector('english', COALESCE(m.content, ''))
+    FROM chunk
+    WHERE m.message_id = chunk.message_id
+      AND m.content_tsv IS NULL
+    RETURNING 1
+)
+SELECT (SELECT MAX(message_id) FROM chunk) AS last_id,
+       (SELECT COUNT(*) FROM updated) AS updated
+"""
+
+async def backfill_content_tsv(batch_size: int = 5000, pause: float = 0.05) -> int:
+    """
+    Populate ``messages.content_tsv`` for rows written before the column existed.
+
+    Rows are walked in message_id order in chunks of ``batch_size``, each
+    updated in its own transaction, so the table stays fully available to
+    readers and writers while the migration runs. Rows written in the
+    meantime are filled in by the trigger. The migration can be stopped and
+    re-run at any time.
+
+    Args:
+        batch_size (int): Rows per chunk
+        pause (float): Seconds to sleep between chunks to limit load
+
+    Returns:
+        int: Number of rows updated
+    """
+    pool = await get_db_pool()
+    last_id = -1
+    total = 0
+
+    while True:
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(BACKFILL_CONTENT_TSV_CHUNK, last_id, batch_size)
+
+        if row is None or row['last_id'] is None:
+            break
+
+        last_id = row['last_id']
+        total += row['updated']
+        logger.info(f"Backfilled content_tsv for {total} messages (up to message {last_id})")
+
+        if pause:
+            await asyncio.sleep(pause)
+
+    logger.info(f"content_tsv backfill complete, {total} messages updated")
+    return total
+
+async def partition_messages_table(drop_legacy: bool = False, pause: float = 0.05) -> int:
+    """
+    Convert an unpartitioned messages table into a monthly partitioned one.
+
+    The rows are copied month by month into a new partitioned table while
+    the old table stays in use. Writes are only blocked for the final swap,
+    which copies the rows changed during the migration and renames the
+    tables. The old table is kept as ``messages_legacy`` unless
+    ``drop_legacy`` is set. Does nothing if messages is already partitioned.
+
+    Args:
+        drop_legacy (bool): Drop the old table after the swap
+        pause (float): Seconds to sleep between months to limit load
+
+    Returns:
+        int: Number of rows copied
+    """
+    from .models import (
+        messages_table_sql,
+        MESSAGE_COLUMNS,
+        MESSAGE_CONFLICT_TARGET,
+        MESSAGE_UPSERT_ASSIGNMENTS,
+        CONTENT_TSV_TRIGGER,
+        ATTACHMENTS_CLEANUP_FUNCTION,
+        ATTACHMENTS_CLEANUP_TRIGGER,
+        INDICES,
+        PARTITIONED_INDICES,
+        VIEWS
+    )
+    from .partitions import (
+        is_messages_partitioned,
+        create_month_partition,
+        partition_name,
+        month_start,
+        add_months
+    )
+
+    pool = await get_db_pool()
+    columns = ', '.join(MESSAGE_COLUMNS + ('last_updated',))
+    total = 0
+
+    async with pool.acquire() as conn:
+        if await is_messages_partitioned(conn, refresh=True):
+            logger.info("messages is already partitioned, nothing to migrate")
+            return 0
+
+        # Rows changed after this are copied again during the swap. A writer
+        # stamps last_updated with the start of its transaction, so go back
+        # to the oldest transaction still open, and a margin in case other
+        # sessions' transactions are not visible to this role
+        started_at = await conn.fetchval("""
+            SELECT LEAST(CURRENT_TIMESTAMP - INTERVAL '5 minutes', MIN(xact_start))
+            FROM pg_stat_activity
+            WHERE datname = current_database()
+        """)
+        bounds = await conn.fetchrow("SELECT MIN(timestamp) AS first, MAX(timestamp) AS last FROM messages")
+        today = datetime.datetime.now(datetime.timezone.utc)
+        first_month = month_start(bounds['first'] or today)
+        last_month = add_months(month_start(max(bounds['last'] or today, today)), 3)
+
+        await conn.execute(messages_table_sql('messages_partitioned'))
+        month = first_month
+        while month <= last_month:
+            await create_month_partition(conn, month, table='messages_partitioned')
+            month = add_months(month, 1)
+
+        # Copy one month per statement so each transaction stays short
+        month = first_month
+        while month <= last_month:
+            upper = add_months(month, 1)
+            status = await conn.execute(f"""
+                INSERT INTO messages_partitioned ({columns}, content_tsv)
+                SELECT {columns}, COALESCE(content_tsv, to_tsvector('english', COALESCE(content, '')))
+                FROM messages
+                WHERE timestamp >= $1 AND timestamp < $2
+                ON CONFLICT {MESSAGE_CONFLICT_TARGET} DO NOTHING
+            """, _as_utc(month), _as_utc(upper))
+            copied = int(status.split()[-1])
+            total += copied
+            logger.info(f"Copied {copied} messages from {month:%Y-%m} ({total} total)")
+            month = upper
+            if pause:
+                await asyncio.sleep(pause)
+
+        async with conn.transaction():
+            # Block writes (not reads) while catching up and swapping
+            await conn.execute("LOCK TABLE messages IN EXCLUSIVE MODE")
+            status = await conn.execute(f"""
+                INSERT INTO messages_partitioned ({columns}, content_tsv)
+                SELECT {columns}, to_tsvector('english', COALESCE(content, ''))
+                FROM messages
+                WHERE last_updated >= $1
+                ON CONFLICT {MESSAGE_CONFLICT_TARGET}
+                DO UPDATE SET {MESSAGE_UPSERT_ASSIGNMENTS}
+            """, started_at)
+            logger.info(f"Caught up {status.split()[-1]} messages changed during the migration")
+
+            # Attachments may reference the old table by foreign key
+            for record in await conn.fetch("""
+                SELECT conname FROM pg_constraint
+                WHERE conrelid = 'attachments'::regclass AND contype = 'f'
+            """):
+                await conn.execute(f"ALTER TABLE attachments DROP CONSTRAINT {record['conname']}")
+
+            # Free the index names for the new table; done here so an
+            # interrupted copy leaves the old table's indexes untouched
+            for record in await conn.fetch(r"""
+                SELECT indexname FROM pg_indexes
+                WHERE tablename = 'messages' AND indexname LIKE 'idx\_messages\_%'
+                  AND indexname NOT LIKE '%\_legacy'
+            """):
+                await conn.execute(f"ALTER INDEX {record['indexname']} RENAME TO {record['indexname']}_legacy")
+
+            await conn.execute("DROP VIEW IF EXISTS messages_with_attachments")
+            await conn.execute("ALTER TABLE messages RENAME TO messages_legacy")
+            await conn.execute("ALTER TABLE messages_partitioned RENAME TO messages")
+            await conn.execute("ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey")
+            await conn.execute("ALTER TABLE messages RENAME CONSTRAINT messages_partitioned_pkey TO messages_pkey")
+
+            month = first_month
+            while month <= last_month:
+                await conn.execute(f"ALTER TABLE {partition_name(month, 'messages_partitioned')} "
+                                   f"RENAME TO {partition_name(month)}")
+                month = add_months(month, 1)
+
+            for command in [CONTENT_TSV_TRIGGER, ATTACHMENTS_CLEANUP_FUNCTION, ATTACHMENTS_CLEANUP_TRIGGER,
+                            *INDICES, *PARTITIONED_INDICES, *VIEWS]:
+                await conn.execute(command)
+
+        await is_messages_partitioned(conn, refresh=True)
+
+        if drop_legacy:
+            await conn.execute("DROP TABLE messages_legacy")
+            logger.info("Dropped messages_legacy")
+
+    logger.info(f"messages is now partitioned by month, {total} messages copied")
+    return total
+
+def _as_utc(month: datetime.date) -> datetime.datetime:
+    """Return midnight UTC on the given date."""
+    return datetime.datetime(month.year, month.month, month.day, tzinfo=datetime.timezone.utc)
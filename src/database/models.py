@@ -2,9 +2,23 @@
 
 # Schema for PostgreSQL
 
-MESSAGES_TABLE = """
-CREATE TABLE IF NOT EXISTS messages (
-    message_id BIGINT PRIMARY KEY,
+def messages_table_sql(table: str = 'messages') -> str:
+    """
+    Return the DDL of the messages table.
+
+    Messages are range partitioned by month on ``timestamp`` (see
+    ``partitions.py``), so the primary key has to include it; a message's
+    timestamp never changes, so ``message_id`` alone stays unique in practice.
+
+    Args:
+        table (str): Name of the table to create
+
+    Returns:
+        str: CREATE TABLE statement
+    """
+    return f"""
+CREATE TABLE IF NOT EXISTS {table} (
+    message_id BIGINT NOT NULL,
     channel_id BIGINT NOT NULL,
     channel_name TEXT NOT NULL,
     guild_id BIGINT NOT NULL,
@@ -15,14 +29,58 @@ CREATE TABLE IF NOT EXISTS messages (
     is_pinned BOOLEAN DEFAULT FALSE,
     has_attachments BOOLEAN DEFAULT FALSE,
     reference_message_id BIGINT,
-    last_updated TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-);
+    last_updated TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    content_tsv TSVECTOR,
+    PRIMARY KEY (message_id, timestamp)
+) PARTITION BY RANGE (timestamp);
+"""
+
+MESSAGES_TABLE = messages_table_sql()
+
+# Key used by upserts; matches the primary key of partitioned tables and a
+# unique index added to messages tables created before partitioning
+MESSAGE_CONFLICT_TARGET = '(message_id, timestamp)'
+
+# Full text search vector of the content, stored so searches and ranking
+# don't recompute to_tsvector per row. It is kept up to date by a trigger
+# rather than declared GENERATED, because adding a generated column to an
+# existing table rewrites it under an exclusive lock; existing rows are
+# filled in batches by migrations.backfill_content_tsv instead.
+CONTENT_TSV_COLUMN = """
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv TSVECTOR;
+"""
+
+CONTENT_TSV_FUNCTION = """
+CREATE OR REPLACE FUNCTION messages_content_tsv_update() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' OR NEW.content IS DISTINCT FROM OLD.content OR NEW.content_tsv IS NULL THEN
+        NEW.content_tsv := to_tsvector('english', COALESCE(NEW.content, ''));
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+CONTENT_TSV_TRIGGER = """
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgname = 'messages_content_tsv'
+          AND tgrelid = 'messages'::regclass
+    ) THEN
+        CREATE TRIGGER messages_content_tsv
+        BEFORE INSERT OR UPDATE ON messages
+        FOR EACH ROW EXECUTE FUNCTION messages_content_tsv_update();
+    END IF;
+END
+$$;
 """
 
 ATTACHMENTS_TABLE = """
 CREATE TABLE IF NOT EXISTS attachments (
     attachment_id BIGINT PRIMARY KEY,
-    message_id BIGINT NOT NULL REFERENCES messages(message_id) ON DELETE CASCADE,
+    message_id BIGINT NOT NULL,
     filename TEXT NOT NULL,
     url TEXT NOT NULL,
     content_type TEXT,
@@ -31,14 +89,125 @@ CREATE TABLE IF NOT EXISTS attachments (
     size INTEGER,
     proxy_url TEXT,
     description TEXT,
-    data BYTEA,
-    CONSTRAINT fk_message
-        FOREIGN KEY(message_id)
-        REFERENCES messages(message_id)
-        ON DELETE CASCADE
+    data BYTEA
+);
+"""
+# No foreign key to messages: a partitioned messages table has no unique key
+# on message_id alone. Both write paths store attachments in the same
+# transaction as (or right after) their message, and the trigger below
+# stands in for ON DELETE CASCADE.
+
+# A row moved to another partition is deleted and re-inserted, so attachments
+# are only removed once no row of their message is left
+ATTACHMENTS_CLEANUP_FUNCTION = """
+CREATE OR REPLACE FUNCTION messages_delete_attachments() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM attachments
+    WHERE message_id = OLD.message_id
+      AND NOT EXISTS (SELECT 1 FROM messages WHERE message_id = OLD.message_id);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+ATTACHMENTS_CLEANUP_TRIGGER = """
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgname = 'messages_delete_attachments'
+          AND tgrelid = 'messages'::regclass
+    ) THEN
+        CREATE TRIGGER messages_delete_attachments
+        AFTER DELETE ON messages
+        FOR EACH ROW EXECUTE FUNCTION messages_delete_attachments();
+    END IF;
+END
+$$;
+"""
+
+BACKFILL_CHECKPOINTS_TABLE = """
+CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+    channel_id BIGINT PRIMARY KEY,
+    guild_id BIGINT,
+    oldest_message_id BIGINT,
+    newest_message_id BIGINT,
+    history_complete BOOLEAN DEFAULT FALSE,
+    last_updated TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 """
 
+# One embedding vector per message for semantic search (see src/rag/semantic.py).
+# guild_id and timestamp are copied from the message so the in-memory index
+# can be loaded without reading the messages table; model names the embedder
+# the vector came from, so vectors of another model are re-embedded rather
+# than compared.
+MESSAGE_EMBEDDINGS_TABLE = """
+CREATE TABLE IF NOT EXISTS message_embeddings (
+    message_id BIGINT PRIMARY KEY,
+    guild_id BIGINT NOT NULL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    model TEXT NOT NULL,
+    embedding BYTEA NOT NULL,
+    last_updated TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# Column order used when writing rows (single inserts and COPY)
+MESSAGE_COLUMNS = (
+    'message_id', 'channel_id', 'channel_name', 'guild_id', 'author_id',
+    'author_name', 'content', 'timestamp', 'is_pinned', 'has_attachments',
+    'reference_message_id'
+)
+
+ATTACHMENT_COLUMNS = (
+    'attachment_id', 'message_id', 'filename', 'url', 'content_type',
+    'width', 'height', 'size', 'proxy_url', 'description'
+)
+
+# Columns refreshed when a stored message is written again (e.g. after an edit)
+MESSAGE_UPSERT_ASSIGNMENTS = """
+    channel_name = EXCLUDED.channel_name,
+    author_name = EXCLUDED.author_name,
+    content = EXCLUDED.content,
+    is_pinned = EXCLUDED.is_pinned,
+    has_attachments = EXCLUDED.has_attachments,
+    reference_message_id = EXCLUDED.reference_message_id,
+    last_updated = CURRENT_TIMESTAMP
+"""
+
+# Per-connection staging tables for bulk ingest; rows vanish on commit
+MESSAGE_STAGING_TABLE = """
+CREATE TEMP TABLE IF NOT EXISTS message_staging (
+    message_id BIGINT,
+    channel_id BIGINT,
+    channel_name TEXT,
+    guild_id BIGINT,
+    author_id BIGINT,
+    author_name TEXT,
+    content TEXT,
+    timestamp TIMESTAMP WITH TIME ZONE,
+    is_pinned BOOLEAN,
+    has_attachments BOOLEAN,
+    reference_message_id BIGINT
+) ON COMMIT DELETE ROWS;
+"""
+
+ATTACHMENT_STAGING_TABLE = """
+CREATE TEMP TABLE IF NOT EXISTS attachment_staging (
+    attachment_id BIGINT,
+    message_id BIGINT,
+    filename TEXT,
+    url TEXT,
+    content_type TEXT,
+    width INTEGER,
+    height INTEGER,
+    size INTEGER,
+    proxy_url TEXT,
+    description TEXT
+) ON COMMIT DELETE ROWS;
+"""
+
 # Create indices for faster searching
 INDICES = [
     "CREATE INDEX IF NOT EXISTS idx_messages_guild_id ON messages(guild_id);",
@@ -46,13 +215,56 @@ INDICES = [
     "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);",
     "CREATE INDEX IF NOT EXISTS idx_messages_author_id ON messages(author_id);",
     "CREATE INDEX IF NOT EXISTS idx_attachments_message_id ON attachments(message_id);",
-    # Full text search index for content
+]
+
+# Full text search index on the stored search vector, for partitioned tables
+# (an index on the parent is created on every partition, existing and future)
+PARTITIONED_INDICES = [
+    "CREATE INDEX IF NOT EXISTS idx_messages_content_tsv ON messages USING GIN (content_tsv);",
+    # Neighbouring messages and replies for context expansion
+    "CREATE INDEX IF NOT EXISTS idx_messages_channel_timestamp ON messages(channel_id, timestamp);",
+    # Keyset scans of a guild's messages in time order
+    "CREATE INDEX IF NOT EXISTS idx_messages_guild_timestamp_id ON messages(guild_id, timestamp, message_id);",
+    """
+    CREATE INDEX IF NOT EXISTS idx_messages_reference_message_id ON messages(reference_message_id)
+    WHERE reference_message_id IS NOT NULL;
+    """
+]
+
+# Indices for messages tables created before partitioning, built without
+# blocking writes; these run outside a transaction
+CONCURRENT_INDICES = [
+    # Full text search index on the stored search vector
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_content_tsv ON messages
+    USING GIN (content_tsv);
+    """,
+    # Lets upserts use the same conflict target as on partitioned tables
+    """
+    CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_id_timestamp ON messages
+    (message_id, timestamp);
+    """,
+    # Neighbouring messages and replies for context expansion
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_channel_timestamp ON messages
+    (channel_id, timestamp);
+    """,
+    # Keyset scans of a guild's messages in time order
     """
-    CREATE INDEX IF NOT EXISTS idx_messages_content_tsvector ON messages 
-    USING GIN (to_tsvector('english', content));
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_guild_timestamp_id ON messages
+    (guild_id, timestamp, message_id);
+    """,
     """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_reference_message_id ON messages
+    (reference_message_id) WHERE reference_message_id IS NOT NULL;
+    """,
+    # Superseded by idx_messages_content_tsv
+    "DROP INDEX CONCURRENTLY IF EXISTS idx_messages_content_tsvector;"
 ]
 
+# Columns returned by message queries (everything except the search vector)
+MESSAGE_SELECT_COLUMNS = ', '.join(MESSAGE_COLUMNS + ('last_updated',))
+
 # Views for common queries
 VIEWS = [
     """
@@ -70,10 +282,25 @@ VIEWS = [
 
 # Function to generate the database schema
 def get_schema_creation_commands():
-    """Return a list of SQL commands to create the database schema."""
+    """Return a list of SQL commands to create the database schema in one transaction."""
     return [
         MESSAGES_TABLE,
+        CONTENT_TSV_COLUMN,
+        CONTENT_TSV_FUNCTION,
+        CONTENT_TSV_TRIGGER,
         ATTACHMENTS_TABLE,
+        ATTACHMENTS_CLEANUP_FUNCTION,
+        ATTACHMENTS_CLEANUP_TRIGGER,
+        BACKFILL_CHECKPOINTS_TABLE,
+        MESSAGE_EMBEDDINGS_TABLE,
         *INDICES,
         *VIEWS
     ]
+
+def get_partitioned_index_commands():
+    """Return index commands for a partitioned messages table."""
+    return list(PARTITIONED_INDICES)
+
+def get_concurrent_index_commands():
+    """Return index commands for an unpartitioned messages table, run outside a transaction."""
+    return list(CONCURRENT_INDICES)
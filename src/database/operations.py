@@ -2,18 +2,94 @@ import discord
 import asyncpg
 import logging
 import datetime
-from typing import Dict, List, Optional, Any, Tuple, Union
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Any, Tuple, Union
 import io
 
-from .connection import execute_query, get_db_pool
+from .connection import execute_query, execute_statement, get_db_pool
+from .partitions import ensure_message_partitions
+from .statements import STATEMENTS
 
 # Configure logging
 logger = logging.getLogger('discord_bot.database.operations')
 
+# Coroutines called with the message records written by store_message
+StoreListener = Callable[[List[Tuple]], Awaitable[None]]
+_store_listeners: List[StoreListener] = []
+
+def add_store_listener(listener: StoreListener) -> None:
+    """
+    Register a coroutine called with the record of each message stored by store_message.
+
+    Messages written through the BulkWriter are reported by its flush
+    listeners instead.
+
+    Args:
+        listener (StoreListener): Coroutine function accepting a list of records
+    """
+    _store_listeners.append(listener)
+
+def message_to_record(message: discord.Message) -> Tuple:
+    """
+    Convert a Discord message into a row for the messages table.
+
+    Args:
+        message (discord.Message): The Discord message to convert
+
+    Returns:
+        Tuple: Values in the order of MESSAGE_COLUMNS
+    """
+    # Get message reference (if it's a reply)
+    reference_id = None
+    if message.reference and message.reference.message_id:
+        reference_id = message.reference.message_id
+
+    return (
+        message.id,
+        message.channel.id,
+        getattr(message.channel, 'name', None) or 'DM',
+        message.guild.id if message.guild else 0,
+        message.author.id,
+        message.author.name,
+        message.content,
+        message.created_at,
+        bool(message.pinned),
+        bool(message.attachments),
+        reference_id
+    )
+
+def attachment_to_records(message: discord.Message) -> List[Tuple]:
+    """
+    Convert the attachments of a Discord message into rows for the attachments table.
+
+    Args:
+        message (discord.Message): The Discord message whose attachments to convert
+
+    Returns:
+        List[Tuple]: Values in the order of ATTACHMENT_COLUMNS
+    """
+    return [
+        (
+            attachment.id,
+            message.id,
+            attachment.filename,
+            attachment.url,
+            attachment.content_type,
+            attachment.width,
+            attachment.height,
+            attachment.size,
+            attachment.proxy_url,
+            attachment.description
+        )
+        for attachment in message.attachments
+    ]
+
 async def store_message(message: discord.Message) -> bool:
     """
     Store a Discord message in the database.
 
+    This writes a single row per call; use the BulkWriter from
+    ``src.database.bulk`` when storing many messages.
+
     Args:
         message (discord.Message): The Discord message to store
 
@@ -21,38 +97,28 @@ async def store_message(message: discord.Message) -> bool:
         bool: True if successful, False otherwise
     """
     try:
-        pool = await get_db_pool()
-
-        # Extract message data
-        message_id = message.id
-        content = message.content
-        author_id = message.author.id
-        channel_id = message.channel.id
-        guild_id = message.guild.id if message.guild else None
-        timestamp = message.created_at
-
-        # Get message reference (if it's a reply)
-        reference_id = None
-        if message.reference and message.reference.message_id:
-            reference_id = message.reference.message_id
-
-        async with pool.acquire() as conn:
-            # Insert or update message
-            await conn.execute("""
-                INSERT INTO messages (
-                    message_id, content, author_id, channel_id,
-                    guild_id, timestamp, reference_id
-                ) VALUES ($1, $2, $3, $4, $5, $6, $7)
-                ON CONFLICT (message_id)
-                DO UPDATE SET
-                    content = EXCLUDED.content,
-                    reference_id = EXCLUDED.reference_id
-            """, message_id, content, author_id, channel_id, guild_id, timestamp, reference_id)
+        record = message_to_record(message)
+
+        # Insert or update message
+        try:
+            await execute_statement('store_message', *record)
+        except asyncpg.CheckViolationError:
+            # No partition for the message's month yet; create it and retry once
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                await ensure_message_partitions(conn, [message.created_at])
+            await execute_statement('store_message', *record)
 
         # Process attachments if any
         if message.attachments:
             for attachment in message.attachments:
-                await store_attachment(attachment.id, attachment.url, message_id)
+                await store_attachment(attachment.id, attachment.url, message.id, attachment.filename)
+
+        for listener in _store_listeners:
+            try:
+                await listener([record])
+            except Exception as e:
+                logger.error(f"Error in store listener: {str(e)}")
 
         return True
     except Exception as e:
@@ -73,21 +139,70 @@ async def update_message(message: discord.Message) -> bool:
     # The ON CONFLICT clause in store_message handles the update logic
     return await store_message(message)
 
-async def store_attachment(attachment_id: int, url: str, message_id: int) -> bool:
+async def store_attachment(attachment_id: int, url: str, message_id: int, filename: str = '') -> bool:
     """Store message attachment in the database."""
     try:
-        pool = await get_db_pool()
-        async with pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO attachments (attachment_id, url, message_id)
-                VALUES ($1, $2, $3)
-                ON CONFLICT (attachment_id) DO NOTHING
-            """, attachment_id, url, message_id)
+        await execute_statement('store_attachment', attachment_id, url, message_id, filename)
         return True
     except Exception as e:
         logger.error(f"Error storing attachment: {str(e)}")
         return False
 
+async def get_backfill_checkpoints(channel_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Get the saved backfill checkpoints for a set of channels.
+
+    Args:
+        channel_ids (List[int]): Discord channel IDs
+
+    Returns:
+        Dict[int, Dict[str, Any]]: Checkpoint records keyed by channel ID;
+            channels without a checkpoint are omitted
+    """
+    try:
+        results = await execute_statement('get_backfill_checkpoints', list(channel_ids), fetch=True)
+
+        return {record['channel_id']: dict(record) for record in results}
+    except Exception as e:
+        logger.error(f"Error fetching backfill checkpoints: {str(e)}")
+        return {}
+
+async def save_backfill_checkpoint(
+    channel_id: int,
+    guild_id: Optional[int],
+    oldest_message_id: Optional[int],
+    newest_message_id: Optional[int],
+    history_complete: bool = False,
+    replace: bool = False
+) -> bool:
+    """
+    Record the range of message IDs fetched from a channel.
+
+    By default the range is merged with the saved one, which must be
+    contiguous with it. With ``replace`` the saved checkpoint is overwritten,
+    as done by a fresh fetch that started over from the newest message.
+
+    Args:
+        channel_id (int): Discord channel ID
+        guild_id (int, optional): Discord server ID
+        oldest_message_id (int, optional): Lowest message ID fetched
+        newest_message_id (int, optional): Highest message ID fetched
+        history_complete (bool): Whether the beginning of the channel was reached
+        replace (bool): Overwrite rather than extend the saved range
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        await execute_statement(
+            'replace_backfill_checkpoint' if replace else 'merge_backfill_checkpoint',
+            channel_id, guild_id, oldest_message_id, newest_message_id, history_complete
+        )
+        return True
+    except Exception as e:
+        logger.error(f"Error saving backfill checkpoint for channel {channel_id}: {str(e)}")
+        return False
+
 async def get_messages_by_date(
     guild_id: int,
     start_date: datetime.datetime,
@@ -113,28 +228,12 @@ async def get_messages_by_date(
         if end_date is None:
             end_date = datetime.datetime.now(datetime.timezone.utc)
 
-        # Build query based on whether channel_id is provided
         if channel_id:
-            query = """
-            SELECT * FROM messages
-            WHERE guild_id = $1 AND channel_id = $2
-            AND timestamp BETWEEN $3 AND $4
-            ORDER BY timestamp DESC
-            LIMIT $5
-            """
-            params = [guild_id, channel_id, start_date, end_date, limit]
+            results = await execute_statement('channel_messages_by_date', guild_id, channel_id,
+                                              start_date, end_date, limit, fetch=True)
         else:
-            query = """
-            SELECT * FROM messages
-            WHERE guild_id = $1
-            AND timestamp BETWEEN $2 AND $3
-            ORDER BY timestamp DESC
-            LIMIT $4
-            """
-            params = [guild_id, start_date, end_date, limit]
-
-        # Execute query and return results
-        results = await execute_query(query, *params, fetch=True)
+            results = await execute_statement('messages_by_date', guild_id,
+                                              start_date, end_date, limit, fetch=True)
 
         # Convert results to dictionaries
         messages = []
@@ -168,28 +267,8 @@ async def get_messages_by_content(
         # Convert search text to tsquery format
         search_terms = ' & '.join(search_text.split())
 
-        # Build query based on whether channel_id is provided
-        if channel_id:
-            query = """
-            SELECT * FROM messages
-            WHERE guild_id = $1 AND channel_id = $2
-            AND to_tsvector('english', content) @@ to_tsquery('english', $3)
-            ORDER BY timestamp DESC
-            LIMIT $4
-            """
-            params = [guild_id, channel_id, search_terms, limit]
-        else:
-            query = """
-            SELECT * FROM messages
-            WHERE guild_id = $1
-            AND to_tsvector('english', content) @@ to_tsquery('english', $2)
-            ORDER BY timestamp DESC
-            LIMIT $3
-            """
-            params = [guild_id, search_terms, limit]
-
-        # Execute query and return results
-        results = await execute_query(query, *params, fetch=True)
+        results = await execute_statement('messages_by_content', guild_id, channel_id or None,
+                                          search_terms, limit, fetch=True)
 
         # Convert results to dictionaries
         messages = []
@@ -201,60 +280,87 @@ async def get_messages_by_content(
         logger.error(f"Error searching messages by content: {str(e)}")
         return []
 
-async def get_messages_for_rag(
+async def iter_message_pages(
     guild_id: int,
-    query: str,
-    max_results: int = 20,
-    max_days: Optional[int] = None
-) -> List[Dict[str, Any]]:
+    start_date: Optional[datetime.datetime] = None,
+    end_date: Optional[datetime.datetime] = None,
+    channel_id: Optional[int] = None,
+    page_size: int = 1000
+) -> AsyncIterator[List[asyncpg.Record]]:
     """
-    Retrieve messages that are relevant for RAG-based question answering.
+    Stream the messages of a guild in pages, oldest first.
+
+    Pages are read with keyset pagination on (timestamp, message_id): each
+    page resumes after the last row of the previous one, so reading a page
+    costs the same however far into the guild it is, and no connection or
+    transaction is held between pages. Only one page is in memory at a
+    time. Messages written while the scan runs are included if they sort
+    after the current position.
 
     Args:
         guild_id (int): The Discord server ID
-        query (str): The user's question or query
-        max_results (int, optional): Maximum number of messages to return
-        max_days (int, optional): Only consider messages from the last X days
-
-    Returns:
-        List[Dict[str, Any]]: List of relevant message records
-    """
-    try:
-        # Extract key terms from the query
-        # This is a simplified version - in production, use better NLP
-        search_terms = ' | '.join(term for term in query.split() if len(term) > 3)
+        start_date (datetime.datetime, optional): Oldest time to include
+        end_date (datetime.datetime, optional): Time to stop before
+        channel_id (int, optional): Specific channel to read, or None for all channels
+        page_size (int): Messages read per query
 
-        # Add date constraint if max_days is provided
-        date_constraint = ""
-        params = [guild_id, search_terms, max_results]
+    Yields:
+        List[asyncpg.Record]: Up to page_size message records
 
-        if max_days:
-            date_constraint = "AND timestamp > NOW() - INTERVAL '$3 days'"
-            params = [guild_id, search_terms, max_days, max_results]
-
-        # Use full-text search with ranking to find relevant messages
-        query = f"""
-        SELECT *, ts_rank(to_tsvector('english', content), to_tsquery('english', $2)) AS rank
-        FROM messages
-        WHERE guild_id = $1
-        AND to_tsvector('english', content) @@ to_tsquery('english', $2)
-        {date_constraint}
-        ORDER BY rank DESC
-        LIMIT ${len(params)}
-        """
+    Raises:
+        Exception: Database errors, so that an interrupted scan is not
+            mistaken for a complete one
+    """
+    if channel_id:
+        statement, scope = 'channel_messages_page', (guild_id, channel_id)
+    else:
+        statement, scope = 'messages_page', (guild_id,)
+    last_timestamp = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+    last_id = -1
+
+    while True:
+        try:
+            page = await execute_statement(statement, *scope, start_date, end_date,
+                                           last_timestamp, last_id, page_size, fetch=True)
+        except Exception as e:
+            logger.error(f"Error reading messages of guild {guild_id} after message {last_id}: {str(e)}")
+            raise
+
+        if not page:
+            return
+
+        yield page
+
+        if len(page) < page_size:
+            return
+        last_timestamp, last_id = page[-1]['timestamp'], page[-1]['message_id']
+
+async def iter_messages(
+    guild_id: int,
+    start_date: Optional[datetime.datetime] = None,
+    end_date: Optional[datetime.datetime] = None,
+    channel_id: Optional[int] = None,
+    page_size: int = 1000
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Stream the messages of a guild one by one, oldest first.
 
-        # Execute query and return results
-        results = await execute_query(query, *params, fetch=True)
+    See iter_message_pages, which avoids converting each record when the
+    caller can work with records directly.
 
-        # Convert results to dictionaries
-        messages = []
-        for record in results:
-            messages.append(dict(record))
+    Args:
+        guild_id (int): The Discord server ID
+        start_date (datetime.datetime, optional): Oldest time to include
+        end_date (datetime.datetime, optional): Time to stop before
+        channel_id (int, optional): Specific channel to read, or None for all channels
+        page_size (int): Messages read per query
 
-        return messages
-    except Exception as e:
-        logger.error(f"Error retrieving messages for RAG: {str(e)}")
-        return []
+    Yields:
+        Dict[str, Any]: Message records
+    """
+    async for page in iter_message_pages(guild_id, start_date, end_date, channel_id, page_size):
+        for record in page:
+            yield dict(record)
 
 async def get_database_stats() -> Dict[str, Any]:
     """
@@ -319,33 +425,16 @@ async def get_messages_for_rag(
     """
     try:
         # Create a date cutoff if max_days is specified
-        date_clause = ""
-        params = [guild_id]
-
+        date_cutoff = None
         if max_days is not None:
-            date_cutoff = datetime.datetime.now() - datetime.timedelta(days=max_days)
-            date_clause = "AND timestamp > $2"
-            params.append(date_cutoff)
+            date_cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=max_days)
 
         # Convert search text to TSQuery format (add:ed for fuzzy matching)
         search_terms = ' | '.join(query.split())
-        params.append(search_terms)
-        params.append(max_results)
-
-        # Build query using PostgreSQL's full-text search capabilities with ranking
-        query_sql = f"""
-        SELECT m.*,
-               ts_rank_cd(to_tsvector('english', m.content), to_tsquery('english', $3)) AS rank
-        FROM messages m
-        WHERE m.guild_id = $1
-        {date_clause}
-        AND to_tsvector('english', m.content) @@ to_tsquery('english', $3)
-        ORDER BY rank DESC
-        LIMIT ${len(params)}
-        """
 
-        # Execute query and return results
-        results = await execute_query(query_sql, *params, fetch=True)
+        # Full-text search with ranking; without a cutoff the same statement is used
+        results = await execute_statement('messages_for_rag', guild_id, date_cutoff,
+                                          search_terms, max_results, fetch=True)
 
         # Convert results to dictionaries
         messages = []
@@ -357,18 +446,146 @@ async def get_messages_for_rag(
         logger.error(f"Error retrieving messages for RAG: {str(e)}")
         return []
 
-async def store_message(message_id: int, content: str, author_id: int, channel_id: int) -> None:
+async def get_messages_by_ids(message_ids: List[int]) -> List[Dict[str, Any]]:
     """
-    Store a message in the database.
+    Get stored messages by ID.
 
     Args:
-        message_id (int): ID of the message
-        content (str): Content of the message
-        author_id (int): ID of the author
-        channel_id (int): ID of the channel
+        message_ids (List[int]): Discord message IDs
+
+    Returns:
+        List[Dict[str, Any]]: Message records, in no particular order;
+            IDs that are not stored are omitted
     """
-    query = """
-    INSERT INTO messages (message_id, content, author_id, channel_id)
-    VALUES ($1, $2, $3, $4)
+    if not message_ids:
+        return []
+
+    try:
+        results = await execute_statement('messages_by_ids', list(message_ids), fetch=True)
+
+        return [dict(record) for record in results]
+    except Exception as e:
+        logger.error(f"Error retrieving messages by ID: {str(e)}")
+        return []
+
+async def get_message_context(
+    hits: List[Dict[str, Any]],
+    window: int = 2,
+    reply_depth: int = 5,
+    max_gap: datetime.timedelta = datetime.timedelta(hours=1)
+) -> List[Dict[str, Any]]:
+    """
+    Get the conversation around retrieved messages in one query.
+
+    For each hit this returns the messages it replies to (following
+    reference_message_id up to ``reply_depth`` levels), the first ``window``
+    replies to it, and up to ``window`` messages before and after it in the
+    same channel within ``max_gap`` of it.
+
+    Args:
+        hits (List[Dict[str, Any]]): Retrieved message records
+        window (int): Neighbouring messages and replies per hit and direction
+        reply_depth (int): Maximum number of messages followed up the reply chain
+        max_gap (datetime.timedelta): Maximum time between a hit and its neighbours or replies
+
+    Returns:
+        List[Dict[str, Any]]: Message records with the 'hit_id' they were found for;
+            a message may be returned once per hit
     """
-    await execute_query(query, message_id, content, author_id, channel_id)
+    if not hits:
+        return []
+
+    try:
+        results = await execute_statement(
+            'message_context',
+            [hit['message_id'] for hit in hits],
+            [hit['channel_id'] for hit in hits],
+            [hit['timestamp'] for hit in hits],
+            reply_depth, window, max_gap,
+            fetch=True
+        )
+
+        return [dict(record) for record in results]
+    except Exception as e:
+        logger.error(f"Error retrieving message context: {str(e)}")
+        return []
+
+async def store_embeddings(records: List[Tuple[int, int, datetime.datetime, str, bytes]]) -> bool:
+    """
+    Insert or replace message embeddings.
+
+    Args:
+        records (List[Tuple]): (message_id, guild_id, timestamp, model, embedding bytes) tuples
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    if not records:
+        return True
+
+    try:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.executemany(STATEMENTS['store_embedding'], records)
+        return True
+    except Exception as e:
+        logger.error(f"Error storing {len(records)} embeddings: {str(e)}")
+        return False
+
+async def get_embeddings(
+    model: str,
+    after_id: int = -1,
+    limit: int = 10000,
+    updated_after: Optional[datetime.datetime] = None,
+    indexed_guild_ids: Optional[List[int]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Get one page of stored embeddings of a model, in message ID order.
+
+    Args:
+        model (str): Name of the embedder the vectors came from
+        after_id (int): Only return embeddings of messages with a higher ID
+        limit (int): Maximum number of embeddings to return
+        updated_after (datetime.datetime, optional): For guilds in indexed_guild_ids,
+            only return embeddings written after this time
+        indexed_guild_ids (List[int], optional): Guilds whose older embeddings are
+            already indexed
+
+    Returns:
+        List[Dict[str, Any]]: Records with message_id, guild_id, timestamp and embedding
+    """
+    if updated_after is None or not indexed_guild_ids:
+        indexed_guild_ids, updated_after = None, None
+    else:
+        indexed_guild_ids = list(indexed_guild_ids)
+
+    try:
+        results = await execute_statement('embeddings_page', model, after_id, limit,
+                                          indexed_guild_ids, updated_after, fetch=True)
+
+        return [dict(record) for record in results]
+    except Exception as e:
+        logger.error(f"Error retrieving embeddings: {str(e)}")
+        return []
+
+async def get_messages_without_embeddings(model: str, after_id: int = -1,
+                                          limit: int = 1000) -> List[Dict[str, Any]]:
+    """
+    Get one page of messages that have no embedding from a model yet, in message ID order.
+
+    Args:
+        model (str): Name of the current embedder
+        after_id (int): Only return messages with a higher ID
+        limit (int): Maximum number of messages to return
+
+    Returns:
+        List[Dict[str, Any]]: Records with message_id, guild_id, timestamp and content
+    """
+    try:
+        results = await execute_statement('messages_without_embeddings', model, after_id, limit,
+                                          fetch=True)
+
+        return [dict(record) for record in results]
+    except Exception as e:
+        logger.error(f"Error retrieving messages without embeddings: {str(e)}")
+        return []
@@ -0,0 +1,232 @@
+"""Monthly range partitions of the messages table."""
+
+import asyncio
+import datetime
+import logging
+import os
+import re
+from typing import Iterable, List, Optional, Set, Tuple
+
+import asyncpg
+
+# Configure logging
+logger = logging.getLogger('discord_bot.database.partitions')
+
+# Months that are known to have a partition, so writers only hit the catalog once per month
+_known_partitions: Set[datetime.date] = set()
+
+# Whether the messages table is partitioned; None until checked
+_partitioned: Optional[bool] = None
+
+def month_start(value: datetime.datetime) -> datetime.date:
+    """
+    Get the first day of the (UTC) month containing a timestamp.
+
+    Args:
+        value (datetime.datetime): Timestamp, naive values are treated as UTC
+
+    Returns:
+        datetime.date: First day of the month
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+    return datetime.date(value.year, value.month, 1)
+
+def add_months(month: datetime.date, count: int) -> datetime.date:
+    """
+    Shift the first day of a month by a number of months.
+
+    Args:
+        month (datetime.date): First day of a month
+        count (int): Number of months to add, may be negative
+
+    Returns:
+        datetime.date: First day of the resulting month
+    """
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: datetime.date, table: str = 'messages') -> str:
+    """
+    Get the name of the partition holding a month.
+
+    Args:
+        month (datetime.date): First day of the month
+        table (str): Name of the partitioned table
+
+    Returns:
+        str: Partition table name, e.g. ``messages_y2024m01``
+    """
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+def partition_month(name: str) -> Optional[datetime.date]:
+    """
+    Get the month held by a partition from its name.
+
+    Args:
+        name (str): Partition table name, e.g. ``messages_y2024m01``
+
+    Returns:
+        Optional[datetime.date]: First day of the month, or None if the name is not a month partition's
+    """
+    match = re.search(r'_y(\d{4})m(\d{2})$', name)
+    return datetime.date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+async def is_messages_partitioned(conn: asyncpg.Connection, refresh: bool = False) -> bool:
+    """
+    Check whether the messages table uses range partitioning.
+
+    Tables created before partitioning was introduced stay plain tables
+    until migrated with ``migrations.partition_messages_table``.
+
+    Args:
+        conn (asyncpg.Connection): Database connection
+        refresh (bool): Query the catalog even if the answer is cached
+
+    Returns:
+        bool: True if messages is a partitioned table
+    """
+    global _partitioned
+
+    if _partitioned is None or refresh:
+        relkind = await conn.fetchval(
+            "SELECT relkind::text FROM pg_class WHERE oid = to_regclass('messages')"
+        )
+        _partitioned = relkind == 'p'
+
+    return _partitioned
+
+async def create_month_partition(conn: asyncpg.Connection, month: datetime.date,
+                                 table: str = 'messages') -> None:
+    """
+    Create the partition of a month if it does not exist yet.
+
+    Args:
+        conn (asyncpg.Connection): Database connection
+        month (datetime.date): First day of the month
+        table (str): Name of the partitioned table
+    """
+    lower = month.isoformat()
+    upper = add_months(month, 1).isoformat()
+    try:
+        await conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {partition_name(month, table)}
+            PARTITION OF {table}
+            FOR VALUES FROM ('{lower} 00:00:00+00') TO ('{upper} 00:00:00+00')
+        """)
+    except (asyncpg.DuplicateTableError, asyncpg.UniqueViolationError):
+        # Another connection created it at the same time
+        pass
+
+async def ensure_message_partitions(conn: asyncpg.Connection,
+                                    timestamps: Iterable[datetime.datetime]) -> None:
+    """
+    Make sure partitions exist for every month the given timestamps fall in.
+
+    Attaching a partition locks the messages table, so writers only call this
+    after an insert failed for want of a partition; upcoming months are
+    created ahead of time by ``create_upcoming_partitions``. Does nothing when
+    the messages table is not partitioned. Must be called outside of the
+    transaction writing the rows, so the lock is not held for the whole write.
+
+    Args:
+        conn (asyncpg.Connection): Database connection
+        timestamps (Iterable[datetime.datetime]): Timestamps about to be written
+    """
+    months = {month_start(timestamp) for timestamp in timestamps} - _known_partitions
+    if not months or not await is_messages_partitioned(conn):
+        return
+
+    for month in sorted(months):
+        await create_month_partition(conn, month)
+        _known_partitions.add(month)
+        logger.debug(f"Ensured partition {partition_name(month)}")
+
+async def create_upcoming_partitions(conn: asyncpg.Connection, months_ahead: int = 3,
+                                     today: Optional[datetime.date] = None) -> None:
+    """
+    Create partitions for the current month and the next few months.
+
+    Args:
+        conn (asyncpg.Connection): Database connection
+        months_ahead (int): Number of future months to create
+        today (datetime.date, optional): Reference date, defaults to the current UTC date
+    """
+    if not await is_messages_partitioned(conn, refresh=True):
+        return
+
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    current = datetime.date(today.year, today.month, 1)
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        await create_month_partition(conn, month)
+        _known_partitions.add(month)
+
+    logger.info(f"Ensured message partitions from {partition_name(current)} "
+                f"to {partition_name(add_months(current, months_ahead))}")
+
+async def _maintain_partitions(interval: float, months_ahead: int) -> None:
+    """Create upcoming partitions every ``interval`` seconds."""
+    from .connection import get_db_pool
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                await create_upcoming_partitions(conn, months_ahead)
+        except Exception as e:
+            logger.error(f"Error creating upcoming partitions: {str(e)}")
+
+# Background task keeping partitions ahead of the writers
+_maintenance_task: Optional[asyncio.Task] = None
+
+def start_partition_maintenance() -> None:
+    """
+    Start creating the upcoming months' partitions periodically.
+
+    ``setup_database`` creates them at startup; this keeps a long-running
+    bot from reaching a month without a partition. The interval in seconds
+    comes from ``DB_PARTITION_CHECK_INTERVAL`` and the number of months from
+    ``DB_PARTITION_MONTHS_AHEAD``.
+    """
+    global _maintenance_task
+
+    if _maintenance_task is None or _maintenance_task.done():
+        interval = float(os.getenv('DB_PARTITION_CHECK_INTERVAL', 6 * 3600))
+        months_ahead = int(os.getenv('DB_PARTITION_MONTHS_AHEAD', 3))
+        _maintenance_task = asyncio.create_task(_maintain_partitions(interval, months_ahead))
+
+async def stop_partition_maintenance() -> None:
+    """Stop the periodic partition creation."""
+    global _maintenance_task
+
+    if _maintenance_task is not None:
+        _maintenance_task.cancel()
+        try:
+            await _maintenance_task
+        except asyncio.CancelledError:
+            pass
+        _maintenance_task = None
+
+async def list_month_partitions(conn: asyncpg.Connection,
+                                table: str = 'messages') -> List[Tuple[str, Optional[datetime.date]]]:
+    """
+    List the partitions of a table.
+
+    Args:
+        conn (asyncpg.Connection): Database connection
+        table (str): Name of the partitioned table
+
+    Returns:
+        List[Tuple[str, Optional[datetime.date]]]: (partition name, month) pairs in name
+            order; the month is None for partitions not created by create_month_partition
+    """
+    records = await conn.fetch("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass($1)
+        ORDER BY c.relname
+    """, table)
+    return [(record['relname'], partition_month(record['relname'])) for record in records]
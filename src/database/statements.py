@@ -0,0 +1,218 @@
+"""
+Registry of the hot SQL statements.
+
+asyncpg keeps a statement cache on each connection, looked up by query
+text and kept while the connection is pooled, so a statement whose text
+never changes is parsed once per pooled connection, on its first use,
+and reused afterwards.
+"""
+
+from typing import Dict
+
+from .models import (
+    MESSAGE_COLUMNS,
+    MESSAGE_CONFLICT_TARGET,
+    MESSAGE_SELECT_COLUMNS,
+    MESSAGE_UPSERT_ASSIGNMENTS
+)
+
+_QUALIFIED_MESSAGE_COLUMNS = ', '.join(f"m.{column}" for column in MESSAGE_SELECT_COLUMNS.split(', '))
+
+# Each statement has one fixed text: optional filters are passed as NULL
+# rather than added to the text, so that every call reuses the same
+# prepared statement. Once Postgres switches a prepared statement to a
+# generic plan, a "$n IS NULL OR column = $n" filter can no longer pick an
+# index, so a filter that decides the index to scan gets its own statement.
+STATEMENTS: Dict[str, str] = {
+    'store_message': f"""
+        INSERT INTO messages ({', '.join(MESSAGE_COLUMNS)})
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+        ON CONFLICT {MESSAGE_CONFLICT_TARGET}
+        DO UPDATE SET {MESSAGE_UPSERT_ASSIGNMENTS}
+    """,
+
+    'store_attachment': """
+        INSERT INTO attachments (attachment_id, url, message_id, filename)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (attachment_id) DO NOTHING
+    """,
+
+    'get_backfill_checkpoints': """
+        SELECT channel_id, guild_id, oldest_message_id, newest_message_id,
+               history_complete, last_updated
+        FROM backfill_checkpoints
+        WHERE channel_id = ANY($1::bigint[])
+    """,
+
+    # Extends the saved range of message IDs fetched from a channel
+    'merge_backfill_checkpoint': """
+        INSERT INTO backfill_checkpoints (
+            channel_id, guild_id, oldest_message_id, newest_message_id, history_complete
+        ) VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT (channel_id)
+        DO UPDATE SET
+            guild_id = COALESCE(EXCLUDED.guild_id, backfill_checkpoints.guild_id),
+            oldest_message_id = LEAST(backfill_checkpoints.oldest_message_id, EXCLUDED.oldest_message_id),
+            newest_message_id = GREATEST(backfill_checkpoints.newest_message_id, EXCLUDED.newest_message_id),
+            history_complete = backfill_checkpoints.history_complete OR EXCLUDED.history_complete,
+            last_updated = CURRENT_TIMESTAMP
+    """,
+
+    # Overwrites the saved range, after a fetch that started over
+    'replace_backfill_checkpoint': """
+        INSERT INTO backfill_checkpoints (
+            channel_id, guild_id, oldest_message_id, newest_message_id, history_complete
+        ) VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT (channel_id)
+        DO UPDATE SET
+            guild_id = EXCLUDED.guild_id,
+            oldest_message_id = EXCLUDED.oldest_message_id,
+            newest_message_id = EXCLUDED.newest_message_id,
+            history_complete = EXCLUDED.history_complete,
+            last_updated = CURRENT_TIMESTAMP
+    """,
+
+    'messages_by_date': f"""
+        SELECT {MESSAGE_SELECT_COLUMNS} FROM messages
+        WHERE guild_id = $1
+        AND timestamp BETWEEN $2 AND $3
+        ORDER BY timestamp DESC
+        LIMIT $4
+    """,
+
+    'channel_messages_by_date': f"""
+        SELECT {MESSAGE_SELECT_COLUMNS} FROM messages
+        WHERE guild_id = $1
+        AND channel_id = $2
+        AND timestamp BETWEEN $3 AND $4
+        ORDER BY timestamp DESC
+        LIMIT $5
+    """,
+
+    # One page of a scan in (timestamp, message_id) order, resuming after the
+    # key in $4 and $5; $2 and $3 are NULL when the scan is not narrowed
+    'messages_page': f"""
+        SELECT {MESSAGE_SELECT_COLUMNS} FROM messages
+        WHERE guild_id = $1
+        AND timestamp >= COALESCE($2::timestamptz, '-infinity')
+        AND timestamp < COALESCE($3::timestamptz, 'infinity')
+        AND (timestamp, message_id) > ($4::timestamptz, $5::bigint)
+        ORDER BY timestamp, message_id
+        LIMIT $6
+    """,
+
+    # The same for one channel, resuming after the key in $5 and $6
+    'channel_messages_page': f"""
+        SELECT {MESSAGE_SELECT_COLUMNS} FROM messages
+        WHERE guild_id = $1
+        AND channel_id = $2
+        AND timestamp >= COALESCE($3::timestamptz, '-infinity')
+        AND timestamp < COALESCE($4::timestamptz, 'infinity')
+        AND (timestamp, message_id) > ($5::timestamptz, $6::bigint)
+        ORDER BY timestamp, message_id
+        LIMIT $7
+    """,
+
+    # $2 is the channel, or NULL for all channels
+    'messages_by_content': f"""
+        SELECT {MESSAGE_SELECT_COLUMNS} FROM messages
+        WHERE guild_id = $1
+        AND ($2::bigint IS NULL OR channel_id = $2)
+        AND content_tsv @@ to_tsquery('english', $3)
+        ORDER BY timestamp DESC
+        LIMIT $4
+    """,
+
+    # $2 is the oldest time to consider, or NULL for no limit; the stored
+    # search vector is matched by the GIN index and ranked as is
+    'messages_for_rag': f"""
+        SELECT {MESSAGE_SELECT_COLUMNS},
+               ts_rank_cd(content_tsv, tsq) AS rank
+        FROM messages, to_tsquery('english', $3) AS tsq
+        WHERE guild_id = $1
+        AND timestamp > COALESCE($2::timestamptz, '-infinity')
+        AND content_tsv @@ tsq
+        ORDER BY rank DESC
+        LIMIT $4
+    """,
+
+    'messages_by_ids': f"""
+        SELECT {MESSAGE_SELECT_COLUMNS}
+        FROM messages
+        WHERE message_id = ANY($1::bigint[])
+    """,
+
+    # Reply chains, first replies and channel neighbours of retrieved messages
+    'message_context': f"""
+        WITH RECURSIVE hits AS (
+            SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::timestamptz[])
+                AS h(message_id, channel_id, timestamp)
+        ),
+        chain AS (
+            SELECT h.message_id AS hit_id, m.message_id, m.reference_message_id, 0 AS depth
+            FROM hits h
+            JOIN messages m ON m.message_id = h.message_id AND m.timestamp = h.timestamp
+            UNION ALL
+            SELECT c.hit_id, m.message_id, m.reference_message_id, c.depth + 1
+            FROM chain c
+            JOIN messages m ON m.message_id = c.reference_message_id
+            WHERE c.depth < $4
+        ),
+        related AS (
+            SELECT hit_id, message_id FROM chain WHERE depth > 0
+            UNION
+            SELECT h.message_id, n.message_id
+            FROM hits h CROSS JOIN LATERAL (
+                (SELECT message_id FROM messages
+                 WHERE reference_message_id = h.message_id
+                 AND timestamp > h.timestamp AND timestamp <= h.timestamp + $6::interval
+                 ORDER BY timestamp LIMIT $5)
+                UNION ALL
+                (SELECT message_id FROM messages
+                 WHERE channel_id = h.channel_id
+                 AND timestamp < h.timestamp AND timestamp >= h.timestamp - $6::interval
+                 ORDER BY timestamp DESC LIMIT $5)
+                UNION ALL
+                (SELECT message_id FROM messages
+                 WHERE channel_id = h.channel_id
+                 AND timestamp > h.timestamp AND timestamp <= h.timestamp + $6::interval
+                 ORDER BY timestamp LIMIT $5)
+            ) n
+        )
+        SELECT r.hit_id, {_QUALIFIED_MESSAGE_COLUMNS}
+        FROM related r
+        JOIN messages m ON m.message_id = r.message_id
+    """,
+
+    'store_embedding': """
+        INSERT INTO message_embeddings (message_id, guild_id, timestamp, model, embedding)
+        VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT (message_id)
+        DO UPDATE SET
+            model = EXCLUDED.model,
+            embedding = EXCLUDED.embedding,
+            last_updated = CURRENT_TIMESTAMP
+    """,
+
+    # $4 lists the guilds whose older embeddings are indexed and $5 the time
+    # they were indexed at; both NULL to read every embedding
+    'embeddings_page': """
+        SELECT message_id, guild_id, timestamp, embedding
+        FROM message_embeddings
+        WHERE model = $1 AND message_id > $2
+        AND ($5::timestamptz IS NULL OR NOT (guild_id = ANY($4::bigint[])) OR last_updated > $5)
+        ORDER BY message_id
+        LIMIT $3
+    """,
+
+    'messages_without_embeddings': """
+        SELECT m.message_id, m.guild_id, m.timestamp, m.content
+        FROM messages m
+        LEFT JOIN message_embeddings e
+            ON e.message_id = m.message_id AND e.model = $1
+        WHERE m.message_id > $2
+          AND e.message_id IS NULL
+        ORDER BY m.message_id
+        LIMIT $3
+    """
+}
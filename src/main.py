@@ -3,7 +3,7 @@ import logging
 import os
 import sys
 from pathlib import Path
-from src.bot import create_bot, register_commands, register_events, run_bot, register_slash_commands, setup_slash_commands
+from src.bot import create_bot, register_commands, register_events, run_bot, register_slash_commands, setup_slash_commands, register_user_commands, register_monitoring, register_error_reporting
 
 # Configure import paths
 project_root = Path(__file__).parent.parent
@@ -52,6 +52,9 @@ def main():
         register_commands(bot)
         register_events(bot)
         register_slash_commands(bot)
+        register_user_commands(bot)
+        register_monitoring(bot)
+        register_error_reporting(bot)
 
         @bot.event
         async def on_connect():
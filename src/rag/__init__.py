@@ -1,5 +1,33 @@
 from .retriever import MessageRetriever
 from .processor import ContextProcessor
+from .expander import ContextExpander
 from .generator import ResponseGenerator
+from .scheduler import LLMScheduler
+from .embeddings import Embedder, HashingEmbedder, OpenAIEmbedder
+from .vector_index import VectorIndex
+from .ann_index import IVFSegment, IVFVectorIndex
+from .semantic import SemanticIndex, get_semantic_index
+from .cache import AnswerCache, get_answer_cache
+from .coalesce import SingleFlight
+from .pipeline import RAGPipeline, get_rag_pipeline
 
-__all__ = ["MessageRetriever", "ContextProcessor", "ResponseGenerator"]
+__all__ = [
+    "MessageRetriever",
+    "ContextProcessor",
+    "ContextExpander",
+    "ResponseGenerator",
+    "LLMScheduler",
+    "Embedder",
+    "HashingEmbedder",
+    "OpenAIEmbedder",
+    "VectorIndex",
+    "IVFSegment",
+    "IVFVectorIndex",
+    "SemanticIndex",
+    "get_semantic_index",
+    "AnswerCache",
+    "get_answer_cache",
+    "SingleFlight",
+    "RAGPipeline",
+    "get_rag_pipeline"
+]
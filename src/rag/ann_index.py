@@ -0,0 +1,583 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .vector_index import VectorIndex
+
+logger = logging.getLogger('discord_bot.rag.ann_index')
+
+# Arrays making up a saved segment, stored as .npy files so they can be memory-mapped
+SEGMENT_ARRAYS = ('ids', 'timestamps', 'vectors', 'centroids', 'offsets', 'sorted_ids', 'id_order')
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length, leaving all-zero rows as they are."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray, chunk_rows: int = 65536) -> np.ndarray:
+    """
+    Find the closest centroid of each vector.
+
+    Args:
+        vectors (np.ndarray): Unit-length row vectors
+        centroids (np.ndarray): Unit-length centroids
+        chunk_rows (int): Rows scored per matrix product
+
+    Returns:
+        np.ndarray: Index of the most similar centroid for each row
+    """
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_rows):
+        scores = vectors[start:start + chunk_rows] @ centroids.T
+        assignments[start:start + chunk_rows] = np.argmax(scores, axis=1)
+    return assignments
+
+def train_centroids(vectors: np.ndarray, n_lists: int, iterations: int = 10,
+                    sample_size: Optional[int] = None, seed: int = 0) -> np.ndarray:
+    """
+    Cluster unit vectors with spherical k-means.
+
+    Args:
+        vectors (np.ndarray): Unit-length row vectors
+        n_lists (int): Number of clusters
+        iterations (int): Number of k-means iterations
+        sample_size (int, optional): Rows to train on, defaults to 64 per cluster
+        seed (int): Random seed, so builds are reproducible
+
+    Returns:
+        np.ndarray: float32 array of n_lists unit-length centroids
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), sample_size or n_lists * 64)
+    if sample_size < len(vectors):
+        sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    else:
+        sample = vectors
+    n_lists = min(n_lists, len(sample))
+
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_lists(sample, centroids)
+        order = np.argsort(assignments, kind='stable')
+        lists, starts = np.unique(assignments[order], return_index=True)
+
+        sums = np.zeros_like(centroids)
+        sums[lists] = np.add.reduceat(sample[order], starts, axis=0)
+
+        # Restart empty clusters from random sample rows
+        empty = np.setdiff1d(np.arange(n_lists), lists)
+        if len(empty):
+            sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+
+        centroids = _normalize(sums)
+
+    return centroids
+
+class IVFSegment:
+    """
+    Immutable inverted-file (IVF-Flat) index over the vectors of one guild.
+
+    Vectors are clustered around ``n_lists`` centroids and stored sorted by
+    cluster, so a search scores the centroids, then only the contiguous rows
+    of the ``n_probe`` closest clusters. Segments are saved as plain ``.npy``
+    files and loaded memory-mapped, so a restart does not rebuild or even
+    read the whole index up front. Rows can be deleted (tombstoned), which
+    is how replaced vectors are hidden until the next rebuild.
+    """
+
+    def __init__(self, ids: np.ndarray, timestamps: np.ndarray, vectors: np.ndarray,
+                 centroids: np.ndarray, offsets: np.ndarray, sorted_ids: np.ndarray,
+                 id_order: np.ndarray, built_at: Optional[datetime.datetime] = None):
+        """
+        Initialize a segment from its arrays; use :meth:`build` or :meth:`load` instead.
+
+        Args:
+            ids (np.ndarray): Message ID of each row
+            timestamps (np.ndarray): POSIX timestamp of each row
+            vectors (np.ndarray): Unit-length vectors, sorted by cluster
+            centroids (np.ndarray): Unit-length cluster centroids
+            offsets (np.ndarray): First row of each cluster, plus the total row count
+            sorted_ids (np.ndarray): Message IDs in ascending order, for lookups
+            id_order (np.ndarray): Row of each entry of sorted_ids
+            built_at (datetime.datetime, optional): Time the vectors were read from the database
+        """
+        self.ids = ids
+        self.timestamps = timestamps
+        self.vectors = vectors
+        self.centroids = centroids
+        self.offsets = offsets
+        self.sorted_ids = sorted_ids
+        self.id_order = id_order
+        self.built_at = built_at
+        self.alive = np.ones(len(ids), dtype=bool)
+        self.deleted = 0
+
+    def __len__(self) -> int:
+        return len(self.ids) - self.deleted
+
+    @property
+    def n_lists(self) -> int:
+        """Number of clusters."""
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, ids: np.ndarray, vectors: np.ndarray, timestamps: np.ndarray,
+              n_lists: Optional[int] = None, centroids: Optional[np.ndarray] = None,
+              built_at: Optional[datetime.datetime] = None) -> 'IVFSegment':
+        """
+        Cluster vectors and lay them out by cluster.
+
+        Args:
+            ids (np.ndarray): Message IDs
+            vectors (np.ndarray): Vectors, one row per message
+            timestamps (np.ndarray): POSIX timestamps
+            n_lists (int, optional): Number of clusters, defaults to the square root of the row count
+            centroids (np.ndarray, optional): Reuse previously trained centroids instead of training
+            built_at (datetime.datetime, optional): Time the vectors were read from the database
+
+        Returns:
+            IVFSegment: The new segment
+        """
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        if centroids is None:
+            n_lists = n_lists or max(1, int(np.sqrt(len(vectors))))
+            centroids = train_centroids(vectors, n_lists)
+
+        assignments = assign_lists(vectors, centroids)
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.searchsorted(assignments[order], np.arange(len(centroids) + 1)).astype(np.int64)
+
+        ids = np.asarray(ids, dtype=np.int64)[order]
+        id_order = np.argsort(ids, kind='stable')
+        return cls(
+            ids=ids,
+            timestamps=np.asarray(timestamps, dtype=np.float64)[order],
+            vectors=np.ascontiguousarray(vectors[order]),
+            centroids=centroids,
+            offsets=offsets,
+            sorted_ids=ids[id_order],
+            id_order=id_order,
+            built_at=built_at
+        )
+
+    def save(self, path: Path) -> None:
+        """
+        Write the segment to a directory, replacing any segment saved there.
+
+        Args:
+            path (Path): Directory to write to
+        """
+        path = Path(path)
+        staging = path.with_name(path.name + '.tmp')
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+
+        for name in SEGMENT_ARRAYS + ('alive',):
+            np.save(staging / f'{name}.npy', np.ascontiguousarray(getattr(self, name)))
+
+        with open(staging / 'segment.json', 'w') as f:
+            json.dump({
+                'rows': len(self.ids),
+                'built_at': self.built_at.isoformat() if self.built_at else None
+            }, f)
+
+        # Swap directories; readers holding the old files keep their mappings
+        retired = path.with_name(path.name + '.old')
+        shutil.rmtree(retired, ignore_errors=True)
+        if path.exists():
+            os.replace(path, retired)
+        os.replace(staging, path)
+        shutil.rmtree(retired, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> 'IVFSegment':
+        """
+        Load a saved segment.
+
+        Args:
+            path (Path): Directory the segment was saved to
+            mmap (bool): Memory-map the arrays instead of reading them into memory
+
+        Returns:
+            IVFSegment: The loaded segment
+        """
+        path = Path(path)
+        arrays = {
+            name: np.load(path / f'{name}.npy', mmap_mode='r' if mmap else None)
+            for name in SEGMENT_ARRAYS
+        }
+        with open(path / 'segment.json') as f:
+            meta = json.load(f)
+
+        built_at = datetime.datetime.fromisoformat(meta['built_at']) if meta.get('built_at') else None
+        segment = cls(built_at=built_at, **arrays)
+
+        # Deletions keep changing, so this one is read into memory
+        segment.alive = np.load(path / 'alive.npy')
+        segment.deleted = int(len(segment.alive) - segment.alive.sum())
+        return segment
+
+    def delete(self, message_ids: Iterable[int]) -> int:
+        """
+        Hide rows by message ID.
+
+        Args:
+            message_ids (Iterable[int]): Messages to hide
+
+        Returns:
+            int: Number of rows hidden
+        """
+        message_ids = np.fromiter(message_ids, dtype=np.int64)
+        if not len(message_ids) or not len(self.ids):
+            return 0
+
+        positions = np.searchsorted(self.sorted_ids, message_ids)
+        positions = np.minimum(positions, len(self.sorted_ids) - 1)
+        found = self.sorted_ids[positions] == message_ids
+        rows = self.id_order[positions[found]]
+        rows = rows[self.alive[rows]]
+
+        self.alive[rows] = False
+        self.deleted += len(rows)
+        return len(rows)
+
+    def live_rows(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Copy out the rows that are not deleted.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: IDs, vectors and timestamps
+        """
+        return (np.asarray(self.ids)[self.alive], np.asarray(self.vectors)[self.alive],
+                np.asarray(self.timestamps)[self.alive])
+
+    def search(self, query: np.ndarray, k: int = 20, n_probe: int = 16,
+               min_timestamp: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        Find approximately the most similar vectors to a unit-length query.
+
+        Args:
+            query (np.ndarray): Unit-length query vector
+            k (int): Maximum number of results
+            n_probe (int): Number of closest clusters to scan
+            min_timestamp (float, optional): Only consider rows at or after this POSIX timestamp
+
+        Returns:
+            List[Tuple[int, float]]: (message_id, cosine similarity) pairs, most similar first
+        """
+        n_probe = min(n_probe, self.n_lists)
+        centroid_scores = self.centroids @ query
+        probed = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe] if n_probe < self.n_lists \
+            else np.arange(self.n_lists)
+
+        candidate_scores = []
+        candidate_rows = []
+        for cluster in probed:
+            start, stop = int(self.offsets[cluster]), int(self.offsets[cluster + 1])
+            if start == stop:
+                continue
+
+            scores = self.vectors[start:stop] @ query
+            valid = self.alive[start:stop]
+            if min_timestamp is not None:
+                valid = valid & (self.timestamps[start:stop] >= min_timestamp)
+            rows = np.flatnonzero(valid)
+            candidate_scores.append(scores[rows])
+            candidate_rows.append(rows + start)
+
+        if not candidate_scores:
+            return []
+
+        scores = np.concatenate(candidate_scores)
+        rows = np.concatenate(candidate_rows)
+        if len(scores) > k:
+            keep = np.argpartition(-scores, k - 1)[:k]
+            scores, rows = scores[keep], rows[keep]
+
+        order = np.argsort(-scores, kind='stable')
+        return [(int(self.ids[rows[i]]), float(scores[i])) for i in order]
+
+class IVFVectorIndex:
+    """
+    Approximate vector index: an IVF segment per large guild plus an exact delta.
+
+    New and replaced vectors go to an in-memory exact :class:`VectorIndex`
+    (the delta); a replaced vector is also deleted from the guild's segment.
+    Searches merge both. Once a guild's delta outgrows ``build_threshold``
+    rows, or a ``rebuild_fraction`` of its segment, :meth:`rebuild` folds it
+    into a new segment in a worker thread and saves it under ``storage_dir``.
+    Guilds below the threshold are only ever searched exactly. Offers the
+    same search interface as VectorIndex.
+
+    Vectors are added from worker threads, so a lock keeps each add and
+    remove whole with respect to the start and the end of a rebuild.
+    """
+
+    def __init__(self, dimension: int, n_probe: int = 16, build_threshold: int = 50000,
+                 rebuild_fraction: float = 0.2, storage_dir: Optional[str] = None):
+        """
+        Initialize an empty index.
+
+        Args:
+            dimension (int): Size of the vectors
+            n_probe (int): Clusters scanned per search; higher is slower but more accurate
+            build_threshold (int): Vectors a guild needs before it gets a segment
+            rebuild_fraction (float): Delta size, relative to the segment, that triggers a rebuild
+            storage_dir (str, optional): Directory segments are saved to and loaded from
+        """
+        self.dimension = dimension
+        self.n_probe = n_probe
+        self.build_threshold = build_threshold
+        self.rebuild_fraction = rebuild_fraction
+        self.storage_dir = Path(storage_dir) if storage_dir else None
+
+        self.delta = VectorIndex(dimension)
+        self._segments: Dict[int, IVFSegment] = {}
+        self._rebuilding: Dict[int, Set[int]] = {}
+        self._lock = threading.RLock()
+
+        self.rebuilds = 0
+        self.last_rebuild_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self.delta) + sum(len(segment) for segment in self._segments.values())
+
+    def guild_size(self, guild_id: int) -> int:
+        """
+        Get the number of vectors stored for a guild.
+
+        Args:
+            guild_id (int): Discord server ID
+
+        Returns:
+            int: Number of vectors
+        """
+        segment = self._segments.get(guild_id)
+        return self.delta.guild_size(guild_id) + (len(segment) if segment else 0)
+
+    def add(self, message_ids: Iterable[int], vectors: np.ndarray,
+            guild_ids: Iterable[int], timestamps: Iterable[float]) -> None:
+        """
+        Add or replace vectors.
+
+        Args:
+            message_ids (Iterable[int]): Message ID of each vector
+            vectors (np.ndarray): Matrix with one row per message
+            guild_ids (Iterable[int]): Guild of each message
+            timestamps (Iterable[float]): POSIX timestamp of each message
+        """
+        message_ids = list(message_ids)
+        guild_ids = list(guild_ids)
+
+        by_guild: Dict[int, List[int]] = {}
+        for message_id, guild_id in zip(message_ids, guild_ids):
+            by_guild.setdefault(guild_id, []).append(message_id)
+
+        with self._lock:
+            for guild_id, ids in by_guild.items():
+                segment = self._segments.get(guild_id)
+                if segment is not None:
+                    segment.delete(ids)
+                if guild_id in self._rebuilding:
+                    self._rebuilding[guild_id].update(ids)
+
+            self.delta.add(message_ids, vectors, guild_ids, timestamps)
+
+    def remove(self, message_ids: Iterable[int]) -> int:
+        """
+        Remove vectors.
+
+        Args:
+            message_ids (Iterable[int]): Messages to remove
+
+        Returns:
+            int: Number of vectors removed
+        """
+        message_ids = list(message_ids)
+        with self._lock:
+            removed = self.delta.remove(message_ids)
+            for guild_id, segment in self._segments.items():
+                removed += segment.delete(message_ids)
+                if guild_id in self._rebuilding:
+                    self._rebuilding[guild_id].update(message_ids)
+        return removed
+
+    def search(self, guild_id: int, query: np.ndarray, k: int = 20,
+               min_timestamp: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        Find approximately the vectors of a guild most similar to a query vector.
+
+        Args:
+            guild_id (int): Discord server ID
+            query (np.ndarray): Query vector
+            k (int): Maximum number of results
+            min_timestamp (float, optional): Only consider messages at or after this POSIX timestamp
+
+        Returns:
+            List[Tuple[int, float]]: (message_id, cosine similarity) pairs, most similar first
+        """
+        return self.search_batch(guild_id, np.asarray(query).reshape(1, -1), k, min_timestamp)[0]
+
+    def search_batch(self, guild_id: int, queries: np.ndarray, k: int = 20,
+                     min_timestamp: Optional[float] = None) -> List[List[Tuple[int, float]]]:
+        """
+        Search for several query vectors at once.
+
+        Args:
+            guild_id (int): Discord server ID
+            queries (np.ndarray): Matrix with one query vector per row
+            k (int): Maximum number of results per query
+            min_timestamp (float, optional): Only consider messages at or after this POSIX timestamp
+
+        Returns:
+            List[List[Tuple[int, float]]]: Results for each query, most similar first
+        """
+        queries = _normalize(np.asarray(queries, dtype=np.float32).reshape(-1, self.dimension))
+        results = self.delta.search_batch(guild_id, queries, k, min_timestamp)
+
+        segment = self._segments.get(guild_id)
+        if segment is None:
+            return results
+
+        merged = []
+        for query, exact in zip(queries, results):
+            hits = exact + segment.search(query, k, self.n_probe, min_timestamp)
+            hits.sort(key=lambda hit: hit[1], reverse=True)
+            merged.append(hits[:k])
+        return merged
+
+    def segment_guild_ids(self) -> List[int]:
+        """
+        List the guilds that have a segment.
+
+        Returns:
+            List[int]: Guild IDs
+        """
+        return list(self._segments)
+
+    def guilds_to_rebuild(self) -> List[int]:
+        """
+        List the guilds whose delta is large enough to fold into a segment.
+
+        Returns:
+            List[int]: Guild IDs, not including guilds being rebuilt
+        """
+        guilds = []
+        for guild_id in self.delta.guild_ids():
+            if guild_id in self._rebuilding:
+                continue
+            pending = self.delta.guild_size(guild_id)
+            segment = self._segments.get(guild_id)
+            if segment is None:
+                if pending >= self.build_threshold:
+                    guilds.append(guild_id)
+            elif pending >= max(1, len(segment) * self.rebuild_fraction):
+                guilds.append(guild_id)
+        return guilds
+
+    async def rebuild(self, guild_id: int, built_at: Optional[datetime.datetime] = None) -> None:
+        """
+        Fold a guild's delta and segment into a new segment and save it.
+
+        The clustering runs in a worker thread; vectors added meanwhile stay
+        in the delta and are hidden in the new segment.
+
+        Args:
+            guild_id (int): Discord server ID
+            built_at (datetime.datetime, optional): Database time before which every
+                stored embedding is already in the index; saved for :meth:`load_saved`
+        """
+        if guild_id in self._rebuilding:
+            return
+
+        started = time.monotonic()
+        try:
+            with self._lock:
+                # From here on, vectors added or removed are recorded as changed
+                self._rebuilding[guild_id] = set()
+                delta_ids, delta_vectors, delta_timestamps = self.delta.guild_rows(guild_id)
+                old = self._segments.get(guild_id)
+            parts = [(delta_ids, delta_vectors, delta_timestamps)]
+            if old is not None:
+                parts.append(old.live_rows())
+            ids = np.concatenate([part[0] for part in parts])
+            vectors = np.concatenate([part[1] for part in parts])
+            timestamps = np.concatenate([part[2] for part in parts])
+
+            # Keep the clusters while the guild has not doubled since they were trained
+            centroids = None
+            if old is not None and len(ids) < 2 * len(old.ids):
+                centroids = np.asarray(old.centroids)
+
+            segment = await asyncio.to_thread(
+                IVFSegment.build, ids, vectors, timestamps, centroids=centroids, built_at=built_at
+            )
+
+            # Vectors replaced or removed during the build are newer in the delta
+            with self._lock:
+                changed = self._rebuilding[guild_id]
+                segment.delete(changed)
+                self.delta.remove(int(message_id) for message_id in delta_ids if int(message_id) not in changed)
+                self._segments[guild_id] = segment
+
+            if self.storage_dir is not None:
+                await asyncio.to_thread(self._save_segment, guild_id, segment)
+        finally:
+            with self._lock:
+                self._rebuilding.pop(guild_id, None)
+
+        self.rebuilds += 1
+        self.last_rebuild_seconds = time.monotonic() - started
+        logger.info(f"Built vector index segment for guild {guild_id}: {len(segment)} vectors, "
+                    f"{segment.n_lists} lists in {self.last_rebuild_seconds:.1f}s")
+
+    def _save_segment(self, guild_id: int, segment: IVFSegment) -> None:
+        """Save one guild's segment under storage_dir."""
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.storage_dir / 'index.json', 'w') as f:
+            json.dump({'dimension': self.dimension}, f)
+        segment.save(self.storage_dir / f'guild_{guild_id}')
+
+    def load_saved(self) -> Optional[datetime.datetime]:
+        """
+        Memory-map the segments saved under storage_dir.
+
+        Returns:
+            datetime.datetime: Oldest build time of the loaded segments; embeddings
+                stored after it must be added again. None if nothing was loaded.
+        """
+        if self.storage_dir is None or not (self.storage_dir / 'index.json').exists():
+            return None
+
+        with open(self.storage_dir / 'index.json') as f:
+            if json.load(f).get('dimension') != self.dimension:
+                logger.warning(f"Ignoring saved vector index in {self.storage_dir}: dimension changed")
+                return None
+
+        oldest = None
+        for path in sorted(self.storage_dir.glob('guild_*')):
+            if not path.is_dir() or not path.name[len('guild_'):].isdigit():
+                continue
+            try:
+                segment = IVFSegment.load(path)
+            except Exception as e:
+                logger.error(f"Error loading vector index segment {path}: {str(e)}")
+                continue
+
+            if segment.built_at is None:
+                continue
+            self._segments[int(path.name[len('guild_'):])] = segment
+            oldest = segment.built_at if oldest is None else min(oldest, segment.built_at)
+
+        logger.info(f"Loaded {len(self._segments)} vector index segment(s) from {self.storage_dir}")
+        return oldest
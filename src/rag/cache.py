@@ -0,0 +1,341 @@
+import hashlib
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from ..database.models import MESSAGE_COLUMNS
+from ..database.operations import add_store_listener
+from .embeddings import Embedder
+
+logger = logging.getLogger('discord_bot.rag.cache')
+
+# Position of the channel within a message record
+_CHANNEL = MESSAGE_COLUMNS.index('channel_id')
+
+def normalize_question(question: str) -> str:
+    """
+    Reduce a question to the form used as cache key.
+
+    Args:
+        question (str): The user's question
+
+    Returns:
+        str: Lowercased question without punctuation or repeated whitespace
+    """
+    return ' '.join(re.sub(r'[^\w\s]', ' ', question.lower()).split())
+
+def question_key(guild_id: int, question: str, history: str = '') -> Tuple[int, str, str]:
+    """
+    Build the key identifying a question asked in a guild and conversation.
+
+    Args:
+        guild_id (int): Discord server ID
+        question (str): The user's question
+        history (str): Conversation history the question was asked in
+
+    Returns:
+        Tuple[int, str, str]: Guild ID, history digest and normalized question
+    """
+    history_hash = hashlib.sha1(history.encode()).hexdigest() if history else ''
+    return (guild_id, history_hash, normalize_question(question))
+
+def context_fingerprint(messages: Iterable[Dict[str, Any]]) -> str:
+    """
+    Fingerprint the set of messages retrieved as context.
+
+    Args:
+        messages (Iterable[Dict[str, Any]]): Retrieved message records
+
+    Returns:
+        str: Hex digest that changes whenever a different set of messages is retrieved
+    """
+    message_ids = sorted(message['message_id'] for message in messages)
+    return hashlib.sha1(','.join(map(str, message_ids)).encode()).hexdigest()
+
+class CachedAnswer:
+    """An answer with the context it was generated from."""
+
+    __slots__ = ('key', 'answer', 'fingerprint', 'channel_ids', 'vector', 'created', 'stale')
+
+    def __init__(self, key: Tuple[int, str, str], answer: str, fingerprint: str,
+                 channel_ids: Set[int], vector: Optional[np.ndarray]):
+        self.key = key
+        self.answer = answer
+        self.fingerprint = fingerprint
+        self.channel_ids = channel_ids
+        self.vector = vector
+        self.created = time.monotonic()
+        # Set when new messages land in one of channel_ids
+        self.stale = False
+
+class AnswerCache:
+    """
+    LRU cache of generated answers to repeated questions.
+
+    Answers are keyed on guild, conversation history and normalized
+    question. An entry remembers the fingerprint and channels of the
+    context it was generated from. When new messages are stored in one of
+    those channels the entry becomes stale: it is only served again once
+    retrieval for the question returns the same messages, which skips the
+    context processing and the LLM call.
+
+    With an embedder, a question close enough in meaning to a cached one
+    is a candidate too, but only under the same condition: questions that
+    differ in a detail, such as a version number, embed almost alike, so
+    the answer is served only when the new question retrieves exactly the
+    messages it was generated from.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600.0,
+                 embedder: Optional[Embedder] = None, similarity_threshold: float = 0.9):
+        """
+        Initialize an empty cache.
+
+        Args:
+            max_entries (int): Entries kept before the least recently used is evicted
+            ttl (float): Seconds an answer may be served after it was generated
+            embedder (Embedder, optional): Embedder for near-duplicate lookups; exact
+                matches only if None
+            similarity_threshold (float): Cosine similarity at which a cached question
+                counts as the same question
+        """
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+
+        self._entries: 'OrderedDict[Tuple[int, str, str], CachedAnswer]' = OrderedDict()
+        self._by_channel: Dict[int, Set[Tuple[int, str, str]]] = {}
+        self._started = False
+
+        self.hits = 0
+        self.similar_hits = 0
+        self.revalidated_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def start(self) -> None:
+        """Subscribe to message writes to invalidate answers about changed channels."""
+        from ..database.bulk import get_bulk_writer
+
+        if self._started:
+            return
+        self._started = True
+
+        writer = await get_bulk_writer()
+        writer.add_flush_listener(self.invalidate_records)
+        add_store_listener(self.invalidate_records)
+
+    async def lookup(self, guild_id: int, question: str,
+                     history: str = '') -> Tuple[Optional[CachedAnswer], bool, Optional[np.ndarray]]:
+        """
+        Find the cached answer to a question, or to a question like it.
+
+        Args:
+            guild_id (int): Discord server ID
+            question (str): The user's question
+            history (str): Conversation history the question was asked in
+
+        Returns:
+            Tuple[Optional[CachedAnswer], bool, Optional[np.ndarray]]: The entry, or None;
+                whether it can be served as is, rather than after :meth:`revalidate`
+                with the question's retrieved messages; and the question's embedding
+                when one was computed, to pass to :meth:`store`
+        """
+        key = question_key(guild_id, question, history)
+        entry = self._entries.get(key)
+        vector = None
+
+        if entry is None and self.embedder is not None and self.similarity_threshold > 0:
+            vector = await self.embedder.embed_query(question)
+            entry = self._most_similar(key, vector)
+
+        if entry is not None and time.monotonic() - entry.created > self.ttl:
+            self._remove(entry.key)
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None, False, vector
+
+        self._entries.move_to_end(entry.key)
+        servable = entry.key == key and not entry.stale
+        if servable:
+            self.hits += 1
+        return entry, servable, vector
+
+    def _most_similar(self, key: Tuple[int, str, str], vector: np.ndarray) -> Optional[CachedAnswer]:
+        """Find the cached question of the same guild and history closest to a query vector."""
+        candidates = [
+            entry for entry in self._entries.values()
+            if entry.key[:2] == key[:2] and entry.vector is not None
+        ]
+        if not candidates:
+            return None
+
+        similarities = np.stack([entry.vector for entry in candidates]) @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        return candidates[best]
+
+    def revalidate(self, entry: CachedAnswer, messages: List[Dict[str, Any]],
+                   key: Tuple[int, str, str]) -> bool:
+        """
+        Check an entry that could not be served as is against freshly retrieved context.
+
+        Args:
+            entry (CachedAnswer): Entry returned by :meth:`lookup`
+            messages (List[Dict[str, Any]]): Messages now retrieved for the question
+            key (Tuple[int, str, str]): Key of the question, from :func:`question_key`
+
+        Returns:
+            bool: True if the question retrieved the context the answer was generated
+                from, so the answer can be served
+        """
+        if entry.key not in self._entries or entry.fingerprint != context_fingerprint(messages):
+            self.misses += 1
+            return False
+
+        if entry.key != key:
+            # Says nothing about the context the cached question retrieves now
+            self.similar_hits += 1
+            return True
+
+        entry.stale = False
+        self.revalidated_hits += 1
+        return True
+
+    def store(self, guild_id: int, question: str, history: str, answer: str,
+              messages: List[Dict[str, Any]], vector: Optional[np.ndarray] = None) -> None:
+        """
+        Cache the answer to a question.
+
+        Args:
+            guild_id (int): Discord server ID
+            question (str): The user's question
+            history (str): Conversation history the question was asked in
+            answer (str): The generated answer
+            messages (List[Dict[str, Any]]): Messages the answer was generated from
+            vector (np.ndarray, optional): Embedding of the question returned by :meth:`lookup`
+        """
+        key = question_key(guild_id, question, history)
+        previous = self._entries.get(key)
+        if vector is None and previous is not None:
+            # Exact lookups do not embed the question; keep the earlier embedding
+            vector = previous.vector
+        self._remove(key)
+
+        entry = CachedAnswer(
+            key, answer, context_fingerprint(messages),
+            {message['channel_id'] for message in messages}, vector
+        )
+        self._entries[key] = entry
+        for channel_id in entry.channel_ids:
+            self._by_channel.setdefault(channel_id, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: Tuple[int, str, str]) -> None:
+        """Drop an entry and its channel references."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for channel_id in entry.channel_ids:
+            keys = self._by_channel.get(channel_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_channel[channel_id]
+
+    def invalidate_channels(self, channel_ids: Iterable[int]) -> int:
+        """
+        Mark the answers generated from messages of the given channels as stale.
+
+        Args:
+            channel_ids (Iterable[int]): Channels that received messages
+
+        Returns:
+            int: Number of entries that became stale
+        """
+        invalidated = 0
+        for channel_id in set(channel_ids):
+            for key in self._by_channel.get(channel_id, ()):
+                entry = self._entries[key]
+                if not entry.stale:
+                    entry.stale = True
+                    invalidated += 1
+        self.invalidations += invalidated
+        return invalidated
+
+    async def invalidate_records(self, records: List[Tuple]) -> None:
+        """
+        Invalidate the channels of freshly written messages.
+
+        Args:
+            records (List[Tuple]): Message records in MESSAGE_COLUMNS order
+        """
+        self.invalidate_channels(record[_CHANNEL] for record in records)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get counters for the answer cache.
+
+        Returns:
+            Dict[str, Any]: Size, hit and invalidation counters
+        """
+        hits = self.hits + self.similar_hits + self.revalidated_hits
+        lookups = hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'similar_hits': self.similar_hits,
+            'revalidated_hits': self.revalidated_hits,
+            'misses': self.misses,
+            'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions
+        }
+
+# Answer cache singleton
+_answer_cache: Optional[AnswerCache] = None
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """
+    Get or create the shared answer cache from the ``answer_cache`` config.
+
+    Returns:
+        AnswerCache: The shared answer cache, or None if caching is disabled
+    """
+    global _answer_cache
+
+    if _answer_cache is None:
+        from ..utils.config import get_config
+        from ..utils.metrics import get_metrics
+        from .embeddings import HashingEmbedder
+
+        cache_config = get_config().get('answer_cache', {})
+        if not cache_config.get('enabled', True):
+            return None
+
+        # Questions are short; the local embedder is enough to spot rephrasings
+        embedder = HashingEmbedder() if cache_config.get('similarity_threshold', 0.9) > 0 else None
+        _answer_cache = AnswerCache(
+            max_entries=cache_config.get('max_entries', 1000),
+            ttl=cache_config.get('ttl', 3600.0),
+            embedder=embedder,
+            similarity_threshold=cache_config.get('similarity_threshold', 0.9)
+        )
+        get_metrics().add_collector('answer_cache', _answer_cache.stats)
+
+    return _answer_cache
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger('discord_bot.rag.coalesce')
+
+class _Flight:
+    """An answer being produced, with the pieces yielded so far."""
+
+    __slots__ = ('pieces', 'done', 'error', 'changed', 'waiters', 'task')
+
+    def __init__(self):
+        self.pieces: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        # Replaced by a fresh event each time the flight changes
+        self.changed = asyncio.Event()
+        self.waiters = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def notify(self) -> None:
+        """Wake up the waiters after a new piece or the end of the flight."""
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+class SingleFlight:
+    """
+    Share one in-flight streamed computation between identical concurrent calls.
+
+    The first call for a key starts the computation in its own task; calls
+    for the same key made before it finishes replay the pieces produced so
+    far and then follow it as it streams. Once it finishes, the next call
+    starts a new computation. A caller that stops reading does not cancel
+    the computation for the others.
+    """
+
+    def __init__(self):
+        """Initialize the single-flight group."""
+        self._flights: Dict[Hashable, _Flight] = {}
+
+        # Counters
+        self.calls = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def stream(self, key: Hashable, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        Stream the result for a key, joining the computation in flight if there is one.
+
+        Args:
+            key (Hashable): Identifies calls that produce the same result
+            factory (Callable[[], AsyncIterator[str]]): Starts the computation when none is in flight
+
+        Yields:
+            str: The pieces of the result, from the first one
+
+        Raises:
+            Exception: Whatever the shared computation raised
+        """
+        self.calls += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(self._run(key, flight, factory()))
+        else:
+            self.coalesced += 1
+            logger.debug(f"Joined in-flight request with {flight.waiters} waiters")
+
+        flight.waiters += 1
+        self.max_waiters = max(self.max_waiters, flight.waiters)
+        try:
+            position = 0
+            while True:
+                changed = flight.changed
+                if position < len(flight.pieces):
+                    yield flight.pieces[position]
+                    position += 1
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await changed.wait()
+        finally:
+            flight.waiters -= 1
+
+    async def _run(self, key: Hashable, flight: _Flight, pieces: AsyncIterator[str]) -> None:
+        """Produce the pieces of a flight and publish them to its waiters."""
+        try:
+            async for piece in pieces:
+                flight.pieces.append(piece)
+                flight.notify()
+        except BaseException as e:
+            flight.error = e
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.notify()
+
+    async def close(self) -> None:
+        """Cancel the computations in flight."""
+        tasks = [flight.task for flight in self._flights.values() if flight.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get counters for request coalescing.
+
+        Returns:
+            Dict[str, Any]: Calls, calls that joined an in-flight computation
+                and the most callers sharing one
+        """
+        return {
+            'in_flight': len(self._flights),
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'coalesced_rate': round(self.coalesced / self.calls, 3) if self.calls else 0.0,
+            'max_waiters': self.max_waiters
+        }
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import os
+import re
+import hashlib
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+import numpy as np
+
+logger = logging.getLogger('discord_bot.rag.embeddings')
+
+# Words, numbers and identifiers; punctuation and emoji are ignored
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+")
+
+class Embedder:
+    """Base class for turning texts into unit-length embedding vectors."""
+
+    # Identifies the vectors an embedder produces; stored with each embedding
+    # so vectors of different models are never compared
+    name: str = 'embedder'
+    dimension: int = 0
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a batch of texts.
+
+        Args:
+            texts (List[str]): Texts to embed
+
+        Returns:
+            np.ndarray: float32 array of shape (len(texts), dimension) with L2-normalized rows
+        """
+        raise NotImplementedError
+
+    async def embed_query(self, text: str) -> np.ndarray:
+        """
+        Embed a single query text.
+
+        Args:
+            text (str): Query to embed
+
+        Returns:
+            np.ndarray: float32 vector of length dimension
+        """
+        return (await self.embed([text]))[0]
+
+    async def start(self) -> None:
+        """Acquire the resources the embedder needs, such as an HTTP session."""
+
+    async def close(self) -> None:
+        """Release the resources acquired by :meth:`start`."""
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scale the rows of a matrix to unit length, leaving all-zero rows as they are.
+
+    Args:
+        vectors (np.ndarray): Matrix of row vectors
+
+    Returns:
+        np.ndarray: float32 matrix with L2-normalized rows
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+@lru_cache(maxsize=200000)
+def _hash_feature(feature: str, dimension: int) -> Tuple[int, float]:
+    """Map a feature to a (bucket, sign) pair, stable across processes."""
+    digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+    return digest % dimension, 1.0 if digest >> 63 else -1.0
+
+class HashingEmbedder(Embedder):
+    """
+    Deterministic local embedder based on the hashing trick.
+
+    Each text becomes a bag of lower-cased words and character trigrams,
+    hashed into ``dimension`` signed buckets. Trigrams let inflected forms
+    ("deploy", "deployed", "deployment") land close together. It needs no
+    model download or network access, which makes it suitable for tests and
+    for running without an embedding service, but it only captures surface
+    similarity, not meaning.
+    """
+
+    def __init__(self, dimension: int = 256, trigram_weight: float = 0.5):
+        """
+        Initialize the hashing embedder.
+
+        Args:
+            dimension (int): Number of hash buckets, i.e. the vector size
+            trigram_weight (float): Weight of character trigrams relative to whole words
+        """
+        self.dimension = dimension
+        self.trigram_weight = trigram_weight
+        self.name = f'hashing-{dimension}'
+
+    def embed_text(self, text: str) -> np.ndarray:
+        """
+        Embed one text synchronously.
+
+        Args:
+            text (str): Text to embed
+
+        Returns:
+            np.ndarray: Unit-length float32 vector, all zeros for texts without words
+        """
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in TOKEN_PATTERN.findall((text or '').lower()):
+            bucket, sign = _hash_feature(token, self.dimension)
+            vector[bucket] += sign
+
+            padded = f'<{token}>'
+            for i in range(len(padded) - 2):
+                bucket, sign = _hash_feature(padded[i:i + 3], self.dimension)
+                vector[bucket] += sign * self.trigram_weight
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a batch of texts synchronously.
+
+        Args:
+            texts (List[str]): Texts to embed
+
+        Returns:
+            np.ndarray: float32 array of shape (len(texts), dimension)
+        """
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return np.stack([self.embed_text(text) for text in texts])
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a batch of texts in a worker thread.
+
+        Args:
+            texts (List[str]): Texts to embed
+
+        Returns:
+            np.ndarray: float32 array of shape (len(texts), dimension)
+        """
+        if len(texts) <= 1:
+            # A single query is quicker than the hand-off to a thread
+            return self.embed_texts(texts)
+        # A batch of messages takes long enough to stall the event loop
+        return await asyncio.to_thread(self.embed_texts, texts)
+
+class OpenAIEmbedder(Embedder):
+    """Embedder using the OpenAI embeddings API."""
+
+    def __init__(self, model: str = "text-embedding-3-small", dimension: int = 1536,
+                 api_key: Optional[str] = None, api_base: str = "https://api.openai.com/v1"):
+        """
+        Initialize the OpenAI embedder.
+
+        Args:
+            model (str): Embedding model to use
+            dimension (int): Vector size to request from the model
+            api_key (str, optional): API key for the embedding service
+            api_base (str): Base URL of the OpenAI-compatible API
+        """
+        self.model = model
+        self.dimension = dimension
+        self.name = f'openai-{model}-{dimension}'
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        if not self.api_key:
+            logger.warning("No OpenAI API key provided. Embedding requests will fail.")
+        self.api_base = api_base.rstrip('/')
+
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self) -> None:
+        """Open the HTTP session shared by all embedding requests."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+
+    async def close(self) -> None:
+        """Close the HTTP session and its pooled connections."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a batch of texts with one API request.
+
+        Args:
+            texts (List[str]): Texts to embed
+
+        Returns:
+            np.ndarray: float32 array of shape (len(texts), dimension)
+
+        Raises:
+            RuntimeError: If the API returns an error
+        """
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        # Normally opened by SemanticIndex.start; opened here for standalone use
+        await self.start()
+
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+
+        payload = {
+            "model": self.model,
+            # The API rejects empty strings
+            "input": [text or " " for text in texts],
+            "dimensions": self.dimension
+        }
+
+        async with self._session.post(
+            f"{self.api_base}/embeddings",
+            headers=headers,
+            json=payload
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise RuntimeError(f"Error from OpenAI embeddings API: {error_text}")
+
+            result = await response.json()
+
+        data = sorted(result["data"], key=lambda item: item["index"])
+        return normalize_rows(np.array([item["embedding"] for item in data], dtype=np.float32))
+
+def create_embedder(embeddings_config: Dict[str, Any]) -> Embedder:
+    """
+    Create the embedder selected by the ``embeddings`` config section.
+
+    Args:
+        embeddings_config (Dict[str, Any]): The ``embeddings`` config section
+
+    Returns:
+        Embedder: The configured embedder, the hashing embedder by default
+    """
+    provider = embeddings_config.get('provider', 'hashing')
+    dimension = embeddings_config.get('dimension', 256)
+
+    if provider == 'openai':
+        return OpenAIEmbedder(
+            model=embeddings_config.get('model', 'text-embedding-3-small'),
+            dimension=dimension,
+            api_key=os.getenv(embeddings_config.get('api_key_env_var', 'OPENAI_API_KEY')),
+            api_base=embeddings_config.get('api_base', 'https://api.openai.com/v1')
+        )
+
+    if provider != 'hashing':
+        logger.warning(f"Unknown embedding provider '{provider}', using the hashing embedder")
+    return HashingEmbedder(dimension=dimension)
@@ -0,0 +1,80 @@
+import datetime
+import logging
+from typing import Any, Dict, List, Tuple
+
+from ..database.operations import get_message_context
+
+logger = logging.getLogger('discord_bot.rag.expander')
+
+# A retrieved message and its conversation, oldest first
+ContextGroup = Tuple[Dict[str, Any], List[Dict[str, Any]]]
+
+class ContextExpander:
+    """
+    Expand retrieved messages into the conversations they belong to.
+
+    Each hit gets the messages it replies to, the first replies to it and
+    a few neighbouring messages from its channel, all fetched in a single
+    query. A message is only used once: when hits overlap, it stays with
+    the best-ranked hit, and a hit that is already part of a better-ranked
+    hit's conversation extends that conversation instead of starting its
+    own.
+    """
+
+    def __init__(self, window: int = 2, reply_depth: int = 5,
+                 max_gap: datetime.timedelta = datetime.timedelta(hours=1)):
+        """
+        Initialize the context expander.
+
+        Args:
+            window (int): Neighbouring messages and replies per hit and direction
+            reply_depth (int): Maximum number of messages followed up a reply chain
+            max_gap (datetime.timedelta): Maximum time between a hit and its neighbours or replies
+        """
+        self.window = window
+        self.reply_depth = reply_depth
+        self.max_gap = max_gap
+
+    async def expand(self, messages: List[Dict[str, Any]]) -> List[ContextGroup]:
+        """
+        Group retrieved messages with their conversational context.
+
+        Args:
+            messages (List[Dict[str, Any]]): Retrieved messages, most relevant first
+
+        Returns:
+            List[ContextGroup]: (hit, conversation) pairs in rank order; each conversation
+                includes its hit and is sorted by timestamp
+        """
+        related = await get_message_context(messages, self.window, self.reply_depth, self.max_gap)
+
+        related_by_hit: Dict[int, List[Dict[str, Any]]] = {}
+        for message in related:
+            related_by_hit.setdefault(message.pop('hit_id'), []).append(message)
+
+        groups: List[Tuple[Dict[str, Any], Dict[int, Dict[str, Any]]]] = []
+        # message_id -> index of the group the message was placed in
+        placed: Dict[int, int] = {}
+
+        for hit in messages:
+            hit_id = hit['message_id']
+            index = placed.get(hit_id)
+            if index is None:
+                index = placed[hit_id] = len(groups)
+                groups.append((hit, {}))
+            # Keep the retrieved record, which carries the ranking scores
+            groups[index][1][hit_id] = hit
+
+            for message in related_by_hit.get(hit_id, ()):
+                if message['message_id'] not in placed:
+                    placed[message['message_id']] = index
+                    groups[index][1][message['message_id']] = message
+
+        if related:
+            logger.debug(f"Expanded {len(messages)} messages into {len(groups)} conversations "
+                         f"of {len(placed)} messages")
+
+        return [
+            (hit, sorted(members.values(), key=lambda m: m['timestamp']))
+            for hit, members in groups
+        ]
@@ -1,73 +1,368 @@
 import logging
 import os
-from typing import Dict, Any, Optional
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Any, Optional
 import json
 import aiohttp
 
+from .scheduler import LLMScheduler, PRIORITY_NORMAL
+from ..utils.metrics import get_metrics
+
 logger = logging.getLogger('discord_bot.rag.generator')
 
+LLM_REQUEST_SECONDS = get_metrics().histogram(
+    'llm_request_seconds', 'Time taken by LLM API requests, including generation', ('mode',)
+)
+LLM_FIRST_TOKEN_SECONDS = get_metrics().histogram(
+    'llm_first_token_seconds', 'Time until the first piece of a streamed LLM response'
+)
+
+NOT_CONFIGURED_RESPONSE = "I'm unable to generate a response because the AI service is not configured properly."
+ERROR_RESPONSE = "I encountered an error while generating a response. Please try again later."
+INTERRUPTED_NOTE = "\n\n[Response interrupted]"
+
 class ResponseGenerator:
     """Generate responses using an LLM with retrieved context."""
     
-    def __init__(self, model: str = "gpt-3.5-turbo", api_key: Optional[str] = None):
+    def __init__(self, model: str = "gpt-3.5-turbo", api_key: Optional[str] = None,
+                 api_base: str = "https://api.openai.com/v1", connection_limit: int = 20,
+                 keepalive_timeout: float = 60.0, dns_cache_ttl: int = 300,
+                 connect_timeout: float = 10.0, request_timeout: float = 120.0,
+                 scheduler: Optional[LLMScheduler] = None, max_retries: int = 3):
         """
         Initialize the response generator.
         
         Args:
             model (str): The LLM model to use
             api_key (str, optional): API key for the LLM service
+            api_base (str): Base URL of the OpenAI-compatible API
+            connection_limit (int): Maximum number of open connections to the API
+            keepalive_timeout (float): Seconds an idle connection is kept open for reuse
+            dns_cache_ttl (int): Seconds a resolved API address is cached
+            connect_timeout (float): Seconds allowed to obtain a connection
+            request_timeout (float): Seconds allowed for a whole request, including generation
+            scheduler (LLMScheduler, optional): Limits and orders concurrent requests
+            max_retries (int): Times a rate limited request is retried
         """
         self.model = model
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             logger.warning("No OpenAI API key provided. Response generation will fail.")
+        self.api_base = api_base.rstrip('/')
+        self.connection_limit = connection_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = aiohttp.ClientTimeout(total=request_timeout, connect=connect_timeout)
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+        
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        self.requests = 0
+        self.failures = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.connect_seconds = 0.0
+        self.model_seconds = 0.0
+        self.last_connect_seconds = 0.0
+        self.last_model_seconds = 0.0
+        self.streams = 0
+        self.stream_fallbacks = 0
+        self.last_first_token_seconds = 0.0
+        self.retries = 0
+    
+    async def start(self) -> None:
+        """Open the HTTP session shared by all requests to the LLM API."""
+        if self._session is not None and not self._session.closed:
+            return
+        
+        connector = aiohttp.TCPConnector(
+            limit=self.connection_limit,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            trace_configs=[self._trace_config()]
+        )
+    
+    async def close(self) -> None:
+        """Close the HTTP session and its pooled connections."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+    
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        """
+        Create hooks that measure the time spent waiting for and opening connections.
+        
+        Connection time (pool wait, DNS, TCP and TLS) is added to the dict
+        passed as ``trace_request_ctx`` under 'connect'.
+        """
+        trace_config = aiohttp.TraceConfig()
+        
+        async def on_connection_start(session, context, params):
+            context.connection_started = time.perf_counter()
+        
+        async def on_connection_end(session, context, params):
+            if context.trace_request_ctx is not None:
+                context.trace_request_ctx['connect'] += time.perf_counter() - context.connection_started
+        
+        async def on_connection_create_end(session, context, params):
+            self.connections_opened += 1
+        
+        async def on_connection_reuseconn(session, context, params):
+            self.connections_reused += 1
+        
+        trace_config.on_connection_queued_start.append(on_connection_start)
+        trace_config.on_connection_queued_end.append(on_connection_end)
+        trace_config.on_connection_create_start.append(on_connection_start)
+        trace_config.on_connection_create_end.append(on_connection_end)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+    
+    @asynccontextmanager
+    async def _slot(self, guild_id: Optional[int], priority: int) -> AsyncIterator[None]:
+        """Hold a scheduler slot, if requests are scheduled, for the duration of the block."""
+        if self.scheduler is None:
+            yield
+            return
+        async with self.scheduler.slot(guild_id, priority):
+            yield
     
-    async def generate_response(self, prompt: str, temperature: float = 0.7) -> str:
+    def _should_retry(self, response: aiohttp.ClientResponse, attempt: int) -> bool:
+        """Report a response to the scheduler and check whether it is a rate limit worth retrying."""
+        if self.scheduler is not None:
+            self.scheduler.record_response(response.status, response.headers)
+        if response.status == 429 and attempt < self.max_retries:
+            logger.warning(f"Rate limited by the LLM API, retry {attempt + 1} of {self.max_retries}")
+            self.retries += 1
+            return True
+        return False
+    
+    def _headers(self) -> Dict[str, str]:
+        """Get the headers of an API request."""
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+    
+    def _payload(self, prompt: str, temperature: float, stream: bool = False) -> Dict[str, Any]:
+        """Get the body of a chat completion request."""
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": "You are a helpful assistant that answers questions based on Discord message history."},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": temperature,
+            "max_tokens": 1000
+        }
+        if stream:
+            payload["stream"] = True
+        return payload
+    
+    async def generate_response(self, prompt: str, temperature: float = 0.7,
+                                guild_id: Optional[int] = None, priority: int = PRIORITY_NORMAL) -> str:
         """
         Generate a response using the LLM.
         
         Args:
             prompt (str): The prompt for the LLM
             temperature (float): Creativity parameter
+            guild_id (int, optional): Discord server the response is for, used for fair scheduling
+            priority (int): Scheduling priority of the request
             
         Returns:
             str: Generated response
         """
         if not self.api_key:
-            return "I'm unable to generate a response because the AI service is not configured properly."
+            return NOT_CONFIGURED_RESPONSE
         
         logger.info("Generating response with LLM")
         
         try:
-            async with aiohttp.ClientSession() as session:
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.api_key}"
-                }
-                
-                payload = {
-                    "model": self.model,
-                    "messages": [
-                        {"role": "system", "content": "You are a helpful assistant that answers questions based on Discord message history."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "temperature": temperature,
-                    "max_tokens": 1000
-                }
-                
-                async with session.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Error from OpenAI API: {error_text}")
-                        return "I encountered an error while generating a response. Please try again later."
-                    
-                    result = await response.json()
-                    return result["choices"][0]["message"]["content"]
+            for attempt in range(self.max_retries + 1):
+                async with self._slot(guild_id, priority):
+                    timing = {'connect': 0.0}
+                    started = time.perf_counter()
+                    try:
+                        # Normally opened by the startup hook; opened here for standalone use
+                        await self.start()
+                        
+                        async with self._session.post(
+                            f"{self.api_base}/chat/completions",
+                            headers=self._headers(),
+                            json=self._payload(prompt, temperature),
+                            trace_request_ctx=timing
+                        ) as response:
+                            if self._should_retry(response, attempt):
+                                continue
+                            if response.status != 200:
+                                error_text = await response.text()
+                                logger.error(f"Error from OpenAI API: {error_text}")
+                                self.failures += 1
+                                return ERROR_RESPONSE
+                            
+                            result = await response.json()
+                            return result["choices"][0]["message"]["content"]
+                    finally:
+                        self._record_timing(time.perf_counter() - started, timing['connect'], 'complete')
         
         except Exception as e:
             logger.error(f"Error generating response: {str(e)}")
-            return "I encountered an error while generating a response. Please try again later."
+            self.failures += 1
+            return ERROR_RESPONSE
+    
+    async def stream_response(self, prompt: str, temperature: float = 0.7,
+                              guild_id: Optional[int] = None,
+                              priority: int = PRIORITY_NORMAL) -> AsyncIterator[str]:
+        """
+        Generate a response using the LLM, yielding text as soon as it is produced.
+        
+        Reads the server-sent events of a streaming completion. If the stream
+        fails before any text arrives, the response is generated again
+        without streaming and yielded in one piece.
+        
+        Args:
+            prompt (str): The prompt for the LLM
+            temperature (float): Creativity parameter
+            guild_id (int, optional): Discord server the response is for, used for fair scheduling
+            priority (int): Scheduling priority of the request
+            
+        Yields:
+            str: Consecutive pieces of the response
+        """
+        if not self.api_key:
+            yield NOT_CONFIGURED_RESPONSE
+            return
+        
+        logger.info("Streaming response from LLM")
+        
+        received = False
+        rate_limited = False
+        error = None
+        self.streams += 1
+        try:
+            for attempt in range(self.max_retries + 1):
+                async with self._slot(guild_id, priority):
+                    timing = {'connect': 0.0}
+                    started = time.perf_counter()
+                    try:
+                        await self.start()
+                        
+                        async with self._session.post(
+                            f"{self.api_base}/chat/completions",
+                            headers=self._headers(),
+                            json=self._payload(prompt, temperature, stream=True),
+                            trace_request_ctx=timing
+                        ) as response:
+                            if self._should_retry(response, attempt):
+                                continue
+                            if response.status != 200:
+                                rate_limited = response.status == 429
+                                error_text = await response.text()
+                                raise RuntimeError(f"Error from OpenAI API: {error_text}")
+                            
+                            async for line in response.content:
+                                line = line.strip()
+                                if not line.startswith(b"data:"):
+                                    continue
+                                data = line[len(b"data:"):].strip()
+                                if data == b"[DONE]":
+                                    break
+                                
+                                choices = json.loads(data).get("choices") or [{}]
+                                content = (choices[0].get("delta") or {}).get("content")
+                                if not content:
+                                    continue
+                                if not received:
+                                    received = True
+                                    self.last_first_token_seconds = time.perf_counter() - started
+                                    LLM_FIRST_TOKEN_SECONDS.observe(self.last_first_token_seconds)
+                                yield content
+                            break
+                    finally:
+                        self._record_timing(time.perf_counter() - started, timing['connect'], 'stream')
+        except Exception as e:
+            error = e
+        
+        if error is None:
+            return
+        
+        self.failures += 1
+        if received:
+            logger.error(f"Error streaming response: {str(error)}")
+            yield INTERRUPTED_NOTE
+            return
+        if rate_limited:
+            # Retrying without streaming would only wait out the same limit again
+            logger.error(f"Rate limit retries exhausted: {str(error)}")
+            yield ERROR_RESPONSE
+            return
+        
+        logger.warning(f"Streaming failed, retrying without streaming: {str(error)}")
+        self.stream_fallbacks += 1
+        yield await self.generate_response(prompt, temperature, guild_id, priority)
+    
+    def _record_timing(self, elapsed: float, connect: float, mode: str) -> None:
+        """Add the connection and model time of one request to the counters."""
+        LLM_REQUEST_SECONDS.labels(mode).observe(elapsed)
+        self.requests += 1
+        self.last_connect_seconds = connect
+        self.last_model_seconds = max(0.0, elapsed - connect)
+        self.connect_seconds += self.last_connect_seconds
+        self.model_seconds += self.last_model_seconds
+        logger.debug(f"LLM request took {elapsed:.2f}s ({connect:.3f}s connecting)")
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get request, connection and timing counters.
+        
+        Returns:
+            Dict[str, Any]: Counters; model time is everything after a connection was obtained
+        """
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'connections_opened': self.connections_opened,
+            'connections_reused': self.connections_reused,
+            'connect_seconds': round(self.connect_seconds, 3),
+            'model_seconds': round(self.model_seconds, 3),
+            'last_connect_seconds': round(self.last_connect_seconds, 3),
+            'last_model_seconds': round(self.last_model_seconds, 3),
+            'streams': self.streams,
+            'stream_fallbacks': self.stream_fallbacks,
+            'last_first_token_seconds': round(self.last_first_token_seconds, 3),
+            'retries': self.retries
+        }
+
+def create_generator(ai_config: Dict[str, Any]) -> ResponseGenerator:
+    """
+    Create a response generator from the ``ai`` config section.
+    
+    Args:
+        ai_config (Dict[str, Any]): The ``ai`` config section
+        
+    Returns:
+        ResponseGenerator: The configured generator; its session opens on first use
+    """
+    return ResponseGenerator(
+        model=ai_config.get('model', 'gpt-3.5-turbo'),
+        api_key=os.getenv(ai_config.get('api_key_env_var', 'OPENAI_API_KEY')),
+        api_base=ai_config.get('api_base', 'https://api.openai.com/v1'),
+        connection_limit=ai_config.get('connection_limit', 20),
+        keepalive_timeout=ai_config.get('keepalive_timeout', 60.0),
+        dns_cache_ttl=ai_config.get('dns_cache_ttl', 300),
+        connect_timeout=ai_config.get('connect_timeout', 10.0),
+        request_timeout=ai_config.get('request_timeout', 120.0),
+        scheduler=LLMScheduler(
+            max_concurrent=ai_config.get('max_concurrent_requests', 4),
+            base_backoff=ai_config.get('rate_limit_backoff', 1.0),
+            max_backoff=ai_config.get('rate_limit_max_backoff', 60.0)
+        ),
+        max_retries=ai_config.get('max_retries', 3)
+    )
@@ -0,0 +1,248 @@
+import datetime
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+from .retriever import MessageRetriever
+from .processor import ContextProcessor
+from .expander import ContextExpander
+from .generator import (
+    ResponseGenerator,
+    create_generator,
+    ERROR_RESPONSE,
+    NOT_CONFIGURED_RESPONSE,
+    INTERRUPTED_NOTE
+)
+from .cache import AnswerCache, get_answer_cache, question_key
+from .coalesce import SingleFlight
+from .scheduler import PRIORITY_NORMAL
+from .tokens import create_tokenizer
+from ..utils.metrics import get_metrics
+from ..utils.tracing import get_tracer
+
+logger = logging.getLogger('discord_bot.rag.pipeline')
+
+RETRIEVAL_SECONDS = get_metrics().histogram(
+    'retrieval_seconds', 'Time taken to retrieve the messages relevant to a question'
+)
+
+NO_CONTEXT_RESPONSE = "I couldn't find any relevant information in the server's message history to answer your question."
+
+class RAGPipeline:
+    """
+    Answer questions from server message history: retrieve, build the prompt, generate.
+
+    Shared by the prefix and slash ``ask`` commands. Answers are served from
+    the answer cache when the same question was answered before from the
+    same messages, and identical questions asked while an answer is being
+    generated share that answer.
+    """
+
+    def __init__(self, retriever: MessageRetriever, processor: ContextProcessor,
+                 generator: ResponseGenerator, cache: Optional[AnswerCache] = None,
+                 stream: bool = True, expander: Optional[ContextExpander] = None,
+                 coalesce: bool = True):
+        """
+        Initialize the pipeline.
+
+        Args:
+            retriever (MessageRetriever): Finds the messages relevant to a question
+            processor (ContextProcessor): Turns messages into the prompt
+            generator (ResponseGenerator): Generates the answer
+            cache (AnswerCache, optional): Cache of previous answers
+            stream (bool): Whether answers are streamed from the LLM
+            expander (ContextExpander, optional): Adds the surrounding conversation
+                to retrieved messages
+            coalesce (bool): Whether identical concurrent questions share one answer
+        """
+        self.retriever = retriever
+        self.processor = processor
+        self.generator = generator
+        self.cache = cache
+        self.stream = stream
+        self.expander = expander
+        self.flights = SingleFlight() if coalesce else None
+
+    async def start(self) -> None:
+        """Open the LLM session and subscribe the cache to message writes."""
+        await self.generator.start()
+        if self.cache is not None:
+            await self.cache.start()
+
+    async def close(self) -> None:
+        """Cancel the answers in flight and close the LLM session."""
+        if self.flights is not None:
+            await self.flights.close()
+        await self.generator.close()
+
+    async def answer_stream(self, guild_id: int, question: str, history: str = "",
+                            priority: int = PRIORITY_NORMAL) -> AsyncIterator[str]:
+        """
+        Answer a question, yielding the answer as it is generated.
+
+        Args:
+            guild_id (int): Discord server ID
+            question (str): The user's question
+            history (str): The user's recent conversation with the bot
+            priority (int): Scheduling priority of the LLM request; identical questions
+                in flight share the request of the first one
+
+        Yields:
+            str: Consecutive pieces of the answer; a cached answer comes in one piece
+        """
+        if self.flights is None:
+            pieces = self._answer_stream(guild_id, question, history, priority)
+        else:
+            pieces = self.flights.stream(
+                question_key(guild_id, question, history),
+                lambda: self._answer_stream(guild_id, question, history, priority)
+            )
+        async for piece in pieces:
+            yield piece
+
+    async def _answer_stream(self, guild_id: int, question: str, history: str,
+                             priority: int) -> AsyncIterator[str]:
+        """Answer a question from the cache or by retrieval and generation."""
+        tracer = get_tracer()
+        entry, vector = None, None
+        if self.cache is not None:
+            with tracer.span('rag.cache_lookup') as span:
+                entry, servable, vector = await self.cache.lookup(guild_id, question, history)
+                span.set_attribute('hit', servable)
+            if servable:
+                yield entry.answer
+                return
+
+        with tracer.span('rag.retrieve') as span:
+            started = time.perf_counter()
+            messages = await self.retriever.retrieve(guild_id, question)
+            RETRIEVAL_SECONDS.observe(time.perf_counter() - started)
+            span.set_attribute('messages', len(messages))
+        if not messages:
+            yield NO_CONTEXT_RESPONSE
+            return
+
+        # The cached answer is stale or to a similar question, but was
+        # generated from the messages retrieved now
+        if entry is not None and self.cache.revalidate(entry, messages,
+                                                       question_key(guild_id, question, history)):
+            yield entry.answer
+            return
+
+        if self.expander is not None:
+            with tracer.span('rag.expand'):
+                groups = await self.expander.expand(messages)
+            with tracer.span('rag.pack'):
+                context = self.processor.process_groups(groups)
+        else:
+            with tracer.span('rag.pack'):
+                context = self.processor.process_messages(messages)
+        with tracer.span('rag.prompt') as span:
+            prompt = self.processor.create_prompt_with_context(question, context)
+            if history:
+                prompt += f"\n\nRecent conversation history:\n{history}"
+            span.set_attribute('chars', len(prompt))
+
+        # Not entered: while streaming, the caller's spans run between the pieces
+        span = tracer.span('rag.generate', stream=self.stream)
+        try:
+            if self.stream:
+                pieces = []
+                async for piece in self.generator.stream_response(prompt, guild_id=guild_id, priority=priority):
+                    if not pieces:
+                        span.set_attribute('first_piece_ms', round(span.elapsed_ms(), 1))
+                    pieces.append(piece)
+                    yield piece
+                answer = "".join(pieces)
+            else:
+                answer = await self.generator.generate_response(prompt, guild_id=guild_id, priority=priority)
+        except Exception as e:
+            span.record_error(e)
+            raise
+        finally:
+            span.end()
+        if not self.stream:
+            yield answer
+
+        if self.cache is not None and answer not in (ERROR_RESPONSE, NOT_CONFIGURED_RESPONSE) \
+                and not answer.endswith(INTERRUPTED_NOTE):
+            self.cache.store(guild_id, question, history, answer, messages, vector)
+
+    async def answer(self, guild_id: int, question: str, history: str = "",
+                     priority: int = PRIORITY_NORMAL) -> str:
+        """
+        Answer a question.
+
+        Args:
+            guild_id (int): Discord server ID
+            question (str): The user's question
+            history (str): The user's recent conversation with the bot
+            priority (int): Scheduling priority of the LLM request
+
+        Returns:
+            str: The complete answer
+        """
+        return "".join([piece async for piece in self.answer_stream(guild_id, question, history, priority)])
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get counters for the pipeline.
+
+        Returns:
+            Dict[str, Any]: Request coalescing counters, empty if coalescing is disabled
+        """
+        return self.flights.stats() if self.flights is not None else {}
+
+# Pipeline singleton
+_rag_pipeline: Optional[RAGPipeline] = None
+
+def get_rag_pipeline() -> RAGPipeline:
+    """
+    Get or create the shared pipeline from the ``rag`` and ``ai`` config.
+
+    Returns:
+        RAGPipeline: The shared pipeline
+    """
+    global _rag_pipeline
+
+    if _rag_pipeline is None:
+        from ..utils.config import get_config
+
+        config = get_config()
+        rag_config = config.get('rag', {})
+        ai_config = config.get('ai', {})
+
+        retriever = MessageRetriever(
+            max_results=rag_config.get('max_context_messages', 20),
+            max_days=rag_config.get('max_context_days', 30),
+            rrf_k=rag_config.get('rrf_k', 60),
+            lexical_weight=rag_config.get('lexical_weight', 1.0),
+            semantic_weight=rag_config.get('semantic_weight', 1.0)
+        )
+        expander = None
+        if rag_config.get('expand_context', True):
+            expander = ContextExpander(
+                window=rag_config.get('context_window', 2),
+                reply_depth=rag_config.get('reply_chain_depth', 5),
+                max_gap=datetime.timedelta(minutes=rag_config.get('context_window_minutes', 60))
+            )
+        _rag_pipeline = RAGPipeline(
+            retriever,
+            ContextProcessor(
+                max_context_tokens=rag_config.get('max_context_tokens', 3000),
+                tokenizer=create_tokenizer(rag_config.get('tokenizer', 'approximate'))
+            ),
+            create_generator(ai_config),
+            cache=get_answer_cache(),
+            stream=ai_config.get('stream', True),
+            expander=expander,
+            coalesce=rag_config.get('coalesce_questions', True)
+        )
+
+        metrics = get_metrics()
+        metrics.add_collector('rag_pipeline', _rag_pipeline.stats)
+        metrics.add_collector('llm', _rag_pipeline.generator.stats)
+        if _rag_pipeline.generator.scheduler is not None:
+            metrics.add_collector('llm_scheduler', _rag_pipeline.generator.scheduler.stats)
+
+    return _rag_pipeline
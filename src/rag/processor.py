@@ -2,62 +2,156 @@ import logging
 from typing import List, Dict, Any, Optional
 import datetime
 
+from .tokens import ApproximateTokenizer, Tokenizer
+from .expander import ContextGroup
+
 logger = logging.getLogger('discord_bot.rag.processor')
 
 class ContextProcessor:
     """Process retrieved messages into a suitable context format for the LLM."""
     
-    def __init__(self, max_context_length: int = 4000):
+    def __init__(self, max_context_tokens: int = 3000, tokenizer: Optional[Tokenizer] = None):
         """
         Initialize the context processor.
         
         Args:
-            max_context_length (int): Maximum token length for the context
+            max_context_tokens (int): Maximum number of tokens in the context
+            tokenizer (Tokenizer, optional): Token counter, defaults to the fast approximation
+        """
+        self.max_context_tokens = max_context_tokens
+        self.tokenizer = tokenizer or ApproximateTokenizer()
+        # Tokens of the timestamp and punctuation around each message
+        self._header_tokens = self.tokenizer.count("[2024-01-01 00:00:00]  in #: ")
+        self._name_tokens: Dict[str, int] = {}
+    
+    def _count_name(self, name: str) -> int:
+        """Count the tokens of an author or channel name, which repeat across messages."""
+        tokens = self._name_tokens.get(name)
+        if tokens is None:
+            if len(self._name_tokens) > 10000:
+                self._name_tokens.clear()
+            tokens = self._name_tokens[name] = self.tokenizer.count(name)
+        return tokens
+    
+    def _message_tokens(self, message: Dict[str, Any]) -> int:
+        """Count the tokens of a formatted message, including its trailing newline."""
+        return (self._header_tokens + 1
+                + self._count_name(message['author_name'] or '')
+                + self._count_name(message['channel_name'] or '')
+                + self.tokenizer.count(message['content'] or "[No text content]"))
+    
+    def _format_message(self, message: Dict[str, Any]) -> str:
+        """Format a message as a context line."""
+        timestamp = message['timestamp'].strftime("%Y-%m-%d %H:%M:%S") if message['timestamp'] else "Unknown time"
+        content = message['content'] or "[No text content]"
+        return f"[{timestamp}] {message['author_name']} in #{message['channel_name']}: {content}"
+    
+    def pack_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Select the best-ranked messages that fit in the token budget.
+        
+        Messages are taken in rank order while they fit; a message too large
+        for the remaining budget is skipped rather than cut, so smaller
+        lower-ranked messages can still fill the space.
+        
+        Args:
+            messages (List[Dict[str, Any]]): Message records, most relevant first
+            
+        Returns:
+            List[Dict[str, Any]]: The selected messages, oldest first
         """
-        self.max_context_length = max_context_length
+        budget = self.max_context_tokens
+        selected = []
+        message_tokens = self._message_tokens
+        # Even an empty message needs its header and newline
+        fixed_tokens = self._header_tokens + 1
+        
+        for message in messages:
+            tokens = message_tokens(message)
+            if tokens <= budget:
+                selected.append(message)
+                budget -= tokens
+                if budget <= fixed_tokens:
+                    break
+        
+        if len(selected) < len(messages):
+            logger.debug(f"Packed {len(selected)} of {len(messages)} messages into "
+                         f"{self.max_context_tokens - budget} tokens")
+        
+        return sorted(selected, key=lambda m: m['timestamp'])
     
     def process_messages(self, messages: List[Dict[str, Any]]) -> str:
         """
         Process retrieved messages into a context string.
         
         Args:
-            messages (List[Dict[str, Any]]): List of message records
+            messages (List[Dict[str, Any]]): List of message records, most relevant first
             
         Returns:
-            str: Formatted context string
+            str: Formatted context string of the messages that fit the token budget,
+                in chronological order
         """
         if not messages:
             return "No relevant message history found."
         
-        # Sort messages by timestamp (oldest first)
-        sorted_messages = sorted(messages, key=lambda m: m['timestamp'])
+        context_parts = [self._format_message(message) for message in self.pack_messages(messages)]
+        
+        if not context_parts:
+            return "No relevant message history found."
+        return "\n".join(context_parts)
+    
+    def pack_groups(self, groups: List[ContextGroup]) -> List[List[Dict[str, Any]]]:
+        """
+        Select the best-ranked conversations that fit in the token budget.
         
-        # Format messages into context
-        context_parts = []
+        Conversations are taken whole in rank order while they fit. When a
+        conversation does not fit, its retrieved message is taken on its own
+        if that fits, so a long thread never crowds out the hit itself.
         
-        for message in sorted_messages:
-            # Format timestamp
-            timestamp = message['timestamp'].strftime("%Y-%m-%d %H:%M:%S") if message['timestamp'] else "Unknown time"
-            
-            # Format message
-            author = message['author_name']
-            channel = message['channel_name']
-            content = message['content'] or "[No text content]"
+        Args:
+            groups (List[ContextGroup]): (hit, conversation) pairs, most relevant first
             
-            # Create formatted message entry
-            formatted_message = f"[{timestamp}] {author} in #{channel}: {content}"
-            context_parts.append(formatted_message)
+        Returns:
+            List[List[Dict[str, Any]]]: The selected conversations, each oldest first,
+                ordered by their first message
+        """
+        budget = self.max_context_tokens
+        selected = []
+        
+        for hit, members in groups:
+            # One more token for the blank line between conversations
+            tokens = 1 + sum(self._message_tokens(message) for message in members)
+            if tokens > budget:
+                members = [hit]
+                tokens = 1 + self._message_tokens(hit)
+            if tokens <= budget:
+                selected.append(members)
+                budget -= tokens
         
-        # Join messages and truncate if needed
-        context = "\n".join(context_parts)
+        logger.debug(f"Packed {len(selected)} of {len(groups)} conversations into "
+                     f"{self.max_context_tokens - budget} tokens")
         
-        # Simple truncation strategy - in a production system, you'd want
-        # to use a proper tokenizer to ensure you don't exceed token limits
-        if len(context) > self.max_context_length:
-            # Truncate and add indicator
-            context = context[:self.max_context_length - 100] + "\n[Context truncated due to length...]"
+        return sorted(selected, key=lambda members: members[0]['timestamp'])
+    
+    def process_groups(self, groups: List[ContextGroup]) -> str:
+        """
+        Process retrieved messages grouped into conversations into a context string.
+        
+        Args:
+            groups (List[ContextGroup]): (hit, conversation) pairs, most relevant first
+            
+        Returns:
+            str: Formatted context string of the conversations that fit the token budget,
+                separated by blank lines, in chronological order
+        """
+        conversations = self.pack_groups(groups)
+        if not conversations:
+            return "No relevant message history found."
         
-        return context
+        return "\n\n".join(
+            "\n".join(self._format_message(message) for message in members)
+            for members in conversations
+        )
     
     def create_prompt_with_context(self, query: str, context: str) -> str:
         """
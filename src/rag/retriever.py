@@ -1,53 +1,139 @@
+import asyncio
 import logging
 import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
-from ..database.operations import get_messages_by_content, get_messages_for_rag
+from ..database.operations import get_messages_by_content, get_messages_for_rag, get_messages_by_ids
+from .semantic import SemanticIndex, get_semantic_index
 
 logger = logging.getLogger('discord_bot.rag.retriever')
 
 class MessageRetriever:
     """Retrieves relevant messages from the database based on user queries."""
     
-    def __init__(self, max_results: int = 20, max_days: Optional[int] = 30):
+    def __init__(self, max_results: int = 20, max_days: Optional[int] = 30,
+                 semantic_index: Optional[SemanticIndex] = None, min_similarity: float = 0.1,
+                 rrf_k: int = 60, lexical_weight: float = 1.0, semantic_weight: float = 1.0):
         """
         Initialize the message retriever.
         
         Args:
             max_results (int): Maximum number of messages to retrieve
             max_days (int, optional): Only consider messages from the last X days
+            semantic_index (SemanticIndex, optional): Index for semantic search,
+                defaults to the shared one once it has loaded
+            min_similarity (float): Cosine similarity below which semantic matches are ignored
+            rrf_k (int): Reciprocal rank fusion constant; higher values flatten the
+                advantage of top-ranked results
+            lexical_weight (float): Weight of full-text search results in the fusion
+            semantic_weight (float): Weight of semantic search results in the fusion
         """
         self.max_results = max_results
         self.max_days = max_days
+        self.semantic_index = semantic_index
+        self.min_similarity = min_similarity
+        self.rrf_k = rrf_k
+        self.lexical_weight = lexical_weight
+        self.semantic_weight = semantic_weight
     
     async def retrieve(self, guild_id: int, query: str) -> List[Dict[str, Any]]:
         """
         Retrieve relevant messages for the given query.
         
+        Full-text search (best for exact terms such as error codes and names)
+        and semantic search (best for paraphrases) run concurrently, and their
+        rankings are combined with reciprocal rank fusion.
+        
         Args:
             guild_id (int): Discord server ID
             query (str): User's question or query
             
         Returns:
-            List[Dict[str, Any]]: List of relevant messages
+            List[Dict[str, Any]]: Relevant messages with a 'fused_score', best first
         """
         logger.info(f"Retrieving context for query: {query}")
         
         try:
-            # Use the specialized RAG query function
-            messages = await get_messages_for_rag(
-                guild_id=guild_id,
-                query=query,
-                max_results=self.max_results,
-                max_days=self.max_days
+            lexical, semantic = await asyncio.gather(
+                get_messages_for_rag(
+                    guild_id=guild_id,
+                    query=query,
+                    max_results=self.max_results,
+                    max_days=self.max_days
+                ),
+                self.retrieve_semantic(guild_id, query)
             )
             
-            logger.info(f"Retrieved {len(messages)} messages as context")
+            messages = self._fuse([(self.lexical_weight, lexical), (self.semantic_weight, semantic)])
+            
+            logger.info(f"Retrieved {len(messages)} messages as context "
+                        f"({len(lexical)} lexical, {len(semantic)} semantic)")
             return messages
         except Exception as e:
             logger.error(f"Error retrieving messages for RAG: {str(e)}")
             return []
     
+    async def retrieve_semantic(self, guild_id: int, query: str) -> List[Dict[str, Any]]:
+        """
+        Retrieve the messages most similar in meaning to the query.
+        
+        Args:
+            guild_id (int): Discord server ID
+            query (str): User's question or query
+            
+        Returns:
+            List[Dict[str, Any]]: Messages with a 'similarity' score, most similar
+                first; empty if no semantic index is ready
+        """
+        index = self.semantic_index or get_semantic_index()
+        if index is None or not index.ready:
+            return []
+        
+        try:
+            hits = await index.search(guild_id, query, k=self.max_results, max_days=self.max_days)
+            hits = [(message_id, score) for message_id, score in hits if score >= self.min_similarity]
+            if not hits:
+                return []
+            
+            scores = dict(hits)
+            messages = await get_messages_by_ids(list(scores))
+            for message in messages:
+                message['similarity'] = scores[message['message_id']]
+            
+            return sorted(messages, key=lambda m: m['similarity'], reverse=True)
+        except Exception as e:
+            logger.error(f"Error retrieving similar messages: {str(e)}")
+            return []
+    
+    def _fuse(self, rankings: List[Tuple[float, List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """
+        Combine ranked result lists with weighted reciprocal rank fusion.
+        
+        A message scores ``weight / (rrf_k + position)`` in each list it
+        appears in; the scores are summed, so messages found by both searches
+        rise to the top. Only positions are used, as full-text ranks and
+        cosine similarities are not comparable.
+        
+        Args:
+            rankings (List[Tuple[float, List[Dict[str, Any]]]]): (weight, results) pairs,
+                each list best first
+            
+        Returns:
+            List[Dict[str, Any]]: Up to max_results messages with a 'fused_score', best first
+        """
+        fused: Dict[int, Dict[str, Any]] = {}
+        for weight, results in rankings:
+            if weight <= 0:
+                continue
+            for position, message in enumerate(results, start=1):
+                entry = fused.setdefault(message['message_id'], {'fused_score': 0.0})
+                # Keep the scores of every list the message was found by
+                entry.update(message)
+                entry['fused_score'] += weight / (self.rrf_k + position)
+        
+        messages = sorted(fused.values(), key=lambda m: m['fused_score'], reverse=True)
+        return messages[:self.max_results]
+    
     def filter_by_relevance(self, messages: List[Dict[str, Any]], query: str) -> List[Dict[str, Any]]:
         """
         Further filter messages by relevance to the query.
@@ -59,7 +145,9 @@ class MessageRetriever:
         Returns:
             List[Dict[str, Any]]: Filtered list of messages
         """
-        # If we already have ranking from the database, we can just use that
+        # If we already have ranking from retrieval, we can just use that
+        if messages and 'fused_score' in messages[0]:
+            return sorted(messages, key=lambda m: m['fused_score'], reverse=True)
         if messages and 'rank' in messages[0]:
             return sorted(messages, key=lambda m: m['rank'], reverse=True)
         
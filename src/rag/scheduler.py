@@ -0,0 +1,304 @@
+import asyncio
+import datetime
+import logging
+import re
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Deque, Dict, List, Mapping, Optional
+
+from ..utils.metrics import get_metrics
+
+logger = logging.getLogger('discord_bot.rag.scheduler')
+
+LLM_QUEUE_SECONDS = get_metrics().histogram(
+    'llm_queue_seconds', 'Time LLM requests waited for a slot', ('priority',)
+)
+
+# Request priorities, most urgent first
+PRIORITY_HIGH = 0    # slash commands and server admins
+PRIORITY_NORMAL = 1  # prefix commands
+PRIORITY_LOW = 2     # questions asked by mentioning the bot
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+_PRIORITY_NAMES = ('high', 'normal', 'low')
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a rate limit reset duration such as '20ms', '1s' or '6m0s'.
+
+    Args:
+        value (str, optional): Header value
+
+    Returns:
+        Optional[float]: Seconds, or None if the value is missing or malformed
+    """
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Get how long the API asked to wait before the next request.
+
+    Understands ``retry-after-ms``, ``Retry-After`` in seconds or as an
+    HTTP date, and the OpenAI ``x-ratelimit-reset-*`` headers of exhausted
+    limits.
+
+    Args:
+        headers (Mapping[str, str]): Response headers, looked up case-insensitively
+
+    Returns:
+        Optional[float]: Seconds to wait, or None if the response does not say
+    """
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get('Retry-After')
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(value)
+                return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+
+    resets = [
+        parse_duration(headers.get(f'x-ratelimit-reset-{limit}'))
+        for limit in ('requests', 'tokens')
+        if headers.get(f'x-ratelimit-remaining-{limit}') == '0'
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+class LLMScheduler:
+    """
+    Limit concurrent LLM requests and decide who goes next.
+
+    Requests beyond the concurrency limit wait in one queue per priority.
+    Within a priority, guilds take turns, so a burst of questions in one
+    server does not hold up the others.
+
+    Rate limit responses pause all new requests for as long as the API asks,
+    or for an exponentially growing backoff when it does not say, and halve
+    the concurrency limit. Successful responses reset the backoff and
+    slowly raise the limit back to its maximum.
+    """
+
+    def __init__(self, max_concurrent: int = 4, base_backoff: float = 1.0, max_backoff: float = 60.0):
+        """
+        Initialize the scheduler.
+
+        Args:
+            max_concurrent (int): Maximum number of requests in flight
+            base_backoff (float): Seconds to pause after a rate limit without Retry-After
+            max_backoff (float): Longest pause after repeated rate limits
+        """
+        self.max_concurrent = max_concurrent
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        # Fractional so that successes can raise it gradually
+        self._limit = float(max_concurrent)
+        self._active = 0
+        # One queue per priority: guild ID -> its waiters, guilds in turn order
+        self._queues: List[OrderedDict] = [OrderedDict() for _ in PRIORITIES]
+        self._waiting = 0
+        self._paused_until = 0.0
+        self._resume_handle: Optional[asyncio.TimerHandle] = None
+        self._backoff = 0.0
+
+        # Counters
+        self.granted = 0
+        self.queued = 0
+        self.rate_limited = 0
+        self.max_queue_depth = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.last_wait_seconds = 0.0
+
+    @property
+    def limit(self) -> int:
+        """Current number of requests allowed in flight."""
+        return max(1, int(self._limit))
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of requests waiting for a slot."""
+        return self._waiting
+
+    def _can_start(self) -> bool:
+        """Check whether another request may start now."""
+        return self._active < self.limit and time.monotonic() >= self._paused_until
+
+    @asynccontextmanager
+    async def slot(self, guild_id: Optional[int] = None, priority: int = PRIORITY_NORMAL) -> AsyncIterator[None]:
+        """
+        Hold a request slot for the duration of the block.
+
+        Args:
+            guild_id (int, optional): Discord server the request is for
+            priority (int): One of PRIORITY_HIGH, PRIORITY_NORMAL and PRIORITY_LOW
+        """
+        await self.acquire(guild_id, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, guild_id: Optional[int] = None, priority: int = PRIORITY_NORMAL) -> None:
+        """
+        Wait for a request slot.
+
+        Args:
+            guild_id (int, optional): Discord server the request is for
+            priority (int): One of PRIORITY_HIGH, PRIORITY_NORMAL and PRIORITY_LOW
+        """
+        started = time.monotonic()
+        if not self._waiting and self._can_start():
+            self._active += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            queue = self._queues[priority]
+            queue.setdefault(guild_id, deque()).append(future)
+            self._waiting += 1
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._waiting)
+            self._schedule_resume()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Granted just before the caller gave up: pass the slot on
+                    self.release()
+                else:
+                    self._discard(queue, guild_id, future)
+                raise
+
+        self.granted += 1
+        self.last_wait_seconds = time.monotonic() - started
+        self.wait_seconds += self.last_wait_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, self.last_wait_seconds)
+        LLM_QUEUE_SECONDS.labels(_PRIORITY_NAMES[priority]).observe(self.last_wait_seconds)
+
+    def release(self) -> None:
+        """Return a request slot and start the next waiting request."""
+        self._active -= 1
+        self._dispatch()
+
+    def _discard(self, queue: OrderedDict, guild_id: Optional[int], future: asyncio.Future) -> None:
+        """Remove a cancelled waiter from its queue."""
+        waiters: Optional[Deque[asyncio.Future]] = queue.get(guild_id)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            self._waiting -= 1
+            if not waiters:
+                del queue[guild_id]
+
+    def _next_waiter(self) -> asyncio.Future:
+        """Take the next waiter: most urgent priority first, guilds in turn."""
+        for queue in self._queues:
+            if queue:
+                guild_id, waiters = next(iter(queue.items()))
+                future = waiters.popleft()
+                if waiters:
+                    queue.move_to_end(guild_id)
+                else:
+                    del queue[guild_id]
+                self._waiting -= 1
+                return future
+        raise LookupError("No request is waiting")
+
+    def _dispatch(self) -> None:
+        """Start waiting requests while slots are free."""
+        while self._waiting and self._can_start():
+            self._active += 1
+            self._next_waiter().set_result(None)
+        self._schedule_resume()
+
+    def _schedule_resume(self) -> None:
+        """Make sure waiting requests start when a pause ends."""
+        delay = self._paused_until - time.monotonic()
+        if self._waiting and delay > 0 and self._resume_handle is None:
+            self._resume_handle = asyncio.get_running_loop().call_later(delay, self._resume)
+
+    def _resume(self) -> None:
+        """Start waiting requests at the end of a pause."""
+        self._resume_handle = None
+        self._dispatch()
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hold back new requests.
+
+        Args:
+            seconds (float): How long no request may start
+        """
+        paused_until = time.monotonic() + seconds
+        if paused_until > self._paused_until:
+            self._paused_until = paused_until
+            if self._resume_handle is not None:
+                self._resume_handle.cancel()
+                self._resume_handle = None
+            self._schedule_resume()
+
+    def record_response(self, status: int, headers: Mapping[str, str]) -> None:
+        """
+        Adapt to the rate limit information of an API response.
+
+        Args:
+            status (int): HTTP status of the response
+            headers (Mapping[str, str]): Response headers
+        """
+        if status == 429:
+            self.rate_limited += 1
+            delay = parse_retry_after(headers)
+            if delay is None:
+                self._backoff = min(self.max_backoff, self._backoff * 2 or self.base_backoff)
+                delay = self._backoff
+            self._limit = max(1.0, self._limit / 2)
+            logger.warning(f"LLM API rate limit reached, pausing requests for {delay:.1f}s "
+                           f"with at most {self.limit} in flight")
+            self.pause(delay)
+        elif status < 400:
+            self._backoff = 0.0
+            # One more concurrent request for every `limit` successes
+            self._limit = min(float(self.max_concurrent), self._limit + 1 / self._limit)
+            # Out of requests or tokens for this window: wait for the reset
+            delay = parse_retry_after(headers)
+            if delay:
+                self.pause(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get counters for request scheduling.
+
+        Returns:
+            Dict[str, Any]: Slots in use, queue depth and wait times
+        """
+        return {
+            'in_flight': self._active,
+            'limit': self.limit,
+            'queue_depth': self._waiting,
+            'max_queue_depth': self.max_queue_depth,
+            'granted': self.granted,
+            'queued': self.queued,
+            'rate_limited': self.rate_limited,
+            'paused_seconds': round(max(0.0, self._paused_until - time.monotonic()), 3),
+            'wait_seconds': round(self.wait_seconds, 3),
+            'mean_wait_seconds': round(self.wait_seconds / self.granted, 3) if self.granted else 0.0,
+            'max_wait_seconds': round(self.max_wait_seconds, 3),
+            'last_wait_seconds': round(self.last_wait_seconds, 3)
+        }
@@ -0,0 +1,449 @@
+import asyncio
+import datetime
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from ..database.connection import execute_query
+from ..database.models import MESSAGE_COLUMNS
+from ..database.operations import (
+    add_store_listener,
+    store_embeddings,
+    get_embeddings,
+    get_messages_without_embeddings
+)
+from .embeddings import Embedder, create_embedder
+from .vector_index import VectorIndex
+from .ann_index import IVFVectorIndex
+
+logger = logging.getLogger('discord_bot.rag.semantic')
+
+# Embeddings stored less than this long before an index build may not be in
+# it yet; they are loaded again from the database after a restart
+REBUILD_MARGIN = datetime.timedelta(minutes=5)
+
+# Positions of the fields needed for embedding within a message record
+_ID = MESSAGE_COLUMNS.index('message_id')
+_GUILD = MESSAGE_COLUMNS.index('guild_id')
+_CONTENT = MESSAGE_COLUMNS.index('content')
+_TIMESTAMP = MESSAGE_COLUMNS.index('timestamp')
+
+class SemanticIndex:
+    """
+    Embeddings of stored messages, persisted in ``message_embeddings`` and
+    searched through an exact VectorIndex or an approximate IVFVectorIndex.
+
+    Once started, the index loads the stored embeddings in the background
+    and embeds every message written afterwards, whether through the
+    BulkWriter or ``store_message``. Written messages are put on a bounded
+    queue drained by a worker task, so writes never wait on the embedder;
+    failed batches are retried with exponential backoff. Messages stored
+    before embeddings existed, or dropped from a full queue, are embedded
+    by :meth:`backfill`. With an IVFVectorIndex,
+    large guilds are periodically rebuilt into saved segments in the
+    background, and only embeddings written since are loaded at startup.
+    """
+
+    def __init__(self, embedder: Embedder, batch_size: int = 256, initial_capacity: int = 1024,
+                 index: Optional[Union[VectorIndex, IVFVectorIndex]] = None,
+                 queue_size: int = 10000, max_retries: int = 5, retry_delay: float = 1.0):
+        """
+        Initialize the semantic index.
+
+        Args:
+            embedder (Embedder): Embedder used for messages and queries
+            batch_size (int): Maximum number of texts per embedding call
+            initial_capacity (int): Vectors allocated per guild before growing
+            index (VectorIndex or IVFVectorIndex, optional): Vector index to use,
+                defaults to an exact VectorIndex
+            queue_size (int): Maximum number of written messages waiting to be embedded
+            max_retries (int): Retries of a failed batch before giving up on it
+            retry_delay (float): Seconds before the first retry, doubled for each further one
+        """
+        self.embedder = embedder
+        self.batch_size = max(1, batch_size)
+        self.index = index if index is not None else VectorIndex(embedder.dimension, initial_capacity=initial_capacity)
+        self.queue_size = queue_size
+        self.max_retries = max(0, max_retries)
+        self.retry_delay = retry_delay
+
+        self.ready = False
+        self._load_task: Optional[asyncio.Task] = None
+        self._rebuild_tasks: Dict[int, asyncio.Task] = {}
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._worker: Optional[asyncio.Task] = None
+
+        self.embedded = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retries = 0
+        self.load_seconds = 0.0
+
+    async def start(self) -> None:
+        """Subscribe to message writes and load the stored embeddings in the background."""
+        from ..database.bulk import get_bulk_writer
+
+        if self._load_task is not None:
+            return
+
+        await self.embedder.start()
+        self._worker = asyncio.create_task(self._embed_loop())
+        writer = await get_bulk_writer()
+        writer.add_flush_listener(self.index_records)
+        add_store_listener(self.index_records)
+        self._load_task = asyncio.create_task(self.load())
+
+    async def drain(self, timeout: Optional[float] = 30.0) -> None:
+        """
+        Wait until every queued message has been embedded or given up on.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the queue to drain
+        """
+        try:
+            if self._worker is not None and not self._worker.done():
+                await asyncio.wait_for(self._queue.join(), timeout)
+            else:
+                # No worker running (never started or crashed), drain inline
+                while not self._queue.empty():
+                    await self._embed_next()
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out draining embedding queue, {self._queue.qsize()} message(s) not embedded")
+
+    async def close(self, timeout: Optional[float] = 30.0) -> None:
+        """
+        Embed what is still queued, stop all tasks and release the embedder's resources.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the embedding queue to drain
+        """
+        await self.drain(timeout)
+        tasks = [task for task in [self._worker, self._load_task, *self._rebuild_tasks.values()]
+                 if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker = None
+        await self.embedder.close()
+
+    async def load(self, page_size: int = 10000) -> int:
+        """
+        Load every stored embedding of the current embedder into memory.
+
+        Args:
+            page_size (int): Embeddings read per query
+
+        Returns:
+            int: Number of embeddings loaded
+        """
+        started = time.monotonic()
+        loaded = 0
+        after_id = -1
+
+        # Saved segments already hold everything stored before they were built
+        updated_after = None
+        indexed_guild_ids = []
+        if isinstance(self.index, IVFVectorIndex):
+            updated_after = await asyncio.to_thread(self.index.load_saved)
+            indexed_guild_ids = self.index.segment_guild_ids()
+
+        while True:
+            rows = await get_embeddings(self.embedder.name, after_id, page_size,
+                                        updated_after, indexed_guild_ids)
+            if not rows:
+                break
+
+            vectors = np.stack([np.frombuffer(row['embedding'], dtype='<f4') for row in rows])
+            await asyncio.to_thread(
+                self.index.add,
+                [row['message_id'] for row in rows],
+                vectors,
+                [row['guild_id'] for row in rows],
+                [row['timestamp'].timestamp() for row in rows]
+            )
+            loaded += len(rows)
+            after_id = rows[-1]['message_id']
+
+        self.ready = True
+        self.load_seconds = time.monotonic() - started
+        logger.info(f"Loaded {loaded} {self.embedder.name} embeddings in {self.load_seconds:.1f}s")
+        self._schedule_rebuilds()
+        return loaded
+
+    def _schedule_rebuilds(self) -> None:
+        """Start background rebuilds for guilds whose recent vectors outgrew the exact delta."""
+        if not self.ready or not isinstance(self.index, IVFVectorIndex):
+            return
+
+        for guild_id in self.index.guilds_to_rebuild():
+            if guild_id not in self._rebuild_tasks:
+                self._rebuild_tasks[guild_id] = asyncio.create_task(self._rebuild(guild_id))
+
+    async def _rebuild(self, guild_id: int) -> None:
+        """Rebuild and save the index segment of one guild."""
+        try:
+            now = await execute_query("SELECT CURRENT_TIMESTAMP", fetch_val=True)
+            await self.index.rebuild(guild_id, built_at=now - REBUILD_MARGIN)
+        except Exception as e:
+            logger.error(f"Error rebuilding vector index for guild {guild_id}: {str(e)}")
+        finally:
+            self._rebuild_tasks.pop(guild_id, None)
+
+    async def index_records(self, records: List[Tuple]) -> None:
+        """
+        Queue freshly written messages for embedding, without waiting.
+
+        Called by every BulkWriter flush and ``store_message``. When the
+        queue is full the messages are dropped and counted; they are
+        embedded by the next :meth:`backfill`.
+
+        Args:
+            records (List[Tuple]): Message records in MESSAGE_COLUMNS order
+        """
+        for record in records:
+            content = record[_CONTENT]
+            if not content or not content.strip():
+                continue
+            try:
+                self._queue.put_nowait((record[_ID], record[_GUILD], record[_TIMESTAMP], content))
+            except asyncio.QueueFull:
+                self.dropped += 1
+                # Log the first drop and then every thousandth to avoid flooding the log
+                if self.dropped == 1 or self.dropped % 1000 == 0:
+                    logger.warning(f"Embedding queue full ({self.queue_size}), {self.dropped} message(s) "
+                                   f"dropped so far; run setup_db.py --embed to embed them")
+
+    async def _embed_loop(self) -> None:
+        """Embed queued messages in batches until cancelled."""
+        while True:
+            try:
+                await self._embed_next()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in embedding worker: {str(e)}")
+
+    async def _embed_next(self) -> None:
+        """Embed up to batch_size queued messages, retrying failures with backoff."""
+        batch = [await self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await self._index_batch(batch)
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        self.failed += len(batch)
+                        logger.error(f"Giving up embedding {len(batch)} messages after "
+                                     f"{attempt + 1} attempts: {str(e)}")
+                        return
+                    self.retries += 1
+                    delay = self.retry_delay * 2 ** attempt
+                    logger.warning(f"Error embedding {len(batch)} messages, retrying in {delay:.1f}s: {str(e)}")
+                    await asyncio.sleep(delay)
+
+            self.embedded += len(batch)
+            self._schedule_rebuilds()
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _index_batch(self, batch: List[Tuple[int, int, datetime.datetime, str]]) -> None:
+        """
+        Embed, store and index one batch of (message ID, guild ID, timestamp, content) items.
+
+        Raises:
+            Exception: If embedding or storing the batch failed
+        """
+        vectors = await self.embedder.embed([item[3] for item in batch])
+
+        records = [
+            (message_id, guild_id, timestamp, self.embedder.name, vector.astype('<f4').tobytes())
+            for (message_id, guild_id, timestamp, _), vector in zip(batch, vectors)
+        ]
+        if not await store_embeddings(records):
+            raise RuntimeError(f"Could not store {len(records)} embeddings")
+
+        # Waits for searches of the index, so off the event loop too
+        await asyncio.to_thread(
+            self.index.add,
+            [item[0] for item in batch],
+            vectors,
+            [item[1] for item in batch],
+            [item[2].timestamp() for item in batch]
+        )
+
+    async def index_messages(self, message_ids: Sequence[int], guild_ids: Sequence[int],
+                             timestamps: Sequence[datetime.datetime], contents: Sequence[str]) -> int:
+        """
+        Embed, store and index messages, skipping those without text.
+
+        Args:
+            message_ids (Sequence[int]): Message IDs
+            guild_ids (Sequence[int]): Guild of each message
+            timestamps (Sequence[datetime.datetime]): Creation time of each message
+            contents (Sequence[str]): Text of each message
+
+        Returns:
+            int: Number of messages embedded
+        """
+        items = [
+            (message_id, guild_id, timestamp, content)
+            for message_id, guild_id, timestamp, content in zip(message_ids, guild_ids, timestamps, contents)
+            if content and content.strip()
+        ]
+
+        embedded = 0
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            try:
+                await self._index_batch(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                logger.error(f"Error embedding {len(batch)} messages: {str(e)}")
+                continue
+            embedded += len(batch)
+
+        self.embedded += embedded
+        self._schedule_rebuilds()
+        return embedded
+
+    async def backfill(self, batch_size: int = 1000) -> int:
+        """
+        Embed stored messages that have no embedding from the current embedder.
+
+        Args:
+            batch_size (int): Messages read per query
+
+        Returns:
+            int: Number of messages embedded
+        """
+        total = 0
+        after_id = -1
+
+        while True:
+            rows = await get_messages_without_embeddings(self.embedder.name, after_id, batch_size)
+            if not rows:
+                break
+
+            total += await self.index_messages(
+                [row['message_id'] for row in rows],
+                [row['guild_id'] for row in rows],
+                [row['timestamp'] for row in rows],
+                [row['content'] for row in rows]
+            )
+            after_id = rows[-1]['message_id']
+            logger.info(f"Embedded {total} messages (up to message {after_id})")
+
+        logger.info(f"Embedding backfill complete, {total} messages embedded")
+        return total
+
+    async def search(self, guild_id: int, query: str, k: int = 20,
+                     max_days: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Find the messages of a guild most similar in meaning to a query.
+
+        Args:
+            guild_id (int): Discord server ID
+            query (str): The user's query text
+            k (int): Maximum number of results
+            max_days (int, optional): Only consider messages from the last X days
+
+        Returns:
+            List[Tuple[int, float]]: (message_id, cosine similarity) pairs, most similar first
+        """
+        vector = await self.embedder.embed_query(query)
+
+        min_timestamp = None
+        if max_days is not None:
+            min_timestamp = time.time() - max_days * 86400
+
+        # Scoring a large guild takes a while; keep it off the event loop
+        return await asyncio.to_thread(self.index.search, guild_id, vector, k, min_timestamp)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get counters for the semantic index.
+
+        Returns:
+            Dict[str, Any]: Model, size and embedding counters
+        """
+        stats = {
+            'model': self.embedder.name,
+            'ready': self.ready,
+            'vectors': len(self.index),
+            'embedded': self.embedded,
+            'failed': self.failed,
+            'queue_depth': self._queue.qsize(),
+            'dropped': self.dropped,
+            'retries': self.retries,
+            'load_seconds': round(self.load_seconds, 3)
+        }
+        if isinstance(self.index, IVFVectorIndex):
+            stats.update({
+                'index': 'ivf',
+                'segments': len(self.index.segment_guild_ids()),
+                'delta_vectors': len(self.index.delta),
+                'rebuilds': self.index.rebuilds,
+                'last_rebuild_seconds': round(self.index.last_rebuild_seconds, 3)
+            })
+        return stats
+
+# Semantic index singleton
+_semantic_index: Optional[SemanticIndex] = None
+
+def get_semantic_index() -> Optional[SemanticIndex]:
+    """
+    Get or create the shared semantic index from the ``embeddings`` config.
+
+    Returns:
+        SemanticIndex: The shared semantic index, or None if embeddings are disabled
+    """
+    global _semantic_index
+
+    if _semantic_index is None:
+        from ..utils.config import get_config
+        from ..utils.metrics import get_metrics
+
+        embeddings_config = get_config().get('embeddings', {})
+        if not embeddings_config.get('enabled', True):
+            return None
+
+        embedder = create_embedder(embeddings_config)
+        index = None
+        if embeddings_config.get('index', 'ivf') == 'ivf':
+            storage_dir = embeddings_config.get('storage_dir')
+            index = IVFVectorIndex(
+                embedder.dimension,
+                n_probe=embeddings_config.get('n_probe', 16),
+                build_threshold=embeddings_config.get('ann_threshold', 50000),
+                # Segments are only valid for the embedder that produced them
+                storage_dir=os.path.join(storage_dir, embedder.name) if storage_dir else None
+            )
+
+        _semantic_index = SemanticIndex(
+            embedder,
+            batch_size=embeddings_config.get('batch_size', 256),
+            index=index,
+            queue_size=embeddings_config.get('queue_size', 10000)
+        )
+        get_metrics().add_collector('semantic_index', _semantic_index.stats)
+
+    return _semantic_index
+
+async def close_semantic_index() -> None:
+    """Close the shared semantic index, if one was created."""
+    global _semantic_index
+
+    if _semantic_index is not None:
+        await _semantic_index.close()
+        _semantic_index = None
@@ -0,0 +1,80 @@
+import logging
+
+logger = logging.getLogger('discord_bot.rag.tokens')
+
+class Tokenizer:
+    """Base class for counting the LLM tokens of a text."""
+
+    name = 'base'
+
+    def count(self, text: str) -> int:
+        """
+        Count the tokens of a text.
+
+        Args:
+            text (str): Text to count
+
+        Returns:
+            int: Number of tokens
+        """
+        raise NotImplementedError
+
+class ApproximateTokenizer(Tokenizer):
+    """
+    Fast local token estimate: about four characters per token, but at
+    least one token per word.
+
+    Close to the OpenAI encodings for English chat text, without any
+    dependency or per-call setup.
+    """
+
+    name = 'approximate'
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        # Counting spaces is much cheaper than splitting into words
+        chars = (len(text) + 3) // 4
+        words = text.count(' ') + 1
+        return chars if chars > words else words
+
+class TiktokenTokenizer(Tokenizer):
+    """Exact token counts for OpenAI models, using tiktoken."""
+
+    name = 'tiktoken'
+
+    def __init__(self, encoding: str = 'cl100k_base'):
+        """
+        Initialize the tokenizer.
+
+        Args:
+            encoding (str): tiktoken encoding name
+
+        Raises:
+            ImportError: If tiktoken is not installed
+        """
+        import tiktoken
+
+        self._encoding = tiktoken.get_encoding(encoding)
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+def create_tokenizer(name: str = 'approximate') -> Tokenizer:
+    """
+    Create a tokenizer by name.
+
+    Args:
+        name (str): 'approximate' or 'tiktoken'
+
+    Returns:
+        Tokenizer: The tokenizer; the approximation if tiktoken is not installed
+    """
+    if name == 'tiktoken':
+        try:
+            return TiktokenTokenizer()
+        except ImportError:
+            logger.warning("tiktoken is not installed, using approximate token counts")
+    elif name != 'approximate':
+        logger.warning(f"Unknown tokenizer '{name}', using approximate token counts")
+    return ApproximateTokenizer()
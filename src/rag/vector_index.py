@@ -0,0 +1,258 @@
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger('discord_bot.rag.vector_index')
+
+# Rows scored per matrix product; bounds the temporary score matrix of batched searches
+SEARCH_CHUNK_ROWS = 262144
+
+class _GuildSegment:
+    """Growable arrays holding the vectors of one guild."""
+
+    def __init__(self, dimension: int, capacity: int):
+        self.size = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.vectors = np.zeros((capacity, dimension), dtype=np.float32)
+
+    def reserve(self, count: int) -> None:
+        """Make room for ``count`` more rows, doubling the capacity as needed."""
+        needed = self.size + count
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+
+        while capacity < needed:
+            capacity *= 2
+
+        ids = np.zeros(capacity, dtype=np.int64)
+        timestamps = np.zeros(capacity, dtype=np.float64)
+        vectors = np.zeros((capacity, self.vectors.shape[1]), dtype=np.float32)
+        ids[:self.size] = self.ids[:self.size]
+        timestamps[:self.size] = self.timestamps[:self.size]
+        vectors[:self.size] = self.vectors[:self.size]
+        self.ids, self.timestamps, self.vectors = ids, timestamps, vectors
+
+class VectorIndex:
+    """
+    In-memory exact cosine similarity index over message embeddings.
+
+    Vectors are kept per guild in contiguous float32 matrices, so a search
+    only scores the rows of the guild being asked about, with one matrix
+    product per chunk of rows. Vectors are normalized when added, which
+    makes the dot product equal to the cosine similarity.
+
+    Searches run in worker threads while messages are added and removed,
+    and removal moves rows within the arrays, so a lock keeps searches and
+    changes apart.
+    """
+
+    def __init__(self, dimension: int, initial_capacity: int = 1024):
+        """
+        Initialize an empty index.
+
+        Args:
+            dimension (int): Size of the vectors
+            initial_capacity (int): Rows allocated for a guild before growing
+        """
+        self.dimension = dimension
+        self.initial_capacity = max(1, initial_capacity)
+        self._segments: Dict[int, _GuildSegment] = {}
+        # message_id -> (guild_id, row)
+        self._locations: Dict[int, Tuple[int, int]] = {}
+        # Reentrant, because add removes vectors that moved to another guild
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._locations
+
+    def guild_size(self, guild_id: int) -> int:
+        """
+        Get the number of vectors stored for a guild.
+
+        Args:
+            guild_id (int): Discord server ID
+
+        Returns:
+            int: Number of vectors
+        """
+        segment = self._segments.get(guild_id)
+        return segment.size if segment else 0
+
+    def guild_ids(self) -> List[int]:
+        """
+        List the guilds with at least one vector.
+
+        Returns:
+            List[int]: Guild IDs
+        """
+        return [guild_id for guild_id, segment in self._segments.items() if segment.size]
+
+    def guild_rows(self, guild_id: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Copy out the vectors of a guild.
+
+        Args:
+            guild_id (int): Discord server ID
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: IDs, vectors and timestamps
+        """
+        with self._lock:
+            segment = self._segments.get(guild_id)
+            if segment is None:
+                return (np.zeros(0, dtype=np.int64), np.zeros((0, self.dimension), dtype=np.float32),
+                        np.zeros(0, dtype=np.float64))
+            size = segment.size
+            return segment.ids[:size].copy(), segment.vectors[:size].copy(), segment.timestamps[:size].copy()
+
+    def add(self, message_ids: Iterable[int], vectors: np.ndarray,
+            guild_ids: Iterable[int], timestamps: Iterable[float]) -> None:
+        """
+        Add or replace vectors.
+
+        Args:
+            message_ids (Iterable[int]): Message ID of each vector
+            vectors (np.ndarray): Matrix with one row per message
+            guild_ids (Iterable[int]): Guild of each message
+            timestamps (Iterable[float]): POSIX timestamp of each message
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+
+        with self._lock:
+            for message_id, vector, guild_id, timestamp in zip(message_ids, vectors, guild_ids, timestamps):
+                location = self._locations.get(message_id)
+                if location is not None and location[0] != guild_id:
+                    self.remove([message_id])
+                    location = None
+
+                if location is not None:
+                    segment, row = self._segments[guild_id], location[1]
+                else:
+                    segment = self._segments.get(guild_id)
+                    if segment is None:
+                        segment = self._segments[guild_id] = _GuildSegment(self.dimension, self.initial_capacity)
+                    segment.reserve(1)
+                    row = segment.size
+                    segment.size += 1
+                    self._locations[message_id] = (guild_id, row)
+
+                segment.ids[row] = message_id
+                segment.timestamps[row] = timestamp
+                segment.vectors[row] = vector
+
+    def remove(self, message_ids: Iterable[int]) -> int:
+        """
+        Remove vectors, moving the last row of the guild into each freed row.
+
+        Args:
+            message_ids (Iterable[int]): Messages to remove
+
+        Returns:
+            int: Number of vectors removed
+        """
+        removed = 0
+        with self._lock:
+            for message_id in message_ids:
+                location = self._locations.pop(message_id, None)
+                if location is None:
+                    continue
+
+                guild_id, row = location
+                segment = self._segments[guild_id]
+                last = segment.size - 1
+                if row != last:
+                    moved_id = int(segment.ids[last])
+                    segment.ids[row] = segment.ids[last]
+                    segment.timestamps[row] = segment.timestamps[last]
+                    segment.vectors[row] = segment.vectors[last]
+                    self._locations[moved_id] = (guild_id, row)
+                segment.size = last
+                removed += 1
+
+        return removed
+
+    def search(self, guild_id: int, query: np.ndarray, k: int = 20,
+               min_timestamp: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        Find the vectors of a guild most similar to a query vector.
+
+        Args:
+            guild_id (int): Discord server ID
+            query (np.ndarray): Query vector
+            k (int): Maximum number of results
+            min_timestamp (float, optional): Only consider messages at or after this POSIX timestamp
+
+        Returns:
+            List[Tuple[int, float]]: (message_id, cosine similarity) pairs, most similar first
+        """
+        return self.search_batch(guild_id, np.asarray(query).reshape(1, -1), k, min_timestamp)[0]
+
+    def search_batch(self, guild_id: int, queries: np.ndarray, k: int = 20,
+                     min_timestamp: Optional[float] = None) -> List[List[Tuple[int, float]]]:
+        """
+        Find the most similar vectors of a guild for several query vectors at once.
+
+        Args:
+            guild_id (int): Discord server ID
+            queries (np.ndarray): Matrix with one query vector per row
+            k (int): Maximum number of results per query
+            min_timestamp (float, optional): Only consider messages at or after this POSIX timestamp
+
+        Returns:
+            List[List[Tuple[int, float]]]: Results for each query, most similar first
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dimension)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        queries = queries / norms
+
+        with self._lock:
+            segment = self._segments.get(guild_id)
+            if segment is None or segment.size == 0 or k <= 0:
+                return [[] for _ in range(len(queries))]
+
+            size = segment.size
+            ids = segment.ids[:size]
+            timestamps = segment.timestamps[:size]
+            vectors = segment.vectors[:size]
+
+            candidate_scores = []
+            candidate_rows = []
+
+            for start in range(0, size, SEARCH_CHUNK_ROWS):
+                stop = min(start + SEARCH_CHUNK_ROWS, size)
+                scores = queries @ vectors[start:stop].T
+                if min_timestamp is not None:
+                    scores[:, timestamps[start:stop] < min_timestamp] = -np.inf
+
+                # Keep only the k best of each chunk before merging
+                count = stop - start
+                if count > k:
+                    rows = np.argpartition(scores, count - k, axis=1)[:, count - k:]
+                    scores = np.take_along_axis(scores, rows, axis=1)
+                else:
+                    rows = np.broadcast_to(np.arange(count), scores.shape)
+                candidate_scores.append(scores)
+                candidate_rows.append(rows + start)
+
+            best_scores = np.concatenate(candidate_scores, axis=1)
+            best_rows = np.concatenate(candidate_rows, axis=1)
+
+            results = []
+            for scores, rows in zip(best_scores, best_rows):
+                order = np.argsort(-scores, kind='stable')[:k]
+                results.append([
+                    (int(ids[rows[i]]), float(scores[i]))
+                    for i in order if scores[i] != -np.inf
+                ])
+            return results
@@ -15,9 +15,27 @@ DEFAULT_CONFIG = {
         'command_prefix': '!',
         'description': 'Discord bot with RAG capabilities',
         'message_fetch_limit': 10000,
-        'fetch_delay': 1.0,  # seconds between batch fetches
     },
     
+    # Historical backfill settings
+    'backfill': {
+        'concurrency': 4,          # channels fetched at once
+        'global_rate': 40.0,       # history requests per second across all channels
+        'route_rate': 5.0,         # history requests per second per channel
+        'page_size': 100,          # messages per history request (Discord max is 100)
+        'queue_size': 1000,        # fetched messages waiting to be written
+        'progress_interval': 10.0, # seconds between progress reports
+        'checkpoint_interval': 5.0, # minimum seconds between checkpoint saves
+    },
+
+    # Message ingest settings (bulk writer)
+    'ingest': {
+        'batch_size': 500,       # messages per COPY batch
+        'flush_interval': 1.0,   # seconds between background flushes
+        'max_pending': 5000,     # messages kept for retry after failed flushes
+        'queue_size': 10000,     # live messages waiting in the write-behind queue
+    },
+
     # Database settings
     'database': {
         'host': 'localhost',
@@ -34,17 +52,74 @@ DEFAULT_CONFIG = {
         'max_context_messages': 20,
         'max_context_days': 30,  # How far back to look for context by default
         'search_similarity_threshold': 0.7,
-        'max_context_length': 12000,
-        'conversation_history_limit': 25
+        'max_context_tokens': 3000,  # token budget for retrieved messages in the prompt
+        'tokenizer': 'approximate',  # 'approximate' (fast, local) or 'tiktoken'
+        'conversation_history_limit': 25,
+        # Reciprocal rank fusion of full-text and semantic results
+        'rrf_k': 60,
+        'lexical_weight': 1.0,
+        'semantic_weight': 1.0,
+        # Add each retrieved message's reply chain and neighbouring messages
+        'expand_context': True,
+        'context_window': 2,           # neighbours and replies per message and direction
+        'reply_chain_depth': 5,        # messages followed up a reply chain
+        'context_window_minutes': 60,  # maximum time between a message and its neighbours
+        # Identical questions asked while one is being answered share its answer
+        'coalesce_questions': True
+    },
+    
+    # Cache of answers to repeated questions
+    'answer_cache': {
+        'enabled': True,
+        'max_entries': 1000,           # least recently used answers are evicted beyond this
+        'ttl': 3600.0,                 # seconds an answer may be reused
+        'similarity_threshold': 0.9,   # rephrased questions this similar share an answer; 0 for exact only
+    },
+    
+    # Semantic search settings
+    'embeddings': {
+        'enabled': True,
+        'provider': 'hashing',              # 'hashing' (local) or 'openai'
+        'model': 'text-embedding-3-small',  # used by the openai provider
+        'dimension': 256,
+        'batch_size': 256,                  # texts per embedding call
+        'queue_size': 10000,                # written messages waiting to be embedded
+        'api_key_env_var': 'OPENAI_API_KEY',
+        'api_base': 'https://api.openai.com/v1', # used by the openai provider
+        'index': 'ivf',                     # 'ivf' (approximate) or 'exact'
+        'ann_threshold': 50000,             # vectors before a guild gets an IVF segment
+        'n_probe': 16,                      # IVF clusters scanned per search
+        'storage_dir': '/app/data/vector_index', # where IVF segments are saved
+    },
+    
+    # HTTP health checks and Prometheus metrics
+    'monitoring': {
+        'enabled': True,
+        'host': '0.0.0.0',
+        'port': 8080,
+        'health_check_timeout': 2.0,  # seconds allowed for the database check
+    },
+    
+    # Latency tracing of questions
+    'tracing': {
+        'enabled': True,
+        'slow_trace_ms': 2000,  # keep traces of requests at least this slow
+        'buffer_size': 50,  # slow traces kept for !traces
+        'export_file': None,  # append every trace to this file as OTLP JSON lines
     },
     
     # Logging settings
     'logging': {
         'level': 'INFO',
-        'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        'format': '%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s',
         'file': '/app/logs/discord_rag_bot.log',
         'max_file_size': 10 * 1024 * 1024,  # 10 MB
         'backup_count': 5,
+        'queue_size': 10000,  # records buffered for the log writer thread; more are dropped
+        'json': False,  # write one JSON object per line instead of the format above
+        'discord_channel_id': None,  # post summaries of errors to this channel
+        'discord_level': 'ERROR',
+        'discord_flush_interval': 10.0,  # minimum seconds between posts
     },
     
     # AI model settings
@@ -53,6 +128,20 @@ DEFAULT_CONFIG = {
         'api_key_env_var': 'OPENAI_API_KEY',
         'temperature': 0.7,
         'max_tokens': 16384,
+        'api_base': 'https://api.openai.com/v1',
+        'connection_limit': 20,     # pooled connections to the API
+        'keepalive_timeout': 60.0,  # seconds an idle connection stays open
+        'dns_cache_ttl': 300,       # seconds a resolved address is reused
+        'connect_timeout': 10.0,
+        'request_timeout': 120.0,
+        'stream': True,             # show answers while they are generated
+        'stream_edit_interval': 1.0, # seconds between edits of a streamed reply
+        # Requests beyond the limit wait their turn: slash commands and admins
+        # first, then prefix commands, then mentions, with guilds taking turns
+        'max_concurrent_requests': 4,
+        'max_retries': 3,             # retries of a rate limited request
+        'rate_limit_backoff': 1.0,    # first pause when the API gives no Retry-After
+        'rate_limit_max_backoff': 60.0
     }
 }
 
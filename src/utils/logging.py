@@ -1,25 +1,161 @@
 """Logging configuration for the Discord RAG bot."""
 
+import asyncio
+import atexit
+import datetime
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import sys
 from typing import Optional, Dict, Any
 
+from .tracing import TraceIdFilter
+
 # Default logger
 _LOGGER = None
 
+# Writes queued records to the console and files on its own thread
+_LISTENER: Optional['LogListener'] = None
+
+# Renders tracebacks before records are queued
+_TRACEBACK_FORMATTER = logging.Formatter()
+
+# Logger of DiscordHandler's own problems, never posted to Discord
+_DISCORD_HANDLER_LOGGER = 'discord_bot.logging.discord'
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Hands records to the log writer thread without ever blocking the caller.
+
+    The queue is bounded; when the writer falls behind and it fills up,
+    records are dropped and counted instead of stalling the event loop.
+    """
+
+    def __init__(self, capacity: int = 10000):
+        """
+        Initialize the handler.
+
+        Args:
+            capacity (int): Records buffered for the writer thread
+        """
+        super().__init__(queue.Queue(maxsize=capacity))
+        self.capacity = capacity
+
+        # Counters
+        self.queued = 0
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Render the message and traceback so the record no longer refers to live objects.
+
+        Unlike ``QueueHandler.prepare`` the traceback is kept apart from the
+        message, so the writer's formatters place it as they would have.
+        """
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _TRACEBACK_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Queue a record, dropping it if the queue is full."""
+        try:
+            self.queue.put_nowait(record)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get logging statistics.
+
+        Returns:
+            Dict[str, Any]: Queued and dropped record counts and the current backlog
+        """
+        return {
+            'queued': self.queued,
+            'dropped': self.dropped,
+            'backlog': self.queue.qsize(),
+            'capacity': self.capacity
+        }
+
+class LogListener(QueueListener):
+    """Writes queued records on a background thread and reports dropped ones."""
+
+    def __init__(self, queue_handler: BoundedQueueHandler, *handlers: logging.Handler):
+        """
+        Initialize the listener.
+
+        Args:
+            queue_handler (BoundedQueueHandler): Handler whose queue is read
+            *handlers (logging.Handler): Handlers writing the records
+        """
+        super().__init__(queue_handler.queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self._reported_drops = 0
+
+    def enqueue_sentinel(self) -> None:
+        """Queue the stop signal, waiting for room rather than failing on a full queue."""
+        self.queue.put(self._sentinel)
+
+    def handle(self, record: logging.LogRecord) -> None:
+        """Write a record, preceded by a warning if records were dropped since the last one."""
+        dropped = self.queue_handler.dropped
+        if dropped > self._reported_drops:
+            warning = logging.makeLogRecord({
+                'name': 'discord_bot.logging',
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': f"Log queue full, dropped {dropped - self._reported_drops} records",
+                'trace_id': '-'
+            })
+            self._reported_drops = dropped
+            super().handle(warning)
+        super().handle(record)
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, for log collectors."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        trace_id = getattr(record, 'trace_id', '-')
+        if trace_id != '-':
+            entry['trace_id'] = trace_id
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, default=str)
+
 def setup_logging(config: Optional[Dict[str, Any]] = None) -> logging.Logger:
     """
     Set up logging configuration.
 
+    Log calls only queue the record; a background thread writes it to the
+    console and log files, so slow disks and log rotation never block the
+    event loop.
+
     Args:
         config (Dict[str, Any], optional): Logging configuration
 
     Returns:
         logging.Logger: Configured root logger
     """
-    global _LOGGER
+    global _LOGGER, _LISTENER
 
     if _LOGGER is not None:
         return _LOGGER
@@ -31,16 +167,18 @@ def setup_logging(config: Optional[Dict[str, Any]] = None) -> logging.Logger:
 
     # Get configuration values
     log_level_name = config.get('level', 'INFO')
-    log_format = config.get('format', '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    log_format = config.get('format', '%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s')
     log_file = config.get('file')
     max_file_size = config.get('max_file_size', 10 * 1024 * 1024)  # 10 MB default
     backup_count = config.get('backup_count', 5)
+    queue_size = config.get('queue_size', 10000)
+    json_output = config.get('json', False)
 
     # Convert log level name to logging level
     log_level = getattr(logging, log_level_name, logging.INFO)
 
     # Create formatter
-    formatter = logging.Formatter(log_format)
+    formatter = JsonFormatter() if json_output else logging.Formatter(log_format)
 
     # Configure root logger
     root_logger = logging.getLogger()
@@ -50,12 +188,12 @@ def setup_logging(config: Optional[Dict[str, Any]] = None) -> logging.Logger:
     for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
 
-    # Add console handler
+    # Console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
-    root_logger.addHandler(console_handler)
+    handlers = [console_handler]
 
-    # Add file handler if log file is specified
+    # File handler if log file is specified
     if log_file:
         # Create logs directory if it doesn't exist
         log_dir = os.path.dirname(log_file)
@@ -69,19 +207,68 @@ def setup_logging(config: Optional[Dict[str, Any]] = None) -> logging.Logger:
             backupCount=backup_count
         )
         file_handler.setFormatter(formatter)
-        root_logger.addHandler(file_handler)
+        handlers.append(file_handler)
+
+    # Log file of our application's own loggers
+    app_handler = RotatingFileHandler('/app/logs/discord_rag_bot.log', maxBytes=5*1024*1024, backupCount=2)
+    app_handler.setFormatter(
+        formatter if json_output else logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s')
+    )
+    app_handler.addFilter(logging.Filter('discord_rag_bot'))
+    handlers.append(app_handler)
+
+    # Loggers only queue records; the trace ID has to be read on the logging thread
+    queue_handler = BoundedQueueHandler(queue_size)
+    queue_handler.addFilter(TraceIdFilter())
+    root_logger.addHandler(queue_handler)
+
+    _LISTENER = LogListener(queue_handler, *handlers)
+    _LISTENER.start()
+    # Write out what is still queued before the interpreter exits
+    atexit.register(stop_logging)
+
+    from .metrics import get_metrics
+    get_metrics().add_collector('logging', queue_handler.stats)
 
     # Create a logger for our application
     logger = logging.getLogger('discord_rag_bot')
-    handler = RotatingFileHandler('/app/logs/discord_rag_bot.log', maxBytes=5*1024*1024, backupCount=2)
-    handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-    logger.addHandler(handler)
     # Store logger
     _LOGGER = logger
 
     logger.info("Logging configured")
     return logger
 
+def stop_logging() -> None:
+    """Write the queued records and stop the log writer thread."""
+    global _LISTENER
+
+    if _LISTENER is not None:
+        _LISTENER.stop()
+        _LISTENER = None
+
+def add_log_handler(handler: logging.Handler) -> None:
+    """
+    Add a handler that receives every record, on the log writer thread once logging is set up.
+
+    Args:
+        handler (logging.Handler): The handler
+    """
+    if _LISTENER is not None:
+        _LISTENER.handlers = _LISTENER.handlers + (handler,)
+    else:
+        logging.getLogger().addHandler(handler)
+
+def remove_log_handler(handler: logging.Handler) -> None:
+    """
+    Remove a handler added by ``add_log_handler``.
+
+    Args:
+        handler (logging.Handler): The handler
+    """
+    if _LISTENER is not None:
+        _LISTENER.handlers = tuple(h for h in _LISTENER.handlers if h is not handler)
+    logging.getLogger().removeHandler(handler)
+
 def get_logger(name: Optional[str] = None) -> logging.Logger:
     """
     Get a logger with the specified name.
@@ -104,13 +291,38 @@ def get_logger(name: Optional[str] = None) -> logging.Logger:
     else:
         return _LOGGER
 
+class _ErrorGroup:
+    """Identical records seen since the last post."""
+
+    __slots__ = ('level', 'logger', 'message', 'detail', 'count', 'first', 'last')
+
+    def __init__(self, record: logging.LogRecord, message: str):
+        self.level = record.levelname
+        self.logger = record.name
+        self.message = message
+        # Last line of the traceback, e.g. the exception type and message
+        self.detail = record.exc_text.strip().splitlines()[-1] if record.exc_text else None
+        self.count = 0
+        self.first = record.created
+        self.last = record.created
+
 class DiscordHandler(logging.Handler):
     """
     Custom logging handler that sends log messages to a Discord channel.
     Useful for remote monitoring of the bot.
+
+    Records are only collected when logged, from whichever thread logs
+    them. Identical ones (same level, logger and message) are grouped with
+    a count, and a task on the bot's event loop posts one summary of the
+    groups at most every ``flush_interval`` seconds, well within Discord's
+    rate limits. A burst of hundreds of errors becomes one message.
     """
 
-    def __init__(self, bot, channel_id: int, level: int = logging.ERROR):
+    # Discord rejects messages over 2000 characters
+    MESSAGE_LIMIT = 2000
+
+    def __init__(self, bot, channel_id: int, level: int = logging.ERROR,
+                 flush_interval: float = 10.0, max_groups: int = 100):
         """
         Initialize the Discord logging handler.
 
@@ -118,6 +330,132 @@ class DiscordHandler(logging.Handler):
             bot: Discord bot instance
             channel_id (int): ID of the channel to send logs to
             level (int, optional): Minimum log level to send to Discord
+            flush_interval (float): Minimum seconds between posts
+            max_groups (int): Distinct records kept between posts; further ones are only counted
         """
         super().__init__(level)
         self.bot = bot
+        self.channel_id = channel_id
+        self.flush_interval = flush_interval
+        self.max_groups = max_groups
+
+        self._groups: Dict[tuple, _ErrorGroup] = {}
+        self._overflow = 0
+        self._task: Optional[asyncio.Task] = None
+        self._channel = None
+
+        # Counters
+        self.records = 0
+        self.posts = 0
+        self.send_errors = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Add a record to the next summary."""
+        # Errors about posting would otherwise be posted in turn
+        if record.name == _DISCORD_HANDLER_LOGGER:
+            return
+        try:
+            message = record.getMessage()
+            if record.exc_info and not record.exc_text:
+                record.exc_text = _TRACEBACK_FORMATTER.formatException(record.exc_info)
+            key = (record.levelno, record.name, message)
+            with self.lock:
+                self.records += 1
+                group = self._groups.get(key)
+                if group is None:
+                    if len(self._groups) >= self.max_groups:
+                        self._overflow += 1
+                        return
+                    group = self._groups[key] = _ErrorGroup(record, message)
+                group.count += 1
+                group.last = record.created
+        except Exception:
+            self.handleError(record)
+
+    def take_summary(self) -> Optional[str]:
+        """
+        Take the records collected since the last summary.
+
+        Returns:
+            Optional[str]: Message summarizing them, None if there were none
+        """
+        with self.lock:
+            groups, self._groups = self._groups, {}
+            overflow, self._overflow = self._overflow, 0
+        if not groups and not overflow:
+            return None
+
+        total = sum(group.count for group in groups.values()) + overflow
+        lines = [f"**{total} log record{'s' if total != 1 else ''} since the last report**"]
+        ordered = sorted(groups.values(), key=lambda group: group.first)
+        shown = 0
+        for group in ordered:
+            line = f"`{group.level}` `{group.logger}`"
+            if group.count > 1:
+                line += f" ×{group.count}"
+            line += f": {group.message[:300]}"
+            if group.detail and group.detail not in group.message:
+                line += f"\n> {group.detail[:200]}"
+            # Leave room for the line about the groups left out
+            if sum(len(l) + 1 for l in lines) + len(line) > self.MESSAGE_LIMIT - 60:
+                break
+            lines.append(line)
+            shown += 1
+
+        left_out = sum(group.count for group in ordered[shown:]) + overflow
+        if left_out:
+            lines.append(f"…and {left_out} more")
+        return '\n'.join(lines)
+
+    async def flush_to_discord(self) -> None:
+        """Post the records collected since the last post, if any."""
+        summary = self.take_summary()
+        if summary is None:
+            return
+        try:
+            if self._channel is None:
+                self._channel = self.bot.get_channel(self.channel_id) or \
+                    await self.bot.fetch_channel(self.channel_id)
+            await self._channel.send(summary)
+            self.posts += 1
+        except Exception as e:
+            self.send_errors += 1
+            logging.getLogger(_DISCORD_HANDLER_LOGGER).warning(f"Could not post log summary to Discord: {str(e)}")
+
+    async def _run(self) -> None:
+        """Post a summary every flush interval."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_to_discord()
+
+    async def start(self) -> None:
+        """Start posting summaries from the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop posting, after posting what is left."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_to_discord()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get error reporting statistics.
+
+        Returns:
+            Dict[str, Any]: Records collected, posts sent and failed, and records waiting
+        """
+        with self.lock:
+            pending = sum(group.count for group in self._groups.values()) + self._overflow
+        return {
+            'records': self.records,
+            'posts': self.posts,
+            'send_errors': self.send_errors,
+            'pending': pending
+        }
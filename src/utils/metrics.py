@@ -0,0 +1,279 @@
+import bisect
+import logging
+import math
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger('discord_bot.metrics')
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Returns counts per bucket (the last one for values above every bound) and the sum of the values
+HistogramSource = Callable[[], Tuple[Sequence[int], float]]
+
+def _format_value(value: float) -> str:
+    """Format a sample value for the Prometheus text format."""
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    """Format a label set for the Prometheus text format."""
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+def render_histogram(name: str, labels: Dict[str, str], bounds: Sequence[float],
+                     counts: Sequence[int], total: float) -> List[str]:
+    """
+    Render the samples of one histogram.
+
+    Args:
+        name (str): Full metric name
+        labels (Dict[str, str]): Labels of the histogram
+        bounds (Sequence[float]): Upper bounds of the buckets
+        counts (Sequence[int]): Count per bucket, plus one for values above every bound
+        total (float): Sum of the observed values
+
+    Returns:
+        List[str]: Cumulative bucket, sum and count lines
+    """
+    lines = []
+    cumulative = 0
+    for bound, count in zip(list(bounds) + [math.inf], counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+    lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return lines
+
+class HistogramChild:
+    """Bucket counts of one label set of a histogram."""
+
+    __slots__ = ('bounds', 'counts', 'total')
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+        Count one observation.
+
+        Args:
+            value (float): Observed value, e.g. seconds
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+class Histogram:
+    """
+    Histogram with fixed buckets, optionally split by label values.
+
+    Observing is a bisect and two additions, cheap enough for every event
+    and request; the cumulative counts Prometheus expects are only worked
+    out when the metrics are rendered.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        Initialize the histogram.
+
+        Args:
+            name (str): Metric name without the namespace
+            documentation (str): Help text
+            labelnames (Sequence[str]): Names of the labels the histogram is split by
+            buckets (Sequence[float]): Upper bounds of the buckets, ascending
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children: Dict[Tuple[str, ...], HistogramChild] = {}
+
+    def labels(self, *values: str) -> HistogramChild:
+        """
+        Get the histogram of one label set.
+
+        Args:
+            *values (str): One value per label name
+
+        Returns:
+            HistogramChild: Bucket counts of the label set
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            child = self._children[values] = HistogramChild(self.buckets)
+        return child
+
+    def observe(self, value: float) -> None:
+        """
+        Count one observation of a histogram without labels.
+
+        Args:
+            value (float): Observed value, e.g. seconds
+        """
+        self.labels().observe(value)
+
+    def render(self, name: str) -> List[str]:
+        """
+        Render all label sets.
+
+        Args:
+            name (str): Full metric name
+
+        Returns:
+            List[str]: Sample lines
+        """
+        lines = []
+        for values, child in self._children.items():
+            lines.extend(render_histogram(name, dict(zip(self.labelnames, values)),
+                                          child.bounds, child.counts, child.total))
+        return lines
+
+class MetricsRegistry:
+    """
+    Metrics of the bot process, rendered in the Prometheus text format.
+
+    Latency histograms are observed directly on the hot path. Everything
+    else is read when the metrics are scraped: components register a
+    collector returning their ``stats()`` counters, and each number in it
+    becomes a sample named after the collector and key.
+    """
+
+    def __init__(self, namespace: str = 'discord_bot'):
+        """
+        Initialize the registry.
+
+        Args:
+            namespace (str): Prefix of every metric name
+        """
+        self.namespace = namespace
+        self._histograms: Dict[str, Histogram] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self._histogram_sources: Dict[str, Tuple[str, Sequence[float], HistogramSource]] = {}
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        """
+        Get or create a histogram.
+
+        Args:
+            name (str): Metric name without the namespace
+            documentation (str): Help text
+            labelnames (Sequence[str]): Names of the labels the histogram is split by
+            buckets (Sequence[float]): Upper bounds of the buckets, ascending
+
+        Returns:
+            Histogram: The histogram registered under the name
+        """
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = Histogram(name, documentation, labelnames, buckets)
+        return histogram
+
+    def add_collector(self, name: str, collect: Callable[[], Dict[str, Any]]) -> None:
+        """
+        Register a function whose numeric values are exported on every scrape.
+
+        A collector registered again under the same name replaces the old one.
+
+        Args:
+            name (str): Prefix of the collected metric names
+            collect (Callable[[], Dict[str, Any]]): Returns counters and gauges by name;
+                booleans are exported as 0 or 1 and other non-numeric values are skipped
+        """
+        self._collectors[name] = collect
+
+    def add_histogram_source(self, name: str, documentation: str, bounds: Sequence[float],
+                             source: HistogramSource) -> None:
+        """
+        Register a histogram kept by a component, read on every scrape.
+
+        Args:
+            name (str): Metric name without the namespace
+            documentation (str): Help text
+            bounds (Sequence[float]): Upper bounds of the component's buckets
+            source (HistogramSource): Returns the bucket counts and the sum
+        """
+        self._histogram_sources[name] = (documentation, tuple(bounds), source)
+
+    def collect(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Run the collectors.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Collected values by collector name;
+                collectors that fail are left out
+        """
+        collected = {}
+        for name, collect in list(self._collectors.items()):
+            try:
+                collected[name] = collect()
+            except Exception as e:
+                logger.error(f"Error collecting {name} metrics: {str(e)}")
+        return collected
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text format.
+
+        Returns:
+            str: The exposition, ending with a newline
+        """
+        lines = []
+        for name, histogram in self._histograms.items():
+            full_name = f"{self.namespace}_{name}"
+            lines.append(f"# HELP {full_name} {histogram.documentation}")
+            lines.append(f"# TYPE {full_name} histogram")
+            lines.extend(histogram.render(full_name))
+
+        for name, (documentation, bounds, source) in list(self._histogram_sources.items()):
+            try:
+                counts, total = source()
+            except Exception as e:
+                logger.error(f"Error collecting {name} metrics: {str(e)}")
+                continue
+            full_name = f"{self.namespace}_{name}"
+            lines.append(f"# HELP {full_name} {documentation}")
+            lines.append(f"# TYPE {full_name} histogram")
+            lines.extend(render_histogram(full_name, {}, bounds, counts, total))
+
+        for collector, values in self.collect().items():
+            for key, value in values.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                elif not isinstance(value, (int, float)):
+                    continue
+                full_name = f"{self.namespace}_{collector}_{key}"
+                lines.append(f"# TYPE {full_name} untyped")
+                lines.append(f"{full_name} {_format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+# Metrics registry singleton
+_metrics: Optional[MetricsRegistry] = None
+
+def get_metrics() -> MetricsRegistry:
+    """
+    Get or create the metrics registry of the process.
+
+    Returns:
+        MetricsRegistry: The shared registry
+    """
+    global _metrics
+
+    if _metrics is None:
+        _metrics = MetricsRegistry()
+
+    return _metrics
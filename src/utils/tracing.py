@@ -0,0 +1,425 @@
+import asyncio
+import collections
+import contextvars
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger('discord_bot.tracing')
+
+# Span that new spans are children of, follows the request across awaits and tasks
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('current_span', default=None)
+
+SERVICE_NAME = 'discord-rag-bot'
+
+# OTLP status codes
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+def current_trace_id() -> Optional[str]:
+    """
+    Get the ID of the trace the running code belongs to.
+
+    Returns:
+        Optional[str]: 32 hex digits, or None outside of a trace
+    """
+    span = _current_span.get()
+    return span.trace.trace_id if span is not None else None
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    """Encode an attribute value as an OTLP JSON AnyValue."""
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Encode attributes as an OTLP JSON KeyValue list."""
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items()]
+
+class Span:
+    """
+    One timed step of a traced request.
+
+    Used as a context manager the span becomes the parent of the spans
+    started inside it; a span that outlives a ``with`` block, such as one
+    covering a streamed response, is ended with ``end()`` instead.
+    """
+
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'attributes',
+                 'start_ns', '_started', 'duration', 'error', '_token')
+
+    def __init__(self, trace: 'Trace', name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        """
+        Start the span.
+
+        Args:
+            trace (Trace): Trace the span belongs to
+            name (str): Name of the step, e.g. ``rag.retrieve``
+            parent_id (str, optional): ID of the parent span, None for the root
+            attributes (Dict[str, Any]): Details of the step
+        """
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self._token: Optional[contextvars.Token] = None
+        trace.spans.append(self)
+
+    def __enter__(self) -> 'Span':
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc is not None and self.error is None and not isinstance(exc, GeneratorExit):
+            self.record_error(exc)
+        self.end()
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Exited in another context than it was entered in
+            pass
+        return False
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        """Milliseconds the span took, None while it is running."""
+        return self.duration * 1000 if self.duration is not None else None
+
+    def elapsed_ms(self) -> float:
+        """Milliseconds since the span started."""
+        return (time.perf_counter() - self._started) * 1000
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """
+        Add a detail to the span.
+
+        Args:
+            key (str): Attribute name
+            value (Any): Attribute value; strings, numbers and booleans are exported as such
+        """
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException) -> None:
+        """
+        Mark the span as failed.
+
+        Args:
+            error (BaseException): The error the step failed with
+        """
+        self.error = f"{type(error).__name__}: {error}"
+
+    def end(self) -> None:
+        """End the span; ending it again has no effect."""
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._started
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """
+        Encode the span in the OTLP JSON format.
+
+        Returns:
+            Dict[str, Any]: The span; one still running ends with the trace
+        """
+        duration = self.duration if self.duration is not None else self.trace.root.duration or 0.0
+        span = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 2 if self.parent_id is None else 1,  # SERVER for the request, INTERNAL below it
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.start_ns + int(duration * 1e9)),
+            'attributes': _otlp_attributes(self.attributes),
+            'status': {'code': _STATUS_ERROR, 'message': self.error} if self.error else {'code': _STATUS_OK}
+        }
+        if self.parent_id is not None:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+class _NoopSpan:
+    """Stands in for a span when nothing is traced, so call sites need no checks."""
+
+    __slots__ = ()
+
+    trace = None
+    duration = None
+    duration_ms = None
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+    def elapsed_ms(self) -> float:
+        return 0.0
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def record_error(self, error: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class Trace:
+    """
+    The spans of one request, from the command being invoked to the reply.
+
+    Entering the trace enters its root span; leaving it ends the root span
+    and hands the trace to the tracer.
+    """
+
+    def __init__(self, tracer: 'Tracer', name: str, attributes: Dict[str, Any]):
+        """
+        Start the trace.
+
+        Args:
+            tracer (Tracer): Tracer the finished trace is reported to
+            name (str): Name of the request, e.g. ``ask``
+            attributes (Dict[str, Any]): Details of the request
+        """
+        self.tracer = tracer
+        self.trace_id = secrets.token_hex(16)
+        self.spans: List[Span] = []
+        self.root = Span(self, name, None, attributes)
+
+    def __enter__(self) -> Span:
+        return self.root.__enter__()
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.root.__exit__(exc_type, exc, tb)
+        self.tracer.finish(self)
+        return False
+
+    @property
+    def name(self) -> str:
+        """Name of the root span."""
+        return self.root.name
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        """Milliseconds the request took, None while it is running."""
+        return self.root.duration_ms
+
+    def format(self) -> str:
+        """
+        Render the trace as an indented tree of spans with their durations.
+
+        Returns:
+            str: One line per span, children below their parent in start order
+        """
+        children: Dict[Optional[str], List[Span]] = collections.defaultdict(list)
+        for span in self.spans:
+            children[span.parent_id].append(span)
+
+        lines = [f"trace {self.trace_id}"]
+
+        def render(span: Span, depth: int) -> None:
+            duration = f"{span.duration_ms:.1f} ms" if span.duration is not None else "unfinished"
+            details = ' '.join(f"{key}={value}" for key, value in span.attributes.items())
+            line = f"{'  ' * depth}{span.name} {duration}"
+            if details:
+                line += f" {details}"
+            if span.error:
+                line += f" error={span.error}"
+            lines.append(line)
+            for child in children.get(span.span_id, []):
+                render(child, depth + 1)
+
+        render(self.root, 0)
+        return '\n'.join(lines)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """
+        Encode the trace as an OTLP JSON export request.
+
+        Returns:
+            Dict[str, Any]: ``resourceSpans`` holding every span of the trace
+        """
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': _otlp_attributes({'service.name': SERVICE_NAME})},
+                'scopeSpans': [{
+                    'scope': {'name': 'discord_bot'},
+                    'spans': [span.to_otlp() for span in self.spans]
+                }]
+            }]
+        }
+
+class Tracer:
+    """
+    Traces requests as trees of timed spans.
+
+    A request is traced by entering ``trace()``; code it runs, including
+    tasks it starts, adds steps with ``span()``, which costs next to
+    nothing when no trace is active. Traces slower than ``slow_trace_ms``
+    are kept in a ring buffer for the ``!traces`` command, and every trace
+    can be appended to a file as OTLP JSON, one export request per line,
+    which OpenTelemetry collectors and Jaeger can import.
+    """
+
+    def __init__(self, enabled: bool = True, slow_trace_ms: float = 2000, buffer_size: int = 50,
+                 export_file: Optional[str] = None):
+        """
+        Initialize the tracer.
+
+        Args:
+            enabled (bool): Whether to trace requests at all
+            slow_trace_ms (float): Requests taking at least this many milliseconds are kept
+            buffer_size (int): Number of slow traces kept
+            export_file (str, optional): File to append every trace to as OTLP JSON lines
+        """
+        self.enabled = enabled
+        self.slow_trace_ms = slow_trace_ms
+        self.export_file = export_file
+        self._slow: Deque[Trace] = collections.deque(maxlen=buffer_size)
+        self._export_lock = threading.Lock()
+
+        # Counters
+        self.traces = 0
+        self.slow_traces = 0
+        self.exported = 0
+        self.export_errors = 0
+
+    def trace(self, name: str, **attributes: Any):
+        """
+        Start tracing a request.
+
+        Args:
+            name (str): Name of the request
+            **attributes: Details of the request, e.g. guild and user IDs
+
+        Returns:
+            Trace: Context manager entering the root span, a no-op one if tracing is disabled
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        return Trace(self, name, attributes)
+
+    def span(self, name: str, **attributes: Any):
+        """
+        Start a step of the request being traced.
+
+        Args:
+            name (str): Name of the step
+            **attributes: Details of the step
+
+        Returns:
+            Span: The span, child of the current one; a no-op span outside of a trace
+        """
+        parent = _current_span.get()
+        if parent is None:
+            return NOOP_SPAN
+        return Span(parent.trace, name, parent.span_id, attributes)
+
+    def finish(self, trace: Trace) -> None:
+        """
+        Keep a finished trace if it was slow and export it.
+
+        Args:
+            trace (Trace): The finished trace
+        """
+        self.traces += 1
+        if trace.duration_ms >= self.slow_trace_ms:
+            self.slow_traces += 1
+            self._slow.append(trace)
+            logger.info(f"Slow {trace.name} request took {trace.duration_ms:.0f} ms (trace {trace.trace_id})")
+
+        if self.export_file:
+            line = json.dumps(trace.to_otlp(), separators=(',', ':'))
+            try:
+                asyncio.get_running_loop().run_in_executor(None, self._export, line)
+            except RuntimeError:
+                self._export(line)
+
+    def _export(self, line: str) -> None:
+        """Append one exported trace to the export file."""
+        try:
+            with self._export_lock:
+                directory = os.path.dirname(self.export_file)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.export_file, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+            self.exported += 1
+        except OSError as e:
+            self.export_errors += 1
+            logger.error(f"Error exporting trace: {str(e)}")
+
+    def recent_slow_traces(self, limit: Optional[int] = None) -> List[Trace]:
+        """
+        Get the slow traces kept, newest first.
+
+        Args:
+            limit (int, optional): Maximum number of traces
+
+        Returns:
+            List[Trace]: The traces
+        """
+        traces = list(reversed(self._slow))
+        return traces[:limit] if limit is not None else traces
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get tracing statistics.
+
+        Returns:
+            Dict[str, Any]: Traced, slow and exported request counts
+        """
+        return {
+            'traces': self.traces,
+            'slow_traces': self.slow_traces,
+            'slow_traces_kept': len(self._slow),
+            'exported': self.exported,
+            'export_errors': self.export_errors
+        }
+
+class TraceIdFilter(logging.Filter):
+    """Adds the ID of the current trace to log records as ``trace_id``, ``-`` outside of a trace."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        span = _current_span.get()
+        record.trace_id = span.trace.trace_id if span is not None else '-'
+        return True
+
+# Tracer singleton
+_tracer: Optional[Tracer] = None
+
+def get_tracer() -> Tracer:
+    """
+    Get or create the tracer of the process.
+
+    Returns:
+        Tracer: The tracer configured by the ``tracing`` config section
+    """
+    global _tracer
+
+    if _tracer is None:
+        from .config import get_config
+        tracing_config = get_config().get('tracing', {})
+        _tracer = Tracer(
+            enabled=tracing_config.get('enabled', True),
+            slow_trace_ms=tracing_config.get('slow_trace_ms', 2000),
+            buffer_size=tracing_config.get('buffer_size', 50),
+            export_file=tracing_config.get('export_file')
+        )
+        from .metrics import get_metrics
+        get_metrics().add_collector('tracing', _tracer.stats)
+
+    return _tracer
@@ -1,5 +1,6 @@
 import unittest
 import asyncio
+import logging
 import discord
 from unittest.mock import MagicMock, patch, AsyncMock
 import sys
@@ -10,8 +11,44 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from src.bot.client import create_bot
-from src.bot.commands import register_commands
+from src.bot.commands import register_commands, _checkpoint_flush
+from src.database.bulk import BulkWriter
 from src.bot.events import register_events
+from src.bot.backfill import BackfillEngine, RateLimiter
+from src.bot.streaming import StreamingReply, split_message
+from src.bot.user_commands import ask_priority
+from src.rag.scheduler import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from src.bot.monitoring import MonitoringServer
+from src.utils.metrics import MetricsRegistry
+from src.utils.tracing import Tracer, TraceIdFilter, NOOP_SPAN
+from src.utils.logging import BoundedQueueHandler, LogListener, JsonFormatter, DiscordHandler
+from aiohttp.test_utils import TestClient, TestServer
+
+class FakeChannel:
+    """In-memory stand-in for a channel's history endpoint."""
+    
+    def __init__(self, channel_id, message_ids, forbidden=False):
+        self.id = channel_id
+        self.name = f'channel-{channel_id}'
+        self.messages = [MagicMock(id=message_id) for message_id in sorted(message_ids, reverse=True)]
+        self.forbidden = forbidden
+        self.calls = []
+    
+    async def history(self, limit=100, before=None, after=None, oldest_first=None):
+        self.calls.append({'limit': limit, 'before': before, 'after': after, 'oldest_first': oldest_first})
+        if self.forbidden:
+            raise discord.errors.Forbidden(MagicMock(status=403), 'Missing Access')
+        returned = 0
+        messages = reversed(self.messages) if oldest_first else self.messages
+        for message in messages:
+            if before is not None and message.id >= before.id:
+                continue
+            if after is not None and message.id <= after.id:
+                continue
+            if returned >= limit:
+                break
+            returned += 1
+            yield message
 
 class TestBotClient(unittest.TestCase):
     """Test cases for the bot client functionality."""
@@ -140,10 +177,11 @@ class TestBotEvents(unittest.IsolatedAsyncioTestCase):
         self.assertIn('on_guild_join', self.event_handlers)
         self.assertIn('on_message_edit', self.event_handlers)
     
-    @patch('src.database.operations.store_message')
-    async def test_on_message_event(self, mock_store_message):
+    @patch('src.database.ingest.get_ingest_queue')
+    async def test_on_message_event(self, mock_get_ingest_queue):
         """Test on_message event handler."""
         register_events(self.bot)
+        self.bot.process_commands = AsyncMock()
         
         # Create a mock message
         mock_message = AsyncMock()
@@ -151,18 +189,479 @@ class TestBotEvents(unittest.IsolatedAsyncioTestCase):
         mock_message.author.bot = False
         mock_message.content = "Test message"
         mock_message.attachments = []
+        mock_message.mentions = []
         
-        # Set up mock for store_message
-        mock_store_message.return_value = True
+        # Set up mock for the ingest queue
+        mock_queue = MagicMock()
+        mock_get_ingest_queue.return_value = mock_queue
         
         # Call the event handler
         await self.event_handlers['on_message'](mock_message)
         
-        # Verify store_message was called
-        mock_store_message.assert_called_once_with(mock_message)
+        # Verify the message was queued rather than written inline
+        mock_queue.submit.assert_called_once_with(mock_message)
         
         # Verify process_commands was called
         self.bot.process_commands.assert_called_once_with(mock_message)
 
+class TestAskPriority(unittest.TestCase):
+    """Test cases for the scheduling priority of questions."""
+
+    def test_admins_first_and_mentions_last(self):
+        """Test that admins are served first and mentions after prefix commands."""
+        ctx = MagicMock(valid=True)
+        ctx.author.guild_permissions.administrator = True
+        self.assertEqual(ask_priority(ctx), PRIORITY_HIGH)
+
+        ctx.author.guild_permissions.administrator = False
+        self.assertEqual(ask_priority(ctx), PRIORITY_NORMAL)
+
+        # Mentions are handled as a context without a command prefix
+        ctx.valid = False
+        self.assertEqual(ask_priority(ctx), PRIORITY_LOW)
+
+class TestMonitoring(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the health and metrics endpoints."""
+    
+    async def asyncSetUp(self):
+        """Set up tests."""
+        self.bot = MagicMock()
+        self.bot.is_ready.return_value = True
+        self.bot.is_closed.return_value = False
+        self.bot.latency = 0.05
+        self.bot.guilds = [MagicMock(), MagicMock()]
+        self.registry = MetricsRegistry()
+        self.server = MonitoringServer(self.bot, registry=self.registry)
+        self.client = TestClient(TestServer(self.server.create_app()))
+        await self.client.start_server()
+    
+    async def asyncTearDown(self):
+        """Clean up after tests."""
+        await self.client.close()
+    
+    async def test_ready_needs_gateway_and_database(self):
+        """Test that readiness fails while either the gateway or the database is down."""
+        with patch('src.bot.monitoring.check_database', AsyncMock(return_value=True)):
+            response = await self.client.get('/health')
+            self.assertEqual(response.status, 200)
+            
+            # No heartbeat acknowledged yet
+            self.bot.latency = float('inf')
+            response = await self.client.get('/health/ready')
+            self.assertEqual(response.status, 503)
+            self.assertEqual((await response.json())['checks'], {'gateway': False, 'database': True})
+        
+        # Liveness only needs the event loop
+        response = await self.client.get('/health/live')
+        self.assertEqual(response.status, 200)
+    
+    async def test_metrics_render_histograms_and_collectors(self):
+        """Test that histograms and collected stats are exported in the Prometheus format."""
+        histogram = self.registry.histogram('event_handler_seconds', 'Handler time', ('event',))
+        histogram.labels('on_message').observe(0.003)
+        histogram.labels('on_message').observe(20.0)
+        self.registry.add_collector('ingest_queue', lambda: {'depth': 3, 'model': 'skipped'})
+        self.registry.add_collector('broken', MagicMock(side_effect=RuntimeError('boom')))
+        
+        response = await self.client.get('/metrics')
+        text = await response.text()
+        
+        self.assertEqual(response.status, 200)
+        self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE discord_bot_event_handler_seconds histogram', text)
+        self.assertIn('discord_bot_event_handler_seconds_bucket{event="on_message",le="0.0025"} 0', text)
+        self.assertIn('discord_bot_event_handler_seconds_bucket{event="on_message",le="0.005"} 1', text)
+        self.assertIn('discord_bot_event_handler_seconds_bucket{event="on_message",le="+Inf"} 2', text)
+        self.assertIn('discord_bot_event_handler_seconds_count{event="on_message"} 2', text)
+        self.assertIn('discord_bot_ingest_queue_depth 3', text)
+        self.assertIn('discord_bot_gateway_connected 1', text)
+        self.assertNotIn('model', text)
+        self.assertNotIn('broken', text)
+
+class TestTracing(unittest.IsolatedAsyncioTestCase):
+    """Test cases for request tracing."""
+    
+    async def test_spans_follow_the_request_into_tasks(self):
+        """Test that spans nest under the current span, also in tasks, and slow traces are kept."""
+        tracer = Tracer(slow_trace_ms=0, buffer_size=2)
+        self.assertIs(tracer.span('db.query'), NOOP_SPAN)
+        
+        async def query(n):
+            with tracer.span('db.query', n=n):
+                await asyncio.sleep(0)
+        
+        for _ in range(3):
+            with tracer.trace('ask', guild_id=1) as root:
+                with tracer.span('rag.retrieve') as retrieve:
+                    await asyncio.gather(query(1), query(2))
+                generate = tracer.span('rag.generate')
+                generate.end()
+        
+        traces = tracer.recent_slow_traces()
+        self.assertEqual(len(traces), 2)
+        self.assertIs(traces[0].root, root)
+        parents = {span.name: span.parent_id for span in root.trace.spans}
+        self.assertEqual(parents['rag.retrieve'], root.span_id)
+        self.assertEqual(parents['rag.generate'], root.span_id)
+        self.assertEqual([span.parent_id for span in root.trace.spans if span.name == 'db.query'],
+                         [retrieve.span_id] * 2)
+        self.assertTrue(all(span.duration is not None for span in root.trace.spans))
+        
+        lines = root.trace.format().splitlines()
+        self.assertEqual(lines[0], f"trace {root.trace.trace_id}")
+        self.assertTrue(lines[1].startswith("ask ") and lines[1].endswith("guild_id=1"))
+        self.assertTrue(lines[3].startswith("    db.query "))
+        self.assertEqual(tracer.stats()['traces'], 3)
+    
+    async def test_trace_ids_on_logs_and_otlp_export(self):
+        """Test that log records carry the trace ID and traces are exported as OTLP JSON lines."""
+        import json
+        import logging
+        import tempfile
+        
+        with tempfile.TemporaryDirectory() as directory:
+            export_file = os.path.join(directory, 'traces', 'traces.jsonl')
+            tracer = Tracer(slow_trace_ms=60000, export_file=export_file)
+            log_filter = TraceIdFilter()
+            record = logging.LogRecord('test', logging.INFO, __file__, 1, 'message', None, None)
+            
+            with tracer.trace('ask') as root:
+                log_filter.filter(record)
+                with self.assertRaises(ValueError):
+                    with tracer.span('rag.generate'):
+                        raise ValueError("model unavailable")
+            self.assertEqual(record.trace_id, root.trace.trace_id)
+            log_filter.filter(record)
+            self.assertEqual(record.trace_id, '-')
+            
+            # Written off the event loop
+            await asyncio.sleep(0.1)
+            with open(export_file) as f:
+                exported = [json.loads(line) for line in f]
+        
+        self.assertEqual(tracer.recent_slow_traces(), [])
+        self.assertEqual(len(exported), 1)
+        spans = exported[0]['resourceSpans'][0]['scopeSpans'][0]['spans']
+        self.assertEqual([span['name'] for span in spans], ['ask', 'rag.generate'])
+        self.assertEqual(spans[1]['parentSpanId'], spans[0]['spanId'])
+        self.assertEqual(spans[1]['traceId'], root.trace.trace_id)
+        self.assertEqual(spans[1]['status'], {'code': 2, 'message': 'ValueError: model unavailable'})
+        self.assertGreaterEqual(int(spans[0]['endTimeUnixNano']), int(spans[1]['endTimeUnixNano']))
+
+class TestQueueLogging(unittest.TestCase):
+    """Test cases for the queued logging pipeline."""
+    
+    class Capture(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.records = []
+        
+        def emit(self, record):
+            self.records.append(record)
+    
+    def test_full_queue_drops_and_reports(self):
+        """Test that records beyond the queue capacity are dropped, counted and reported."""
+        queue_handler = BoundedQueueHandler(capacity=2)
+        logger = logging.getLogger('discord_bot.test.queue')
+        logger.propagate = False
+        logger.addHandler(queue_handler)
+        try:
+            for i in range(5):
+                logger.warning("record %d", i)
+        finally:
+            logger.removeHandler(queue_handler)
+        self.assertEqual(queue_handler.stats()['queued'], 2)
+        self.assertEqual(queue_handler.stats()['dropped'], 3)
+        
+        capture = self.Capture()
+        listener = LogListener(queue_handler, capture)
+        listener.start()
+        listener.stop()
+        
+        self.assertEqual([record.getMessage() for record in capture.records],
+                         ["Log queue full, dropped 3 records", "record 0", "record 1"])
+    
+    def test_json_output_keeps_trace_and_traceback(self):
+        """Test that queued records are formatted as JSON with their trace ID and traceback."""
+        import json
+        
+        queue_handler = BoundedQueueHandler()
+        queue_handler.addFilter(TraceIdFilter())
+        tracer = Tracer()
+        logger = logging.getLogger('discord_bot.test.json')
+        logger.propagate = False
+        logger.addHandler(queue_handler)
+        try:
+            with tracer.trace('ask') as root:
+                try:
+                    raise ValueError("connection reset")
+                except ValueError:
+                    logger.exception("Query failed for %s", "guild")
+        finally:
+            logger.removeHandler(queue_handler)
+        
+        entry = json.loads(JsonFormatter().format(queue_handler.queue.get_nowait()))
+        self.assertEqual(entry['message'], "Query failed for guild")
+        self.assertEqual(entry['level'], 'ERROR')
+        self.assertEqual(entry['logger'], 'discord_bot.test.json')
+        self.assertEqual(entry['trace_id'], root.trace.trace_id)
+        self.assertIn("ValueError: connection reset", entry['exception'])
+
+class TestDiscordHandler(unittest.IsolatedAsyncioTestCase):
+    """Test cases for posting errors to a Discord channel."""
+    
+    def setUp(self):
+        self.channel = MagicMock()
+        self.channel.send = AsyncMock()
+        self.bot = MagicMock()
+        self.bot.get_channel.return_value = self.channel
+        self.logger = logging.getLogger('discord_bot.test.discord')
+        self.logger.propagate = False
+    
+    def tearDown(self):
+        self.logger.handlers.clear()
+    
+    async def test_burst_of_errors_becomes_one_post(self):
+        """Test that identical errors are grouped with counts and posted together."""
+        handler = DiscordHandler(self.bot, 42, flush_interval=0.05)
+        self.logger.addHandler(handler)
+        await handler.start()
+        
+        for _ in range(300):
+            self.logger.error("Database query error: connection refused")
+        self.logger.warning("Below the handler level")
+        try:
+            raise TimeoutError("LLM request timed out")
+        except TimeoutError:
+            self.logger.exception("Error generating response")
+        
+        await asyncio.sleep(0.1)
+        await handler.stop()
+        
+        self.bot.get_channel.assert_called_with(42)
+        self.channel.send.assert_awaited_once()
+        post = self.channel.send.await_args.args[0]
+        self.assertTrue(post.startswith("**301 log records"))
+        self.assertIn("×300: Database query error: connection refused", post)
+        self.assertIn("Error generating response\n> TimeoutError: LLM request timed out", post)
+        self.assertNotIn("Below the handler level", post)
+        self.assertEqual(handler.stats(), {'records': 301, 'posts': 1, 'send_errors': 0, 'pending': 0})
+    
+    async def test_summary_fits_one_message(self):
+        """Test that distinct errors beyond the group limit and message size are counted, not posted."""
+        handler = DiscordHandler(self.bot, 42, max_groups=50)
+        self.logger.addHandler(handler)
+        
+        for i in range(60):
+            self.logger.error(f"Error {i}: " + "x" * 200)
+        await handler.flush_to_discord()
+        
+        post = self.channel.send.await_args.args[0]
+        self.assertLessEqual(len(post), DiscordHandler.MESSAGE_LIMIT)
+        shown = post.count("`ERROR`")
+        self.assertTrue(post.endswith(f"…and {60 - shown} more"))
+        
+        # Nothing new, nothing posted
+        await handler.flush_to_discord()
+        self.channel.send.assert_awaited_once()
+
+class TestBackfillEngine(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the concurrent backfill engine."""
+    
+    def setUp(self):
+        """Set up tests."""
+        self.stored = []
+        
+        async def store(message):
+            self.stored.append(message.id)
+            return True
+        
+        self.engine = BackfillEngine(store, concurrency=2, global_rate=1000,
+                                     route_rate=1000, page_size=10)
+    
+    async def test_fetches_all_channels(self):
+        """Test that every message of every channel reaches the store."""
+        channels = [FakeChannel(1, range(1, 26)), FakeChannel(2, range(100, 105))]
+        
+        report = await self.engine.run(channels, fetch_limit=None)
+        
+        self.assertEqual(report.fetched, 30)
+        self.assertEqual(report.stored, 30)
+        self.assertEqual(sorted(self.stored), list(range(1, 26)) + list(range(100, 105)))
+        self.assertEqual(report.channels[1].pages, 3)
+        self.assertEqual(report.channels[1].status, 'complete')
+        self.assertGreater(report.messages_per_second, 0)
+    
+    async def test_respects_fetch_limit(self):
+        """Test that fetch_limit caps messages per channel."""
+        channel = FakeChannel(1, range(1, 50))
+        
+        report = await self.engine.run([channel], fetch_limit=15)
+        
+        self.assertEqual(report.fetched, 15)
+        self.assertEqual([call['limit'] for call in channel.calls], [10, 5])
+        # Pages continue from the oldest message of the previous page
+        self.assertEqual(channel.calls[1]['before'].id, 40)
+    
+    async def test_forbidden_channel_does_not_stop_run(self):
+        """Test that a channel without permissions is skipped."""
+        channels = [FakeChannel(1, [], forbidden=True), FakeChannel(2, range(1, 4))]
+        
+        report = await self.engine.run(channels)
+        
+        self.assertEqual(report.channels[1].status, 'forbidden')
+        self.assertEqual(report.channels[2].status, 'complete')
+        self.assertEqual(report.stored, 3)
+    
+    async def test_store_failures_are_counted(self):
+        """Test that failed writes are reported rather than raised."""
+        async def failing_store(message):
+            raise RuntimeError('database unavailable')
+        
+        engine = BackfillEngine(failing_store, global_rate=1000, route_rate=1000)
+        report = await engine.run([FakeChannel(1, range(1, 6))])
+        
+        self.assertEqual(report.failed, 5)
+        self.assertEqual(report.stored, 0)
+    
+    async def test_checkpoints_follow_written_pages(self):
+        """Test that a fresh run flushes before replacing each channel's checkpoint."""
+        flush = AsyncMock(return_value=True)
+        save_checkpoint = AsyncMock(return_value=True)
+        engine = BackfillEngine(AsyncMock(return_value=True), global_rate=1000, route_rate=1000,
+                                page_size=10, flush=flush, save_checkpoint=save_checkpoint)
+        
+        await engine.run([FakeChannel(1, range(1, 26))], fetch_limit=None)
+        
+        flush.assert_awaited()
+        save_checkpoint.assert_awaited_once_with(1, None, 1, 25, True, replace=True)
+    
+    async def test_limited_fetch_is_not_complete(self):
+        """Test that stopping at fetch_limit leaves the history incomplete."""
+        save_checkpoint = AsyncMock(return_value=True)
+        engine = BackfillEngine(AsyncMock(return_value=True), global_rate=1000, route_rate=1000,
+                                page_size=10, save_checkpoint=save_checkpoint)
+        
+        await engine.run([FakeChannel(1, range(1, 26))], fetch_limit=10)
+        
+        save_checkpoint.assert_awaited_once_with(1, None, 16, 25, False, replace=True)
+    
+    async def test_failed_flush_postpones_checkpoint(self):
+        """Test that checkpoints are not saved when the written data is not durable."""
+        save_checkpoint = AsyncMock(return_value=True)
+        engine = BackfillEngine(AsyncMock(return_value=True), global_rate=1000, route_rate=1000,
+                                flush=AsyncMock(return_value=False), save_checkpoint=save_checkpoint)
+        
+        await engine.run([FakeChannel(1, range(1, 6))])
+        
+        save_checkpoint.assert_not_awaited()
+    
+    async def test_messages_dropped_by_writer_are_never_checkpointed(self):
+        """Test that no checkpoint covers messages the writer dropped between failed and successful flushes."""
+        save_checkpoint = AsyncMock(return_value=True)
+        writer = BulkWriter(batch_size=100, max_pending=15)
+        # Two failed flushes overflow the writer's backlog, then the database recovers
+        writer._copy = AsyncMock(side_effect=[RuntimeError('down'), RuntimeError('down'), None, None, None])
+        engine = BackfillEngine(writer.add, global_rate=1000, route_rate=1000, page_size=10,
+                                flush=_checkpoint_flush(writer), save_checkpoint=save_checkpoint,
+                                checkpoint_interval=0)
+        
+        with patch('src.database.bulk.message_to_record', side_effect=lambda message: (message.id,)), \
+             patch('src.database.bulk.attachment_to_records', return_value=[]):
+            await engine.run([FakeChannel(1, range(1, 41))], fetch_limit=None)
+        
+        self.assertEqual(writer.failed_flushes, 2)
+        self.assertGreater(writer.dropped_messages, 0)
+        save_checkpoint.assert_not_awaited()
+    
+    async def test_checkpoint_flush_without_drops_allows_checkpoints(self):
+        """Test that a successful flush without dropped messages lets checkpoints be saved."""
+        writer = BulkWriter(batch_size=100)
+        writer._copy = AsyncMock(side_effect=[RuntimeError('down'), None])
+        flush = _checkpoint_flush(writer)
+        writer._messages[1] = (1,)
+        
+        self.assertFalse(await flush())
+        self.assertTrue(await flush())
+    
+    async def test_resume_fetches_delta_then_older_history(self):
+        """Test that resuming fetches newer messages and continues below the checkpoint."""
+        save_checkpoint = AsyncMock(return_value=True)
+        engine = BackfillEngine(self.engine.store, global_rate=1000, route_rate=1000,
+                                page_size=10, save_checkpoint=save_checkpoint)
+        channel = FakeChannel(1, range(1, 41))
+        checkpoints = {1: {'oldest_message_id': 21, 'newest_message_id': 30, 'history_complete': False}}
+        
+        report = await engine.run([channel], fetch_limit=None, checkpoints=checkpoints)
+        
+        self.assertEqual(sorted(self.stored), list(range(1, 21)) + list(range(31, 41)))
+        self.assertEqual(report.fetched, 30)
+        self.assertTrue(channel.calls[0]['oldest_first'])
+        self.assertEqual(channel.calls[0]['after'].id, 30)
+        save_checkpoint.assert_awaited_once_with(1, None, 1, 40, True, replace=False)
+    
+    async def test_resume_complete_channel_only_fetches_delta(self):
+        """Test that a channel with complete history only fetches new messages."""
+        channel = FakeChannel(1, range(1, 31))
+        checkpoints = {1: {'oldest_message_id': 1, 'newest_message_id': 25, 'history_complete': True}}
+        
+        report = await self.engine.run([channel], checkpoints=checkpoints)
+        
+        self.assertEqual(sorted(self.stored), list(range(26, 31)))
+        self.assertEqual(len(channel.calls), 1)
+    
+    async def test_rate_limiter_paces_requests(self):
+        """Test that the token bucket delays acquisitions beyond the burst."""
+        limiter = RateLimiter(rate=100, burst=1)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for _ in range(5):
+            await limiter.acquire()
+        self.assertGreaterEqual(loop.time() - start, 0.035)
+
+class TestStreamingReply(unittest.IsolatedAsyncioTestCase):
+    """Test cases for progressively edited replies."""
+    
+    def setUp(self):
+        """Set up a fake reply target."""
+        self.sent = []
+        
+        async def send(content):
+            message = MagicMock()
+            message.edit = AsyncMock()
+            self.sent.append((content, message))
+            return message
+        
+        self.send = send
+    
+    async def test_first_piece_is_sent_and_edits_are_throttled(self):
+        """Test that the reply appears at once and is only edited when the interval allows."""
+        reply = StreamingReply(self.send, edit_interval=60)
+        
+        await reply.append("The release")
+        await reply.append(" is on")
+        await reply.append(" Friday.")
+        text = await reply.finish()
+        
+        self.assertEqual(text, "The release is on Friday.")
+        self.assertEqual([content for content, _ in self.sent], ["The release"])
+        # Only the final update edits the message
+        self.sent[0][1].edit.assert_awaited_once_with(content="The release is on Friday.")
+    
+    async def test_long_replies_continue_in_new_messages(self):
+        """Test that text beyond the message limit is split on word boundaries."""
+        reply = StreamingReply(self.send, edit_interval=0)
+        
+        for _ in range(500):
+            await reply.append("word ")
+        await reply.finish()
+        
+        chunks = split_message(reply.text)
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue(all(len(chunk) <= 1990 and chunk.endswith(" ") for chunk in chunks))
+        self.assertEqual(len(self.sent), 2)
+        self.sent[0][1].edit.assert_awaited_with(content=chunks[0])
+        self.sent[1][1].edit.assert_awaited_with(content=chunks[1])
+
 if __name__ == '__main__':
     unittest.main()
@@ -5,6 +5,7 @@ from unittest.mock import MagicMock, patch, AsyncMock
 import sys
 import os
 import datetime
+import tempfile
 from pathlib import Path
 import asyncpg
 
@@ -17,8 +18,48 @@ from src.database.operations import (
     update_message,
     get_messages_by_date,
     get_messages_by_content,
+    get_message_context,
+    iter_messages,
+    get_messages_for_rag,
     get_database_stats
 )
+from src.database.bulk import BulkWriter
+from src.database.ingest import IngestQueue
+from src.database import partitions
+from src.database.instrumentation import QueryMonitor, count_rows, LATENCY_BUCKETS_MS
+from src.database.statements import STATEMENTS
+from src.database.connection import execute_statement
+from src.database.export import ExportTask, export_filter, plan_export, copy_jsonl, copy_parquet
+
+def make_mock_pool():
+    """Create a mock pool whose acquire() and transaction() work as async context managers."""
+    conn = AsyncMock()
+    conn.transaction = MagicMock()
+    conn.transaction.return_value.__aenter__ = AsyncMock()
+    conn.transaction.return_value.__aexit__ = AsyncMock(return_value=False)
+    pool = MagicMock()
+    pool.acquire.return_value.__aenter__ = AsyncMock(return_value=conn)
+    pool.acquire.return_value.__aexit__ = AsyncMock(return_value=False)
+    return pool, conn
+
+def make_mock_message(message_id, content='hello', attachments=()):
+    """Create a mock Discord message with the attributes used for storage."""
+    message = MagicMock(spec=discord.Message)
+    message.id = message_id
+    message.channel = MagicMock(spec=discord.TextChannel)
+    message.channel.id = 987654321
+    message.channel.name = 'test-channel'
+    message.guild = MagicMock(spec=discord.Guild)
+    message.guild.id = 111222333
+    message.author = MagicMock(spec=discord.Member)
+    message.author.id = 444555666
+    message.author.name = 'Test User'
+    message.content = content
+    message.created_at = datetime.datetime.now(datetime.timezone.utc)
+    message.pinned = False
+    message.attachments = list(attachments)
+    message.reference = None
+    return message
 
 class TestDatabaseConnection(unittest.IsolatedAsyncioTestCase):
     """Test cases for database connection functionality."""
@@ -90,6 +131,110 @@ class TestDatabaseConnection(unittest.IsolatedAsyncioTestCase):
         expected_calls = len(get_schema_creation_commands())
         self.assertGreaterEqual(mock_conn.execute.call_count, expected_calls)
 
+class TestQueryMonitor(unittest.IsolatedAsyncioTestCase):
+    """Test cases for query instrumentation."""
+    
+    def test_statements_are_timed_and_counted(self):
+        """Test per-statement histograms, row counts and the statement ranking."""
+        monitor = QueryMonitor(slow_query_ms=0)
+        for elapsed in (0.0005, 0.003, 0.003, 0.2):
+            monitor.record("SELECT *\n  FROM messages WHERE guild_id = $1", (1,), elapsed, rows=20)
+        monitor.record("UPDATE messages SET pinned = $1", (True,), 0.001, rows=None,
+                       error=asyncpg.PostgresError('boom'))
+        
+        histogram = monitor.histogram("SELECT * FROM messages WHERE guild_id = $1")
+        self.assertEqual(histogram[0], 1)
+        self.assertEqual(histogram[LATENCY_BUCKETS_MS.index(5)], 2)
+        self.assertEqual(histogram[LATENCY_BUCKETS_MS.index(250)], 1)
+        
+        stats = monitor.stats()
+        self.assertEqual((stats['queries'], stats['errors'], stats['statements']), (5, 1, 2))
+        select = stats['by_statement'][0]
+        self.assertEqual(select['statement'], "SELECT * FROM messages WHERE guild_id = $1")
+        self.assertEqual((select['calls'], select['rows'], select['p50_ms'], select['p95_ms']),
+                         (4, 80, 5.0, 250.0))
+        self.assertEqual(stats['by_statement'][1]['errors'], 1)
+        
+        self.assertEqual(count_rows([1, 2, 3]), 3)
+        self.assertEqual(count_rows('INSERT 0 5'), 5)
+        self.assertIsNone(count_rows('CREATE TABLE'))
+        self.assertEqual(count_rows(None), 0)
+    
+    def test_slow_and_sampled_queries_are_logged(self):
+        """Test that only slow queries and the sample are logged, with shortened arguments."""
+        monitor = QueryMonitor(slow_query_ms=100, sample_rate=0.0)
+        with self.assertLogs('discord_bot.database.queries', level='INFO') as logs:
+            monitor.record("SELECT 1", ('x' * 500,), 0.01, rows=1)
+            monitor.record("SELECT 2", ('x' * 500, list(range(1000))), 0.25, rows=1)
+            monitor.sample_rate = 1.0
+            monitor.record("SELECT 3", (), 0.01, rows=1)
+        
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(logs.records[0].levelname, 'WARNING')
+        self.assertIn('Slow query (250.0ms, 1 rows): SELECT 2', logs.output[0])
+        self.assertLess(len(logs.output[0]), 300)
+        self.assertEqual(logs.records[1].levelname, 'INFO')
+        self.assertEqual((monitor.slow_queries, monitor.sampled), (1, 1))
+    
+    async def test_execute_query_records_without_logging_results(self):
+        """Test that execute_query reports to the monitor instead of logging every result."""
+        conn = AsyncMock()
+        conn.fetch.return_value = [{'message_id': 1}, {'message_id': 2}]
+        pool = MagicMock()
+        pool.acquire.return_value.__aenter__.return_value = conn
+        monitor = QueryMonitor(slow_query_ms=0)
+        
+        with patch('src.database.connection.get_db_pool', AsyncMock(return_value=pool)), \
+                patch('src.database.connection.get_query_monitor', return_value=monitor), \
+                self.assertNoLogs('discord_bot.database', level='INFO'):
+            result = await execute_query("SELECT message_id FROM messages", fetch=True)
+        
+        self.assertEqual(len(result), 2)
+        self.assertEqual(monitor.stats()['by_statement'][0]['rows'], 2)
+
+class TestStatements(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the registry of hot statements."""
+    
+    async def test_optional_filters_keep_one_statement_text(self):
+        """Test that optional filters are parameters rather than variations of the text."""
+        self.assertIn("COALESCE($2::timestamptz, '-infinity')", STATEMENTS['messages_for_rag'])
+        self.assertIn('$2::bigint IS NULL OR channel_id = $2', STATEMENTS['messages_by_content'])
+        
+        with patch('src.database.operations.execute_statement') as mock_execute_statement:
+            mock_execute_statement.return_value = []
+            await get_messages_for_rag(1, 'release date', max_days=None)
+            await get_messages_for_rag(1, 'release date', max_days=7)
+        
+        without_cutoff, with_cutoff = [call.args for call in mock_execute_statement.call_args_list]
+        self.assertEqual(without_cutoff[:3], ('messages_for_rag', 1, None))
+        self.assertEqual(with_cutoff[0], 'messages_for_rag')
+        self.assertIsNotNone(with_cutoff[2].tzinfo)
+    
+    async def test_channel_filter_of_date_scans_has_its_own_text(self):
+        """Test that a channel-narrowed date scan names its channel in an index-usable filter."""
+        self.assertIn('AND channel_id = $2', STATEMENTS['channel_messages_by_date'])
+        self.assertNotIn('channel_id', STATEMENTS['messages_by_date'].split('WHERE')[1])
+        start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        end = start + datetime.timedelta(days=1)
+        
+        with patch('src.database.operations.execute_statement') as mock_execute_statement:
+            mock_execute_statement.return_value = []
+            await get_messages_by_date(1, start, end)
+            await get_messages_by_date(1, start, end, channel_id=5)
+        
+        all_channels, one_channel = [call.args for call in mock_execute_statement.call_args_list]
+        self.assertEqual(all_channels, ('messages_by_date', 1, start, end, 100))
+        self.assertEqual(one_channel, ('channel_messages_by_date', 1, 5, start, end, 100))
+    
+    async def test_execute_statement_sends_registered_text(self):
+        """Test that a statement runs with its registered text and parameters."""
+        with patch('src.database.connection.execute_query', AsyncMock(return_value=[])) as mock_execute_query:
+            await execute_statement('messages_by_ids', [1, 2], fetch=True)
+        
+        mock_execute_query.assert_awaited_once_with(
+            STATEMENTS['messages_by_ids'], [1, 2], fetch=True, fetch_one=False, fetch_val=False
+        )
+
 class TestDatabaseOperations(unittest.IsolatedAsyncioTestCase):
     """Test cases for database operations."""
     
@@ -98,6 +243,9 @@ class TestDatabaseOperations(unittest.IsolatedAsyncioTestCase):
         # Mock the execute_query function
         self.execute_query_patcher = patch('src.database.operations.execute_query')
         self.mock_execute_query = self.execute_query_patcher.start()
+        # Hot queries run as registered prepared statements
+        self.execute_statement_patcher = patch('src.database.operations.execute_statement')
+        self.mock_execute_statement = self.execute_statement_patcher.start()
         
         # Create a mock Discord message
         self.mock_message = MagicMock(spec=discord.Message)
@@ -119,37 +267,38 @@ class TestDatabaseOperations(unittest.IsolatedAsyncioTestCase):
     def tearDown(self):
         """Clean up after tests."""
         self.execute_query_patcher.stop()
+        self.execute_statement_patcher.stop()
     
     async def test_store_message(self):
         """Test storing a message."""
         # Set up mock return value
-        self.mock_execute_query.return_value = self.mock_message.id
+        self.mock_execute_statement.return_value = self.mock_message.id
         
         # Call store_message
         result = await store_message(self.mock_message)
         
-        # Verify execute_query was called
-        self.mock_execute_query.assert_called_once()
+        # Verify the statement was executed
+        self.mock_execute_statement.assert_called_once()
         
         # Verify result
         self.assertTrue(result)
         
         # Check query contains expected values
-        query_args = self.mock_execute_query.call_args.args
-        self.assertIn('INSERT INTO messages', query_args[0])
+        query_args = self.mock_execute_statement.call_args.args
+        self.assertEqual(query_args[0], 'store_message')
         self.assertEqual(query_args[1], self.mock_message.id)
         self.assertEqual(query_args[2], self.mock_message.channel.id)
     
     async def test_update_message(self):
         """Test updating a message."""
         # Set up mock return value
-        self.mock_execute_query.return_value = self.mock_message.id
+        self.mock_execute_statement.return_value = self.mock_message.id
         
         # Call update_message
         result = await update_message(self.mock_message)
         
-        # Verify execute_query was called
-        self.mock_execute_query.assert_called_once()
+        # Verify the statement was executed
+        self.mock_execute_statement.assert_called_once()
         
         # Verify result
         self.assertTrue(result)
@@ -161,7 +310,7 @@ class TestDatabaseOperations(unittest.IsolatedAsyncioTestCase):
             {'message_id': 1, 'content': 'Test 1'},
             {'message_id': 2, 'content': 'Test 2'}
         ]
-        self.mock_execute_query.return_value = [
+        self.mock_execute_statement.return_value = [
             MagicMock(**record) for record in mock_records
         ]
         
@@ -172,8 +321,8 @@ class TestDatabaseOperations(unittest.IsolatedAsyncioTestCase):
             start_date=start_date
         )
         
-        # Verify execute_query was called
-        self.mock_execute_query.assert_called_once()
+        # Verify the statement was executed
+        self.mock_execute_statement.assert_called_once()
         
         # Verify result
         self.assertEqual(len(result), 2)
@@ -187,7 +336,7 @@ class TestDatabaseOperations(unittest.IsolatedAsyncioTestCase):
             {'message_id': 1, 'content': 'Test search term'},
             {'message_id': 2, 'content': 'Another test with search term'}
         ]
-        self.mock_execute_query.return_value = [
+        self.mock_execute_statement.return_value = [
             MagicMock(**record) for record in mock_records
         ]
         
@@ -197,8 +346,8 @@ class TestDatabaseOperations(unittest.IsolatedAsyncioTestCase):
             search_text='search term'
         )
         
-        # Verify execute_query was called
-        self.mock_execute_query.assert_called_once()
+        # Verify the statement was executed
+        self.mock_execute_statement.assert_called_once()
         
         # Verify result
         self.assertEqual(len(result), 2)
@@ -232,6 +381,412 @@ class TestDatabaseOperations(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(len(result['channel_stats']), 3)
         self.assertEqual(result['channel_stats'][0], ('channel1', 50))
         self.assertEqual(result['attachment_count'], 10)
+    
+    async def test_get_message_context(self):
+        """Test that the conversation around hits is fetched in one query."""
+        self.mock_execute_statement.return_value = [{'hit_id': 1, 'message_id': 2, 'content': 'a reply'}]
+        hits = [
+            {'message_id': 1, 'channel_id': 10, 'timestamp': datetime.datetime(2024, 1, 1)},
+            {'message_id': 5, 'channel_id': 11, 'timestamp': datetime.datetime(2024, 1, 2)}
+        ]
+        
+        result = await get_message_context(hits, window=3, reply_depth=4,
+                                           max_gap=datetime.timedelta(minutes=30))
+        
+        self.mock_execute_statement.assert_called_once()
+        args = self.mock_execute_statement.call_args[0]
+        self.assertEqual(args, (
+            'message_context',
+            [1, 5], [10, 11], [datetime.datetime(2024, 1, 1), datetime.datetime(2024, 1, 2)],
+            4, 3, datetime.timedelta(minutes=30)
+        ))
+        self.assertEqual(result, [{'hit_id': 1, 'message_id': 2, 'content': 'a reply'}])
+        
+        # Nothing to expand, nothing to query
+        self.assertEqual(await get_message_context([]), [])
+        self.mock_execute_statement.assert_called_once()
+
+    async def test_iter_messages_pages_by_keyset(self):
+        """Test that a scan resumes each page after the last row of the previous one."""
+        t1 = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        t2 = datetime.datetime(2024, 1, 2, tzinfo=datetime.timezone.utc)
+        self.mock_execute_statement.side_effect = [
+            [{'message_id': 1, 'timestamp': t1}, {'message_id': 2, 'timestamp': t1}],
+            [{'message_id': 3, 'timestamp': t2}]
+        ]
+        
+        messages = [message async for message in iter_messages(111222333, channel_id=5, page_size=2)]
+        
+        self.assertEqual([message['message_id'] for message in messages], [1, 2, 3])
+        # A short page ends the scan without another query
+        self.assertEqual(self.mock_execute_statement.call_count, 2)
+        first, second = (call[0] for call in self.mock_execute_statement.call_args_list)
+        self.assertEqual(first[0], 'channel_messages_page')
+        self.assertEqual(first[1:4], (111222333, 5, None))
+        self.assertEqual(first[6:], (-1, 2))
+        self.assertEqual(second[5:], (t1, 2, 2))
+    
+    async def test_iter_messages_raises_on_error(self):
+        """Test that a failed page interrupts the scan instead of ending it quietly."""
+        self.mock_execute_statement.side_effect = [
+            [{'message_id': 1, 'timestamp': datetime.datetime(2024, 1, 1)}],
+            asyncpg.PostgresError('connection lost')
+        ]
+        
+        seen = []
+        with self.assertRaises(asyncpg.PostgresError):
+            async for message in iter_messages(111222333, page_size=1):
+                seen.append(message['message_id'])
+        self.assertEqual(seen, [1])
+        # Without a channel the scan leaves the channel out of its statement
+        self.assertEqual(self.mock_execute_statement.call_args_list[0][0][:2], ('messages_page', 111222333))
+
+class TestBulkWriter(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the COPY-based bulk writer."""
+    
+    def setUp(self):
+        """Set up tests."""
+        self.pool, self.conn = make_mock_pool()
+        self.pool_patcher = patch('src.database.bulk.get_db_pool', AsyncMock(return_value=self.pool))
+        self.pool_patcher.start()
+    
+    def tearDown(self):
+        """Clean up after tests."""
+        self.pool_patcher.stop()
+    
+    async def test_flush_copies_batch_and_upserts(self):
+        """Test that a flush uses COPY into staging and a single upsert."""
+        writer = BulkWriter(batch_size=10)
+        await writer.add(make_mock_message(1))
+        await writer.add(make_mock_message(2))
+        
+        # Nothing is written until the batch is flushed
+        self.conn.copy_records_to_table.assert_not_called()
+        
+        written = await writer.flush()
+        
+        self.assertEqual(written, 2)
+        self.conn.copy_records_to_table.assert_called_once()
+        self.assertEqual(self.conn.copy_records_to_table.call_args.args[0], 'message_staging')
+        records = self.conn.copy_records_to_table.call_args.kwargs['records']
+        self.assertEqual([record[0] for record in records], [1, 2])
+        executed = [call.args[0] for call in self.conn.execute.call_args_list]
+        self.assertTrue(any('INSERT INTO messages' in query for query in executed))
+        self.assertEqual(writer.pending, 0)
+    
+    async def test_full_batch_flushes_automatically(self):
+        """Test that reaching batch_size triggers a flush."""
+        writer = BulkWriter(batch_size=3)
+        for message_id in range(1, 8):
+            await writer.add(make_mock_message(message_id))
+        
+        self.assertEqual(self.conn.copy_records_to_table.call_count, 2)
+        self.assertEqual(writer.flushed_messages, 6)
+        self.assertEqual(writer.pending, 1)
+    
+    async def test_duplicate_messages_keep_latest_version(self):
+        """Test that a message added twice in a batch is upserted once with its latest content."""
+        writer = BulkWriter(batch_size=10)
+        await writer.add(make_mock_message(1, content='original'))
+        await writer.add(make_mock_message(1, content='edited'))
+        await writer.flush()
+        
+        records = self.conn.copy_records_to_table.call_args.kwargs['records']
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0][6], 'edited')
+    
+    async def test_attachments_are_staged(self):
+        """Test that attachments are copied into their own staging table."""
+        attachment = MagicMock(id=55, filename='a.png', url='https://cdn/a.png', content_type='image/png',
+                               width=10, height=10, size=100, proxy_url='https://proxy/a.png', description=None)
+        writer = BulkWriter(batch_size=10)
+        await writer.add(make_mock_message(1, attachments=[attachment]))
+        await writer.flush()
+        
+        tables = [call.args[0] for call in self.conn.copy_records_to_table.call_args_list]
+        self.assertEqual(tables, ['message_staging', 'attachment_staging'])
+    
+    async def test_failed_flush_keeps_batch_for_retry(self):
+        """Test that a failed flush re-queues its messages and notifies no listeners."""
+        listener = AsyncMock()
+        writer = BulkWriter(batch_size=10)
+        writer.add_flush_listener(listener)
+        self.conn.copy_records_to_table.side_effect = asyncpg.PostgresError('boom')
+        
+        await writer.add(make_mock_message(1))
+        self.assertEqual(await writer.flush(), 0)
+        self.assertEqual(writer.pending, 1)
+        self.assertEqual(writer.failed_flushes, 1)
+        listener.assert_not_called()
+        
+        self.conn.copy_records_to_table.side_effect = None
+        self.assertEqual(await writer.flush(), 1)
+        listener.assert_awaited_once()
+    
+    async def test_partitions_are_only_created_after_a_failed_insert(self):
+        """Test that a flush attaches a missing month's partition and retries once."""
+        writer = BulkWriter(batch_size=10)
+        with patch('src.database.bulk.ensure_message_partitions', AsyncMock()) as ensure:
+            await writer.add(make_mock_message(1))
+            self.assertEqual(await writer.flush(), 1)
+            ensure.assert_not_called()
+            
+            message = make_mock_message(2)
+            self.conn.copy_records_to_table.side_effect = [asyncpg.CheckViolationError('no partition'), None]
+            await writer.add(message)
+            self.assertEqual(await writer.flush(), 1)
+            
+            ensure.assert_awaited_once_with(self.conn, {message.created_at})
+            self.assertEqual(writer.failed_flushes, 0)
+
+class TestIngestQueue(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the write-behind ingest queue."""
+    
+    def setUp(self):
+        """Set up tests."""
+        self.writer = MagicMock()
+        self.writer.failed_flushes = 0
+        self.writer.dropped_messages = 0
+        self.writer.pending = 0
+        self.writer.max_pending = 1000
+        self.writer.flush = AsyncMock(return_value=1)
+    
+    async def test_submit_does_not_wait_for_database(self):
+        """Test that submitting only queues the message."""
+        queue = IngestQueue(self.writer, maxsize=10)
+        
+        self.assertTrue(queue.submit(make_mock_message(1)))
+        
+        self.assertEqual(queue.depth, 1)
+        self.writer.flush.assert_not_called()
+    
+    async def test_full_queue_drops_and_counts(self):
+        """Test that a full queue rejects messages instead of blocking."""
+        queue = IngestQueue(self.writer, maxsize=2)
+        
+        results = [queue.submit(make_mock_message(i)) for i in range(4)]
+        
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(queue.stats()['dropped'], 2)
+        self.assertEqual(queue.stats()['high_water_mark'], 2)
+    
+    async def test_burst_is_coalesced_into_batches(self):
+        """Test that queued messages are flushed together in batches of batch_size."""
+        queue = IngestQueue(self.writer, maxsize=100, batch_size=4)
+        for i in range(10):
+            queue.submit(make_mock_message(i))
+        
+        queue.start()
+        await queue.close()
+        
+        self.assertEqual(self.writer.buffer.call_count, 10)
+        self.assertEqual(self.writer.flush.await_count, 3)
+        self.assertEqual(queue.stats()['written'], 10)
+        self.assertEqual(queue.depth, 0)
+    
+    async def test_close_drains_without_flusher(self):
+        """Test that closing writes queued messages even if the flusher never ran."""
+        queue = IngestQueue(self.writer, maxsize=100, batch_size=100)
+        for i in range(3):
+            queue.submit(make_mock_message(i))
+        
+        await queue.close()
+        
+        self.assertEqual(queue.stats()['written'], 3)
+        self.assertFalse(queue.submit(make_mock_message(99)))
+    
+    async def test_full_writer_backlog_holds_messages_in_queue(self):
+        """Test that failed flushes make the queue drop new messages instead of the writer dropping old ones."""
+        writer = BulkWriter(batch_size=2, max_pending=4)
+        writer._copy = AsyncMock(side_effect=RuntimeError('database down'))
+        queue = IngestQueue(writer, maxsize=3, batch_size=2, retry_interval=0.01)
+        queue.start()
+        
+        for i in range(12):
+            queue.submit(make_mock_message(i))
+            await asyncio.sleep(0.01)
+        
+        stats = queue.stats()
+        self.assertEqual((stats['writer_dropped'], stats['writer_pending']), (0, 4))
+        self.assertGreater(stats['dropped'], 0)
+        
+        writer._copy.side_effect = None
+        await queue.close()
+        self.assertEqual(queue.stats()['writer_pending'], 0)
+        self.assertEqual(writer.flushed_messages, 12 - stats['dropped'])
+
+class TestPartitions(unittest.IsolatedAsyncioTestCase):
+    """Test cases for monthly message partitions."""
+    
+    def setUp(self):
+        """Set up tests."""
+        self.pool, self.conn = make_mock_pool()
+        self.conn.fetchval.return_value = 'p'
+        partitions._known_partitions.clear()
+        partitions._partitioned = None
+    
+    def tearDown(self):
+        """Clean up after tests."""
+        partitions._known_partitions.clear()
+        partitions._partitioned = None
+    
+    def test_month_helpers(self):
+        """Test month arithmetic and partition naming."""
+        # 23:30 on Jan 31st in UTC-5 is already February in UTC
+        value = datetime.datetime(2024, 1, 31, 23, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=-5)))
+        self.assertEqual(partitions.month_start(value), datetime.date(2024, 2, 1))
+        self.assertEqual(partitions.add_months(datetime.date(2024, 11, 1), 3), datetime.date(2025, 2, 1))
+        self.assertEqual(partitions.add_months(datetime.date(2024, 1, 1), -1), datetime.date(2023, 12, 1))
+        self.assertEqual(partitions.partition_name(datetime.date(2024, 3, 1)), 'messages_y2024m03')
+    
+    async def test_ensure_creates_each_month_once(self):
+        """Test that missing partitions are created once per month."""
+        timestamps = [
+            datetime.datetime(2023, 5, 2, tzinfo=datetime.timezone.utc),
+            datetime.datetime(2023, 5, 20, tzinfo=datetime.timezone.utc),
+            datetime.datetime(2023, 7, 1, tzinfo=datetime.timezone.utc)
+        ]
+        
+        await partitions.ensure_message_partitions(self.conn, timestamps)
+        await partitions.ensure_message_partitions(self.conn, timestamps)
+        
+        created = [call.args[0] for call in self.conn.execute.call_args_list]
+        self.assertEqual(len(created), 2)
+        self.assertIn('messages_y2023m05', created[0])
+        self.assertIn("FROM ('2023-05-01 00:00:00+00') TO ('2023-06-01 00:00:00+00')", created[0])
+        self.assertIn('messages_y2023m07', created[1])
+    
+    async def test_ensure_skips_unpartitioned_table(self):
+        """Test that nothing is created for a table created before partitioning."""
+        self.conn.fetchval.return_value = 'r'
+        
+        await partitions.ensure_message_partitions(
+            self.conn, [datetime.datetime(2023, 5, 2, tzinfo=datetime.timezone.utc)]
+        )
+        
+        self.conn.execute.assert_not_called()
+    
+    async def test_create_upcoming_partitions(self):
+        """Test that the current and upcoming months get partitions."""
+        await partitions.create_upcoming_partitions(self.conn, 2, today=datetime.date(2024, 12, 15))
+        
+        created = ' '.join(call.args[0] for call in self.conn.execute.call_args_list)
+        for name in ('messages_y2024m12', 'messages_y2025m01', 'messages_y2025m02'):
+            self.assertIn(name, created)
+        self.assertNotIn('messages_y2025m03', created)
+    
+    def test_deleting_a_message_deletes_its_attachments(self):
+        """Test that the schema replaces the attachments foreign key with a delete trigger."""
+        from src.database.models import (
+            get_schema_creation_commands,
+            ATTACHMENTS_TABLE,
+            ATTACHMENTS_CLEANUP_FUNCTION,
+            ATTACHMENTS_CLEANUP_TRIGGER
+        )
+        
+        commands = get_schema_creation_commands()
+        self.assertLess(commands.index(ATTACHMENTS_TABLE), commands.index(ATTACHMENTS_CLEANUP_TRIGGER))
+        self.assertLess(commands.index(ATTACHMENTS_CLEANUP_FUNCTION), commands.index(ATTACHMENTS_CLEANUP_TRIGGER))
+        self.assertIn('AFTER DELETE ON messages', ATTACHMENTS_CLEANUP_TRIGGER)
+        self.assertIn('DELETE FROM attachments', ATTACHMENTS_CLEANUP_FUNCTION)
+    
+    async def test_maintenance_creates_upcoming_partitions_periodically(self):
+        """Test that the maintenance task keeps creating upcoming partitions until stopped."""
+        created = asyncio.Event()
+        
+        async def create_upcoming(conn, months_ahead):
+            created.set()
+        
+        with patch.dict(os.environ, {'DB_PARTITION_CHECK_INTERVAL': '0', 'DB_PARTITION_MONTHS_AHEAD': '2'}), \
+             patch('src.database.connection.get_db_pool', AsyncMock(return_value=self.pool)), \
+             patch('src.database.partitions.create_upcoming_partitions', AsyncMock(side_effect=create_upcoming)) as create:
+            partitions.start_partition_maintenance()
+            await asyncio.wait_for(created.wait(), 1)
+            await partitions.stop_partition_maintenance()
+        
+        create.assert_awaited_with(self.conn, 2)
+        self.assertIsNone(partitions._maintenance_task)
+
+class TestExport(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the archive export."""
+    
+    def setUp(self):
+        """Set up tests."""
+        self.pool, self.conn = make_mock_pool()
+        partitions._partitioned = None
+    
+    def tearDown(self):
+        """Clean up after tests."""
+        partitions._partitioned = None
+    
+    def test_export_filter(self):
+        """Test that only the given filters become conditions."""
+        since = datetime.datetime(2024, 2, 1, tzinfo=datetime.timezone.utc)
+        self.assertEqual(export_filter(), ('TRUE', []))
+        self.assertEqual(export_filter(guild_id=1, since=since),
+                         ('guild_id = $1 AND timestamp >= $2', [1, since]))
+    
+    async def test_plan_skips_partitions_outside_range(self):
+        """Test that one task is planned per partition overlapping the time range."""
+        self.conn.fetchval.return_value = 'p'
+        self.conn.fetch.return_value = [
+            {'relname': name} for name in
+            ('messages_default', 'messages_y2024m01', 'messages_y2024m02', 'messages_y2024m03', 'messages_y2024m04')
+        ]
+        since = datetime.datetime(2024, 2, 10, tzinfo=datetime.timezone.utc)
+        until = datetime.datetime(2024, 4, 1, tzinfo=datetime.timezone.utc)
+        where, args = export_filter(guild_id=1, since=since, until=until)
+        
+        tasks = await plan_export(self.conn, where, args, since, until)
+        
+        self.assertEqual([task.relation for task in tasks],
+                         ['messages_default', 'messages_y2024m02', 'messages_y2024m03', 'attachments'])
+        self.assertIn('SELECT message_id FROM messages WHERE guild_id = $1', tasks[-1].where)
+        self.assertEqual(tasks[-1].args, [1, since, until])
+    
+    async def test_copy_jsonl_streams_copy_output(self):
+        """Test that COPY output is written to the file as it arrives."""
+        async def copy_from_query(query, *args, output, **options):
+            await output(b'{"message_id": 1}\n')
+            await output(b'{"message_id": 2}\n')
+            return 'COPY 2'
+        self.conn.copy_from_query.side_effect = copy_from_query
+        self.conn.fetchval.return_value = 'r'
+        tasks = await plan_export(self.conn, 'guild_id = $1', [1], attachments=False)
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'messages.jsonl'
+            rows = await copy_jsonl(self.conn, tasks[0], path, compress=False)
+            
+            self.assertEqual(rows, 2)
+            self.assertEqual(path.read_bytes(), b'{"message_id": 1}\n{"message_id": 2}\n')
+        query = self.conn.copy_from_query.call_args[0]
+        self.assertIn('row_to_json', query[0])
+        self.assertEqual(query[1:], (1,))
+    
+    async def test_copy_parquet_keeps_text_that_looks_like_null(self):
+        """Test that only unquoted empty CSV fields become NULL in the Parquet file."""
+        import pyarrow.parquet as pq
+        
+        async def copy_from_query(query, *args, output, **options):
+            await output(b'1,NA,null,,\n2,nan,"",NaN,\n')
+            await output(b'3,N/A,"line one\nline two",NULL,\n')
+            return 'COPY 3'
+        self.conn.copy_from_query.side_effect = copy_from_query
+        types = {'message_id': 'int64', 'content': 'string', 'author_name': 'string',
+                 'channel_name': 'string', 'reference_id': 'int64'}
+        task = ExportTask('messages', 'message_id', types, 'TRUE', [])
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'messages.parquet'
+            rows = await copy_parquet(self.conn, task, path, row_group_size=10)
+            table = pq.read_table(path)
+        
+        self.assertEqual(rows, 3)
+        self.assertEqual(table.column('content').to_pylist(), ['NA', 'nan', 'N/A'])
+        self.assertEqual(table.column('author_name').to_pylist(), ['null', '', 'line one\nline two'])
+        self.assertEqual(table.column('channel_name').to_pylist(), [None, 'NaN', 'NULL'])
+        self.assertEqual(table.column('reference_id').to_pylist(), [None, None, None])
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,831 @@
+import unittest
+import asyncio
+import datetime
+import json
+from unittest.mock import MagicMock, patch, AsyncMock
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+# Add parent directory to path to import our modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.rag.embeddings import HashingEmbedder, OpenAIEmbedder
+from src.rag.vector_index import VectorIndex
+from src.rag.ann_index import IVFSegment, IVFVectorIndex
+from src.rag.semantic import SemanticIndex
+from src.rag.retriever import MessageRetriever
+from src.rag.generator import ResponseGenerator, ERROR_RESPONSE
+from src.rag.cache import AnswerCache
+from src.rag.pipeline import RAGPipeline
+from src.rag.processor import ContextProcessor
+from src.rag.expander import ContextExpander
+from src.rag.tokens import ApproximateTokenizer, Tokenizer, create_tokenizer
+from src.rag.scheduler import (
+    LLMScheduler,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    PRIORITY_LOW,
+    parse_duration,
+    parse_retry_after
+)
+
+class TestHashingEmbedder(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the local hashing embedder."""
+
+    async def test_embeddings_are_deterministic_and_normalized(self):
+        """Test that the same text always gets the same unit vector."""
+        embedder = HashingEmbedder(dimension=64)
+        vectors = await embedder.embed(["Deploy the bot", "Deploy the bot", ""])
+
+        self.assertEqual(vectors.shape, (3, 64))
+        self.assertEqual(vectors.dtype, np.float32)
+        np.testing.assert_array_equal(vectors[0], vectors[1])
+        self.assertAlmostEqual(float(np.linalg.norm(vectors[0])), 1.0, places=5)
+        # Texts without words embed to the zero vector
+        self.assertEqual(float(np.linalg.norm(vectors[2])), 0.0)
+
+    async def test_related_texts_are_closer(self):
+        """Test that shared words and word forms increase similarity."""
+        embedder = HashingEmbedder(dimension=256)
+        query, related, unrelated = await embedder.embed([
+            "when was the deployment",
+            "we deployed the new version yesterday",
+            "lunch menu pizza"
+        ])
+
+        self.assertGreater(float(query @ related), float(query @ unrelated))
+
+    async def test_batches_are_embedded_off_the_event_loop(self):
+        """Test that a batch of messages is embedded in a worker thread."""
+        embedder = HashingEmbedder(dimension=64)
+        with patch('src.rag.embeddings.asyncio.to_thread', wraps=asyncio.to_thread) as to_thread:
+            batch = await embedder.embed(["first message", "second message"])
+            query = await embedder.embed_query("first message")
+
+        to_thread.assert_called_once()
+        np.testing.assert_array_equal(batch[0], query)
+
+class TestOpenAIEmbedder(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the OpenAI embedder, against a local fake embeddings server."""
+
+    async def asyncSetUp(self):
+        """Start the fake server."""
+        self.requests = []
+
+        async def embeddings(request):
+            body = await request.json()
+            self.requests.append(body)
+            # Out of order, as the API does not promise an order
+            data = [{'index': i, 'embedding': [float(i + 1), 0.0, 0.0]} for i in range(len(body['input']))]
+            return web.json_response({'data': data[::-1]})
+
+        app = web.Application()
+        app.router.add_post('/v1/embeddings', embeddings)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.embedder = OpenAIEmbedder(dimension=3, api_key='key', api_base=str(self.server.make_url('/v1')))
+
+    async def asyncTearDown(self):
+        """Stop the embedder and the fake server."""
+        await self.embedder.close()
+        await self.server.close()
+
+    async def test_requests_share_one_session(self):
+        """Test that embedding calls reuse the session opened at start."""
+        await self.embedder.start()
+        session = self.embedder._session
+
+        vectors = await self.embedder.embed(['first', ''])
+        await self.embedder.embed_query('second')
+
+        self.assertIs(self.embedder._session, session)
+        self.assertEqual(self.requests[0]['input'], ['first', ' '])
+        np.testing.assert_allclose(vectors, [[1, 0, 0], [1, 0, 0]])
+
+        await self.embedder.close()
+        self.assertTrue(session.closed)
+
+class TestVectorIndex(unittest.TestCase):
+    """Test cases for the in-memory vector index."""
+
+    def setUp(self):
+        """Set up tests."""
+        self.index = VectorIndex(dimension=3, initial_capacity=2)
+        self.index.add(
+            [1, 2, 3, 4],
+            np.array([[1, 0, 0], [0, 1, 0], [1, 1, 0], [1, 0, 0]], dtype=np.float32),
+            [10, 10, 10, 20],
+            [100.0, 200.0, 300.0, 100.0]
+        )
+
+    def test_search_returns_most_similar_of_guild(self):
+        """Test that results are ranked by cosine similarity within a guild."""
+        results = self.index.search(10, np.array([1, 0.1, 0]), k=2)
+
+        self.assertEqual([message_id for message_id, _ in results], [1, 3])
+        self.assertGreater(results[0][1], results[1][1])
+        # Guild 20's identical vector is not returned
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.guild_size(10), 3)
+
+    def test_search_filters_by_time(self):
+        """Test that older messages are skipped."""
+        results = self.index.search(10, np.array([1, 0, 0]), k=3, min_timestamp=150.0)
+
+        self.assertEqual([message_id for message_id, _ in results], [3, 2])
+
+    def test_add_replaces_and_remove_compacts(self):
+        """Test that re-adding a message replaces its vector and removal keeps the rest."""
+        self.index.add([1], np.array([[0, 0, 1]]), [10], [100.0])
+        self.index.remove([2])
+
+        results = self.index.search(10, np.array([0, 0, 1]), k=5)
+
+        self.assertEqual(results[0][0], 1)
+        self.assertAlmostEqual(results[0][1], 1.0, places=5)
+        self.assertNotIn(2, [message_id for message_id, _ in results])
+        self.assertEqual(self.index.guild_size(10), 2)
+
+    def test_batch_search_matches_exact_search(self):
+        """Test batched search against brute force, across several chunks."""
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((500, 8)).astype(np.float32)
+        index = VectorIndex(dimension=8)
+        index.add(range(500), vectors, [1] * 500, [0.0] * 500)
+        queries = rng.standard_normal((4, 8)).astype(np.float32)
+
+        with patch('src.rag.vector_index.SEARCH_CHUNK_ROWS', 128):
+            results = index.search_batch(1, queries, k=5)
+
+        normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        for query, result in zip(queries, results):
+            expected = np.argsort(-(normalized @ query))[:5]
+            self.assertEqual([message_id for message_id, _ in result], expected.tolist())
+
+    def test_searches_see_consistent_rows_while_vectors_change(self):
+        """Test that searches in other threads never pair a message with another's vector."""
+        index = VectorIndex(dimension=4, initial_capacity=4)
+        axes = np.eye(4, dtype=np.float32)
+        index.add(range(100), axes[np.arange(100) % 4], [1] * 100, [0.0] * 100)
+        stop = threading.Event()
+        mismatches = []
+
+        def search():
+            while not stop.is_set():
+                for message_id, score in index.search(1, axes[0], k=100):
+                    if abs(score - (message_id % 4 == 0)) > 1e-6:
+                        mismatches.append((message_id, score))
+
+        searchers = [threading.Thread(target=search) for _ in range(2)]
+        for searcher in searchers:
+            searcher.start()
+        try:
+            # Removal moves the guild's last row into the freed one
+            for round_number in range(300):
+                removed = list(range(round_number % 50, 100, 7))
+                index.remove(removed)
+                index.add(removed, axes[np.array(removed) % 4], [1] * len(removed), [0.0] * len(removed))
+        finally:
+            stop.set()
+            for searcher in searchers:
+                searcher.join()
+
+        self.assertEqual(mismatches, [])
+        self.assertEqual(len(index), 100)
+
+class TestIVFVectorIndex(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the approximate vector index."""
+
+    def setUp(self):
+        """Set up tests."""
+        rng = np.random.default_rng(0)
+        centers = rng.standard_normal((20, 16)).astype(np.float32)
+        self.vectors = centers[rng.integers(0, 20, 2000)] + 0.1 * rng.standard_normal((2000, 16)).astype(np.float32)
+        self.queries = self.vectors[:10] + 0.05 * rng.standard_normal((10, 16)).astype(np.float32)
+        self.exact = VectorIndex(dimension=16)
+        self.exact.add(range(2000), self.vectors, [1] * 2000, [float(i) for i in range(2000)])
+
+    def test_segment_search_matches_exact_search(self):
+        """Test recall of a segment against brute force, including time filtering."""
+        segment = IVFSegment.build(np.arange(2000), self.vectors, np.arange(2000, dtype=np.float64), n_lists=20)
+
+        for query in self.queries:
+            expected = [message_id for message_id, _ in self.exact.search(1, query, 10, min_timestamp=500.0)]
+            found = [message_id for message_id, _ in segment.search(query, 10, n_probe=4, min_timestamp=500.0)]
+            self.assertGreaterEqual(len(set(expected) & set(found)), 9)
+            self.assertTrue(all(message_id >= 500 for message_id in found))
+
+    def test_saved_segment_loads_memory_mapped(self):
+        """Test that a saved segment keeps its results and deletions when loaded."""
+        segment = IVFSegment.build(np.arange(2000), self.vectors, np.zeros(2000), n_lists=20,
+                                   built_at=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc))
+        segment.delete([0])
+
+        with tempfile.TemporaryDirectory() as directory:
+            segment.save(Path(directory) / 'guild_1')
+            loaded = IVFSegment.load(Path(directory) / 'guild_1')
+
+            self.assertIsInstance(loaded.vectors, np.memmap)
+            self.assertEqual(len(loaded), 1999)
+            self.assertEqual(loaded.built_at, segment.built_at)
+            self.assertEqual(loaded.search(self.queries[1], 5, n_probe=4), segment.search(self.queries[1], 5, n_probe=4))
+            self.assertNotIn(0, [message_id for message_id, _ in loaded.search(self.queries[0], 5, n_probe=20)])
+
+    async def test_rebuild_folds_delta_and_reloads(self):
+        """Test that the delta is folded into a saved segment and replaced vectors stay current."""
+        with tempfile.TemporaryDirectory() as directory:
+            index = IVFVectorIndex(dimension=16, n_probe=20, build_threshold=1000, storage_dir=directory)
+            index.add(range(2000), self.vectors, [1] * 2000, [0.0] * 2000)
+            self.assertEqual(index.guilds_to_rebuild(), [1])
+
+            built_at = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+            await index.rebuild(1, built_at=built_at)
+            self.assertEqual(len(index.delta), 0)
+            self.assertEqual(index.guild_size(1), 2000)
+
+            # Replacing a vector hides the segment copy and serves the new one from the delta
+            index.add([5], np.array([self.vectors[1999]]), [1], [0.0])
+            results = index.search(1, self.vectors[1999], k=2)
+            self.assertEqual({message_id for message_id, _ in results}, {5, 1999})
+            self.assertEqual(index.guild_size(1), 2000)
+
+            reloaded = IVFVectorIndex(dimension=16, n_probe=20, storage_dir=directory)
+            self.assertEqual(reloaded.load_saved(), built_at)
+            self.assertEqual(reloaded.segment_guild_ids(), [1])
+            self.assertEqual(reloaded.search(1, self.vectors[7], k=1)[0][0], 7)
+
+class TestSemanticRetrieval(unittest.IsolatedAsyncioTestCase):
+    """Test cases for semantic indexing and retrieval."""
+
+    async def test_index_records_stores_and_indexes(self):
+        """Test that written messages are embedded, persisted and searchable."""
+        semantic_index = SemanticIndex(HashingEmbedder(dimension=64))
+        timestamp = datetime.datetime.now(datetime.timezone.utc)
+        records = [
+            (1, 5, 'general', 42, 7, 'user', 'the release is scheduled for friday', timestamp, False, False, None),
+            (2, 5, 'general', 42, 7, 'user', '', timestamp, False, False, None)
+        ]
+
+        with patch('src.rag.semantic.store_embeddings', AsyncMock(return_value=True)) as mock_store:
+            await semantic_index.index_records(records)
+            # Writes only queue the messages
+            mock_store.assert_not_called()
+            await semantic_index.drain()
+
+        stored = mock_store.call_args.args[0]
+        self.assertEqual([record[0] for record in stored], [1])
+        self.assertEqual(stored[0][3], 'hashing-64')
+        self.assertEqual(len(stored[0][4]), 64 * 4)
+
+        results = await semantic_index.search(42, 'when is the release', k=5, max_days=1)
+        self.assertEqual(results[0][0], 1)
+
+    async def test_failed_batches_are_retried_in_the_background(self):
+        """Test that writes do not wait on the embedder and a failed batch is retried."""
+        embedder = HashingEmbedder(dimension=64)
+        vectors = await embedder.embed(['the release is friday'])
+        embedder.embed = AsyncMock(side_effect=[RuntimeError('rate limited'), vectors])
+        semantic_index = SemanticIndex(embedder, retry_delay=0)
+        timestamp = datetime.datetime.now(datetime.timezone.utc)
+        record = (1, 5, 'general', 42, 7, 'user', 'the release is friday', timestamp, False, False, None)
+
+        with patch('src.rag.semantic.store_embeddings', AsyncMock(return_value=True)), \
+             patch('src.database.bulk.get_bulk_writer', AsyncMock(return_value=MagicMock())), \
+             patch('src.rag.semantic.add_store_listener'), \
+             patch.object(semantic_index, 'load', AsyncMock()):
+            await semantic_index.start()
+            await semantic_index.index_records([record])
+            self.assertEqual(semantic_index.stats()['queue_depth'], 1)
+            await semantic_index.close()
+
+        stats = semantic_index.stats()
+        self.assertEqual((stats['embedded'], stats['failed'], stats['retries'], stats['queue_depth']), (1, 0, 1, 0))
+        self.assertEqual(len(semantic_index.index), 1)
+
+    async def test_full_embedding_queue_drops_and_counts(self):
+        """Test that messages beyond the queue size are dropped instead of waited on."""
+        semantic_index = SemanticIndex(HashingEmbedder(dimension=64), queue_size=2)
+        timestamp = datetime.datetime.now(datetime.timezone.utc)
+        records = [(i, 5, 'general', 42, 7, 'user', f'message {i}', timestamp, False, False, None)
+                   for i in range(3)]
+
+        await semantic_index.index_records(records)
+
+        self.assertEqual(semantic_index.stats()['queue_depth'], 2)
+        self.assertEqual(semantic_index.dropped, 1)
+
+    async def test_retrieve_fuses_rankings(self):
+        """Test that messages found by both searches rank first and keep both scores."""
+        semantic_index = MagicMock()
+        semantic_index.ready = True
+        semantic_index.search = AsyncMock(return_value=[(3, 0.9), (1, 0.8)])
+        retriever = MessageRetriever(max_results=3, semantic_index=semantic_index)
+
+        keyword = [{'message_id': 1, 'rank': 0.5}, {'message_id': 2, 'rank': 0.4}]
+        similar = [{'message_id': 1}, {'message_id': 3}]
+        with patch('src.rag.retriever.get_messages_for_rag', AsyncMock(return_value=keyword)), \
+             patch('src.rag.retriever.get_messages_by_ids', AsyncMock(return_value=similar)):
+            messages = await retriever.retrieve(42, 'question')
+
+        self.assertEqual([message['message_id'] for message in messages], [1, 3, 2])
+        self.assertEqual((messages[0]['rank'], messages[0]['similarity']), (0.5, 0.8))
+        self.assertAlmostEqual(messages[0]['fused_score'], 1 / 61 + 1 / 62)
+        self.assertEqual(messages[1]['similarity'], 0.9)
+
+    async def test_retrieve_runs_searches_concurrently_with_weights(self):
+        """Test that both searches are in flight together and weights change the order."""
+        semantic_started = asyncio.Event()
+
+        async def lexical_search(**kwargs):
+            # Only completes if semantic search starts before lexical search finishes
+            await asyncio.wait_for(semantic_started.wait(), timeout=1)
+            return [{'message_id': 1, 'rank': 0.5}, {'message_id': 2, 'rank': 0.4}]
+
+        async def semantic_search(*args, **kwargs):
+            semantic_started.set()
+            return [(2, 0.9)]
+
+        semantic_index = MagicMock()
+        semantic_index.ready = True
+        semantic_index.search = semantic_search
+        retriever = MessageRetriever(semantic_index=semantic_index, lexical_weight=1.0, semantic_weight=2.0)
+
+        with patch('src.rag.retriever.get_messages_for_rag', lexical_search), \
+             patch('src.rag.retriever.get_messages_by_ids', AsyncMock(return_value=[{'message_id': 2}])):
+            messages = await retriever.retrieve(42, 'question')
+
+        self.assertEqual([message['message_id'] for message in messages], [2, 1])
+
+    async def test_retrieve_without_ready_index_is_keyword_only(self):
+        """Test that retrieval falls back to keyword search until the index has loaded."""
+        semantic_index = MagicMock()
+        semantic_index.ready = False
+        retriever = MessageRetriever(semantic_index=semantic_index)
+
+        keyword = [{'message_id': 1, 'rank': 0.5}, {'message_id': 2, 'rank': 0.4}]
+        with patch('src.rag.retriever.get_messages_for_rag', AsyncMock(return_value=keyword)):
+            messages = await retriever.retrieve(42, 'question')
+
+        self.assertEqual([message['message_id'] for message in messages], [1, 2])
+        self.assertEqual(messages[0]['rank'], 0.5)
+
+class TestResponseGenerator(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the LLM client, against a local fake completion server."""
+
+    async def asyncSetUp(self):
+        """Start the fake server."""
+        self.requests = []
+
+        async def completions(request):
+            body = await request.json()
+            self.requests.append((request.headers.get('Authorization'), body))
+            prompt = body['messages'][-1]['content']
+            if prompt == 'fail' or (body.get('stream') and prompt == 'no streaming'):
+                return web.Response(status=500, text='overloaded')
+            if prompt == 'rate limited' and len(self.requests) == 1:
+                return web.Response(status=429, text='slow down', headers={'retry-after-ms': '50'})
+            if not body.get('stream'):
+                return web.json_response({'choices': [{'message': {'content': 'It ships on Friday.'}}]})
+
+            # Server-sent events, like the OpenAI streaming API
+            response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+            await response.prepare(request)
+            for piece in ['It ships', ' on', ' Friday.']:
+                chunk = {'choices': [{'delta': {'content': piece}}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            return response
+
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', completions)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.generator = ResponseGenerator(model='test-model', api_key='key',
+                                           api_base=str(self.server.make_url('/v1')))
+
+    async def asyncTearDown(self):
+        """Stop the generator and the fake server."""
+        await self.generator.close()
+        await self.server.close()
+
+    async def test_requests_reuse_one_connection(self):
+        """Test that consecutive requests share a pooled keep-alive connection."""
+        await self.generator.start()
+
+        first = await self.generator.generate_response('When does it ship?')
+        second = await self.generator.generate_response('Are you sure?')
+
+        self.assertEqual((first, second), ('It ships on Friday.', 'It ships on Friday.'))
+        self.assertEqual(self.requests[0][0], 'Bearer key')
+        self.assertEqual(self.requests[0][1]['model'], 'test-model')
+
+        stats = self.generator.stats()
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertEqual(stats['connections_reused'], 1)
+        self.assertEqual(self.generator.last_connect_seconds, 0.0)
+        self.assertGreater(stats['model_seconds'], 0.0)
+
+    async def test_errors_are_counted_and_session_reopens(self):
+        """Test that API errors return the apology and a closed session is reopened on use."""
+        response = await self.generator.generate_response('fail')
+        await self.generator.close()
+        await self.generator.generate_response('When does it ship?')
+
+        self.assertIn('error', response)
+        self.assertEqual(self.generator.failures, 1)
+        self.assertEqual(self.generator.connections_opened, 2)
+
+    async def test_stream_yields_pieces(self):
+        """Test that a streamed completion is yielded piece by piece."""
+        pieces = [piece async for piece in self.generator.stream_response('When does it ship?')]
+
+        self.assertEqual(pieces, ['It ships', ' on', ' Friday.'])
+        self.assertTrue(self.requests[0][1]['stream'])
+        self.assertGreater(self.generator.last_first_token_seconds, 0.0)
+
+    async def test_stream_falls_back_to_complete_response(self):
+        """Test that a failed stream is answered without streaming."""
+        pieces = [piece async for piece in self.generator.stream_response('no streaming')]
+
+        self.assertEqual(pieces, ['It ships on Friday.'])
+        self.assertEqual(self.generator.stream_fallbacks, 1)
+        self.assertNotIn('stream', self.requests[1][1])
+
+    async def test_rate_limit_pauses_and_retries(self):
+        """Test that a rate limited stream waits for Retry-After and is retried."""
+        scheduler = LLMScheduler(max_concurrent=4)
+        self.generator.scheduler = scheduler
+
+        pieces = [piece async for piece in self.generator.stream_response('rate limited', guild_id=1)]
+
+        self.assertEqual(pieces, ['It ships', ' on', ' Friday.'])
+        self.assertEqual((len(self.requests), self.generator.retries, self.generator.failures), (2, 1, 0))
+        stats = scheduler.stats()
+        self.assertEqual((stats['rate_limited'], stats['granted'], stats['in_flight']), (1, 2, 0))
+        # The retry waited out the pause, and fewer requests are allowed in flight for a while
+        self.assertGreaterEqual(stats['max_wait_seconds'], 0.04)
+        self.assertEqual(stats['limit'], 2)
+
+class TestLLMScheduler(unittest.IsolatedAsyncioTestCase):
+    """Test cases for limiting and ordering concurrent LLM requests."""
+
+    async def run_requests(self, scheduler, requests):
+        """Queue (guild, priority) requests behind a held slot and return their start order."""
+        started = []
+
+        async def request(name, guild_id, priority):
+            async with scheduler.slot(guild_id, priority):
+                started.append(name)
+                await asyncio.sleep(0)
+
+        await scheduler.acquire()
+        tasks = [asyncio.create_task(request(name, guild_id, priority))
+                 for name, guild_id, priority in requests]
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.queue_depth, len(requests))
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return started
+
+    async def test_priorities_and_guild_turns(self):
+        """Test that urgent requests go first and guilds take turns within a priority."""
+        scheduler = LLMScheduler(max_concurrent=1)
+        started = await self.run_requests(scheduler, [
+            ('mention', 1, PRIORITY_LOW),
+            ('a1', 1, PRIORITY_NORMAL), ('a2', 1, PRIORITY_NORMAL), ('a3', 1, PRIORITY_NORMAL),
+            ('b1', 2, PRIORITY_NORMAL),
+            ('slash', 3, PRIORITY_HIGH)
+        ])
+
+        self.assertEqual(started, ['slash', 'a1', 'b1', 'a2', 'a3', 'mention'])
+        stats = scheduler.stats()
+        self.assertEqual((stats['granted'], stats['queued'], stats['max_queue_depth']), (7, 6, 6))
+        self.assertEqual((stats['in_flight'], stats['queue_depth']), (0, 0))
+
+    async def test_concurrency_limit_and_cancelled_waiters(self):
+        """Test that no more than the limit run at once and cancelled waiters leave the queue."""
+        scheduler = LLMScheduler(max_concurrent=2)
+        running, peak = 0, 0
+
+        async def request():
+            nonlocal running, peak
+            async with scheduler.slot(1):
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        tasks = [asyncio.create_task(request()) for _ in range(6)]
+        await asyncio.sleep(0)
+        tasks[-1].cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.assertEqual(peak, 2)
+        self.assertEqual((scheduler.granted, scheduler.queue_depth, scheduler.stats()['in_flight']), (5, 0, 0))
+
+    async def test_rate_limits_back_off_adaptively(self):
+        """Test backoff without Retry-After, the reduced limit and recovery on success."""
+        scheduler = LLMScheduler(max_concurrent=8, base_backoff=0.5, max_backoff=1.5)
+
+        scheduler.record_response(429, {})
+        self.assertEqual((scheduler.limit, round(scheduler.stats()['paused_seconds'], 1)), (4, 0.5))
+        scheduler.record_response(429, {})
+        scheduler.record_response(429, {})
+        self.assertEqual((scheduler.limit, scheduler._backoff), (1, 1.5))
+
+        for _ in range(40):
+            scheduler.record_response(200, {})
+        self.assertEqual((scheduler.limit, scheduler._backoff), (8, 0.0))
+
+        scheduler._paused_until = 0
+        scheduler.record_response(200, {'x-ratelimit-remaining-requests': '0',
+                                        'x-ratelimit-reset-requests': '2s'})
+        self.assertGreater(scheduler.stats()['paused_seconds'], 1.9)
+
+    def test_parse_rate_limit_headers(self):
+        """Test the Retry-After and rate limit reset header formats."""
+        self.assertEqual(parse_duration('6m0s'), 360.0)
+        self.assertEqual(parse_duration('1h2m3.5s'), 3723.5)
+        self.assertEqual(parse_duration('20ms'), 0.02)
+        self.assertIsNone(parse_duration('soon'))
+        self.assertEqual(parse_retry_after({'Retry-After': '7'}), 7.0)
+        self.assertEqual(parse_retry_after({'retry-after-ms': '250', 'Retry-After': '1'}), 0.25)
+        self.assertEqual(parse_retry_after({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}), 0.0)
+        self.assertEqual(parse_retry_after({
+            'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '1s',
+            'x-ratelimit-remaining-tokens': '0', 'x-ratelimit-reset-tokens': '6m0s'
+        }), 360.0)
+        self.assertIsNone(parse_retry_after({'x-ratelimit-remaining-requests': '5',
+                                             'x-ratelimit-reset-requests': '1s'}))
+
+class TestContextProcessor(unittest.TestCase):
+    """Test cases for token-aware context packing."""
+
+    def message(self, message_id, content, day):
+        """Build a message record posted on the given day of January."""
+        return {
+            'message_id': message_id, 'author_name': 'dev', 'channel_name': 'general',
+            'content': content, 'timestamp': datetime.datetime(2024, 1, day)
+        }
+
+    def test_best_ranked_messages_fill_budget_in_time_order(self):
+        """Test that packing follows rank, skips what does not fit and sorts by time."""
+        ranked = [
+            self.message(1, 'the release moved to friday', 20),
+            self.message(2, 'word ' * 200, 5),
+            self.message(3, 'friday release notes are in the docs', 1),
+            self.message(4, 'unrelated chatter about lunch plans', 10)
+        ]
+        processor = ContextProcessor(max_context_tokens=45)
+
+        packed = processor.pack_messages(ranked)
+        context = processor.process_messages(ranked)
+
+        # The oversized message is skipped whole; the budget runs out before the last one
+        self.assertEqual([message['message_id'] for message in packed], [3, 1])
+        self.assertEqual(context.splitlines(), [
+            '[2024-01-01 00:00:00] dev in #general: friday release notes are in the docs',
+            '[2024-01-20 00:00:00] dev in #general: the release moved to friday'
+        ])
+        self.assertLessEqual(processor.tokenizer.count(context), 45)
+
+    def test_tokenizer_is_pluggable(self):
+        """Test that a custom tokenizer decides what fits."""
+        class WordTokenizer(Tokenizer):
+            name = 'words'
+
+            def count(self, text):
+                return len(text.split())
+
+        processor = ContextProcessor(max_context_tokens=20, tokenizer=WordTokenizer())
+        packed = processor.pack_messages([self.message(1, 'one two three', 1), self.message(2, 'four ' * 12, 2)])
+
+        self.assertEqual([message['message_id'] for message in packed], [1])
+        self.assertEqual(ApproximateTokenizer().count('deploy the new version'), 6)
+        self.assertIsInstance(create_tokenizer('unknown'), ApproximateTokenizer)
+
+    def test_conversations_fall_back_to_their_hit(self):
+        """Test that a conversation too large for the budget is replaced by its hit."""
+        hit = self.message(1, 'the release moved to friday', 20)
+        other = self.message(3, 'friday release notes are in the docs', 1)
+        groups = [
+            (hit, [self.message(2, 'word ' * 200, 19), hit]),
+            (other, [other, self.message(4, 'thanks', 2)])
+        ]
+        processor = ContextProcessor(max_context_tokens=60)
+
+        packed = processor.pack_groups(groups)
+        context = processor.process_groups(groups)
+
+        self.assertEqual([[message['message_id'] for message in members] for members in packed], [[3, 4], [1]])
+        self.assertEqual(context.split('\n\n'), [
+            '[2024-01-01 00:00:00] dev in #general: friday release notes are in the docs\n'
+            '[2024-01-02 00:00:00] dev in #general: thanks',
+            '[2024-01-20 00:00:00] dev in #general: the release moved to friday'
+        ])
+        self.assertEqual(ContextProcessor(max_context_tokens=5).process_groups(groups),
+                         "No relevant message history found.")
+
+class TestContextExpander(unittest.IsolatedAsyncioTestCase):
+    """Test cases for expanding retrieved messages into conversations."""
+
+    def message(self, message_id, minute, **extra):
+        """Build a message record posted at the given minute."""
+        return {
+            'message_id': message_id, 'channel_id': 1,
+            'timestamp': datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=minute),
+            **extra
+        }
+
+    async def test_overlapping_conversations_are_merged(self):
+        """Test that each message is used once, with the best-ranked hit."""
+        hits = [self.message(4, 4, fused_score=0.9), self.message(3, 3, fused_score=0.5),
+                self.message(9, 90, fused_score=0.1)]
+        related = [
+            {'hit_id': 4, **self.message(3, 3)}, {'hit_id': 4, **self.message(5, 5)},
+            {'hit_id': 4, **self.message(7, 50)},
+            {'hit_id': 3, **self.message(1, 1)}, {'hit_id': 3, **self.message(4, 4)},
+            {'hit_id': 3, **self.message(5, 5)}
+        ]
+
+        with patch('src.rag.expander.get_message_context', AsyncMock(return_value=related)) as fetch:
+            groups = await ContextExpander(window=2, reply_depth=3).expand(hits)
+
+        fetch.assert_awaited_once_with(hits, 2, 3, datetime.timedelta(hours=1))
+        self.assertEqual([hit['message_id'] for hit, _ in groups], [4, 9])
+        self.assertEqual([[m['message_id'] for m in members] for _, members in groups],
+                         [[1, 3, 4, 5, 7], [9]])
+        # The retrieved records, with their scores, replace the neighbour copies
+        members = {m['message_id']: m for m in groups[0][1]}
+        self.assertIs(members[3], hits[1])
+        self.assertNotIn('hit_id', members[5])
+
+class TestAnswerCache(unittest.IsolatedAsyncioTestCase):
+    """Test cases for caching answers to repeated questions."""
+
+    def setUp(self):
+        """Set up a pipeline with a stub retriever and generator."""
+        self.messages = [{
+            'message_id': 1, 'channel_id': 5, 'channel_name': 'releases', 'author_name': 'dev',
+            'content': 'Next release is on Friday', 'timestamp': datetime.datetime(2024, 1, 1)
+        }]
+        self.retriever = MagicMock()
+        self.retriever.retrieve = AsyncMock(side_effect=lambda *args: list(self.messages))
+        self.generator = MagicMock()
+        self.generator.generate_response = AsyncMock(return_value='Friday.')
+        self.cache = AnswerCache(embedder=HashingEmbedder(), similarity_threshold=0.9)
+        self.pipeline = RAGPipeline(self.retriever, ContextProcessor(), self.generator,
+                                    cache=self.cache, stream=False)
+
+    async def test_repeated_question_skips_retrieval_and_generation(self):
+        """Test that a repeated or rephrased question is answered from the cache."""
+        first = await self.pipeline.answer(42, 'When is the next release?')
+        second = await self.pipeline.answer(42, 'when is the next release')
+        similar = await self.pipeline.answer(42, 'When is the next release planned?')
+        await self.pipeline.answer(42, 'When is the next release?', history='User: hi')
+        await self.pipeline.answer(43, 'When is the next release?')
+
+        self.assertEqual((first, second, similar), ('Friday.', 'Friday.', 'Friday.'))
+        # Other conversations and guilds are answered separately
+        self.assertEqual(self.generator.generate_response.await_count, 3)
+        # The rephrased question is served only after retrieval finds the same context
+        self.assertEqual(self.retriever.retrieve.await_count, 4)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['similar_hits'], stats['misses']), (1, 1, 3))
+        self.assertEqual(stats['hit_rate'], 0.4)
+
+    async def test_similar_question_with_other_context_is_regenerated(self):
+        """Test that questions differing only in a version number do not share an answer."""
+        releases = {
+            'v2': {'message_id': 1, 'channel_id': 5, 'channel_name': 'releases', 'author_name': 'dev',
+                   'content': 'v2 ships on March 3', 'timestamp': datetime.datetime(2024, 1, 1)},
+            'v3': {'message_id': 2, 'channel_id': 5, 'channel_name': 'releases', 'author_name': 'dev',
+                   'content': 'v3 ships on June 9', 'timestamp': datetime.datetime(2024, 2, 1)}
+        }
+        self.retriever.retrieve.side_effect = lambda guild_id, question: [releases[question.split()[-1]]]
+        self.generator.generate_response.side_effect = ['March 3.', 'June 9.']
+
+        v2_question, v3_question = 'what is the release date for v2', 'what is the release date for v3'
+        v2_vector = await self.cache.embedder.embed_query(v2_question)
+        v3_vector = await self.cache.embedder.embed_query(v3_question)
+        self.assertGreaterEqual(float(v2_vector @ v3_vector), self.cache.similarity_threshold)
+
+        self.assertEqual(await self.pipeline.answer(42, v2_question), 'March 3.')
+        self.assertEqual(await self.pipeline.answer(42, v3_question), 'June 9.')
+        self.assertEqual(self.cache.similar_hits, 0)
+
+    async def test_new_messages_in_context_channel_revalidate(self):
+        """Test that new messages make answers stale until retrieval is checked again."""
+        await self.pipeline.answer(42, 'When is the next release?')
+
+        # A message in another channel changes nothing
+        await self.cache.invalidate_records([(2, 6, 'random', 42, 7, 'user', 'lunch?', None, False, False, None)])
+        await self.pipeline.answer(42, 'When is the next release?')
+        self.assertEqual(self.retriever.retrieve.await_count, 1)
+
+        # A message in the context's channel that is not retrieved keeps the answer
+        self.cache.invalidate_channels([5])
+        await self.pipeline.answer(42, 'When is the next release?')
+        self.assertEqual(self.retriever.retrieve.await_count, 2)
+        self.assertEqual(self.generator.generate_response.await_count, 1)
+        self.assertEqual(self.cache.revalidated_hits, 1)
+
+        # Once it is retrieved, the answer is generated again
+        self.cache.invalidate_channels([5])
+        self.messages.append(dict(self.messages[0], message_id=3, content='Release moved to Monday'))
+        self.generator.generate_response.return_value = 'Monday.'
+        self.assertEqual(await self.pipeline.answer(42, 'When is the next release?'), 'Monday.')
+        self.assertEqual(self.generator.generate_response.await_count, 2)
+
+    async def test_expired_and_evicted_answers_are_regenerated(self):
+        """Test TTL expiry, LRU eviction and that failed generations are not cached."""
+        self.cache.max_entries = 1
+        await self.pipeline.answer(42, 'When is the next release?')
+        await self.pipeline.answer(42, 'How do I get the role?')
+        self.assertEqual((len(self.cache), self.cache.evictions), (1, 1))
+
+        self.cache.ttl = 0
+        await self.pipeline.answer(42, 'How do I get the role?')
+
+        self.generator.generate_response.return_value = ERROR_RESPONSE
+        self.cache.ttl = 3600
+        await self.pipeline.answer(42, 'Who is the admin?')
+        await self.pipeline.answer(42, 'Who is the admin?')
+        self.assertEqual(self.generator.generate_response.await_count, 5)
+
+class TestRequestCoalescing(unittest.IsolatedAsyncioTestCase):
+    """Test cases for sharing one answer between identical concurrent questions."""
+
+    def setUp(self):
+        """Set up a streaming pipeline whose generator waits to be released."""
+        self.release = asyncio.Event()
+        self.retriever = MagicMock()
+        self.retriever.retrieve = AsyncMock(return_value=[{
+            'message_id': 1, 'channel_id': 5, 'channel_name': 'releases', 'author_name': 'dev',
+            'content': 'Next release is on Friday', 'timestamp': datetime.datetime(2024, 1, 1)
+        }])
+        self.prompts = []
+
+        async def stream_response(prompt, **kwargs):
+            self.prompts.append(prompt)
+            yield 'On '
+            await self.release.wait()
+            yield 'Friday.'
+
+        self.generator = MagicMock()
+        self.generator.stream_response = stream_response
+        self.pipeline = RAGPipeline(self.retriever, ContextProcessor(), self.generator)
+
+    async def test_concurrent_identical_questions_share_one_answer(self):
+        """Test that in-flight identical questions share retrieval and generation."""
+        questions = ['When is the release?', 'when is the release', 'WHEN IS THE RELEASE??']
+        tasks = [asyncio.create_task(self.pipeline.answer(42, question)) for question in questions]
+        other_guild = asyncio.create_task(self.pipeline.answer(43, questions[0]))
+        await asyncio.sleep(0.01)
+        self.release.set()
+
+        answers = await asyncio.gather(*tasks, other_guild)
+
+        self.assertEqual(answers, ['On Friday.'] * 4)
+        self.assertEqual(len(self.prompts), 2)
+        self.assertEqual(self.retriever.retrieve.await_count, 2)
+        self.assertEqual(self.pipeline.stats(), {
+            'in_flight': 0, 'calls': 4, 'coalesced': 2, 'coalesced_rate': 0.5, 'max_waiters': 3
+        })
+
+        # Finished answers are not shared with later calls
+        await self.pipeline.answer(42, questions[0])
+        self.assertEqual(len(self.prompts), 3)
+
+    async def test_abandoning_caller_does_not_cancel_others(self):
+        """Test that the answer keeps streaming when the first caller stops reading."""
+        first = self.pipeline.answer_stream(42, 'When is the release?')
+        self.assertEqual(await first.__anext__(), 'On ')
+        second = asyncio.create_task(self.pipeline.answer(42, 'When is the release?'))
+        await asyncio.sleep(0)
+        await first.aclose()
+        self.release.set()
+
+        self.assertEqual(await second, 'On Friday.')
+        self.assertEqual(len(self.prompts), 1)
+
+    async def test_errors_reach_every_caller(self):
+        """Test that a failed answer raises in every caller sharing it."""
+        self.retriever.retrieve.side_effect = RuntimeError('database down')
+        tasks = [asyncio.create_task(self.pipeline.answer(42, 'When is the release?')) for _ in range(2)]
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+        self.assertEqual(self.retriever.retrieve.await_count, 1)
+        self.assertEqual(len(self.pipeline.flights), 0)
+
+if __name__ == '__main__':
+    unittest.main()